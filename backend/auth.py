@@ -4,7 +4,7 @@ Handles user login, token generation, and authentication middleware.
 """
 from datetime import datetime, timedelta
 from typing import Optional, Dict, Any
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, Response, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from jose import JWTError, jwt
 from passlib.context import CryptContext
@@ -128,6 +128,49 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
     return user_data
 
 
+# HttpOnly cookie carrying the JWT for EventSource requests, which cannot set headers
+AUTH_COOKIE_NAME = "access_token"
+
+
+def set_auth_cookie(response: Response, request: Request, token: str):
+    """Store the access token in the HttpOnly cookie read by get_stream_username"""
+    samesite = settings.auth_cookie_samesite.lower()
+    response.set_cookie(
+        AUTH_COOKIE_NAME,
+        token,
+        max_age=settings.jwt_expire_minutes * 60,
+        path="/api",
+        httponly=True,
+        samesite=samesite,
+        secure=request.url.scheme == "https" or samesite == "none"
+    )
+
+
+def clear_auth_cookie(response: Response):
+    """Remove the access token cookie"""
+    response.delete_cookie(AUTH_COOKIE_NAME, path="/api")
+
+
+async def get_stream_username(request: Request) -> str:
+    """
+    Dependency for Server-Sent Events endpoints. EventSource cannot send an
+    Authorization header, so the token comes from the access_token cookie (set at
+    login or by POST /api/auth/stream-session), or the header when one is sent.
+    Tokens are never read from the query string, which ends up in access logs.
+    Raises HTTPException if no valid token is found.
+    """
+    auth_token = request.cookies.get(AUTH_COOKIE_NAME) or request.headers.get("authorization", "").replace("Bearer ", "")
+    if not auth_token:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
+    
+    payload = decode_access_token(auth_token)
+    username = payload.get("sub") if payload else None
+    if not username:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    
+    return username
+
+
 async def get_current_user_sheet_id(current_user: Dict[str, Any] = Depends(get_current_user)) -> str:
     """
     Dependency to get the current user's sheet_id.
@@ -2,7 +2,7 @@
 Configuration management for the FastAPI backend.
 Loads settings from environment variables and secrets.toml
 """
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List
 import os
 
 # Trigger reload 2
@@ -25,6 +25,8 @@ class Settings(BaseSettings):
     jwt_secret: str = Field(default="your-secret-key-change-in-production", alias="JWT_SECRET")
     jwt_algorithm: str = Field(default="HS256", alias="JWT_ALGORITHM")
     jwt_expire_minutes: int = Field(default=1440, alias="JWT_EXPIRE_MINUTES")  # 24 hours
+    # SameSite of the access_token cookie used by Server-Sent Events streams ("none" needs HTTPS)
+    auth_cookie_samesite: str = Field(default="lax", alias="AUTH_COOKIE_SAMESITE")
     
     # CORS
     cors_origins: list = Field(default=["http://localhost:3000", "http://localhost:5173", "http://localhost:5174", "http://localhost:5175"], alias="CORS_ORIGINS")
@@ -70,6 +72,25 @@ def get_google_api_key() -> Optional[str]:
     secrets = configs.load_secrets()
     return secrets.get("google_api_key") or secrets.get("GOOGLE_API_KEY")
 
+def get_google_api_keys() -> List[str]:
+    """
+    Get all Google API keys available for Gemini.
+    Several keys (GOOGLE_API_KEYS as a comma-separated list, or google_api_keys
+    in secrets) let extraction traffic be sharded across separate quotas.
+    Falls back to the single key from get_google_api_key().
+    """
+    env_keys = os.getenv("GOOGLE_API_KEYS")
+    if env_keys:
+        keys = [key.strip() for key in env_keys.split(",") if key.strip()]
+    else:
+        keys = configs.load_secrets().get("google_api_keys") or []
+    
+    if not keys:
+        single_key = get_google_api_key()
+        keys = [single_key] if single_key else []
+    
+    return keys
+
 def get_supabase_config() -> Optional[Dict[str, str]]:
     """
     Returns Supabase configuration.
@@ -5,7 +5,7 @@ Loads industry templates and user configs, merges them, and provides config to t
 import json
 import os
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List
 import logging
 from copy import deepcopy
 
@@ -20,6 +20,25 @@ TEMPLATES_DIR = USER_CONFIGS_DIR / "templates"
 _config_cache: Dict[str, Dict[str, Any]] = {}
 _template_cache: Dict[str, Dict[str, Any]] = {}
 
+# Files behind each cached config and their modification times.
+# A changed file (e.g. an edited Gemini prompt) is reloaded on next access.
+_config_sources: Dict[str, List[Path]] = {}
+_config_mtimes: Dict[str, tuple] = {}
+_template_mtimes: Dict[str, Optional[float]] = {}
+
+
+def _get_mtime(path: Path) -> Optional[float]:
+    """Get file modification time, or None if the file does not exist"""
+    try:
+        return path.stat().st_mtime
+    except OSError:
+        return None
+
+
+def _get_mtimes(paths: List[Path]) -> tuple:
+    """Get modification times for a list of files"""
+    return tuple(_get_mtime(path) for path in paths)
+
 
 def load_template(industry: str) -> Optional[Dict[str, Any]]:
     """
@@ -33,12 +52,12 @@ def load_template(industry: str) -> Optional[Dict[str, Any]]:
     """
     global _template_cache
     
-    # Check cache first
-    if industry in _template_cache:
-        return deepcopy(_template_cache[industry])
-    
     template_path = TEMPLATES_DIR / f"{industry}.json"
     
+    # Check cache first (skipped if the template file changed on disk)
+    if industry in _template_cache and _template_mtimes.get(industry) == _get_mtime(template_path):
+        return deepcopy(_template_cache[industry])
+    
     if not template_path.exists():
         logger.warning(f"Template not found: {industry}")
         return None
@@ -48,6 +67,7 @@ def load_template(industry: str) -> Optional[Dict[str, Any]]:
             template = json.load(f)
         
         _template_cache[industry] = template
+        _template_mtimes[industry] = _get_mtime(template_path)
         logger.info(f"Loaded template: {industry}")
         return deepcopy(template)
     
@@ -69,8 +89,9 @@ def load_user_config(username: str, bypass_cache: bool = False) -> Optional[Dict
     """
     global _config_cache
     
-    # Check cache first
-    if not bypass_cache and username in _config_cache:
+    # Check cache first (skipped if the user config or its template changed on disk)
+    if not bypass_cache and username in _config_cache \
+            and _config_mtimes.get(username) == _get_mtimes(_config_sources[username]):
         return deepcopy(_config_cache[username])
     
     user_config_path = USER_CONFIGS_DIR / f"{username}.json"
@@ -101,7 +122,12 @@ def load_user_config(username: str, bypass_cache: bool = False) -> Optional[Dict
             merged_config = user_config
         
         # Cache the merged config
+        sources = [user_config_path]
+        if "extends_template" in user_config:
+            sources.append(TEMPLATES_DIR / f"{user_config['extends_template']}.json")
         _config_cache[username] = merged_config
+        _config_sources[username] = sources
+        _config_mtimes[username] = _get_mtimes(sources)
         return deepcopy(merged_config)
     
     except Exception as e:
@@ -203,6 +229,9 @@ def clear_cache():
     global _config_cache, _template_cache
     _config_cache.clear()
     _template_cache.clear()
+    _config_sources.clear()
+    _config_mtimes.clear()
+    _template_mtimes.clear()
     logger.info("Config cache cleared")
 
 
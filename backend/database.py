@@ -3,14 +3,31 @@ Supabase database client wrapper.
 Handles all database operations for DigiEntry.
 """
 import os
+import json
+import time
+import random
 from typing import Optional, Dict, Any, List
 import logging
+from concurrent.futures import ThreadPoolExecutor
 from supabase import create_client, Client
 
 from config import get_supabase_config
 
 logger = logging.getLogger(__name__)
 
+# batch_upsert: chunks are cut at BATCH_MAX_BYTES of JSON payload (and at most batch_size rows)
+# and a failed chunk is retried BATCH_MAX_RETRIES times with exponential backoff starting at
+# BATCH_RETRY_BASE_DELAY seconds. Chunks are sent one at a time unless the caller opts in to
+# concurrency; BATCH_UPSERT_CONCURRENCY is the setting for the large upserts that do
+BATCH_MAX_BYTES = int(os.getenv("BATCH_MAX_BYTES", str(1024 * 1024)))
+BATCH_UPSERT_CONCURRENCY = int(os.getenv("BATCH_UPSERT_CONCURRENCY", "4"))
+BATCH_MAX_RETRIES = int(os.getenv("BATCH_MAX_RETRIES", "3"))
+BATCH_RETRY_BASE_DELAY = float(os.getenv("BATCH_RETRY_BASE_DELAY", "0.5"))
+
+# PostgreSQL error classes that fail the same way on every attempt
+# (22 data exception, 23 integrity violation, 42 syntax/undefined column, PGRST request errors)
+NON_RETRYABLE_PG_CLASSES = ("22", "23", "42", "PGRST")
+
 # Global Supabase client instance
 _supabase_client: Optional[Client] = None
 
@@ -75,47 +92,149 @@ class DatabaseClient:
         response = self.client.table(table).upsert(data).execute()
         return response.data
     
-    def batch_upsert(self, table: str, records: List[Dict[str, Any]], batch_size: int = 500, on_conflict: str = None) -> int:
+    def batch_upsert(self, table: str, records: List[Dict[str, Any]], batch_size: int = 500, on_conflict: str = None,
+                     concurrency: int = 1) -> int:
         """
         Upsert records in batches for better performance
         
         Args:
             table: Table name
             records: List of records to upsert
-            batch_size: Number of records per batch (default: 500)
+            batch_size: Maximum number of records per batch (default: 500)
             on_conflict: Column name(s) to use for conflict resolution (default: primary key)
+            concurrency: Batches in flight at once (default: 1, one batch after another)
         
         Returns:
             Total number of records processed
+        
+        Raises:
+            The error of the first failed batch. Serial upserts stop there; with
+            concurrency > 1 it is raised after every batch has been attempted
+        """
+        report = self.batch_upsert_report(table, records, batch_size, on_conflict, concurrency)
+        for chunk in report["chunks"]:
+            if chunk["exception"] is not None:
+                raise chunk["exception"]
+        return report["processed"]
+    
+    def batch_upsert_report(self, table: str, records: List[Dict[str, Any]], batch_size: int = 500,
+                            on_conflict: str = None, concurrency: int = 1) -> Dict[str, Any]:
+        """
+        Upsert records in batches and report how each batch went.
+        
+        Batches are cut at BATCH_MAX_BYTES of JSON payload or batch_size records,
+        whichever comes first. Each batch is retried with exponential backoff on
+        transient errors (upserts are idempotent). Serial upserts stop at the first
+        failed batch. Concurrent batches may complete in any order, so records sharing
+        a conflict key should be de-duplicated by the caller.
+        
+        Args:
+            table: Table name
+            records: List of records to upsert
+            batch_size: Maximum number of records per batch (default: 500)
+            on_conflict: Column name(s) to use for conflict resolution (default: primary key)
+            concurrency: Batches in flight at once (default: 1)
+        
+        Returns:
+            Dict with table, records, processed, failed_chunks, skipped_chunks, seconds and chunks
+            (one entry per attempted batch: index, start, rows, bytes, attempts, seconds, error, exception)
+        """
+        started = time.perf_counter()
+        chunks = _chunk_by_payload(records, batch_size, BATCH_MAX_BYTES) if records else []
+        concurrency = max(1, min(concurrency or 1, len(chunks) or 1))
+        
+        if chunks:
+            logger.info(f"Batch upserting {len(records)} records to '{table}' in {len(chunks)} batches (concurrency {concurrency})")
+        
+        def run(index: int, chunk: Dict[str, Any]) -> Dict[str, Any]:
+            batch = records[chunk["start"]:chunk["start"] + chunk["rows"]]
+            chunk_started = time.perf_counter()
+            result = dict(chunk, index=index, attempts=0, processed=0, error=None, exception=None)
+            
+            for attempt in range(BATCH_MAX_RETRIES + 1):
+                result["attempts"] = attempt + 1
+                try:
+                    # Use onConflict parameter if specified (for unique constraints other than primary key)
+                    if on_conflict:
+                        response = self.client.table(table).upsert(batch, on_conflict=on_conflict).execute()
+                    else:
+                        response = self.client.table(table).upsert(batch).execute()
+                    result["processed"] = len(response.data) if response.data else len(batch)
+                    result["error"] = result["exception"] = None
+                    break
+                except Exception as e:
+                    result["error"], result["exception"] = str(e), e
+                    if attempt == BATCH_MAX_RETRIES or not _is_retryable(e):
+                        logger.error(f"  Batch {index + 1}/{len(chunks)} failed after {attempt + 1} attempt(s): {e}")
+                        break
+                    delay = BATCH_RETRY_BASE_DELAY * (2 ** attempt) * random.uniform(0.5, 1.5)
+                    logger.warning(f"  Batch {index + 1}/{len(chunks)} failed ({e}), retrying in {delay:.1f}s")
+                    time.sleep(delay)
+            
+            result["seconds"] = round(time.perf_counter() - chunk_started, 3)
+            logger.debug(f"  Batch {index + 1}/{len(chunks)}: {result['processed']} records in {result['seconds']}s")
+            return result
+        
+        if concurrency == 1:
+            chunk_reports = []
+            for i, chunk in enumerate(chunks):
+                chunk_reports.append(run(i, chunk))
+                if chunk_reports[-1]["error"] is not None:
+                    break
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                chunk_reports = list(pool.map(run, range(len(chunks)), chunks))
+        
+        report = {
+            "table": table,
+            "records": len(records),
+            "processed": sum(chunk["processed"] for chunk in chunk_reports),
+            "failed_chunks": sum(1 for chunk in chunk_reports if chunk["error"] is not None),
+            "skipped_chunks": len(chunks) - len(chunk_reports),
+            "concurrency": concurrency,
+            "seconds": round(time.perf_counter() - started, 3),
+            "chunks": chunk_reports,
+        }
+        if chunks:
+            logger.info(
+                f"✅ Batch upsert complete: {report['processed']} records processed in {report['seconds']}s "
+                f"({report['failed_chunks']} failed batches)"
+            )
+        return report
+    
+    def batch_insert(self, table: str, records: List[Dict[str, Any]], batch_size: int = 500) -> List[Dict[str, Any]]:
+        """
+        Insert records in batches (one request per batch)
+        
+        Args:
+            table: Table name
+            records: List of records to insert
+            batch_size: Number of records per batch (default: 500)
+        
+        Returns:
+            Inserted records as returned by the database (including generated ids)
         """
         if not records:
-            return 0
+            return []
         
-        total_processed = 0
+        inserted = []
         total_batches = (len(records) + batch_size - 1) // batch_size
         
-        logger.info(f"Batch upserting {len(records)} records to '{table}' in {total_batches} batches")
+        logger.info(f"Batch inserting {len(records)} records to '{table}' in {total_batches} batches")
         
         for i in range(0, len(records), batch_size):
             batch = records[i:i + batch_size]
             batch_num = (i // batch_size) + 1
             
             try:
-                # Use onConflict parameter if specified (for unique constraints other than primary key)
-                if on_conflict:
-                    response = self.client.table(table).upsert(batch, on_conflict=on_conflict).execute()
-                else:
-                    response = self.client.table(table).upsert(batch).execute()
-                    
-                processed = len(response.data) if response.data else len(batch)
-                total_processed += processed
-                logger.debug(f"  Batch {batch_num}/{total_batches}: {processed} records")
+                response = self.client.table(table).insert(batch).execute()
+                inserted.extend(response.data or [])
+                logger.debug(f"  Batch {batch_num}/{total_batches}: {len(batch)} records")
             except Exception as e:
                 logger.error(f"  Batch {batch_num}/{total_batches} failed: {e}")
                 raise
         
-        logger.info(f"✅ Batch upsert complete: {total_processed} records processed")
-        return total_processed
+        return inserted
     
     def update(self, table: str, data: Dict[str, Any], match: Dict[str, Any]) -> Dict[str, Any]:
         """Update records matching criteria"""
@@ -127,6 +246,34 @@ class DatabaseClient:
         response = self.client.table(table).delete().match(match).execute()
         return response.data
 
+    def delete_in(self, table: str, column: str, values: List[Any], match: Dict[str, Any] = None) -> Dict[str, Any]:
+        """Delete records whose column is one of values (and matching criteria, if given)"""
+        query = self.client.table(table).delete().in_(column, values)
+        if match:
+            query = query.match(match)
+        response = query.execute()
+        return response.data
+
+
+def _chunk_by_payload(records: List[Dict[str, Any]], max_rows: int, max_bytes: int) -> List[Dict[str, Any]]:
+    """Split records into consecutive chunks ({start, rows, bytes}) bounded by row count and JSON size"""
+    chunks = []
+    start, size = 0, 0
+    for i, record in enumerate(records):
+        record_bytes = len(json.dumps(record, default=str)) + 1
+        if i > start and (i - start >= max_rows or size + record_bytes > max_bytes):
+            chunks.append({"start": start, "rows": i - start, "bytes": size})
+            start, size = i, 0
+        size += record_bytes
+    chunks.append({"start": start, "rows": len(records) - start, "bytes": size})
+    return chunks
+
+
+def _is_retryable(error: Exception) -> bool:
+    """Transport errors and server-side failures are retried; data/constraint errors are not"""
+    code = str(getattr(error, "code", "") or "")
+    return not code.startswith(NON_RETRYABLE_PG_CLASSES)
+
 
 # Global database client instance
 _db_client: Optional[DatabaseClient] = None
@@ -2,13 +2,23 @@
 Database helper functions for route endpoints.
 Provides clean interface for common Supabase queries.
 """
-from typing import List, Dict, Any, Optional
+import os
+from typing import List, Dict, Any, Optional, Callable, Iterator
 import logging
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
-from database import get_database_client
+from database import get_database_client, BATCH_UPSERT_CONCURRENCY
 
 logger = logging.getLogger(__name__)
 
+# update_verification_records writes in chunks of VERIFICATION_WRITE_BATCH_SIZE rows,
+# up to VERIFICATION_WRITE_CONCURRENCY requests at a time
+VERIFICATION_WRITE_BATCH_SIZE = int(os.getenv("VERIFICATION_WRITE_BATCH_SIZE", "500"))
+VERIFICATION_WRITE_CONCURRENCY = int(os.getenv("VERIFICATION_WRITE_CONCURRENCY", "4"))
+VERIFICATION_DELETE_CHUNK_SIZE = 100  # ids per delete request (kept short for the URL)
+
+PAGE_SIZE = 1000  # Supabase's maximum per request
+
 
 def convert_numeric_types(row_dict: Dict[str, Any]) -> Dict[str, Any]:
     """
@@ -54,12 +64,116 @@ def convert_numeric_types(row_dict: Dict[str, Any]) -> Dict[str, Any]:
 
 
 
+def iter_table_pages(
+    table: str,
+    username: str,
+    columns: Optional[List[str]] = None,
+    filters: Optional[Dict[str, Any]] = None,
+    descending: bool = False,
+    prefetch: bool = False,
+    page_size: int = PAGE_SIZE,
+    order_column: str = 'created_at',
+    where: Optional[Callable[[Any], Any]] = None
+) -> Iterator[List[Dict[str, Any]]]:
+    """
+    Stream a user's rows page by page using keyset pagination on (order_column, id).
+    
+    Each page continues after the last (order_column, id) seen instead of using an
+    offset, so deep pages cost the same as the first one and rows inserted or moved
+    during the scan cannot shift pages (no skipped or repeated rows). order_column
+    must be non-null (created_at and updated_at default to NOW() on every table read
+    this way).
+    
+    Args:
+        table: Table name with order_column and id columns
+        username: Username for RLS filtering
+        columns: Columns to select (None = all); order_column and id are always included
+        filters: Extra equality filters, e.g. {'type': 'Part'}
+        descending: Newest rows first
+        prefetch: Fetch the next page in a background thread while the caller
+                  processes the current one
+        page_size: Rows per request
+        order_column: Column to page on ('id' pages on id alone)
+        where: Applies any other filters to each request's query,
+               e.g. lambda query: query.gt('updated_at', since)
+    
+    Yields:
+        Lists of row dictionaries (never empty)
+    """
+    db = get_database_client()
+    keys = list(dict.fromkeys([order_column, 'id']))
+    if columns:
+        columns = list(dict.fromkeys([*columns, *keys]))
+    op = 'lt' if descending else 'gt'
+    
+    def fetch(after):
+        query = db.query(table, columns).eq('username', username)
+        for column, value in (filters or {}).items():
+            query = query.eq(column, value)
+        if where:
+            query = where(query)
+        if after is not None and len(keys) == 1:
+            query = getattr(query, op)('id', after[0])
+        elif after is not None:
+            value, row_id = after
+            query = query.or_(f'{order_column}.{op}."{value}",and({order_column}.eq."{value}",id.{op}."{row_id}")')
+        for key in keys:
+            query = query.order(key, desc=descending)
+        result = query.limit(page_size).execute()
+        return result.data or []
+    
+    pool = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    try:
+        next_page = pool.submit(fetch, None) if pool else None
+        after = None
+        while True:
+            page = next_page.result() if pool else fetch(after)
+            has_more = len(page) == page_size
+            if has_more:
+                after = tuple(page[-1].get(key) for key in keys)
+                if pool:
+                    next_page = pool.submit(fetch, after)
+            if page:
+                yield page
+            if not has_more:
+                return
+    finally:
+        if pool:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+
+def iter_table_rows(table: str, username: str, **kwargs) -> Iterator[Dict[str, Any]]:
+    """Stream a user's rows one at a time (see iter_table_pages for the arguments)"""
+    for page in iter_table_pages(table, username, **kwargs):
+        yield from page
+
+
+def iter_invoices(username: str, **kwargs) -> Iterator[Dict[str, Any]]:
+    """Stream a user's invoices (see iter_table_pages for the arguments)"""
+    return iter_table_rows('invoices', username, **kwargs)
+
+
+def iter_inventory(username: str, **kwargs) -> Iterator[Dict[str, Any]]:
+    """Stream a user's inventory items (see iter_table_pages for the arguments)"""
+    return iter_table_rows('inventory', username, **kwargs)
+
+
+def iter_verified_invoices(username: str, **kwargs) -> Iterator[Dict[str, Any]]:
+    """Stream a user's verified invoices (see iter_table_pages for the arguments)"""
+    return iter_table_rows('verified_invoices', username, **kwargs)
+
+
+def _sort_by_upload_date_desc(records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Order rows like ORDER BY upload_date DESC (NULLs first, as in PostgreSQL)"""
+    return sorted(records, key=lambda r: (r.get('upload_date') is None, r.get('upload_date') or ''), reverse=True)
+
+
 def get_all_invoices(username: str, limit: Optional[int] = None, offset: int = 0) -> List[Dict[str, Any]]:
     """
     Get all invoices for a user from Supabase.
     
     IMPORTANT: Supabase has a hard limit of 1000 records per query.
-    This function automatically paginates to fetch ALL records.
+    This function automatically paginates to fetch ALL records (see iter_invoices to stream them).
     
     Args:
         username: Username for RLS filtering
@@ -79,29 +193,9 @@ def get_all_invoices(username: str, limit: Optional[int] = None, offset: int = 0
             result = query.execute()
             return result.data if result.data else []
         
-        # Otherwise, fetch ALL records using pagination (for sync operations)
-        all_records = []
-        batch_size = 1000  # Supabase's maximum per request
-        current_offset = 0
-        
+        # Otherwise, fetch ALL records using keyset pagination (for sync operations)
         logger.info(f"Fetching all invoice records for {username} (paginated)")
-        
-        while True:
-            query = db.query('invoices').eq('username', username).order('created_at', desc=True)
-            query = query.limit(batch_size).offset(current_offset)
-            result = query.execute()
-            
-            if not result.data or len(result.data) == 0:
-                break
-            
-            all_records.extend(result.data)
-            logger.info(f"  Fetched batch {current_offset // batch_size + 1}: {len(result.data)} records (total so far: {len(all_records)})")
-            
-            # If we got less than batch_size records, we've reached the end
-            if len(result.data) < batch_size:
-                break
-            
-            current_offset += batch_size
+        all_records = list(iter_invoices(username, descending=True, prefetch=True))
         
         logger.info(f"✅ Fetched {len(all_records)} total invoice records for {username}")
         return all_records
@@ -111,6 +205,123 @@ def get_all_invoices(username: str, limit: Optional[int] = None, offset: int = 0
         return []
 
 
+def get_invoices_updated_since(username: str, since: str) -> List[Dict[str, Any]]:
+    """
+    Get invoices inserted or changed after a point in time.
+    
+    Pages on (updated_at, id) with iter_table_pages, so rows edited during the scan
+    move ahead of the cursor instead of shifting unchanged rows past it.
+    Raises on query errors: callers use the result to decide what to re-sync and
+    must not mistake a failed read for "nothing changed".
+    
+    Args:
+        username: Username for RLS filtering
+        since: ISO timestamp; rows with updated_at strictly after it are returned
+    
+    Returns:
+        List of invoice dictionaries, oldest change first
+    """
+    all_records = list(iter_table_rows(
+        'invoices', username, order_column='updated_at', where=lambda query: query.gt('updated_at', since)
+    ))
+    
+    logger.info(f"Fetched {len(all_records)} invoice records changed since {since} for {username}")
+    return all_records
+
+
+def get_invoices_for_receipts(
+    username: str,
+    receipt_numbers: List[str],
+    receipt_links: Optional[List[str]] = None,
+    chunk_size: int = 100
+) -> List[Dict[str, Any]]:
+    """
+    Get every invoice line item of the given receipts.
+    
+    Rows are matched on receipt_number or receipt_link (corrections in the
+    verification tables are keyed by link and may rename the receipt), using
+    one `in_` query per chunk like get_records_by_image_hashes. Raises on query
+    errors for the same reason as get_invoices_updated_since.
+    
+    Args:
+        username: Username for RLS filtering
+        receipt_numbers: Receipt numbers to load
+        receipt_links: Receipt links to load
+        chunk_size: Number of values per query
+    
+    Returns:
+        List of invoice dictionaries (each row once)
+    """
+    records: Dict[Any, Dict[str, Any]] = {}
+    
+    for column, values in (('receipt_number', receipt_numbers), ('receipt_link', receipt_links or [])):
+        unique_values = list(dict.fromkeys(v for v in values if v))
+        for i in range(0, len(unique_values), chunk_size):
+            chunk = unique_values[i:i + chunk_size]
+            rows = iter_table_rows(
+                'invoices', username, order_column='id',
+                where=lambda query, column=column, chunk=chunk: query.in_(column, chunk)
+            )
+            for record in rows:
+                records.setdefault(record.get('id'), record)
+    
+    logger.info(f"Fetched {len(records)} invoice records for {len(receipt_numbers)} receipt(s) for {username}")
+    return list(records.values())
+
+
+def get_sync_watermark(username: str) -> Optional[Dict[str, Any]]:
+    """
+    Get the user's Sync & Finish watermark.
+    
+    Args:
+        username: Username for RLS filtering
+    
+    Returns:
+        sync_watermarks row, or None if the user has never synced (or the table is missing)
+    """
+    try:
+        db = get_database_client()
+        result = db.query('sync_watermarks').eq('username', username).limit(1).execute()
+        return result.data[0] if result.data else None
+    
+    except Exception as e:
+        logger.warning(f"Could not read sync watermark for {username}: {e}")
+        return None
+
+
+def save_sync_watermark(username: str, invoices_watermark: Optional[str],
+                        pending_receipts: List[str], full_sync: bool = False) -> bool:
+    """
+    Save the user's Sync & Finish watermark.
+    
+    Args:
+        username: Username for RLS filtering
+        invoices_watermark: Latest invoices.updated_at covered by this sync
+        pending_receipts: Receipt numbers still pending review after this sync
+        full_sync: Whether this sync was a full rebuild
+    
+    Returns:
+        True if successful, False otherwise
+    """
+    try:
+        db = get_database_client()
+        now = pd.Timestamp.now(tz='UTC').isoformat()
+        record = {
+            'username': username,
+            'invoices_watermark': invoices_watermark,
+            'pending_receipts': sorted(pending_receipts),
+            'updated_at': now
+        }
+        if full_sync:
+            record['last_full_sync'] = now
+        db.upsert('sync_watermarks', record)
+        return True
+    
+    except Exception as e:
+        logger.warning(f"Could not save sync watermark for {username}: {e}")
+        return False
+
+
 def get_all_inventory(username: str, limit: Optional[int] = None) -> List[Dict[str, Any]]:
     """
     Get inventory items for a user.
@@ -137,29 +348,9 @@ def get_all_inventory(username: str, limit: Optional[int] = None) -> List[Dict[s
             logger.info(f"✅ Fetched {len(result.data) if result.data else 0} inventory records")
             return result.data if result.data else []
         
-        # Otherwise, fetch ALL records using pagination (for searches/filters)
-        all_records = []
-        batch_size = 1000  # Supabase's maximum per request
-        current_offset = 0
-        
+        # Otherwise, fetch ALL records using keyset pagination (for searches/filters)
         logger.info(f"Fetching ALL inventory records for {username} (paginated, for filtering)")
-        
-        while True:
-            query = db.query('inventory').eq('username', username).order('upload_date', desc=True)
-            query = query.limit(batch_size).offset(current_offset)
-            result = query.execute()
-            
-            if not result.data or len(result.data) == 0:
-                break
-            
-            all_records.extend(result.data)
-            logger.info(f"  Fetched batch {current_offset // batch_size + 1}: {len(result.data)} records (total so far: {len(all_records)})")
-            
-            # If we got less than batch_size records, we've reached the end
-            if len(result.data) < batch_size:
-                break
-            
-            current_offset += batch_size
+        all_records = _sort_by_upload_date_desc(list(iter_inventory(username, prefetch=True)))
         
         logger.info(f"✅ Fetched {len(all_records)} total inventory records for {username}")
         return all_records
@@ -195,29 +386,9 @@ def get_verified_invoices(username: str, limit: Optional[int] = None) -> List[Di
             logger.info(f"✅ Fetched {len(result.data) if result.data else 0} verified invoice records")
             return result.data if result.data else []
         
-        # Otherwise, fetch ALL records using pagination (for searches/filters)
-        all_records = []
-        batch_size = 1000  # Supabase's maximum per request
-        current_offset = 0
-        
+        # Otherwise, fetch ALL records using keyset pagination (for searches/filters)
         logger.info(f"Fetching ALL verified invoice records for {username} (paginated, for filtering)")
-        
-        while True:
-            query = db.query('verified_invoices').eq('username', username).order('upload_date', desc=True)
-            query = query.limit(batch_size).offset(current_offset)
-            result = query.execute()
-            
-            if not result.data or len(result.data) == 0:
-                break
-            
-            all_records.extend(result.data)
-            logger.info(f"  Fetched batch {current_offset // batch_size + 1}: {len(result.data)} records (total so far: {len(all_records)})")
-            
-            # If we got less than batch_size records, we've reached the end
-            if len(result.data) < batch_size:
-                break
-            
-            current_offset += batch_size
+        all_records = _sort_by_upload_date_desc(list(iter_verified_invoices(username, prefetch=True)))
         
         logger.info(f"✅ Fetched {len(all_records)} total verified invoice records for {username}")
         return all_records
@@ -229,6 +400,98 @@ def get_verified_invoices(username: str, limit: Optional[int] = None) -> List[Di
 
 
 
+def get_records_by_image_hashes(
+    table: str,
+    username: str,
+    image_hashes: List[str],
+    columns: Optional[List[str]] = None,
+    chunk_size: int = 100
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Look up records for many image hashes at once.
+    
+    Uses one `in_` query per chunk of hashes instead of one query per file.
+    Chunks keep the PostgREST request URL well under proxy limits
+    (100 SHA-256 hashes ≈ 6.5KB).
+    
+    Args:
+        table: Table name with an image_hash column
+        username: Username for RLS filtering
+        image_hashes: Hashes to resolve (duplicates and empty values are ignored)
+        columns: Columns to select (None = all). image_hash is always included.
+        chunk_size: Number of hashes per query
+    
+    Returns:
+        Dictionary of image_hash -> first matching record (hashes without a match are absent)
+    """
+    unique_hashes = list(dict.fromkeys(h for h in image_hashes if h))
+    if not unique_hashes:
+        return {}
+    
+    if columns and 'image_hash' not in columns:
+        columns = list(columns) + ['image_hash']
+    
+    matches: Dict[str, Dict[str, Any]] = {}
+    try:
+        db = get_database_client()
+        
+        for i in range(0, len(unique_hashes), chunk_size):
+            chunk = unique_hashes[i:i + chunk_size]
+            result = db.query(table, columns) \
+                .eq('username', username) \
+                .in_('image_hash', chunk) \
+                .execute()
+            
+            for record in result.data or []:
+                # Keep the first record per hash, like the single-hash .limit(1) lookups
+                matches.setdefault(record.get('image_hash'), record)
+        
+        logger.info(f"Resolved {len(unique_hashes)} image hashes against {table}: {len(matches)} match(es)")
+        return matches
+    
+    except Exception as e:
+        logger.error(f"Error looking up image hashes in {table} for {username}: {e}")
+        return matches
+
+
+def get_verified_invoices_by_row_ids(
+    username: str,
+    row_ids: List[Any],
+    columns: Optional[List[str]] = None,
+    chunk_size: int = 100
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Look up verified invoices for many row_ids at once (one `in_` query per chunk).
+    
+    Args:
+        username: Username for RLS filtering
+        row_ids: row_id values to resolve (duplicates and empty values are ignored)
+        columns: Columns to select (None = all). row_id is always included.
+        chunk_size: Number of row_ids per query
+    
+    Returns:
+        Dictionary of str(row_id) -> record (row_ids without a record are absent)
+    
+    Raises:
+        Any query error (callers rely on the result being complete)
+    """
+    unique_ids = list(dict.fromkeys(str(row_id) for row_id in row_ids if row_id is not None and row_id != ''))
+    if columns and 'row_id' not in columns:
+        columns = list(columns) + ['row_id']
+    
+    db = get_database_client()
+    records: Dict[str, Dict[str, Any]] = {}
+    for i in range(0, len(unique_ids), chunk_size):
+        result = db.query('verified_invoices', columns) \
+            .eq('username', username) \
+            .in_('row_id', unique_ids[i:i + chunk_size]) \
+            .execute()
+        for record in result.data or []:
+            records[str(record.get('row_id'))] = record
+    
+    return records
+
+
 def get_verification_dates(username: str) -> List[Dict[str, Any]]:
     """
     Get all date verification records for a user.
@@ -295,7 +558,14 @@ def update_verified_invoices(username: str, data: List[Dict[str, Any]]) -> bool:
         
         # OPTIMIZED: Use batch upsert with row_id as conflict resolution
         # This allows updating existing records instead of throwing duplicate key errors
-        count = db.batch_upsert('verified_invoices', records, batch_size=500, on_conflict='row_id')
+        # Batches are sent concurrently and may land in any order, so keep only the last record per row_id
+        by_row_id = {record['row_id']: i for i, record in enumerate(records) if record.get('row_id') is not None}
+        records = [
+            record for i, record in enumerate(records)
+            if record.get('row_id') is None or by_row_id[record['row_id']] == i
+        ]
+        count = db.batch_upsert('verified_invoices', records, batch_size=500, on_conflict='row_id',
+                                concurrency=BATCH_UPSERT_CONCURRENCY)
         logger.info(f"✅ Upserted {count} verified invoices for {username} (preserving existing data)")
         return True
     
@@ -327,7 +597,32 @@ def delete_records_by_receipt(username: str, receipt_number: str, table: str = '
         return False
 
 
-def update_verification_records(username: str, table: str, data: List[Dict[str, Any]]) -> bool:
+def _write_chunks(write: Callable[[List[Any]], Any], items: List[Any], chunk_size: int, concurrency: int):
+    """Call write() once per chunk of items, running up to concurrency chunks at a time"""
+    chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+    if concurrency <= 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            write(chunk)
+        return
+    
+    with ThreadPoolExecutor(max_workers=min(concurrency, len(chunks))) as pool:
+        futures = [pool.submit(write, chunk) for chunk in chunks]
+        for future in futures:
+            future.result()
+
+
+def _get_all_verification_rows(table: str, username: str) -> Dict[Any, Dict[str, Any]]:
+    """All of a user's rows in a verification table keyed by id (keyset-paginated on id)"""
+    return {row.get('id'): row for row in iter_table_rows(table, username, order_column='id')}
+
+
+def update_verification_records(
+    username: str,
+    table: str,
+    data: List[Dict[str, Any]],
+    diff: bool = False,
+    concurrency: Optional[int] = None
+) -> bool:
     """
     Update verification records (replace all for user).
     
@@ -335,27 +630,72 @@ def update_verification_records(username: str, table: str, data: List[Dict[str,
     Verification tables need to remove "Done" records after Sync & Finish.
     The caller (verification.py) filters the data to only include records that should remain.
     
+    Records are inserted with multi-row requests (VERIFICATION_WRITE_BATCH_SIZE rows each,
+    up to `concurrency` at a time), so the table is only empty for a few requests.
+    
+    With diff=True nothing is deleted wholesale: rows whose id is not in data are
+    deleted, changed rows are upserted by id and rows without an id are inserted.
+    Unchanged rows are not written and the table is never empty.
+    
     Args:
         username: Username for RLS filtering
         table: Table name ('verification_dates' or 'verification_amounts')
         data: List of record dictionaries (already filtered to keep only Pending/Duplicate)
+        diff: Only delete/write the rows that changed (requires records to carry their id)
+        concurrency: Concurrent write requests (default: VERIFICATION_WRITE_CONCURRENCY)
     
     Returns:
         True if successful, False otherwise
     """
+    concurrency = VERIFICATION_WRITE_CONCURRENCY if concurrency is None else concurrency
+    
     try:
         db = get_database_client()
+        records = [convert_numeric_types({**record, 'username': username}) for record in data]
         
-        # Delete existing records for this user (removes "Done" records)
-        db.delete(table, {'username': username})
+        if not diff:
+            # Delete existing records for this user (removes "Done" records)
+            db.delete(table, {'username': username})
+            
+            # Insert filtered records (only Pending/Duplicate)
+            _write_chunks(
+                lambda chunk: db.batch_insert(table, chunk, batch_size=len(chunk)),
+                records, VERIFICATION_WRITE_BATCH_SIZE, concurrency
+            )
+            logger.info(f"Updated {len(records)} records in {table} for {username} (removed Done records)")
+            return True
         
-        # Insert filtered records (only Pending/Duplicate)
-        for record in data:
-            record['username'] = username  # Ensure username is set
-            record = convert_numeric_types(record)
-            db.insert(table, record)
+        existing = _get_all_verification_rows(table, username)
+        keep_ids = {record.get('id') for record in records if record.get('id') is not None}
+        stale_ids = [row_id for row_id in existing if row_id not in keep_ids]
+        
+        changed = [
+            record for record in records
+            if record.get('id') is not None and (
+                record['id'] not in existing
+                or any(existing[record['id']].get(key) != value for key, value in record.items())
+            )
+        ]
+        new_records = [record for record in records if record.get('id') is None]
+        
+        # Delete first so re-inserted rows cannot collide with the rows they replace
+        _write_chunks(
+            lambda chunk: db.delete_in(table, 'id', chunk, {'username': username}),
+            stale_ids, VERIFICATION_DELETE_CHUNK_SIZE, concurrency
+        )
+        _write_chunks(
+            lambda chunk: db.batch_upsert(table, chunk, batch_size=len(chunk), on_conflict='id'),
+            changed, VERIFICATION_WRITE_BATCH_SIZE, concurrency
+        )
+        _write_chunks(
+            lambda chunk: db.batch_insert(table, chunk, batch_size=len(chunk)),
+            new_records, VERIFICATION_WRITE_BATCH_SIZE, concurrency
+        )
         
-        logger.info(f"Updated {len(data)} records in {table} for {username} (removed Done records)")
+        logger.info(
+            f"Updated {table} for {username}: {len(stale_ids)} deleted, {len(changed)} changed, "
+            f"{len(new_records)} inserted, {len(records) - len(changed) - len(new_records)} unchanged"
+        )
         return True
     
     except Exception as e:
@@ -105,12 +105,19 @@ async def startup_event():
     """Application startup"""
     logger.info("DigiEntry API starting up...")
     logger.info(f"CORS origins: {config.settings.cors_origins}")
+    
+    # Lease queued and interrupted upload jobs (handlers are registered by the routes)
+    from services.job_queue import start_job_worker
+    start_job_worker()
 
 
 @app.on_event("shutdown")
 async def shutdown_event():
     """Application shutdown"""
     logger.info("DigiEntry API shutting down...")
+    
+    from services.job_queue import stop_job_worker
+    stop_job_worker()
 
 
 if __name__ == "__main__":
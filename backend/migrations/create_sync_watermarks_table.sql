@@ -0,0 +1,40 @@
+-- Migration: Incremental Sync & Finish
+-- Sync & Finish only re-derives receipts changed since the user's last sync.
+-- invoices.updated_at is the change marker; sync_watermarks stores how far each
+-- user's last sync got.
+-- Run this in Supabase SQL Editor
+
+-- 1. Change marker on invoices (set on insert, bumped when an update changes the row).
+--    Sync & Finish writes back every row of the receipts it re-derives; rows it
+--    leaves unchanged must not count as edits, or each sync would trigger the next.
+ALTER TABLE invoices ADD COLUMN IF NOT EXISTS updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW();
+
+CREATE OR REPLACE FUNCTION set_invoices_updated_at()
+RETURNS TRIGGER AS $$
+BEGIN
+    NEW.updated_at = NOW();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trg_invoices_updated_at ON invoices;
+CREATE TRIGGER trg_invoices_updated_at
+    BEFORE UPDATE ON invoices
+    FOR EACH ROW
+    WHEN (OLD IS DISTINCT FROM NEW)
+    EXECUTE FUNCTION set_invoices_updated_at();
+
+CREATE INDEX IF NOT EXISTS idx_invoices_username_updated_at ON invoices(username, updated_at);
+CREATE INDEX IF NOT EXISTS idx_invoices_username_receipt_link ON invoices(username, receipt_link);
+
+-- 2. Per-user watermark
+CREATE TABLE IF NOT EXISTS sync_watermarks (
+    username TEXT PRIMARY KEY,
+    invoices_watermark TIMESTAMPTZ,                  -- Latest invoices.updated_at covered by the last sync
+    pending_receipts JSONB NOT NULL DEFAULT '[]',    -- Receipts still pending review after the last sync
+    last_full_sync TIMESTAMPTZ,
+    updated_at TIMESTAMPTZ NOT NULL DEFAULT NOW()
+);
+
+-- Grant permissions (adjust as needed based on your security settings)
+-- ALTER TABLE sync_watermarks ENABLE ROW LEVEL SECURITY;
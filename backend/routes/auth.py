@@ -1,5 +1,6 @@
 """Authentication routes for login and user management"""
-from fastapi import APIRouter, HTTPException, status, Depends
+from fastapi import APIRouter, HTTPException, Request, Response, status, Depends
+from fastapi.security import HTTPAuthorizationCredentials
 from pydantic import BaseModel
 from typing import Dict, Any
 from datetime import timedelta
@@ -32,9 +33,9 @@ class UserResponse(BaseModel):
 
 
 @router.post("/login", response_model=LoginResponse)
-async def login(credentials: LoginRequest):
+async def login(credentials: LoginRequest, request: Request, response: Response):
     """
-    Authenticate user and return JWT token
+    Authenticate user and return JWT token (also set as the stream cookie)
     """
     user_config = auth.authenticate_user(credentials.username, credentials.password)
     
@@ -60,6 +61,8 @@ async def login(credentials: LoginRequest):
         "dashboard_url": user_config.get("dashboard_url")
     }
     
+    auth.set_auth_cookie(response, request, access_token)
+    
     return {
         "access_token": access_token,
         "token_type": "bearer",
@@ -80,9 +83,25 @@ async def get_me(current_user: Dict[str, Any] = Depends(auth.get_current_user)):
     }
 
 
+@router.post("/stream-session")
+async def create_stream_session(
+    request: Request,
+    response: Response,
+    credentials: HTTPAuthorizationCredentials = Depends(auth.security),
+    current_user: Dict[str, Any] = Depends(auth.get_current_user)
+):
+    """
+    Set the stream cookie from the bearer token, so EventSource progress streams
+    authenticate for sessions that started before the cookie was issued
+    """
+    auth.set_auth_cookie(response, request, credentials.credentials)
+    return {"message": "Stream session ready"}
+
+
 @router.post("/logout")
-async def logout():
+async def logout(response: Response):
     """
-    Logout endpoint (client-side token removal)
+    Logout endpoint (client-side token removal; clears the stream cookie)
     """
+    auth.clear_auth_cookie(response)
     return {"message": "Logged out successfully"}
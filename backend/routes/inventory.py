@@ -1,29 +1,30 @@
 """Inventory upload and processing routes"""
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, Request
 from typing import List, Dict, Any, Optional
 from pydantic import BaseModel
 import logging
-from datetime import datetime
-import uuid
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 from io import BytesIO
 from fastapi.responses import StreamingResponse
 import pandas as pd
 
-from auth import get_current_user, get_current_user_r2_bucket
+from auth import get_current_user, get_current_user_r2_bucket, get_stream_username
 from services.storage import get_storage_client
 from utils.image_optimizer import optimize_image_for_gemini, should_optimize_image, validate_image_quality
+from services.job_queue import get_job_store, enqueue_job, register_job_handler, JobProgress, JobLease, JobCancelled
+from services.progress_bus import stream_task_events
+from services.stock_ledger import apply_stock_movements
 from config import get_purchases_folder
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-# Thread pool for blocking operations
-executor = ThreadPoolExecutor(max_workers=10)
+# Job kind for inventory processing batches; status and checkpoints live in the job store
+INVENTORY_UPLOAD_JOB = "inventory_upload"
 
-# In-memory storage for processing status
-inventory_processing_status: Dict[str, Dict[str, Any]] = {}
+# inventory_items fields that affect stock levels
+STOCK_FIELDS = {"part_number", "description", "qty", "rate", "invoice_date", "excluded_from_stock"}
 
 
 class InventoryUploadResponse(BaseModel):
@@ -179,17 +180,15 @@ async def process_inventory(
     current_user: Dict[str, Any] = Depends(get_current_user)
 ):
     """
-    Trigger inventory processing in thread pool
+    Queue inventory processing as a durable background job
     """
-    task_id = str(uuid.uuid4())
-    
     # Get r2_bucket from user config
     r2_bucket = current_user.get("r2_bucket")
     if not r2_bucket:
         raise HTTPException(status_code=400, detail="No r2_bucket configured for user")
     
-    # Initialize status
-    inventory_processing_status[task_id] = {
+    # Initial status (stored with the job, read back by the status endpoint)
+    initial_status = {
         "status": "queued",
         "progress": {
             "total": len(request.file_keys),
@@ -203,16 +202,15 @@ async def process_inventory(
         "end_time": None
     }
     
-    # Run in thread pool
-    loop = asyncio.get_event_loop()
-    loop.run_in_executor(
-        executor,
-        process_inventory_sync,
-        task_id,
-        request.file_keys,
-        r2_bucket,
+    task_id = enqueue_job(
+        INVENTORY_UPLOAD_JOB,
         current_user.get("username", "user"),
-        request.force_upload  # Pass force_upload parameter
+        payload={
+            "file_keys": request.file_keys,
+            "r2_bucket": r2_bucket,
+            "force_upload": request.force_upload
+        },
+        state=initial_status
     )
     
     return {
@@ -222,6 +220,18 @@ async def process_inventory(
     }
 
 
+def format_inventory_status(task_id: str, status: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the status response (also sent as each streamed event) from a job's state"""
+    return {
+        "task_id": task_id,
+        "status": status.get("status", "unknown"),
+        "progress": status.get("progress", {}),
+        "message": status.get("message", ""),
+        "duplicates": status.get("duplicates", []),  # Include duplicates array
+        "uploaded_r2_keys": status.get("uploaded_r2_keys", [])  # CRITICAL: Include R2 keys
+    }
+
+
 @router.get("/status/{task_id}", response_model=InventoryProcessStatusResponse)
 async def get_inventory_process_status(
     task_id: str,
@@ -230,19 +240,51 @@ async def get_inventory_process_status(
     """
     Get processing status for an inventory task
     """
-    if task_id not in inventory_processing_status:
+    job = get_job_store().get_job(task_id)
+    if not job or job["kind"] != INVENTORY_UPLOAD_JOB:
         raise HTTPException(status_code=404, detail="Task not found")
     
-    status = inventory_processing_status[task_id]
+    return format_inventory_status(task_id, job["state"])
+
+
+@router.get("/stream/{task_id}")
+async def stream_inventory_process_status(
+    task_id: str,
+    request: Request,
+    username: str = Depends(get_stream_username)
+):
+    """
+    Stream processing status for an inventory task with Server-Sent Events (replaces polling /status).
     
-    return {
-        "task_id": task_id,
-        "status": status.get("status", "unknown"),
-        "progress": status.get("progress", {}),
-        "message": status.get("message", ""),
-        "duplicates": status.get("duplicates", []),  # Include duplicates array
-        "uploaded_r2_keys": status.get("uploaded_r2_keys", [])  # CRITICAL: Include R2 keys
-    }
+    Each event carries the same JSON as the status endpoint; the stream ends after
+    status completed, failed or duplicate_detected. Reconnecting clients send
+    Last-Event-ID and get the events they missed.
+    """
+    store = get_job_store()
+    job = await asyncio.get_running_loop().run_in_executor(None, store.get_job, task_id)
+    if not job or job["kind"] != INVENTORY_UPLOAD_JOB or job["username"] != username:
+        raise HTTPException(status_code=404, detail="Task not found")
+    
+    last_event_id = request.headers.get("last-event-id")
+    
+    def load_state() -> Optional[Dict[str, Any]]:
+        current = store.get_job(task_id)
+        return current["state"] if current else None
+    
+    return StreamingResponse(
+        stream_task_events(
+            task_id,
+            load_state,
+            lambda state: format_inventory_status(task_id, state),
+            int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+        ),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no"
+        }
+    )
 
 
 def process_inventory_sync(
@@ -250,17 +292,26 @@ def process_inventory_sync(
     file_keys: List[str],  # These are temp paths now
     r2_bucket: str,
     username: str,
-    force_upload: bool = False
+    force_upload: bool = False,
+    lease: Optional[JobLease] = None
 ):
     """
     Synchronous background task to process inventory
     1. Upload temp files to R2
     2. Process with Gemini
     3. Clean up temp files
+    
+    Runs as a job-queue handler. Uploaded and processed files are checkpointed
+    in the job store, so a job resumed after a worker restart skips them.
+    Stops with JobCancelled once the worker loses the job's lease (another
+    worker has taken the job over), leaving the temp files to that worker.
     """
     import os
     import shutil
     
+    store = get_job_store()
+    progress = JobProgress(store, task_id)
+    
     logger.info(f"=== INVENTORY PROCESSING STARTED ===")
     logger.info(f"Task ID: {task_id}")
     logger.info(f"Temp files: {file_keys}")
@@ -270,118 +321,168 @@ def process_inventory_sync(
     inventory_folder = get_purchases_folder(username)
     
     try:
-        # Check if files are R2 keys (already uploaded) or temp paths  
-        # R2 keys look like "Adnak/purchases/xxx.jpg"
-        # Temp paths look like "C:\Users\...\temp_xxx\file.jpg"
-        first_file = file_keys[0] if file_keys else ""
-        files_already_in_r2 = force_upload or ("/" in first_file and not os.path.exists(first_file))
-        
-        if files_already_in_r2:
-            # Files are already in R2 (duplicate replacement flow)
-            logger.info("Files already in R2 - skipping upload phase")
-            r2_file_keys = file_keys  # These are R2 keys, not temp paths
-            inventory_processing_status[task_id]["status"] = "processing"
-            inventory_processing_status[task_id]["message"] = "Processing inventory items..."
-            inventory_processing_status[task_id]["start_time"] = datetime.now().isoformat()
+        # A previous attempt may have finished the batch and died before recording it
+        finished = store.get_checkpoints(task_id, "batch").get("result")
+        if finished:
+            r2_file_keys, results = finished["r2_file_keys"], finished["results"]
+            logger.info(f"Task {task_id} already processed, restoring final status")
         else:
-            # Phase 1: Upload temp files to R2 (new upload flow)
-            logger.info("Phase 1: Uploading files to R2...")
-            inventory_processing_status[task_id]["status"] = "uploading"
-            inventory_processing_status[task_id]["message"] = "Uploading files to cloud storage..."
-            inventory_processing_status[task_id]["start_time"] = datetime.now().isoformat()
+            # Check if files are R2 keys (already uploaded) or temp paths  
+            # R2 keys look like "Adnak/purchases/xxx.jpg"
+            # Temp paths look like "C:\Users\...\temp_xxx\file.jpg"
+            first_file = file_keys[0] if file_keys else ""
+            files_already_in_r2 = force_upload or ("/" in first_file and not os.path.exists(first_file))
+            
+            if files_already_in_r2:
+                # Files are already in R2 (duplicate replacement flow)
+                logger.info("Files already in R2 - skipping upload phase")
+                r2_file_keys = file_keys  # These are R2 keys, not temp paths
+                store.update_state(task_id, {
+                    "status": "processing",
+                    "message": "Processing inventory items...",
+                    "start_time": datetime.now().isoformat()
+                })
+            else:
+                # Phase 1: Upload temp files to R2 (new upload flow)
+                logger.info("Phase 1: Uploading files to R2...")
+                uploaded = store.get_checkpoints(task_id, "upload")
+                if uploaded:
+                    logger.info(f"Resuming upload: {len(uploaded)}/{len(file_keys)} files already in R2")
+                store.update_state(task_id, {
+                    "status": "uploading",
+                    "message": "Uploading files to cloud storage...",
+                    "start_time": datetime.now().isoformat()
+                })
+                
+                for idx, temp_path in enumerate(file_keys):
+                    if lease:
+                        lease.check()
+                    try:
+                        r2_key = uploaded.get(temp_path)
+                        if not r2_key:
+                            with open(temp_path, 'rb') as f:
+                                content = f.read()
+                            
+                            filename = os.path.basename(temp_path)
+                            
+                            # Upload to R2 using existing function
+                            r2_key = upload_single_inventory_file_sync(
+                                content=content,
+                                filename=filename,
+                                username=username,
+                                r2_bucket=r2_bucket,
+                                inventory_folder=inventory_folder
+                            )
+                            if r2_key:
+                                store.save_checkpoint(task_id, "upload", temp_path, r2_key)
+                        
+                        if r2_key:
+                            r2_file_keys.append(r2_key)
+                            logger.info(f"Uploaded {idx+1}/{len(file_keys)}: {r2_key}")
+                        
+                        progress.update(
+                            message=f"Uploading to cloud: {idx+1}/{len(file_keys)}",
+                            progress={"processed": idx}
+                        )
+                        
+                    except Exception as e:
+                        logger.error(f"Error uploading {temp_path}: {e}")
+                        continue
+                
+                progress.flush()
+                logger.info(f"R2 upload complete: {len(r2_file_keys)}/{len(file_keys)} files")
             
-            for idx, temp_path in enumerate(file_keys):
-                try:
-                    with open(temp_path, 'rb') as f:
-                        content = f.read()
-                    
-                    filename = os.path.basename(temp_path)
-                    
-                    # Upload to R2 using existing function
-                    r2_key = upload_single_inventory_file_sync(
-                        content=content,
-                        filename=filename,
-                        username=username,
-                        r2_bucket=r2_bucket,
-                        inventory_folder=inventory_folder
-                    )
-                    
-                    if r2_key:
-                        r2_file_keys.append(r2_key)
-                        logger.info(f"Uploaded {idx+1}/{len(file_keys)}: {r2_key}")
-                    
-                    inventory_processing_status[task_id]["message"] = f"Uploading to cloud: {idx+1}/{len(file_keys)}"
-                    inventory_processing_status[task_id]["progress"]["processed"] = idx
-                    
-                except Exception as e:
-                    logger.error(f"Error uploading {temp_path}: {e}")
-                    continue
+            # Phase 2: Process inventory
+            logger.info("Phase 2: Processing inventory with AI...")
+            store.update_state(
+                task_id,
+                {"status": "processing", "message": "Processing inventory items..."},
+                {"total": len(r2_file_keys), "processed": 0}
+            )
             
-            logger.info(f"R2 upload complete: {len(r2_file_keys)}/{len(file_keys)} files")
-        
-        # Phase 2: Process inventory
-        logger.info("Phase 2: Processing inventory with AI...")
-        inventory_processing_status[task_id]["status"] = "processing"
-        inventory_processing_status[task_id]["message"] = "Processing inventory items..."
-        inventory_processing_status[task_id]["progress"]["total"] = len(r2_file_keys)
-        inventory_processing_status[task_id]["progress"]["processed"] = 0
-        
-        def update_progress(current_index: int, total: int, current_file: str):
-            inventory_processing_status[task_id]["progress"]["processed"] = current_index
-            inventory_processing_status[task_id]["current_file"] = current_file
-            inventory_processing_status[task_id]["current_index"] = current_index
-            inventory_processing_status[task_id]["message"] = f"Processing: {current_file}"
-            logger.info(f"Progress: {current_index}/{total} - {current_file}")
-        
-        from services.inventory_processor import process_inventory_batch
-        
-        results = process_inventory_batch(
-            file_keys=r2_file_keys,
-            r2_bucket=r2_bucket,
-            username=username,
-            progress_callback=update_progress,
-            force_upload=force_upload
-        )
+            def update_progress(current_index: int, total: int, current_file: str):
+                progress.update(
+                    current_file=current_file,
+                    current_index=current_index,
+                    message=f"Processing: {current_file}",
+                    progress={"processed": current_index}
+                )
+                logger.info(f"Progress: {current_index}/{total} - {current_file}")
+            
+            def checkpoint_file(file_key: str, result: Dict[str, Any]):
+                """Record a saved vendor invoice so a resumed job does not process it again"""
+                store.save_checkpoint(task_id, "process", file_key, result)
+            
+            from services.inventory_processor import process_inventory_batch
+            
+            results = process_inventory_batch(
+                file_keys=r2_file_keys,
+                r2_bucket=r2_bucket,
+                username=username,
+                progress_callback=update_progress,
+                force_upload=force_upload,
+                completed_files=store.get_checkpoints(task_id, "process"),
+                on_file_complete=checkpoint_file,
+                cancelled=lease.lost if lease else None
+            )
+            progress.flush()
+            
+            if lease:
+                lease.check()
+            store.save_checkpoint(task_id, "batch", "result", {"r2_file_keys": r2_file_keys, "results": results})
         
         logger.info(f"Processing completed. Results: {results}")
         
         # Check for duplicates
+        updates: Dict[str, Any] = {}
+        progress_updates: Dict[str, Any] = {}
         if results.get("duplicates"):
-            inventory_processing_status[task_id]["status"] = "duplicate_detected"
-            inventory_processing_status[task_id]["duplicates"] = results["duplicates"]
-            inventory_processing_status[task_id]["uploaded_r2_keys"] = r2_file_keys  # CRITICAL: Frontend needs ALL R2 keys
-            inventory_processing_status[task_id]["message"] = f"Duplicate vendor invoices detected: {len(results['duplicates'])} file(s)"
+            updates["status"] = "duplicate_detected"
+            updates["duplicates"] = results["duplicates"]
+            updates["uploaded_r2_keys"] = r2_file_keys  # CRITICAL: Frontend needs ALL R2 keys
+            updates["message"] = f"Duplicate vendor invoices detected: {len(results['duplicates'])} file(s)"
             logger.info(f"Duplicates detected: {len(results['duplicates'])}")
         else:
-            inventory_processing_status[task_id]["status"] = "completed"
-            inventory_processing_status[task_id]["progress"]["processed"] = results["processed"]
-            inventory_processing_status[task_id]["progress"]["failed"] = results["failed"]
-            inventory_processing_status[task_id]["message"] = f"Successfully processed {results['processed']} vendor invoices"
-            inventory_processing_status[task_id]["current_file"] = "All complete"
+            updates["status"] = "completed"
+            progress_updates["processed"] = results["processed"]
+            progress_updates["failed"] = results["failed"]
+            updates["message"] = f"Successfully processed {results['processed']} vendor invoices"
+            updates["current_file"] = "All complete"
+            progress_updates["routing"] = results.get("routing")
             # ✓ Include top-level counts for frontend summary
-            inventory_processing_status[task_id]["processed"] = results["processed"]
-            inventory_processing_status[task_id]["duplicates"] = results.get("duplicates", [])
+            updates["processed"] = results["processed"]
+            updates["duplicates"] = results.get("duplicates", [])
         
-        inventory_processing_status[task_id]["end_time"] = datetime.now().isoformat()
+        updates["end_time"] = datetime.now().isoformat()
         
         if results["errors"]:
-            inventory_processing_status[task_id]["message"] += f" ({results['failed']} failed)"
-            inventory_processing_status[task_id]["errors"] = results["errors"]
+            updates["message"] += f" ({results['failed']} failed)"
+            updates["errors"] = results["errors"]
             logger.warning(f"Processing errors: {results['errors']}")
         
+        store.update_state(task_id, updates, progress_updates)
+        
+    except JobCancelled:
+        logger.warning(f"Task {task_id} taken over by another worker, stopping")
+        raise
+        
     except Exception as e:
         logger.error(f"=== INVENTORY PROCESSING FAILED ===")
         logger.error(f"Error processing inventory: {e}")
         import traceback
         logger.error(f"Traceback: {traceback.format_exc()}")
-        inventory_processing_status[task_id]["status"] = "failed"
-        inventory_processing_status[task_id]["message"] = f"Processing failed: {str(e)}"
-        inventory_processing_status[task_id]["end_time"] = datetime.now().isoformat()
+        progress.flush()
+        store.update_state(task_id, {
+            "status": "failed",
+            "message": f"Processing failed: {str(e)}",
+            "end_time": datetime.now().isoformat()
+        })
     
     finally:
         # Phase 3: Cleanup temp files
         try:
-            if file_keys:
+            # A worker that lost the lease must not delete files the new owner is reading
+            if file_keys and (lease is None or lease.held()):
                 temp_dir = os.path.dirname(file_keys[0])
                 if os.path.exists(temp_dir):
                     shutil.rmtree(temp_dir)
@@ -392,6 +493,22 @@ def process_inventory_sync(
         logger.info("=== INVENTORY PROCESSING COMPLETED ===")
 
 
+def run_inventory_upload_job(job: Dict[str, Any]):
+    """Job-queue handler for INVENTORY_UPLOAD_JOB"""
+    payload = job["payload"]
+    process_inventory_sync(
+        job["job_id"],
+        payload["file_keys"],
+        payload["r2_bucket"],
+        job["username"],
+        payload.get("force_upload", False),
+        job.get("lease")
+    )
+
+
+register_job_handler(INVENTORY_UPLOAD_JOB, run_inventory_upload_job)
+
+
 @router.get("/items")
 async def get_inventory_items(
     show_all: bool = False,
@@ -444,6 +561,15 @@ async def update_inventory_item(
     db = get_database_client()
     
     try:
+        # Keep the old row if the edit moves stock (the ledger removes it and adds the new one)
+        previous = None
+        if STOCK_FIELDS.intersection(updates):
+            previous = db.client.table("inventory_items")\
+                .select("part_number, description, qty, rate, invoice_date, excluded_from_stock")\
+                .eq("id", item_id)\
+                .eq("username", username)\
+                .execute()
+        
         # Add updated_at timestamp
         updates["updated_at"] = datetime.now().isoformat()
         
@@ -457,6 +583,9 @@ async def update_inventory_item(
         if not response.data:
             raise HTTPException(status_code=404, detail="Item not found")
         
+        if previous is not None:
+            apply_stock_movements(username, vendor_added=response.data, vendor_removed=previous.data or [])
+        
         return {
             "success": True,
             "item": response.data[0]
@@ -493,6 +622,7 @@ async def delete_inventory_item(
             raise HTTPException(status_code=404, detail="Item not found")
         
         logger.info(f"Deleted inventory item with id: {item_id}")
+        apply_stock_movements(username, vendor_removed=response.data)
         
         return {
             "success": True,
@@ -530,6 +660,7 @@ async def delete_by_image_hash(
         deleted_count = len(result.data) if result.data else 0
         
         logger.info(f"Deleted {deleted_count} inventory items with image_hash: {image_hash}")
+        apply_stock_movements(username, vendor_removed=result.data or [])
         
         return {
             "success": True,
@@ -569,6 +700,7 @@ async def delete_bulk_inventory_items(
         
         # Delete all items matching the IDs for this user
         deleted_count = 0
+        deleted_rows = []
         for item_id in ids:
             response = db.client.table("inventory_items")\
                 .delete()\
@@ -578,8 +710,10 @@ async def delete_bulk_inventory_items(
             
             if response.data:
                 deleted_count += 1
+                deleted_rows.extend(response.data)
         
         logger.info(f"Deleted {deleted_count} inventory items for {username}")
+        apply_stock_movements(username, vendor_removed=deleted_rows)
         
         return {
             "success": True,
@@ -1,12 +1,13 @@
 """Review workflow routes"""
-from fastapi import APIRouter, HTTPException, Depends, Body, Request
+from fastapi import APIRouter, HTTPException, Depends, Body, Query
 from pydantic import BaseModel
 from typing import List, Dict, Any
 import logging
+import asyncio
 import pandas as pd
 import numpy as np
 
-from auth import get_current_user
+from auth import get_current_user, get_stream_username
 from database_helpers import (
     get_verification_dates,
     get_verification_amounts,
@@ -18,6 +19,32 @@ from database import get_database_client
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# Seconds between heartbeat events while a Sync & Finish stage is running
+SYNC_HEARTBEAT_INTERVAL = 5.0
+
+
+async def run_sync_off_loop(username: str, progress_callback=None, full_rebuild: bool = False) -> Dict[str, Any]:
+    """
+    Run the Sync & Finish workflow on a worker thread.
+    run_sync_verified_logic_supabase makes blocking Supabase calls; running it on
+    its own event loop in a thread keeps this server's loop free for other requests.
+    
+    Args:
+        username: User whose review data is synced
+        progress_callback: Optional async function(stage, percentage, message); it is
+                           called on the worker thread's event loop
+        full_rebuild: Re-derive all invoices instead of only receipts touched since the last sync
+    
+    Returns:
+        Results dictionary from run_sync_verified_logic_supabase
+    """
+    from services.verification import run_sync_verified_logic_supabase
+    
+    return await asyncio.to_thread(
+        asyncio.run,
+        run_sync_verified_logic_supabase(username, progress_callback=progress_callback, full_rebuild=full_rebuild)
+    )
+
 
 class ReviewData(BaseModel):
     """Review data model"""
@@ -440,6 +467,7 @@ async def update_single_review_amount(
 
 @router.post("/sync-finish")
 async def sync_and_finish(
+    full: bool = Query(False, description="Rebuild from all invoices instead of only receipts changed since the last sync"),
     current_user: Dict[str, Any] = Depends(get_current_user)
 ):
     """
@@ -456,14 +484,10 @@ async def sync_and_finish(
         raise HTTPException(status_code=400, detail="No username in token")
     
     try:
-        # Import and call the verification logic (migrated version)
-        from services.verification import run_sync_verified_logic_supabase
-        from datetime import datetime
-        
         logger.info(f"Sync & Finish triggered for user: {username}")
         
-        # Execute sync
-        results = await run_sync_verified_logic_supabase(username)
+        # Execute sync (off the event loop; it makes blocking Supabase calls)
+        results = await run_sync_off_loop(username, full_rebuild=full)
         
 
         
@@ -471,7 +495,8 @@ async def sync_and_finish(
         return {
             "success": results["success"],
             "message": results["message"],
-            "records_synced": results.get("records_synced", 0)
+            "records_synced": results.get("records_synced", 0),
+            "mode": results.get("mode", "full")
         }
     
     except Exception as e:
@@ -481,65 +506,69 @@ async def sync_and_finish(
 
 @router.get("/sync-finish/stream")
 async def sync_and_finish_stream(
-    request: Request,
-    token: str = None
+    full: bool = Query(False, description="Rebuild from all invoices instead of only receipts changed since the last sync"),
+    username: str = Depends(get_stream_username)
 ):
     """
     Execute Sync & Finish with Server-Sent Events (SSE) for real-time progress
     
+    The sync runs on a worker thread; each progress event is forwarded to the
+    client as soon as it is emitted. While a stage runs, a "heartbeat" event
+    repeats the last percentage and message every SYNC_HEARTBEAT_INTERVAL seconds.
+    
     SSE Event Format:
     {
-        "stage": "reading"|"saving_invoices"|"building_verified"|"saving_verified"|"cleanup"|"complete",
+        "stage": "reading"|"saving_invoices"|"building_verified"|"saving_verified"|"cleanup"|"heartbeat"|"complete",
         "percentage": 0-100,
         "message": "Human-readable status message"
     }
     """
-    # Extract token from query param, cookie, or Authorization header
-    auth_token = token or request.cookies.get("access_token") or request.headers.get("authorization", "").replace("Bearer ", "")
-    
-    if not auth_token:
-        raise HTTPException(status_code=401, detail="Not authenticated")
-    
-    # Verify token
-    from auth import decode_access_token
-    payload = decode_access_token(auth_token)
-    
-    if not payload:
-        raise HTTPException(status_code=401, detail="Invalid token")
-        
-    username = payload.get("sub")  # JWT standard uses 'sub' for subject/username
-    
-    if not username:
-        raise HTTPException(status_code=401, detail="Invalid token")
-    
     from fastapi.responses import StreamingResponse
-    from services.verification import run_sync_verified_logic_supabase
     import json
-    import asyncio
+    import time
+    
+    loop = asyncio.get_running_loop()
+    events: asyncio.Queue = asyncio.Queue()
+    
+    # Called on the sync thread's event loop; hands each event to this loop's queue
+    async def progress_callback(stage: str, percentage: int, message: str):
+        event_data = {
+            "stage": stage,
+            "percentage": percentage,
+            "message": message
+        }
+        loop.call_soon_threadsafe(events.put_nowait, event_data)
     
     async def event_generator():
+        logger.info(f"SSE Sync & Finish triggered for user: {username}")
+        started = time.monotonic()
+        sync_task = asyncio.ensure_future(run_sync_off_loop(username, progress_callback, full))
+        last_event = {"stage": "reading", "percentage": 0, "message": "Starting sync..."}
+        
         try:
-            logger.info(f"SSE Sync & Finish triggered for user: {username}")
-            
-            # Track progress events to yield
-            progress_events = []
-            
-            # Progress callback to collect events
-            async def progress_callback(stage: str, percentage: int, message: str):
-                event_data = {
-                    "stage": stage,
-                    "percentage": percentage,
-                    "message": message
-                }
-                progress_events.append(event_data)
-            
-            # Execute sync with progress tracking
-            results = await run_sync_verified_logic_supabase(username, progress_callback=progress_callback)
+            while not sync_task.done() or not events.empty():
+                next_event = asyncio.ensure_future(events.get())
+                done, _ = await asyncio.wait(
+                    {next_event, sync_task},
+                    timeout=SYNC_HEARTBEAT_INTERVAL,
+                    return_when=asyncio.FIRST_COMPLETED
+                )
+                if next_event in done:
+                    last_event = next_event.result()
+                    yield f"data: {json.dumps(last_event)}\n\n"
+                    continue
+                next_event.cancel()
+                
+                if not done:
+                    heartbeat_data = {
+                        "stage": "heartbeat",
+                        "percentage": last_event["percentage"],
+                        "message": last_event["message"],
+                        "elapsed_seconds": round(time.monotonic() - started)
+                    }
+                    yield f"data: {json.dumps(heartbeat_data)}\n\n"
             
-            # Yield all collected events
-            for event in progress_events:
-                yield f"data: {json.dumps(event)}\n\n"
-                await asyncio.sleep(0.01)
+            results = sync_task.result()
             
             # Send completion event
             completion_data = {
@@ -547,7 +576,8 @@ async def sync_and_finish_stream(
                 "percentage": 100,
                 "message": "Sync complete!",
                 "success": results["success"],
-                "records_synced": results.get("records_synced", 0)
+                "records_synced": results.get("records_synced", 0),
+                "mode": results.get("mode", "full")
             }
             yield f"data: {json.dumps(completion_data)}\n\n"
             
@@ -560,6 +590,11 @@ async def sync_and_finish_stream(
                 "success": False
             }
             yield f"data: {json.dumps(error_data)}\n\n"
+        
+        finally:
+            if not sync_task.done():
+                # Client went away; the sync thread still runs to completion
+                logger.warning(f"SSE client for {username} disconnected before Sync & Finish completed")
     
     return StreamingResponse(
         event_generator(),
@@ -17,12 +17,12 @@ from models.mapping_models import (
     MappingSheetExtractedData
 )
 from config_loader import load_user_config
-from config import get_mappings_folder, get_google_api_key
-from google import genai
+from config import get_mappings_folder
+from services.gemini_client import get_gemini_client
 from google.genai import types
 
-# Import recalculation function to trigger after upload
-from routes.stock_routes import recalculate_stock_for_user
+# Stock ledger, to apply the new mappings after upload
+from services.stock_ledger import apply_stock_movements
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
@@ -95,14 +95,12 @@ async def upload_mapping_sheet(
                 detail="vendor_mapping_gemini prompt not configured"
             )
         
-        # Configure Gemini
-        gemini_api_key = get_google_api_key()
+        # Shared Gemini client (keep-alive connections)
+        client, _ = get_gemini_client()
         
-        if not gemini_api_key:
+        if not client:
             raise HTTPException(status_code=500, detail="Gemini API key not configured")
         
-        client = genai.Client(api_key=gemini_api_key)
-        
         # Generate extraction using new API
         response = client.models.generate_content(
             model="gemini-2.0-flash-exp",
@@ -133,6 +131,7 @@ async def upload_mapping_sheet(
         created_mapping_count = 0
         updated_mapping_count = 0
         skipped_count = 0
+        mapped_parts = []
         
         for row in rows_data:
             row_number = row.get("row_number")
@@ -207,6 +206,7 @@ async def upload_mapping_sheet(
                         .execute()
                     created_mapping_count += 1
                     logger.info(f"✨ Created mapping (+priority/reorder) for {part_number}")
+                mapped_parts.append(part_number)
 
                 # 2. UPDATE stock_levels TEMPORARILY (Old Stock only)
                 # Priority and Reorder will be sync'd during recalculation from mapping table
@@ -238,11 +238,11 @@ async def upload_mapping_sheet(
         total_mappings = created_mapping_count + updated_mapping_count
         logger.info(f"✅ Stock Updates: {updated_stock_count}, Mappings Created: {created_mapping_count}, Mappings Updated: {updated_mapping_count}, Skipped: {skipped_count}")
         
-        # 6. Trigger stock recalculation to update all derived fields
+        # 6. Update the derived fields of the mapped parts
         # This will populate customer_items from vendor_mapping_entries
-        logger.info(f"🔄 Triggering stock recalculation to apply new values...")
+        logger.info(f"🔄 Applying {len(mapped_parts)} mapping changes to stock levels...")
         try:
-            recalculate_stock_for_user(username)
+            apply_stock_movements(username, mapping_parts=mapped_parts)
             logger.info(f"✅ Stock recalculation completed successfully")
         except Exception as recalc_error:
             logger.error(f"⚠️ Stock recalculation failed: {recalc_error}")
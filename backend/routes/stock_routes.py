@@ -18,17 +18,15 @@ from reportlab.lib.enums import TA_CENTER, TA_LEFT
 from io import BytesIO
 
 from database import get_database_client
+from database_helpers import iter_verified_invoices
+from services.fuzzy_matcher import fuzzy_match_part_numbers
+from services.stock_ledger import DEFAULT_REORDER_POINT, apply_stock_movements
+from services.stock_scheduler import get_stock_scheduler
 from auth import get_current_user
 
 logger = logging.getLogger(__name__)
 router = APIRouter()
 
-# ============================================================================
-# REORDER POINT CONFIGURATION - CHANGE HERE TO UPDATE DEFAULT
-# ============================================================================
-DEFAULT_REORDER_POINT = 2  # Change this value to update default for ALL items
-# ============================================================================
-
 
 # Pydantic Models
 class StockAdjustment(BaseModel):
@@ -61,28 +59,6 @@ class TransactionDelete(BaseModel):
     type: str  # "IN" or "OUT"
 
 
-def normalize_part_number(part_number: str) -> str:
-    """Normalize part number for matching (remove spaces, lowercase)"""
-    if not part_number:
-        return ""
-    return part_number.strip().replace(" ", "").replace("-", "").lower()
-
-
-def fuzzy_match_part_numbers(part1: str, part2: str, threshold: float = 99.0) -> bool:
-    """
-    Check if two part numbers match with fuzzy logic.
-    Uses 99%+ similarity threshold to catch variations.
-    """
-    norm1 = normalize_part_number(part1)
-    norm2 = normalize_part_number(part2)
-    
-    if norm1 == norm2:
-        return True
-    
-    similarity = fuzz.ratio(norm1, norm2)
-    return similarity >= threshold
-
-
 @router.get("/levels")
 async def get_stock_levels(
     search: Optional[str] = Query(None),
@@ -261,34 +237,14 @@ async def get_stock_history(
                 if fuzzy_match_part_numbers(part_number, vendor_part, threshold=98):
                     customer_items_for_part.append(customer_item)
         
-        # Step 2: Get ALL sales transactions using pagination
-        all_sales_data = []
-        batch_size = 1000
-        current_offset = 0
-        
-        logger.info(f"VIEW HISTORY: Fetching ALL sales records for {username} with pagination...")
-        
-        while True:
-            sales_batch = db.client.table("verified_invoices")\
-                .select("id, description, quantity, rate, date, receipt_number, receipt_link, type")\
-                .eq("username", username)\
-                .limit(batch_size)\
-                .offset(current_offset)\
-                .execute()
-            
-            if not sales_batch.data or len(sales_batch.data) == 0:
-                break
-            
-            all_sales_data.extend(sales_batch.data)
-            
-            # If we got less than batch_size records, we've reached the end
-            if len(sales_batch.data) < batch_size:
-                break
-            
-            current_offset += batch_size
-        
-        # Filter by type='Part'
-        all_sales_data = [s for s in all_sales_data if s.get("type") == "Part"]
+        # Step 2: Stream ALL sales transactions (type='Part') with keyset pagination
+        logger.info(f"VIEW HISTORY: Streaming sales records for {username}...")
+        all_sales_data = iter_verified_invoices(
+            username,
+            columns=["id", "description", "quantity", "rate", "date", "receipt_number", "receipt_link", "type"],
+            filters={"type": "Part"},
+            prefetch=True
+        )
         
         # Step 3: Match sales to customer_items using 90% fuzzy threshold
         out_transactions = []
@@ -368,7 +324,7 @@ async def update_transaction(
     current_user: Dict[str, Any] = Depends(get_current_user)
 ):
     """
-    Update a transaction (IN or OUT) and recalculate stock levels.
+    Update a transaction (IN or OUT) and apply the change to the affected stock levels.
     """
     username = current_user.get("username")
     db = get_database_client()
@@ -382,6 +338,16 @@ async def update_transaction(
         
         # Update appropriate table based on type
         if updates.type == "IN":
+            # Keep the old row: the stock ledger removes it and adds the updated one
+            previous = db.client.table("inventory_items")\
+                .select("part_number, description, qty, rate, invoice_date, excluded_from_stock")\
+                .eq("id", transaction_id)\
+                .eq("username", username)\
+                .execute()
+            
+            if not previous.data:
+                raise HTTPException(status_code=404, detail="Transaction not found")
+            
             # Update inventory_items table
             update_data = {"qty": updates.quantity}
             if updates.rate is not None:
@@ -397,8 +363,19 @@ async def update_transaction(
                 raise HTTPException(status_code=404, detail="Transaction not found")
             
             logger.info(f"Updated IN transaction #{transaction_id}: qty={updates.quantity}, rate={updates.rate}")
+            apply_stock_movements(username, vendor_added=response.data, vendor_removed=previous.data)
             
         elif updates.type == "OUT":
+            # Keep the old row: the stock ledger removes it and adds the updated one
+            previous = db.client.table("verified_invoices")\
+                .select("type, description, quantity, rate, date")\
+                .eq("id", transaction_id)\
+                .eq("username", username)\
+                .execute()
+            
+            if not previous.data:
+                raise HTTPException(status_code=404, detail="Transaction not found")
+            
             # Update verified_invoices table
             update_data = {"quantity": updates.quantity}
             if updates.rate is not None:
@@ -414,12 +391,10 @@ async def update_transaction(
                 raise HTTPException(status_code=404, detail="Transaction not found")
             
             logger.info(f"Updated OUT transaction #{transaction_id}: qty={updates.quantity}, rate={updates.rate}")
+            apply_stock_movements(username, sales_added=response.data, sales_removed=previous.data)
         else:
             raise HTTPException(status_code=400, detail="Invalid transaction type. Must be 'IN' or 'OUT'")
         
-        # Trigger stock recalculation
-        recalculate_stock_for_user(username)
-        
         return {
             "success": True,
             "message": "Transaction updated and stock levels recalculated"
@@ -439,7 +414,7 @@ async def delete_transaction(
     current_user: Dict[str, Any] = Depends(get_current_user)
 ):
     """
-    Delete a transaction (IN or OUT) and recalculate stock levels.
+    Delete a transaction (IN or OUT) and apply the change to the affected stock levels.
     """
     username = current_user.get("username")
     db = get_database_client()
@@ -458,6 +433,7 @@ async def delete_transaction(
                 raise HTTPException(status_code=404, detail="Transaction not found")
             
             logger.info(f"Deleted IN transaction #{transaction_id}")
+            apply_stock_movements(username, vendor_removed=response.data)
             
         elif delete_request.type == "OUT":
             # Delete from verified_invoices table
@@ -471,12 +447,10 @@ async def delete_transaction(
                 raise HTTPException(status_code=404, detail="Transaction not found")
             
             logger.info(f"Deleted OUT transaction #{transaction_id}")
+            apply_stock_movements(username, sales_removed=response.data)
         else:
             raise HTTPException(status_code=400, detail="Invalid transaction type. Must be 'IN' or 'OUT'")
         
-        # Trigger stock recalculation
-        recalculate_stock_for_user(username)
-        
         return {
             "success": True,
             "message": "Transaction deleted and stock levels recalculated"
@@ -643,376 +617,55 @@ async def delete_stock_items_bulk(
 
 @router.post("/calculate")
 async def calculate_stock_levels(
+    wait: bool = Query(True, description="Wait for the recalculation to finish"),
+    timeout: float = Query(120, ge=0, le=600, description="Seconds to wait before returning with done=false"),
     current_user: Dict[str, Any] = Depends(get_current_user)
 ):
     """
     Recalculate all stock levels from existing inventory and sales data.
-    This is a comprehensive recalculation that processes all data.
+    This is a comprehensive recalculation that processes all data; it reconciles
+    the incremental updates applied by the stock ledger.
+    
+    Requests are coalesced by the stock recalculation scheduler: repeated clicks
+    within the debounce window share one run. With wait=false the call returns a
+    ticket at once; poll GET /calculate/status?ticket=... for completion.
     """
     username = current_user.get("username")
     
     try:
-        recalculate_stock_for_user(username)
+        scheduler = get_stock_scheduler()
+        ticket = scheduler.request(username, reason="manual")
+        if not wait:
+            return {"success": True, "message": "Stock recalculation scheduled", **scheduler.status(username, ticket)}
+        
+        status = await scheduler.wait_async(username, ticket, timeout)
+        if status["done"] and status["last_error"]:
+            raise HTTPException(status_code=500, detail=status["last_error"])
         
         return {
             "success": True,
-            "message": "Stock levels recalculated successfully"
+            "message": "Stock levels recalculated successfully" if status["done"] else "Stock recalculation still running",
+            **status
         }
         
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error calculating stock levels: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
-def recalculate_stock_for_user(username: str):
+@router.get("/calculate/status")
+async def get_calculation_status(
+    ticket: Optional[int] = Query(None, description="Ticket returned by POST /calculate (default: latest request)"),
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
     """
-    Core logic to recalculate stock levels for a user.
-    Can be called from other routes after invoice processing.
+    Get the state of the user's stock recalculation (idle, pending or running),
+    whether a ticket's run has finished, and how many requests were coalesced.
     """
-    db = get_database_client()
-    
-    logger.info(f"Starting stock recalculation for {username}")
-    
-    # 1. Get all vendor invoice items (IN transactions) - EXCLUDING items marked as deleted
-    vendor_items = db.client.table("inventory_items")\
-        .select("part_number, description, qty, rate, invoice_date")\
-        .eq("username", username)\
-        .eq("excluded_from_stock", False)\
-        .execute()
-    
-    vendor_data = vendor_items.data or []
-    logger.info(f"Found {len(vendor_data)} vendor invoice items")
-    
-    # 2. Get ALL customer sales items (OUT transactions) using pagination
-    sales_data = []
-    batch_size = 1000
-    current_offset = 0
-    
-    logger.info(f"Fetching ALL sales records for {username} with pagination...")
-    
-    while True:
-        sales_batch = db.client.table("verified_invoices")\
-            .select("description, quantity, rate, date")\
-            .eq("username", username)\
-            .eq("type", "Part")\
-            .limit(batch_size)\
-            .offset(current_offset)\
-            .execute()
-        
-        if not sales_batch.data or len(sales_batch.data) == 0:
-            break
-        
-        sales_data.extend(sales_batch.data)
-        
-        # If we got less than batch_size records, we've reached the end
-        if len(sales_batch.data) < batch_size:
-            break
-        
-        current_offset += batch_size
-    
-    logger.info(f"Found {len(sales_data)} sales invoice items")
-    
-    # 3. Get inventory mappings (customer item, part, vendor desc, priority, reorder)
-    mappings = db.client.table("vendor_mapping_entries")\
-        .select("customer_item_name, part_number, vendor_description, priority, reorder_point")\
-        .eq("username", username)\
-        .eq("status", "Added")\
-        .execute()
-    
-    mapping_data = mappings.data or []
-    logger.info(f"Found {len(mapping_data)} inventory mappings")
-    
-    # 4. GET EXISTING STOCK LEVELS TO PRESERVE MANUAL EDITS (Old Stock only)
-    # Priority and Reorder are now sourced from vendor_mapping_entries
-    existing_stock_levels = db.client.table("stock_levels")\
-        .select("part_number, internal_item_name, old_stock")\
-        .eq("username", username)\
-        .execute()
-    
-    # Build lookup dict: (part_number, internal_item_name) -> {old_stock}
-    existing_values = {}
-    for stock in (existing_stock_levels.data or []):
-        key = (stock.get("part_number"), stock.get("internal_item_name"))
-        existing_values[key] = {
-            "old_stock": stock.get("old_stock")
-        }
-    
-    logger.info(f"Found {len(existing_values)} existing stock levels to preserve")
-    
-    # Create mapping lookup
-    # key: part_number -> {customer_item, priority, reorder_point}
-    mapping_lookup = {}
-    for mapping in mapping_data:
-        part = mapping.get("part_number")
-        if part:
-            mapping_lookup[part] = {
-                "customer_item_name": mapping.get("customer_item_name"),
-                "priority": mapping.get("priority"),
-                "reorder_point": mapping.get("reorder_point")
-            }
-    
-    
-    # 4. Initialize stock_by_part with MAPPINGS FIRST (map once, use forever)
-    # This ensures mappings persist even when vendor invoices are deleted
-    stock_by_part = {}
-    
-    logger.info(f"🔷 Step 1: Initializing stock_by_part with {len(mapping_data)} mappings")
-    
-    for mapping in mapping_data:
-        part_number = mapping.get("part_number")
-        vendor_desc = mapping.get("vendor_description")
-        customer_item = mapping.get("customer_item_name")
-        
-        if not part_number or not vendor_desc:
-            continue
-        
-        # Find existing group with fuzzy match (same logic as before)
-        matched_group = None
-        for existing_part in stock_by_part.keys():
-            if fuzzy_match_part_numbers(part_number, existing_part, threshold=99):
-                matched_group = existing_part
-                break
-        
-        group_key = matched_group or part_number
-        
-        if group_key not in stock_by_part:
-            # Create entry with mapping data, zero transactional data
-            stock_by_part[group_key] = {
-                "part_number": group_key,
-                "internal_item_name": vendor_desc,
-                "vendor_description": vendor_desc,
-                "total_in": 0.0,  # Will be filled from vendor invoices
-                "total_out": 0.0,  # Will be filled from sales
-                "customer_items": [],
-                "vendor_rate": None,  # Will be filled from vendor invoices
-                "customer_rate": None,
-                "last_vendor_invoice_date": None,
-                "last_customer_invoice_date": None,
-                "reorder_point": DEFAULT_REORDER_POINT
-            }
-        
-        # Add customer item if not already in list
-        if customer_item and customer_item not in stock_by_part[group_key]["customer_items"]:
-            stock_by_part[group_key]["customer_items"].append(customer_item)
-    
-    logger.info(f"🔷 Step 2: Filling IN transactions from {len(vendor_data)} vendor invoices")
-    
-    # 5. Fill IN transactions from vendor invoices (if any exist)
-    for item in vendor_data:
-        part_number = item.get("part_number", "")
-        internal_item_name = item.get("description", "")
-        
-        if not part_number:
-            continue
-        
-        # Find existing group with fuzzy match
-        matched_group = None
-        for existing_part in stock_by_part.keys():
-            if fuzzy_match_part_numbers(part_number, existing_part, threshold=99):
-                matched_group = existing_part
-                break
-        
-        group_key = matched_group or part_number
-        
-        # If this part doesn't have a mapping, create entry from vendor invoice
-        if group_key not in stock_by_part:
-            stock_by_part[group_key] = {
-                "part_number": group_key,
-                "internal_item_name": internal_item_name,
-                "vendor_description": internal_item_name,
-                "total_in": 0.0,
-                "total_out": 0.0,
-                "customer_items": [],
-                "vendor_rate": item.get("rate"),
-                "customer_rate": None,
-                "last_vendor_invoice_date": item.get("invoice_date"),
-                "last_customer_invoice_date": None,
-                "reorder_point": DEFAULT_REORDER_POINT
-            }
-        
-        # Fill in transactional data
-        stock_by_part[group_key]["total_in"] += float(item.get("qty", 0) or 0)
-        
-        # Update vendor_description if it was created from mapping without invoice
-        if not stock_by_part[group_key].get("internal_item_name"):
-            stock_by_part[group_key]["internal_item_name"] = internal_item_name
-            stock_by_part[group_key]["vendor_description"] = internal_item_name
-        
-        # Update latest rate and date
-        if item.get("invoice_date"):
-            existing_date = stock_by_part[group_key]["last_vendor_invoice_date"]
-            if not existing_date or item["invoice_date"] > existing_date:
-                stock_by_part[group_key]["last_vendor_invoice_date"] = item["invoice_date"]
-                stock_by_part[group_key]["vendor_rate"] = item.get("rate")
-    
-    # 6. Build part_to_customer_items mapping ONCE (optimize from O(n²) to O(n))
-    # For each part_number in stock_by_part, find customer_items via 98% fuzzy match
-    part_to_customer_items = {}  # part_number -> [customer_items]
-    
-    logger.info(f"🔷 Step 3: Building part-to-customer mapping for {len(stock_by_part)} parts")
-    
-    for part_number in stock_by_part.keys():
-        customer_items_for_part = []
-        
-        # Find mappings where part_number fuzzy matches this part (98% threshold)
-        for mapping in mapping_data:
-            vendor_part = mapping.get("part_number")
-            customer_item = mapping.get("customer_item_name")
-            
-            if vendor_part and customer_item:
-                # Use 98% threshold for part number matching
-                if fuzzy_match_part_numbers(part_number, vendor_part, threshold=98):
-                    customer_items_for_part.append(customer_item)
-        
-        if customer_items_for_part:
-            part_to_customer_items[part_number] = customer_items_for_part
-    
-    logger.info(f"🔷 Step 4: Processing {len(sales_data)} sales transactions")
-    
-    # Now process each sales transaction
-    for item in sales_data:
-        customer_desc = item.get("description")
-        if not customer_desc:
-            continue
-        
-        qty = float(item.get("quantity", 0) or 0)
-        
-        # For each part, check if this sale matches any of its mapped customer_items
-        for part_number, mapped_customer_items in part_to_customer_items.items():
-            matched = False
-            matched_customer_item = None
-            
-            # Check fuzzy match (90% threshold) against all mapped customer items
-            for customer_item in mapped_customer_items:
-                similarity = fuzz.ratio(customer_desc.lower(), customer_item.lower())
-                if similarity >= 90:
-                    matched = True
-                    matched_customer_item = customer_item
-                    break
-            
-            if matched:
-                # Add to total_out
-                stock_by_part[part_number]["total_out"] += qty
-                
-                # Track customer items that were actually sold
-                if "customer_items" not in stock_by_part[part_number]:
-                    stock_by_part[part_number]["customer_items"] = []
-                
-                # Only add if not already in list (distinct customer items)
-                if matched_customer_item not in stock_by_part[part_number]["customer_items"]:
-                    stock_by_part[part_number]["customer_items"].append(matched_customer_item)
-                
-                # Update customer rate and date
-                if item.get("date"):
-                    existing_date = stock_by_part[part_number]["last_customer_invoice_date"]
-                    if not existing_date or item["date"] > existing_date:
-                        stock_by_part[part_number]["last_customer_invoice_date"] = item["date"]
-                        stock_by_part[part_number]["customer_rate"] = item.get("rate")
-
-    
-    # 7. Calculate current stock and values
-    stock_records = []
-    now = datetime.now().isoformat()
-    
-    for part, data in stock_by_part.items():
-        current_stock = data["total_in"] - data["total_out"]
-        
-        # Check if this item has existing manual edits to preserve
-        lookup_key = (part, data["internal_item_name"])
-        preserved = existing_values.get(lookup_key, {})
-        
-        # Use preserved values if they exist, otherwise use defaults
-        # CHANGED: Reorder Point and Priority now come from MAPPING TABLE (mapping_lookup)
-        
-        mapping_info = mapping_lookup.get(part, {})
-        
-        # Priority: From mapping > existing preserved (fallback) > None
-        priority = mapping_info.get("priority") 
-        
-        # Reorder Point: From mapping > default
-        # Note: We prioritize the mapping Reorder Point. 
-        reorder_point = mapping_info.get("reorder_point")
-        if reorder_point is None:
-             reorder_point = DEFAULT_REORDER_POINT
-
-        # Old Stock: Still from existing stock_levels (transactional snapshot)
-        old_stock = preserved.get("old_stock")
-        
-        # customer_items comes ONLY from vendor_mapping_entries (single source of truth)
-        # Already populated in data["customer_items"] from Step 1 (initialization with mappings)
-        customer_items_str = ", ".join(data.get("customer_items", [])) if data.get("customer_items") else None
-        
-        # Calculate ACTUAL ON HAND (including old_stock for value calculation)
-        stock_on_hand = current_stock + (old_stock or 0)
-        
-        # Calculate value using ON HAND (not just current_stock)
-        unit_value = data.get("vendor_rate") or 0
-        total_value = stock_on_hand * unit_value
-        
-        stock_records.append({
-            "username": username,
-            "part_number": part,
-            "internal_item_name": data["internal_item_name"],
-            "vendor_description": data["vendor_description"],
-            "customer_items": customer_items_str, 
-            "current_stock": round(current_stock, 2),
-            "total_in": round(data["total_in"], 2),
-            "total_out": round(data["total_out"], 2),
-            "reorder_point": reorder_point,  
-            "old_stock": old_stock,  
-            "priority": priority,
-            "vendor_rate": data.get("vendor_rate"),
-            "customer_rate": data.get("customer_rate"),
-            "unit_value": unit_value,
-            "total_value": round(total_value, 2),  # Now includes old_stock
-            "last_vendor_invoice_date": data.get("last_vendor_invoice_date"),
-            "last_customer_invoice_date": data.get("last_customer_invoice_date"),
-            "updated_at": now
-        })
-    
-    # 8. Add orphaned items (exist in stock_levels but have no transactions)
-    # These are items uploaded from mapping sheets that haven't been purchased/sold yet
-    processed_parts = set(stock_by_part.keys())
-    
-    for existing_item in (existing_stock_levels.data or []):
-        part_num = existing_item.get("part_number")
-        internal_name = existing_item.get("internal_item_name")
-        
-        # If this part wasn't processed (no transactions), preserve it
-        if part_num and part_num not in processed_parts:
-            stock_records.append({
-                "username": username,
-                "part_number": part_num,
-                "internal_item_name": internal_name or "Unknown Item",
-                "vendor_description": existing_item.get("vendor_description") or internal_name or "Unknown Item",
-                "customer_items": existing_item.get("customer_items"),
-                "current_stock": 0,  # No transactions yet
-                "total_in": 0,
-                "total_out": 0,
-                "reorder_point": existing_item.get("reorder_point") or DEFAULT_REORDER_POINT,
-                "old_stock": existing_item.get("old_stock"),
-                "priority": existing_item.get("priority"),
-                "vendor_rate": None,
-                "customer_rate": None,
-                "unit_value": 0,
-                "total_value": 0,
-                "last_vendor_invoice_date": None,
-                "last_customer_invoice_date": None,
-                "updated_at": now
-            })
-            logger.info(f"🔄 Preserved orphaned item: {part_num} (no transactions)")
-    
-    # 9. Clear existing stock levels and insert new ones
-    if stock_records:
-        # Delete existing
-        db.client.table("stock_levels").delete().eq("username", username).execute()
-        
-        # Batch insert new records
-        db.batch_upsert("stock_levels", stock_records, batch_size=500)
-        
-        logger.info(f"✅ Recalculated {len(stock_records)} stock levels for {username}")
-    else:
-        logger.warning(f"No stock records calculated for {username}")
+    username = current_user.get("username")
+    return get_stock_scheduler().status(username, ticket)
 
 
 @router.patch("/levels/{stock_id}")
@@ -1062,6 +715,7 @@ async def update_stock_level(
             update_data["old_stock"] = updates.old_stock
         
         # If we have mapping updates, we need to push them to vendor_mapping_entries
+        part_number = None
         if mapping_updates:
             # Get part_number and internal_item_name from stock_levels
             stock_record = db.client.table("stock_levels")\
@@ -1140,6 +794,10 @@ async def update_stock_level(
                 .eq("id", stock_id)\
                 .execute()
         
+        # A new customer item changes which sales count toward this part
+        if part_number and "customer_item_name" in mapping_updates:
+            apply_stock_movements(username, mapping_parts=[part_number])
+        
         logger.info(f"Updated stock level ID {stock_id}")
         
         return {
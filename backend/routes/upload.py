@@ -1,26 +1,24 @@
 """Upload and processing routes"""
-from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, BackgroundTasks
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends, BackgroundTasks, Request
+from fastapi.responses import StreamingResponse
 from typing import List, Dict, Any, Optional
 from pydantic import BaseModel
 import logging
-from datetime import datetime
-import uuid
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
 
-from auth import get_current_user, get_current_user_r2_bucket, get_current_user_sheet_id
+from auth import get_current_user, get_current_user_r2_bucket, get_current_user_sheet_id, get_stream_username
 from services.storage import get_storage_client
 from utils.image_optimizer import optimize_image_for_gemini, should_optimize_image, validate_image_quality
+from services.job_queue import get_job_store, enqueue_job, register_job_handler, JobProgress, JobLease, JobCancelled
+from services.progress_bus import stream_task_events
 from config import get_sales_folder
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-# Thread pool for blocking operations (increased for bulk uploads)
-executor = ThreadPoolExecutor(max_workers=10)
-
-# In-memory storage for processing status (in production, use Redis or database)
-processing_status: Dict[str, Dict[str, Any]] = {}
+# Job kind for invoice processing batches; status and checkpoints live in the job store
+SALES_UPLOAD_JOB = "sales_upload"
 
 
 class UploadResponse(BaseModel):
@@ -225,12 +223,12 @@ async def process_invoices_endpoint(
     sheet_id: str = Depends(get_current_user_sheet_id)
 ):
     """
-    Trigger invoice processing in thread pool (for blocking I/O operations)
+    Queue invoice processing as a durable background job
     """
-    task_id = str(uuid.uuid4())
+    username = current_user.get("username", "user")
     
-    # Initialize status
-    processing_status[task_id] = {
+    # Initial status (stored with the job, read back by the status endpoint)
+    initial_status = {
         "status": "queued",
         "progress": {
             "total": len(request.file_keys),
@@ -244,8 +242,19 @@ async def process_invoices_endpoint(
         "end_time": None
     }
     
-    # Run in thread pool for blocking I/O operations
     try:
+        task_id = enqueue_job(
+            SALES_UPLOAD_JOB,
+            username,
+            payload={
+                "file_keys": request.file_keys,
+                "r2_bucket": r2_bucket,
+                "sheet_id": sheet_id,
+                "force_upload": request.force_upload
+            },
+            state=initial_status
+        )
+        
         # FILE LOGGING with UTF-8 encoding (fixes Windows Unicode errors)
         with open("process_debug.log", "a", encoding="utf-8") as f:
             f.write(f"\n{'='*80}\n")
@@ -255,21 +264,9 @@ async def process_invoices_endpoint(
             f.write(f"Force upload: {request.force_upload}\n")
             f.write(f"{'='*80}\n\n")
         
-        logger.info(f"Submitting task {task_id} to executor...")
-        loop = asyncio.get_event_loop()
-        loop.run_in_executor(
-            executor,
-            process_invoices_sync,
-            task_id,
-            request.file_keys,
-            r2_bucket,
-            sheet_id,
-            current_user.get("username", "user"),
-            request.force_upload
-        )
-        logger.info(f"Task {task_id} submitted successfully")
+        logger.info(f"Task {task_id} queued successfully")
     except Exception as e:
-        logger.error(f"Failed to submit task {task_id}: {e}")
+        logger.error(f"Failed to queue processing task: {e}")
         import traceback
         logger.error(traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Failed to start processing: {str(e)}")
@@ -283,6 +280,18 @@ async def process_invoices_endpoint(
 
 
 
+def format_process_status(task_id: str, status: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the status response (also sent as each streamed event) from a job's state"""
+    return {
+        "task_id": task_id,
+        "status": status.get("status", "unknown"),
+        "progress": status.get("progress", {}),
+        "message": status.get("message", ""),
+        "duplicates": status.get("duplicates", []),  # Include duplicates info
+        "uploaded_r2_keys": status.get("uploaded_r2_keys", [])  # CRITICAL: Include R2 keys for frontend
+    }
+
+
 @router.get("/process/status/{task_id}", response_model=ProcessStatusResponse)
 async def get_process_status(
     task_id: str,
@@ -291,38 +300,127 @@ async def get_process_status(
     """
     Get processing status for a task
     """
-    if task_id not in processing_status:
+    job = get_job_store().get_job(task_id)
+    if not job or job["kind"] != SALES_UPLOAD_JOB:
         raise HTTPException(status_code=404, detail="Task not found")
     
-    status = processing_status[task_id]
+    return format_process_status(task_id, job["state"])
+
+
+@router.get("/process/stream/{task_id}")
+async def stream_process_status(
+    task_id: str,
+    request: Request,
+    username: str = Depends(get_stream_username)
+):
+    """
+    Stream processing status for a task with Server-Sent Events (replaces polling /process/status).
+    
+    Each event carries the same JSON as the status endpoint; the stream ends after
+    status completed, failed or duplicate_detected. Reconnecting clients send
+    Last-Event-ID and get the events they missed.
+    """
+    store = get_job_store()
+    job = await asyncio.get_running_loop().run_in_executor(None, store.get_job, task_id)
+    if not job or job["kind"] != SALES_UPLOAD_JOB or job["username"] != username:
+        raise HTTPException(status_code=404, detail="Task not found")
+    
+    last_event_id = request.headers.get("last-event-id")
+    
+    def load_state() -> Optional[Dict[str, Any]]:
+        current = store.get_job(task_id)
+        return current["state"] if current else None
     
+    return StreamingResponse(
+        stream_task_events(
+            task_id,
+            load_state,
+            lambda state: format_process_status(task_id, state),
+            int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+        ),
+        media_type="text/event-stream",
+        headers={
+            "Cache-Control": "no-cache",
+            "Connection": "keep-alive",
+            "X-Accel-Buffering": "no"
+        }
+    )
+
+
+@router.get("/process/routing-stats")
+async def get_routing_stats(
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """
+    Get starting-model routing counters since startup:
+    Flash-first vs Pro-first images, measured hit rate and estimated Gemini calls/seconds saved
+    """
+    from services.model_router import get_model_router
+    
+    router_instance = get_model_router()
+    if not router_instance:
+        return {"enabled": False, "pipelines": {}}
+    return {"enabled": True, "pipelines": router_instance.stats()}
+
+
+@router.get("/process/scheduler-stats")
+async def get_scheduler_stats(
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """
+    Get the current user's place in the shared processing queues:
+    queued/running batches, queued/running extractions and how long extractions waited for a slot
+    """
+    from services.extraction_engine import get_extraction_engine
+    
+    username = current_user.get("username", "user")
+    extraction = get_extraction_engine().scheduler_stats(username)
     return {
-        "task_id": task_id,
-        "status": status.get("status", "unknown"),
-        "progress": status.get("progress", {}),
-        "message": status.get("message", ""),
-        "duplicates": status.get("duplicates", []),  # Include duplicates info
-        "uploaded_r2_keys": status.get("uploaded_r2_keys", [])  # CRITICAL: Include R2 keys for frontend
+        "batches": get_job_store().queue_stats(username),
+        "extractions": extraction["tenants"].get(username, {}),
+        "global": extraction["global"]
     }
 
 
+@router.get("/process/concurrency")
+async def get_concurrency_status(
+    current_user: Dict[str, Any] = Depends(get_current_user)
+):
+    """
+    Get the adaptive extraction concurrency: current in-flight limit, its floor/ceiling,
+    slots in use and the last adjustment with its reason
+    """
+    from services.extraction_engine import get_extraction_engine
+    
+    return get_extraction_engine().concurrency_stats()
+
+
 def process_invoices_sync(
     task_id: str,
     file_keys: List[str],  # These are temp paths now
     r2_bucket: str,
     sheet_id: str,
     username: str,
-    force_upload: bool = False
+    force_upload: bool = False,
+    lease: Optional[JobLease] = None
 ):
     """
     Synchronous background task to process invoices
     1. Upload temp files to R2
     2. Process with Gemini
     3. Clean up temp files
+    
+    Runs as a job-queue handler. Uploaded and extracted files are checkpointed
+    in the job store, so a job resumed after a worker restart skips them.
+    Stops with JobCancelled once the worker loses the job's lease (another
+    worker has taken the job over), leaving the temp files to that worker.
     """
     import os
     import shutil
     
+    store = get_job_store()
+    progress = JobProgress(store, task_id)
+    
     # FILE LOGGING with UTF-8 encoding (fixes Windows Unicode errors)
     with open("process_debug.log", "a", encoding="utf-8") as f:
         f.write(f"\nBACKGROUND TASK STARTED\n")
@@ -348,130 +446,175 @@ def process_invoices_sync(
     temp_dir = None
     
     try:
-        # Phase 1: Upload temp files to R2 (skip if force_upload=True, files already in R2)
-        if force_upload:
-            # Files are already R2 keys, no need to upload
-            logger.info("Force upload enabled - files already in R2, skipping upload phase")
-            r2_file_keys = file_keys  # file_keys are already R2 keys
+        # A previous attempt may have finished the batch and died before recording it
+        finished = store.get_checkpoints(task_id, "batch").get("result")
+        if finished:
+            r2_file_keys, results = finished["r2_file_keys"], finished["results"]
+            logger.info(f"Task {task_id} already processed, restoring final status")
         else:
-            # Normal flow: Upload temp files to R2
-            logger.info("Phase 1: Uploading files to R2...")
-            processing_status[task_id]["status"] = "uploading"
-            processing_status[task_id]["message"] = "Uploading files to cloud storage..."
-            processing_status[task_id]["start_time"] = datetime.now().isoformat()
+            # Phase 1: Upload temp files to R2 (skip if force_upload=True, files already in R2)
+            if force_upload:
+                # Files are already R2 keys, no need to upload
+                logger.info("Force upload enabled - files already in R2, skipping upload phase")
+                r2_file_keys = file_keys  # file_keys are already R2 keys
+            else:
+                # Normal flow: Upload temp files to R2
+                logger.info("Phase 1: Uploading files to R2...")
+                uploaded = store.get_checkpoints(task_id, "upload")
+                if uploaded:
+                    logger.info(f"Resuming upload: {len(uploaded)}/{len(file_keys)} files already in R2")
+                store.update_state(task_id, {
+                    "status": "uploading",
+                    "message": "Uploading files to cloud storage...",
+                    "start_time": datetime.now().isoformat()
+                })
+                
+                for idx, temp_path in enumerate(file_keys):
+                    if lease:
+                        lease.check()
+                    try:
+                        r2_key = uploaded.get(temp_path)
+                        if not r2_key:
+                            # Read temp file
+                            with open(temp_path, 'rb') as f:
+                                content = f.read()
+                            
+                            filename = os.path.basename(temp_path)
+                            
+                            # Upload to R2 using existing function
+                            r2_key = upload_single_file_sync(
+                                content=content,
+                                filename=filename,
+                                username=username,
+                                r2_bucket=r2_bucket
+                            )
+                            if r2_key:
+                                store.save_checkpoint(task_id, "upload", temp_path, r2_key)
+                        
+                        if r2_key:
+                            r2_file_keys.append(r2_key)
+                            logger.info(f"Uploaded {idx+1}/{len(file_keys)}: {r2_key}")
+                        
+                        # Update progress
+                        progress.update(
+                            message=f"Uploading to cloud: {idx+1}/{len(file_keys)}",
+                            progress={"processed": idx}
+                        )
+                        
+                    except Exception as e:
+                        logger.error(f"Error uploading {temp_path}: {e}")
+                        continue
+                
+                progress.flush()
+                logger.info(f"R2 upload complete: {len(r2_file_keys)}/{len(file_keys)} files")
+
             
-            for idx, temp_path in enumerate(file_keys):
-                try:
-                    # Read temp file
-                    with open(temp_path, 'rb') as f:
-                        content = f.read()
-                    
-                    filename = os.path.basename(temp_path)
-                    
-                    # Upload to R2 using existing function
-                    r2_key = upload_single_file_sync(
-                        content=content,
-                        filename=filename,
-                        username=username,
-                        r2_bucket=r2_bucket
-                    )
-                    
-                    if r2_key:
-                        r2_file_keys.append(r2_key)
-                        logger.info(f"Uploaded {idx+1}/{len(file_keys)}: {r2_key}")
-                    
-                    # Update progress
-                    processing_status[task_id]["message"] = f"Uploading to cloud: {idx+1}/{len(file_keys)}"
-                    processing_status[task_id]["progress"]["processed"] = idx
-                    
-                except Exception as e:
-                    logger.error(f"Error uploading {temp_path}: {e}")
-                    continue
+            # Phase 2: Process invoices
+            logger.info("Phase 2: Processing invoices with AI...")
+            store.update_state(
+                task_id,
+                {"status": "processing", "message": "Processing invoices..."},
+                {"total": len(r2_file_keys), "processed": 0}
+            )
             
-            logger.info(f"R2 upload complete: {len(r2_file_keys)}/{len(file_keys)} files")
-
-        
-        # Phase 2: Process invoices
-        logger.info("Phase 2: Processing invoices with AI...")
-        processing_status[task_id]["status"] = "processing"
-        processing_status[task_id]["message"] = "Processing invoices..."
-        processing_status[task_id]["progress"]["total"] = len(r2_file_keys)
-        processing_status[task_id]["progress"]["processed"] = 0
-        
-        # Define progress callback
-        def update_progress(current_index: int, total: int, current_file: str):
-            """Callback to update processing status in real-time"""
-            processing_status[task_id]["progress"]["processed"] = current_index
-            processing_status[task_id]["current_file"] = current_file
-            processing_status[task_id]["current_index"] = current_index
-            processing_status[task_id]["message"] = f"Processing: {current_file}"
-            logger.info(f"Progress: {current_index}/{total} - {current_file}")
-        
-        # Import the processor
-        from services.processor import process_invoices_batch
-        
-        logger.info(f"Processing {len(r2_file_keys)} files for user {username}")
-        
-        # Call the actual processor with R2 keys
-        results = process_invoices_batch(
-            file_keys=r2_file_keys,
-            r2_bucket=r2_bucket,
-            sheet_id=sheet_id,
-            username=username,
-            progress_callback=update_progress,
-            force_upload=force_upload
-        )
+            # Define progress callback
+            def update_progress(current_index: int, total: int, current_file: str):
+                """Callback to update processing status in real-time"""
+                progress.update(
+                    current_file=current_file,
+                    current_index=current_index,
+                    message=f"Processing: {current_file}",
+                    progress={"processed": current_index}
+                )
+                logger.info(f"Progress: {current_index}/{total} - {current_file}")
+            
+            def checkpoint_file(file_key: str, rows: List[Dict[str, Any]]):
+                """Record a file's extracted rows so a resumed job does not call Gemini again"""
+                store.save_checkpoint(task_id, "extract", file_key, rows)
+            
+            # Import the processor
+            from services.processor import process_invoices_batch
+            
+            logger.info(f"Processing {len(r2_file_keys)} files for user {username}")
+            
+            # Call the actual processor with R2 keys
+            results = process_invoices_batch(
+                file_keys=r2_file_keys,
+                r2_bucket=r2_bucket,
+                sheet_id=sheet_id,
+                username=username,
+                progress_callback=update_progress,
+                force_upload=force_upload,
+                completed_rows=store.get_checkpoints(task_id, "extract"),
+                on_file_complete=checkpoint_file,
+                cancelled=lease.lost if lease else None
+            )
+            progress.flush()
+            
+            if lease:
+                lease.check()
+            store.save_checkpoint(task_id, "batch", "result", {"r2_file_keys": r2_file_keys, "results": results})
         
         logger.info(f"Processing completed. Results: {results}")
         
         # Check for duplicates
+        updates: Dict[str, Any] = {}
+        progress_updates: Dict[str, Any] = {
+            "total": results["total"],
+            "processed": results["processed"],
+            "failed": results["failed"]
+        }
         if results.get("duplicates"):
-            processing_status[task_id]["status"] = "duplicate_detected"
-            processing_status[task_id]["progress"]["total"] = results["total"]
-            processing_status[task_id]["progress"]["processed"] = results["processed"]
-            processing_status[task_id]["progress"]["failed"] = results["failed"]
-            processing_status[task_id]["duplicates"] = results["duplicates"]
-            processing_status[task_id]["uploaded_r2_keys"] = r2_file_keys  # CRITICAL: Frontend needs ALL R2 keys
-            logger.info(f"✅ Set uploaded_r2_keys to processing_status: {r2_file_keys}")
+            updates["status"] = "duplicate_detected"
+            updates["duplicates"] = results["duplicates"]
+            updates["uploaded_r2_keys"] = r2_file_keys  # CRITICAL: Frontend needs ALL R2 keys
+            logger.info(f"✅ Set uploaded_r2_keys in job status: {r2_file_keys}")
             
             duplicate_count = len(results["duplicates"])
             processed_count = results["processed"]
             if processed_count > 0:
-                processing_status[task_id]["message"] = f"Processed {processed_count} invoice{'s' if processed_count != 1 else ''}, found {duplicate_count} duplicate{'s' if duplicate_count != 1 else ''}"
+                updates["message"] = f"Processed {processed_count} invoice{'s' if processed_count != 1 else ''}, found {duplicate_count} duplicate{'s' if duplicate_count != 1 else ''}"
             else:
-                processing_status[task_id]["message"] = f"All files are duplicates: {duplicate_count} file{'s' if duplicate_count != 1 else ''}"
+                updates["message"] = f"All files are duplicates: {duplicate_count} file{'s' if duplicate_count != 1 else ''}"
             
             logger.info(f"Duplicates detected: {len(results['duplicates'])}")
         else:
-            processing_status[task_id]["status"] = "completed"
-            processing_status[task_id]["progress"]["total"] = results["total"]
-            processing_status[task_id]["progress"]["processed"] = results["processed"]
-            processing_status[task_id]["progress"]["failed"] = results["failed"]
-            processing_status[task_id]["end_time"] = datetime.now().isoformat()
-            processing_status[task_id]["message"] = f"Successfully processed {results['processed']} invoices"
-            processing_status[task_id]["current_file"] = "All complete"
+            updates["status"] = "completed"
+            updates["message"] = f"Successfully processed {results['processed']} invoices"
+            updates["current_file"] = "All complete"
+            progress_updates["routing"] = results.get("routing")
         
-        processing_status[task_id]["end_time"] = datetime.now().isoformat()
+        updates["end_time"] = datetime.now().isoformat()
         
         if results["errors"]:
-            processing_status[task_id]["message"] += f" ({results['failed']} failed)"
-            processing_status[task_id]["errors"] = results["errors"]
+            updates["message"] += f" ({results['failed']} failed)"
+            updates["errors"] = results["errors"]
             logger.warning(f"Processing errors: {results['errors']}")
         
+        store.update_state(task_id, updates, progress_updates)
+        
+    except JobCancelled:
+        logger.warning(f"Task {task_id} taken over by another worker, stopping")
+        raise
+        
     except Exception as e:
         logger.error(f"=== BACKGROUND TASK FAILED ===")
         logger.error(f"Error processing invoices: {e}")
         logger.error(f"Error type: {type(e).__name__}")
         import traceback
         logger.error(f"Traceback: {traceback.format_exc()}")
-        processing_status[task_id]["status"] = "failed"
-        processing_status[task_id]["message"] = f"Processing failed: {str(e)}"
-        processing_status[task_id]["end_time"] = datetime.now().isoformat()
+        progress.flush()
+        store.update_state(task_id, {
+            "status": "failed",
+            "message": f"Processing failed: {str(e)}",
+            "end_time": datetime.now().isoformat()
+        })
     
     finally:
         # Phase 3: Cleanup temp files
         try:
-            if file_keys:
+            # A worker that lost the lease must not delete files the new owner is reading
+            if file_keys and (lease is None or lease.held()):
                 # Get temp directory from first file
                 temp_dir = os.path.dirname(file_keys[0])
                 if os.path.exists(temp_dir):
@@ -483,6 +626,23 @@ def process_invoices_sync(
         logger.info("=== BACKGROUND TASK COMPLETED ===")
 
 
+def run_sales_upload_job(job: Dict[str, Any]):
+    """Job-queue handler for SALES_UPLOAD_JOB"""
+    payload = job["payload"]
+    process_invoices_sync(
+        job["job_id"],
+        payload["file_keys"],
+        payload["r2_bucket"],
+        payload["sheet_id"],
+        job["username"],
+        payload.get("force_upload", False),
+        job.get("lease")
+    )
+
+
+register_job_handler(SALES_UPLOAD_JOB, run_sales_upload_job)
+
+
 @router.delete("/files/{file_key:path}")
 async def delete_file(
     file_key: str,
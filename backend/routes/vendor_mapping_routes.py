@@ -9,14 +9,15 @@ from datetime import datetime
 from fastapi import APIRouter, HTTPException, Depends, UploadFile, File
 from typing import List, Dict, Any, Optional
 from pydantic import BaseModel
-from google import genai
 from google.genai import types
 import json
 
 from database import get_database_client
 from auth import get_current_user
+from services.stock_ledger import apply_stock_movements
 from services.storage import get_storage_client
-from config import get_google_api_key, get_mappings_folder
+from services.gemini_client import get_gemini_client
+from config import get_mappings_folder
 from config_loader import get_user_config
 
 logger = logging.getLogger(__name__)
@@ -287,9 +288,10 @@ async def extract_from_image(
         if not image_bytes:
             raise HTTPException(status_code=404, detail="Could not download image")
         
-        # Configure Gemini
-        api_key = get_google_api_key()
-        client = genai.Client(api_key=api_key)
+        # Shared Gemini client (keep-alive connections)
+        client, _ = get_gemini_client()
+        if not client:
+            raise HTTPException(status_code=500, detail="Gemini API key not configured")
         
         # Call Gemini with image
         response = client.models.generate_content(
@@ -395,6 +397,10 @@ async def update_entry(
         if not response.data:
             raise HTTPException(status_code=404, detail="Entry not found")
         
+        # Only 'Added' mappings count toward stock
+        if "status" in update_data:
+            apply_stock_movements(username, mapping_parts=[response.data[0].get("part_number")])
+        
         return {"success": True, "entry": response.data[0]}
     
     except HTTPException:
@@ -420,6 +426,7 @@ async def bulk_save_entries(
         
         saved_count = 0
         errors = []
+        mapped_parts = []
         
         for entry in request.entries:
             try:
@@ -452,6 +459,7 @@ async def bulk_save_entries(
                     db.client.table("stock_levels").update({
                         "customer_items": entry.customer_item_name  # Plain string, NOT array
                     }).eq("part_number", entry.part_number).eq("username", username).execute()
+                    mapped_parts.append(entry.part_number)
                 
                 saved_count += 1
             
@@ -467,6 +475,12 @@ async def bulk_save_entries(
         if errors:
             logger.error(f"Errors details: {errors}")
         
+        # Count the sales of the newly mapped customer items toward their parts
+        try:
+            apply_stock_movements(username, mapping_parts=mapped_parts)
+        except Exception as e:
+            logger.error(f"Error updating stock levels for saved mappings: {e}")
+        
         return {
             "success": True,
             "saved_count": saved_count,
@@ -494,6 +508,8 @@ async def delete_entry(
             "id", entry_id
         ).eq("username", username).execute()
         
+        apply_stock_movements(username, mapping_parts=[row.get("part_number") for row in response.data or []])
+        
         return {"success": True, "deleted": True}
     
     except Exception as e:
@@ -525,6 +541,9 @@ async def delete_entry_by_part(
             "customer_items": None
         }).eq("part_number", part_number).eq("username", username).execute()
         
+        # Sales of the unmapped customer items no longer count toward this part
+        apply_stock_movements(username, mapping_parts=[part_number])
+        
         logger.info(f"Deleted vendor mapping and cleared stock_levels for part {part_number}")
         return {"success": True, "deleted": True}
     
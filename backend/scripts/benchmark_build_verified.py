@@ -0,0 +1,171 @@
+"""
+Benchmark build_verified() on synthetic Sync & Finish inputs.
+
+Generates invoices plus verification_dates / verification_amounts rows (including
+orphaned Done rows) shaped like the frames run_sync_verified_logic_supabase passes
+to build_verified(), times the current implementation, and optionally compares it
+with build_verified() from an earlier git revision (output must be identical).
+
+Usage (from backend/):
+    python scripts/benchmark_build_verified.py
+    python scripts/benchmark_build_verified.py --rows 50000 200000 --baseline-rev HEAD~1
+
+The pre-vectorization baseline scans the invoices once per orphaned row and needs
+about 20 minutes at 200k rows; use --rows 50000 for a quick comparison.
+"""
+import sys
+import time
+import types
+import logging
+import argparse
+import subprocess
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+from services.verification import build_verified
+
+LINE_ITEMS_PER_RECEIPT = 3
+DATE_REVIEW_SHARE = 0.05  # Share of receipts with a verification_dates row
+AMOUNT_REVIEW_SHARE = 0.05  # Share of line items with a verification_amounts row
+ORPHAN_SHARE = 0.01  # Verification rows (relative to line items) whose invoice no longer exists
+STATUSES = ["Done", "Pending", "Duplicate Receipt Number"]
+STATUS_WEIGHTS = [0.7, 0.25, 0.05]
+
+
+def make_inputs(n_rows: int, seed: int = 0):
+    """
+    Build synthetic (df_raw, df_date, df_amount) with Title Case columns.
+
+    Args:
+        n_rows: Number of invoice line items
+        seed: Random seed
+
+    Returns:
+        Tuple of three DataFrames
+    """
+    rng = np.random.default_rng(seed)
+    n_receipts = max(1, n_rows // LINE_ITEMS_PER_RECEIPT)
+    receipt_idx = np.arange(n_rows) // LINE_ITEMS_PER_RECEIPT % n_receipts
+    line_idx = np.arange(n_rows) % LINE_ITEMS_PER_RECEIPT
+    days = pd.Timestamp("2025-01-01") + pd.to_timedelta(rng.integers(0, 365, n_receipts), unit="D")
+    receipt_dates = days.strftime("%Y-%m-%d").to_numpy(dtype=object)
+    receipt_dates[rng.random(n_receipts) < 0.01] = None
+
+    quantity = rng.integers(1, 10, n_rows)
+    rate = rng.integers(10, 5000, n_rows).astype(float)
+    df_raw = pd.DataFrame({
+        "Row_Id": np.arange(1, n_rows + 1),
+        "row_id": [f"{r}_{i}" for r, i in zip(receipt_idx, line_idx)],
+        "Receipt Number": receipt_idx.astype(str),
+        "Receipt Link": [f"https://r2.example/{r}.jpg" for r in receipt_idx],
+        "Date": receipt_dates[receipt_idx],
+        "Customer Name": [f"Customer {r % 500}" for r in receipt_idx],
+        "Car Number": [f"KA{r % 90:02d}AB{r % 9999:04d}" for r in receipt_idx],
+        "Description": [f"Part {i} of {r % 700}" for r, i in zip(receipt_idx, line_idx)],
+        "Type": np.where(line_idx == 0, "Part", "Labour"),
+        "Quantity": quantity,
+        "Rate": rate,
+        "Amount": quantity * rate,
+        "Upload Date": "2025-12-31",
+        "Image Hash": [f"{r:064x}" for r in receipt_idx],
+        "username": "bench",
+    })
+
+    # verification_dates: one row per reviewed receipt, plus orphans
+    reviewed = rng.choice(n_receipts, int(n_receipts * DATE_REVIEW_SHARE), replace=False)
+    n_date_orphans = int(n_rows * ORPHAN_SHARE / 2)
+    date_receipts = np.concatenate([reviewed, n_receipts + np.arange(n_date_orphans)])
+    df_date = pd.DataFrame({
+        "row_id": [f"{r}_0" for r in date_receipts],
+        "Receipt Number": date_receipts.astype(str),
+        "Receipt Link": [f"https://r2.example/{r}.jpg" for r in date_receipts],
+        "Date": pd.Series(pd.Timestamp("2025-06-01") + pd.to_timedelta(rng.integers(0, 180, len(date_receipts)), unit="D")).dt.strftime("%d-%m-%Y"),
+        "Upload Date": "2025-12-31",
+        "Verification Status": rng.choice(STATUSES, len(date_receipts), p=STATUS_WEIGHTS),
+    })
+
+    # verification_amounts: one row per reviewed line item, plus orphans
+    reviewed_items = rng.choice(n_rows, int(n_rows * AMOUNT_REVIEW_SHARE), replace=False)
+    n_amount_orphans = int(n_rows * ORPHAN_SHARE / 2)
+    item_receipts = np.concatenate([receipt_idx[reviewed_items], n_receipts + np.arange(n_amount_orphans)])
+    item_lines = np.concatenate([line_idx[reviewed_items], np.zeros(n_amount_orphans, dtype=int)])
+    new_quantity = rng.integers(1, 10, len(item_receipts))
+    new_rate = rng.integers(10, 5000, len(item_receipts)).astype(float)
+    df_amount = pd.DataFrame({
+        "row_id": [f"{r}_{i}" for r, i in zip(item_receipts, item_lines)],
+        "Receipt Number": item_receipts.astype(str),
+        "Receipt Link": [f"https://r2.example/{r}.jpg" for r in item_receipts],
+        "Description": [f"Part {i} of {r % 700}" for r, i in zip(item_receipts, item_lines)],
+        "Quantity": new_quantity,
+        "Rate": new_rate,
+        "Amount": new_quantity * new_rate,
+        "Amount Mismatch": rng.integers(0, 100, len(item_receipts)).astype(float),
+        "Upload Date": "2025-12-31",
+        "Verification Status": rng.choice(STATUSES, len(item_receipts), p=STATUS_WEIGHTS),
+    })
+    return df_raw, df_date, df_amount
+
+
+def default_baseline_rev() -> str:
+    """Parent of the commit that added this script (HEAD if it is not committed yet)"""
+    added = subprocess.run(
+        ["git", "log", "--format=%H", "--diff-filter=A", "--", str(Path(__file__).resolve())],
+        capture_output=True, text=True, cwd=BACKEND_DIR
+    ).stdout.split()
+    return f"{added[-1]}~1" if added else "HEAD"
+
+
+def load_baseline(rev: str):
+    """Load build_verified() from services/verification.py at a git revision"""
+    source = subprocess.run(
+        ["git", "show", f"{rev}:./services/verification.py"],
+        capture_output=True, text=True, check=True, cwd=BACKEND_DIR
+    ).stdout
+    module = types.ModuleType("baseline_verification")
+    exec(compile(source, f"{rev}:services/verification.py", "exec"), module.__dict__)
+    return module.build_verified
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[50000, 200000], help="Invoice line items per run")
+    parser.add_argument("--baseline-rev", default=None,
+                        help="Git revision to compare against (default: the revision before this script was added)")
+    parser.add_argument("--no-baseline", action="store_true", help="Only time the current implementation")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    baseline = None
+    if not args.no_baseline:
+        rev = args.baseline_rev or default_baseline_rev()
+        baseline = load_baseline(rev)
+        print(f"Baseline: build_verified at {rev}")
+
+    for n_rows in args.rows:
+        df_raw, df_date, df_amount = make_inputs(n_rows, args.seed)
+        print(f"\n{n_rows} line items, {len(df_date)} date rows, {len(df_amount)} amount rows")
+
+        current, current_seconds = timed(build_verified, df_raw, df_date, df_amount)
+        print(f"  current:  {current_seconds:8.2f}s  ({len(current)} verified rows)")
+
+        if baseline:
+            expected, baseline_seconds = timed(baseline, df_raw, df_date, df_amount)
+            pd.testing.assert_frame_equal(current, expected)
+            print(f"  baseline: {baseline_seconds:8.2f}s  (identical output)")
+            print(f"  speedup:  {baseline_seconds / current_seconds:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
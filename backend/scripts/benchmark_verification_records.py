@@ -0,0 +1,215 @@
+"""
+Benchmark and parity-check create_verification_records_supabase() on synthetic uploads.
+
+Generates rows shaped like convert_to_dataframe_rows() output (including missing and
+unparseable dates, reused receipt numbers and links, and mixed amount_mismatch values),
+runs the current create_verification_records_supabase() and the row-wise version from
+an earlier git revision against an in-memory database, and checks that both write the
+same verification_dates and verification_amounts rows.
+
+Usage (from backend/):
+    python scripts/benchmark_verification_records.py
+    python scripts/benchmark_verification_records.py --rows 2000 20000 --baseline-rev HEAD~1
+
+The row-wise baseline rescans every date record per receipt and makes one request per
+row, so it is slow beyond a few thousand rows even in memory.
+"""
+import sys
+import math
+import time
+import types
+import logging
+import argparse
+import itertools
+import subprocess
+from pathlib import Path
+from typing import Any, Dict, List
+
+import numpy as np
+import pandas as pd
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+import services.processor as processor
+
+LINE_ITEMS_PER_RECEIPT = 3
+MISSING_DATE_SHARE = 0.03  # Receipts without a date
+BAD_DATE_SHARE = 0.01  # Receipts with a date that does not parse
+REUSED_RECEIPT_SHARE = 0.02  # Receipts sharing a receipt number with another upload
+REUSED_LINK_SHARE = 0.02  # Receipts sharing a receipt link with another upload
+MISMATCH_SHARE = 0.2  # Line items with a non-zero amount_mismatch
+
+
+class RecordingQuery:
+    """Just enough of the Supabase query builder for the row-wise header id lookup"""
+
+    def __init__(self, rows: List[Dict[str, Any]]):
+        self.rows = rows
+
+    def eq(self, column: str, value: Any) -> "RecordingQuery":
+        return RecordingQuery([row for row in self.rows if row.get(column) == value])
+
+    def execute(self):
+        return types.SimpleNamespace(data=list(self.rows))
+
+
+class RecordingDatabase:
+    """In-memory stand-in for DatabaseClient that keeps inserted rows per table"""
+
+    def __init__(self):
+        self.tables: Dict[str, List[Dict[str, Any]]] = {}
+        self.requests = 0
+        self._ids = itertools.count(1)
+
+    def insert(self, table: str, data: Dict[str, Any]) -> List[Dict[str, Any]]:
+        return self.batch_insert(table, [data])
+
+    def batch_insert(self, table: str, records: List[Dict[str, Any]], batch_size: int = 500) -> List[Dict[str, Any]]:
+        self.requests += 1
+        inserted = [dict(record, id=next(self._ids)) for record in records]
+        self.tables.setdefault(table, []).extend(inserted)
+        return inserted
+
+    def query(self, table: str, columns: List[str] = None) -> RecordingQuery:
+        self.requests += 1
+        return RecordingQuery(self.tables.get(table, []))
+
+
+def make_rows(n_rows: int, seed: int = 0) -> List[Dict[str, Any]]:
+    """
+    Build synthetic convert_to_dataframe_rows() output.
+
+    Args:
+        n_rows: Number of line items
+        seed: Random seed
+
+    Returns:
+        List of row dictionaries
+    """
+    rng = np.random.default_rng(seed)
+    n_receipts = max(1, n_rows // LINE_ITEMS_PER_RECEIPT)
+
+    receipt_numbers = np.arange(n_receipts).astype(str).astype(object)
+    reused = rng.random(n_receipts) < REUSED_RECEIPT_SHARE
+    receipt_numbers[reused] = rng.integers(0, n_receipts, reused.sum()).astype(str)
+    links = np.array([f"https://r2.example/{r}.jpg" for r in range(n_receipts)], dtype=object)
+    reused = rng.random(n_receipts) < REUSED_LINK_SHARE
+    links[reused] = [f"https://r2.example/{r}.jpg" for r in rng.integers(0, n_receipts, reused.sum())]
+
+    days = pd.Timestamp("2025-01-01") + pd.to_timedelta(np.sort(rng.integers(0, 365, n_receipts)), unit="D")
+    dates = days.strftime("%Y-%m-%d").to_numpy(dtype=object)
+    dates[rng.random(n_receipts) < MISSING_DATE_SHARE] = None
+    dates[rng.random(n_receipts) < BAD_DATE_SHARE] = "31-02-2025"
+
+    rows = []
+    for i in range(n_rows):
+        receipt = i // LINE_ITEMS_PER_RECEIPT % n_receipts
+        quantity = int(rng.integers(1, 10))
+        rate = float(rng.integers(10, 5000))
+        mismatch = rng.choice([0, 0.5, 12, "3", None]) if rng.random() < MISMATCH_SHARE else 0
+        rows.append({
+            "row_id": f"{receipt}_{i % LINE_ITEMS_PER_RECEIPT}",
+            "receipt_number": receipt_numbers[receipt],
+            "date": dates[receipt],
+            "receipt_link": links[receipt],
+            "upload_date": "2025-12-31",
+            "description": f"Part {i % 700}",
+            "quantity": quantity,
+            "rate": rate,
+            "amount": quantity * rate,
+            "amount_mismatch": mismatch,
+            "receipt_number_bbox": None if i % 5 else "[1, 2, 3, 4]",
+            "line_item_row_bbox": "[5, 6, 7, 8]",
+        })
+    return rows
+
+
+def normalize(value: Any) -> Any:
+    """Compare numpy scalars as Python values and NaN as None"""
+    if hasattr(value, "item"):
+        value = value.item()
+    if isinstance(value, float) and math.isnan(value):
+        return None
+    return value
+
+
+def written_rows(db: RecordingDatabase, table: str) -> List[Dict[str, Any]]:
+    """Rows written to a table, with ids dropped and values normalized"""
+    return [
+        {key: normalize(value) for key, value in row.items() if key != "id"}
+        for row in db.tables.get(table, [])
+    ]
+
+
+def default_baseline_rev() -> str:
+    """Parent of the commit that introduced build_date_verification_records()"""
+    added = subprocess.run(
+        ["git", "log", "--format=%H", "-S", "def build_date_verification_records", "--", "services/processor.py"],
+        capture_output=True, text=True, cwd=BACKEND_DIR
+    ).stdout.split()
+    return f"{added[-1]}~1" if added else "HEAD"
+
+
+def load_baseline(rev: str):
+    """Load the processor module from services/processor.py at a git revision"""
+    source = subprocess.run(
+        ["git", "show", f"{rev}:./services/processor.py"],
+        capture_output=True, text=True, check=True, cwd=BACKEND_DIR
+    ).stdout
+    module = types.ModuleType("baseline_processor")
+    exec(compile(source, f"{rev}:services/processor.py", "exec"), module.__dict__)
+    return module
+
+
+def timed_run(module, rows: List[Dict[str, Any]]):
+    """Run module.create_verification_records_supabase against a fresh in-memory database"""
+    db = RecordingDatabase()
+    module.get_database_client = lambda: db
+    started = time.perf_counter()
+    module.create_verification_records_supabase(rows, "bench")
+    return db, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, nargs="+", default=[300, 3000], help="Line items per run")
+    parser.add_argument("--baseline-rev", default=None,
+                        help="Git revision to compare against (default: the revision before vectorization)")
+    parser.add_argument("--no-baseline", action="store_true", help="Only time the current implementation")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    baseline = None
+    if not args.no_baseline:
+        rev = args.baseline_rev or default_baseline_rev()
+        baseline = load_baseline(rev)
+        print(f"Baseline: create_verification_records_supabase at {rev}")
+
+    for n_rows in args.rows:
+        rows = make_rows(n_rows, args.seed)
+        print(f"\n{n_rows} line items")
+
+        current, current_seconds = timed_run(processor, rows)
+        print(f"  current:  {current_seconds:8.2f}s  ({current.requests} requests, "
+              f"{len(current.tables.get('verification_dates', []))} date rows, "
+              f"{len(current.tables.get('verification_amounts', []))} amount rows)")
+
+        if baseline:
+            expected, baseline_seconds = timed_run(baseline, rows)
+            for table in ("verification_dates", "verification_amounts"):
+                got, want = written_rows(current, table), written_rows(expected, table)
+                if got != want:
+                    mismatch = next((i for i, (a, b) in enumerate(zip(got, want)) if a != b), min(len(got), len(want)))
+                    raise AssertionError(
+                        f"{table} differs at row {mismatch} ({len(got)} vs {len(want)} rows):\n"
+                        f"  current:  {got[mismatch] if mismatch < len(got) else None}\n"
+                        f"  baseline: {want[mismatch] if mismatch < len(want) else None}"
+                    )
+            print(f"  baseline: {baseline_seconds:8.2f}s  ({expected.requests} requests, identical rows)")
+            print(f"  speedup:  {baseline_seconds / current_seconds:8.1f}x")
+
+
+if __name__ == "__main__":
+    main()
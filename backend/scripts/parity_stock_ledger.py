@@ -0,0 +1,349 @@
+"""
+Parity-check apply_stock_movements() against a full stock recalculation.
+
+Generates users with vendor invoice items, verified sales, vendor mappings and stock
+rows kept without transactions. Part numbers come in fuzzy variants (case, spaces,
+trailing dashes, one-character edits of long part numbers), so the groups collide the
+way they do in real uploads. It then saves random vendor item / sale adds, deletes and
+edits and mapping adds/deletes the way the endpoints do. Each change goes through
+apply_stock_movements(), and the script checks that:
+
+- the stock_levels rows equal what recalculate_stock_for_user() writes from the same tables
+- applying the same movements again writes nothing
+
+Everything runs against an in-memory database.
+
+Usage (from backend/):
+    python scripts/parity_stock_ledger.py
+    python scripts/parity_stock_ledger.py --seeds 500 --steps 10 --parts 60
+"""
+import sys
+import copy
+import random
+import logging
+import argparse
+import itertools
+from collections import Counter
+from pathlib import Path
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BACKEND_DIR))
+
+import services.stock_ledger as stock_ledger
+
+USERNAME = "parity"
+LONG_PART_SHARE = 0.3  # Part numbers long enough for 99% matches to allow one-character edits
+EVENT_KINDS = [
+    "vendor_add", "vendor_delete", "vendor_edit",
+    "sale_add", "sale_delete", "sale_edit",
+    "mapping_add", "mapping_delete"
+]
+# Columns iter_table_rows() always returns (keyset pagination keys)
+KEY_COLUMNS = ["id", "created_at"]
+IGNORED_COLUMNS = {"id", "created_at", "updated_at", "username"}
+NUMERIC_COLUMNS = ["current_stock", "total_in", "total_out", "total_value", "unit_value", "old_stock"]
+
+
+class InMemoryDatabase:
+    """In-memory stand-in for DatabaseClient and the paged readers the stock ledger uses"""
+
+    def __init__(self, tables: Dict[str, List[Dict[str, Any]]]):
+        self.tables = copy.deepcopy(tables)
+        self._ids = itertools.count(1 + max((row.get("id", 0) for rows in self.tables.values() for row in rows), default=0))
+        for rows in self.tables.values():
+            for row in rows:
+                self._stamp(row)
+        self.writes = 0
+
+    def _stamp(self, row: Dict[str, Any]) -> Dict[str, Any]:
+        row_id = next(self._ids)
+        row.setdefault("id", row_id)
+        row.setdefault("created_at", f"2025-01-01T00:00:00.{row_id:06d}")
+        return row
+
+    def insert(self, table: str, records: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Save rows the way an endpoint does (returns the saved rows)"""
+        inserted = [self._stamp(copy.deepcopy(record)) for record in records]
+        self.tables.setdefault(table, []).extend(inserted)
+        return copy.deepcopy(inserted)
+
+    def remove(self, table: str, row_ids: List[Any]) -> List[Dict[str, Any]]:
+        """Delete rows by id (returns the deleted rows)"""
+        removed = [row for row in self.tables[table] if row["id"] in row_ids]
+        self.tables[table] = [row for row in self.tables[table] if row["id"] not in row_ids]
+        return copy.deepcopy(removed)
+
+    def change(self, table: str, row_id: Any, data: Dict[str, Any]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """Update a row by id (returns the new and the previous version)"""
+        row = next(row for row in self.tables[table] if row["id"] == row_id)
+        previous = copy.deepcopy(row)
+        row.update(data)
+        return [copy.deepcopy(row)], [previous]
+
+    # DatabaseClient methods used by services.stock_ledger
+
+    def batch_upsert(self, table: str, records: List[Dict[str, Any]], batch_size: int = 500, **kwargs) -> int:
+        self.writes += len(records)
+        rows = {row["id"]: row for row in self.tables.setdefault(table, [])}
+        for record in records:
+            rows[record["id"]].update(copy.deepcopy(record))
+        return len(records)
+
+    def batch_insert(self, table: str, records: List[Dict[str, Any]], batch_size: int = 500) -> List[Dict[str, Any]]:
+        self.writes += len(records)
+        return self.insert(table, records)
+
+    def delete_in(self, table: str, column: str, values: List[Any], match: Optional[Dict[str, Any]] = None):
+        self.writes += len(values)
+        self.tables[table] = [
+            row for row in self.tables.get(table, [])
+            if row.get(column) not in values or any(row.get(key) != value for key, value in (match or {}).items())
+        ]
+
+    # Replacements for database_helpers.iter_table_rows / iter_verified_invoices
+
+    def iter_table_rows(self, table: str, username: str, columns: Optional[List[str]] = None,
+                        filters: Optional[Dict[str, Any]] = None, **kwargs) -> Iterator[Dict[str, Any]]:
+        for row in sorted(self.tables.get(table, []), key=lambda row: (row["created_at"], row["id"])):
+            if row.get("username") != username:
+                continue
+            if any(row.get(column) != value for column, value in (filters or {}).items()):
+                continue
+            if columns:
+                yield {column: copy.deepcopy(row.get(column)) for column in [*columns, *KEY_COLUMNS]}
+            else:
+                yield copy.deepcopy(row)
+
+    def iter_verified_invoices(self, username: str, columns: Optional[List[str]] = None,
+                               filters: Optional[Dict[str, Any]] = None, **kwargs) -> Iterator[Dict[str, Any]]:
+        return self.iter_table_rows("verified_invoices", username, columns=columns, filters=filters)
+
+
+class FailingScheduler:
+    """A ledger update that fails would be hidden behind a scheduled recalculation"""
+
+    def request(self, username: str, reason: str = ""):
+        raise AssertionError(f"apply_stock_movements failed for {username} and fell back to a recalculation")
+
+
+def use(db: InMemoryDatabase):
+    """Point services.stock_ledger at an in-memory database"""
+    stock_ledger.get_database_client = lambda: db
+    stock_ledger.iter_table_rows = db.iter_table_rows
+    stock_ledger.iter_verified_invoices = db.iter_verified_invoices
+    stock_ledger.get_stock_scheduler = FailingScheduler
+
+
+def make_tables(rng: random.Random, n_parts: int) -> Tuple[Dict[str, List[Dict[str, Any]]], List[str], List[str]]:
+    """
+    Build a user's inventory_items, verified_invoices, vendor_mapping_entries and stock_levels.
+
+    Returns:
+        Tuple of (table name -> rows, part numbers, customer items)
+    """
+    parts = []
+    for i in range(n_parts):
+        if rng.random() < LONG_PART_SHARE:
+            parts.append("".join(rng.choice("ABCDEFGH0123456789") for _ in range(rng.randint(45, 110))))
+        else:
+            parts.append(f"P{rng.randint(0, n_parts * 2)}-{rng.choice('XYZ')}{i}")
+    customer_items = [f"item {i} {rng.choice(['brake', 'pad', 'oil', 'filter'])}" for i in range(n_parts)]
+
+    tables = {
+        "inventory_items": [vendor_item(rng, parts) for _ in range(rng.randint(0, n_parts * 3))],
+        "verified_invoices": [sale(rng, customer_items) for _ in range(rng.randint(0, n_parts * 2))],
+        "vendor_mapping_entries": [mapping(rng, parts, customer_items) for _ in range(rng.randint(0, n_parts))],
+        # Rows added from mapping sheets or by hand, before any transaction
+        "stock_levels": [{
+            "username": USERNAME,
+            "part_number": variant(rng, rng.choice(parts)),
+            "internal_item_name": rng.choice(["v1", "sheet item"]),
+            "vendor_description": rng.choice([None, "sheet item"]),
+            "old_stock": rng.choice([None, 3])
+        } for _ in range(n_parts // 5)]
+    }
+    return tables, parts, customer_items
+
+
+def variant(rng: random.Random, part_number: str) -> str:
+    """The part number as it may be typed or OCR'd on another document"""
+    roll = rng.random()
+    if roll < 0.2:
+        return part_number.lower()
+    if roll < 0.3:
+        middle = len(part_number) // 2
+        return part_number[:middle] + " " + part_number[middle:]
+    if roll < 0.4:
+        return part_number + "-"
+    if roll < 0.55 and len(part_number) > 40:
+        i = rng.randrange(len(part_number))
+        return part_number[:i] + rng.choice("QRS") + part_number[i + 1:]
+    if roll < 0.65 and len(part_number) > 40:
+        i = rng.randrange(len(part_number))
+        return part_number[:i] + part_number[i + 1:]
+    return part_number
+
+
+def vendor_item(rng: random.Random, parts: List[str]) -> Dict[str, Any]:
+    return {
+        "username": USERNAME,
+        "excluded_from_stock": rng.random() < 0.05,
+        "part_number": variant(rng, rng.choice(parts)) if rng.random() < 0.95 else "",
+        "description": rng.choice(["v1", "v2", ""]),
+        "qty": rng.choice([1, 2, 5, None]),
+        "rate": rng.choice([10, 20, 35.5]),
+        "invoice_date": rng.choice(["2025-01-01", "2025-02-01", "2025-02-15", None])
+    }
+
+
+def sale(rng: random.Random, customer_items: List[str]) -> Dict[str, Any]:
+    description = rng.choice(customer_items)
+    return {
+        "username": USERNAME,
+        "type": rng.choice(["Part", "Part", "Labour"]),
+        "description": rng.choice([description, description + "s", description.upper(), description + " x", None]),
+        "quantity": rng.choice([1, 2, 0.5, 1.25, None]),
+        "rate": rng.randint(1, 9),
+        "date": rng.choice(["2025-03-01", "2025-03-02", "2025-02-28", None])
+    }
+
+
+def mapping(rng: random.Random, parts: List[str], customer_items: List[str]) -> Dict[str, Any]:
+    return {
+        "username": USERNAME,
+        "status": "Added",
+        "customer_item_name": rng.choice([*customer_items, None]),
+        "part_number": variant(rng, rng.choice(parts)),
+        "vendor_description": rng.choice(["desc a", "desc b", None]),
+        "priority": rng.choice([None, "High"]),
+        "reorder_point": rng.choice([None, 5])
+    }
+
+
+def random_event(rng: random.Random, db: InMemoryDatabase, parts: List[str],
+                 customer_items: List[str]) -> Tuple[str, Dict[str, Any]]:
+    """
+    Save a random change like an endpoint would.
+
+    Returns:
+        Tuple of (event kind, apply_stock_movements() keyword arguments), ("", {}) if
+        there was nothing to change
+    """
+    kind = rng.choice(EVENT_KINDS)
+    tables = db.tables
+    if kind == "vendor_add":
+        return kind, {"vendor_added": db.insert("inventory_items", [vendor_item(rng, parts) for _ in range(rng.randint(1, 4))])}
+    if kind == "sale_add":
+        return kind, {"sales_added": db.insert("verified_invoices", [sale(rng, customer_items) for _ in range(rng.randint(1, 5))])}
+    if kind == "mapping_add":
+        new_mapping = mapping(rng, parts, customer_items)
+        db.insert("vendor_mapping_entries", [new_mapping])
+        return kind, {"mapping_parts": [new_mapping["part_number"]]}
+
+    table = {"vendor": "inventory_items", "sale": "verified_invoices", "mapping": "vendor_mapping_entries"}[kind.split("_")[0]]
+    if not tables.get(table):
+        return "", {}
+    victim = rng.choice(tables[table])
+    if kind == "vendor_delete":
+        return kind, {"vendor_removed": db.remove(table, [victim["id"]])}
+    if kind == "sale_delete":
+        return kind, {"sales_removed": db.remove(table, [victim["id"]])}
+    if kind == "mapping_delete":
+        # The mapping routes delete every mapping of the part number
+        db.remove(table, [row["id"] for row in tables[table] if row["part_number"] == victim["part_number"]])
+        return kind, {"mapping_parts": [victim["part_number"]]}
+    if kind == "vendor_edit":
+        added, removed = db.change(table, victim["id"], {
+            "qty": rng.randint(0, 5), "rate": rng.choice([10, 50]), "invoice_date": rng.choice(["2025-04-01", None])
+        })
+        return kind, {"vendor_added": added, "vendor_removed": removed}
+    added, removed = db.change(table, victim["id"], {"quantity": rng.randint(0, 5), "rate": rng.randint(1, 9)})
+    return kind, {"sales_added": added, "sales_removed": removed}
+
+
+def stock_rows(db: InMemoryDatabase) -> List[Dict[str, Any]]:
+    """stock_levels rows without ids and timestamps, numbers rounded, in a stable order"""
+    rows = []
+    for row in db.tables.get("stock_levels", []):
+        row = {key: value for key, value in row.items() if key not in IGNORED_COLUMNS}
+        for column in NUMERIC_COLUMNS:
+            if row.get(column) is not None:
+                row[column] = round(float(row[column]), 2)
+        rows.append(row)
+    return sorted(rows, key=lambda row: (str(row.get("part_number")), repr(sorted(row.items()))))
+
+
+def full_recalculation(db: InMemoryDatabase) -> InMemoryDatabase:
+    """Copy of the database after recalculate_stock_for_user()"""
+    reference = InMemoryDatabase(db.tables)
+    use(reference)
+    stock_ledger.recalculate_stock_for_user(USERNAME)
+    use(db)
+    return reference
+
+
+def check(seed: int, event: int, kind: str, got: List[Dict[str, Any]], want: List[Dict[str, Any]], what: str):
+    if got == want:
+        return
+    got_by_part = {row.get("part_number"): row for row in got}
+    want_by_part = {row.get("part_number"): row for row in want}
+    part = next(
+        (part for part in {**got_by_part, **want_by_part} if got_by_part.get(part) != want_by_part.get(part)),
+        None
+    )
+    raise AssertionError(
+        f"seed {seed}, event {event} ({kind}): {what} ({len(got)} vs {len(want)} rows), part {part!r}:\n"
+        f"  ledger:   {got_by_part.get(part)}\n"
+        f"  expected: {want_by_part.get(part)}"
+    )
+
+
+def run_seed(seed: int, steps: int, max_parts: int, stats: Counter):
+    rng = random.Random(seed)
+    tables, parts, customer_items = make_tables(rng, rng.randint(2, max_parts))
+    db = InMemoryDatabase(tables)
+    use(db)
+    stock_ledger.recalculate_stock_for_user(USERNAME)
+
+    for event in range(steps):
+        kind, movements = random_event(rng, db, parts, customer_items)
+        if not kind:
+            continue
+        stats[kind] += 1
+
+        writes = db.writes
+        stock_ledger.apply_stock_movements(USERNAME, **movements)
+        stats["ledger writes"] += db.writes - writes
+        reference = full_recalculation(db)
+        stats["recalculation writes"] += reference.writes
+        check(seed, event, kind, stock_rows(db), stock_rows(reference), "stock_levels differ from a full recalculation")
+
+        before, writes = stock_rows(db), db.writes
+        stock_ledger.apply_stock_movements(USERNAME, **movements)
+        if db.writes != writes:
+            raise AssertionError(f"seed {seed}, event {event} ({kind}): applying the same movements again wrote {db.writes - writes} rows")
+        check(seed, event, kind, stock_rows(db), before, "applying the same movements again changed stock_levels")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--seeds", type=int, default=200, help="Number of random users")
+    parser.add_argument("--steps", type=int, default=8, help="Changes saved per user")
+    parser.add_argument("--parts", type=int, default=40, help="Maximum part numbers per user")
+    parser.add_argument("--first-seed", type=int, default=0)
+    args = parser.parse_args()
+
+    logging.disable(logging.WARNING)
+    stats = Counter()
+    for seed in range(args.first_seed, args.first_seed + args.seeds):
+        run_seed(seed, args.steps, args.parts, stats)
+
+    events = sum(stats[kind] for kind in EVENT_KINDS)
+    print(f"{args.seeds} users, {events} changes: stock_levels identical to a full recalculation after every change")
+    print("  " + ", ".join(f"{kind} {stats[kind]}" for kind in EVENT_KINDS))
+    print(f"  rows written: ledger {stats['ledger writes']}, full recalculation {stats['recalculation writes']}")
+
+
+if __name__ == "__main__":
+    main()
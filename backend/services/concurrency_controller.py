@@ -0,0 +1,143 @@
+"""
+Adaptive (AIMD) control of extraction concurrency.
+A fixed in-flight limit is wrong in both directions: when Gemini slows down or
+throttles, extra in-flight work only piles up retries; when it is fast, the
+limit leaves throughput unused. The controller watches every Gemini call and,
+once per window of calls, adds a few slots when calls are healthy and the limit
+is actually in use, or cuts the limit multiplicatively on 429s, errors or
+latency well above the model's normal latency.
+"""
+import os
+import time
+import threading
+import logging
+from typing import Dict, Any, Optional
+
+from services.latency_tracker import get_latency_tracker
+
+logger = logging.getLogger(__name__)
+
+# Controller configuration
+AIMD_ENABLED = os.getenv("AIMD_ENABLED", "true").lower() == "true"
+AIMD_MIN_IN_FLIGHT = int(os.getenv("AIMD_MIN_IN_FLIGHT", "5"))  # Floor
+AIMD_INITIAL_IN_FLIGHT = int(os.getenv("AIMD_INITIAL_IN_FLIGHT", "25"))  # Starting limit
+AIMD_WINDOW_SIZE = int(os.getenv("AIMD_WINDOW_SIZE", "20"))  # Calls per adjustment decision
+AIMD_INCREASE_STEP = 2  # Slots added after a healthy window
+AIMD_DECREASE_FACTOR = 0.7  # Limit multiplier after an unhealthy window
+AIMD_MAX_ERROR_RATE = 0.2  # Share of failed calls (other than 429) tolerated in a window
+AIMD_LATENCY_TOLERANCE = 2.0  # Window median over the model's usual (p10) latency that counts as slow
+AIMD_BASELINE_MIN_SAMPLES = 20  # Latency samples needed before a model's baseline is trusted
+AIMD_DECREASE_COOLDOWN = 5.0  # Seconds after a decrease during which 429s from calls already in flight don't cut again
+
+
+class AIMDController:
+    """Additive-increase / multiplicative-decrease limit for in-flight extractions"""
+
+    def __init__(self, floor: int, ceiling: int, initial: int, window_size: int = AIMD_WINDOW_SIZE):
+        self.floor = max(1, floor)
+        self.ceiling = max(self.floor, ceiling)
+        self.limit = min(max(initial, self.floor), self.ceiling)
+        self.window_size = window_size
+        self._lock = threading.Lock()
+        self._reset_window()
+        self._increases = 0
+        self._decreases = 0
+        self._last_change: Optional[Dict[str, Any]] = None
+        self._cooldown_until = 0.0
+
+    def _reset_window(self):
+        self._calls = 0
+        self._errors = 0
+        self._rate_limited = 0
+        self._latency_ratios = []
+        self._saturated = 0
+
+    def record(self, model: str, seconds: Optional[float], ok: bool = True, rate_limited: bool = False,
+               saturated: bool = True) -> Optional[int]:
+        """
+        Record one finished Gemini call.
+
+        Args:
+            model: Model the call went to
+            seconds: Call latency (None if unknown, e.g. the call failed early)
+            ok: Whether the call returned a usable response
+            rate_limited: Whether the call failed with 429 / RESOURCE_EXHAUSTED
+            saturated: Whether every in-flight slot was in use or had waiters when the call finished
+
+        Returns:
+            The new limit if this call closed a window and changed it, otherwise None
+        """
+        baseline = get_latency_tracker().percentile(model, 10, min_samples=AIMD_BASELINE_MIN_SAMPLES)
+        with self._lock:
+            self._calls += 1
+            if rate_limited:
+                self._rate_limited += 1
+            elif not ok:
+                self._errors += 1
+            if ok and seconds is not None and baseline:
+                self._latency_ratios.append(seconds / baseline)
+            if saturated:
+                self._saturated += 1
+
+            # A 429 ends the window at once: waiting for more calls only adds more 429s
+            cut_now = rate_limited and time.monotonic() >= self._cooldown_until
+            if self._calls < self.window_size and not cut_now:
+                return None
+            return self._adjust()
+
+    def _adjust(self) -> Optional[int]:
+        """Close the current window and move the limit; caller holds the lock"""
+        ratios = sorted(self._latency_ratios)
+        median_ratio = ratios[len(ratios) // 2] if ratios else None
+        error_rate = self._errors / self._calls
+
+        reason = None
+        if self._rate_limited:
+            reason = f"{self._rate_limited} rate-limited call(s)"
+        elif error_rate > AIMD_MAX_ERROR_RATE:
+            reason = f"error rate {error_rate:.0%}"
+        elif median_ratio is not None and median_ratio > AIMD_LATENCY_TOLERANCE:
+            reason = f"latency {median_ratio:.1f}x usual"
+
+        old_limit = self.limit
+        direction = None
+        if reason:
+            self.limit = max(self.floor, int(self.limit * AIMD_DECREASE_FACTOR))
+            direction = "decrease"
+        elif self._saturated * 2 >= self._calls:
+            # Only grow while the limit is what holds work back
+            self.limit = min(self.ceiling, self.limit + AIMD_INCREASE_STEP)
+            direction = "increase"
+            reason = "healthy window at the limit"
+        self._reset_window()
+
+        if self.limit == old_limit:
+            return None
+        if direction == "decrease":
+            self._decreases += 1
+            self._cooldown_until = time.monotonic() + AIMD_DECREASE_COOLDOWN
+            logger.warning(f"Extraction concurrency {old_limit} -> {self.limit} ({reason})")
+        else:
+            self._increases += 1
+            logger.info(f"Extraction concurrency {old_limit} -> {self.limit} ({reason})")
+        self._last_change = {
+            "from": old_limit,
+            "to": self.limit,
+            "reason": reason,
+            "at": time.time()
+        }
+        return self.limit
+
+    def stats(self) -> Dict[str, Any]:
+        """Get the current limit, its bounds and recent adjustments"""
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "floor": self.floor,
+                "ceiling": self.ceiling,
+                "window_size": self.window_size,
+                "window_calls": self._calls,
+                "increases": self._increases,
+                "decreases": self._decreases,
+                "last_change": self._last_change
+            }
@@ -0,0 +1,167 @@
+"""
+Persistent cache of Gemini extraction results.
+Keyed by (image hash, prompt hash, model) so re-processing the same image with
+the same prompt and model is served locally instead of calling Gemini again.
+"""
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import logging
+from pathlib import Path
+from typing import Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# Cache configuration
+EXTRACTION_CACHE_ENABLED = os.getenv("EXTRACTION_CACHE_ENABLED", "true").lower() == "true"
+EXTRACTION_CACHE_PATH = os.getenv(
+    "EXTRACTION_CACHE_PATH",
+    str(Path(__file__).parent.parent / "cache" / "extraction_cache.sqlite3")
+)
+EXTRACTION_CACHE_MAX_ENTRIES = int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", "5000"))
+
+
+def hash_prompt(prompt: str) -> str:
+    """
+    Calculate SHA-256 hash of a prompt.
+    The hash is part of the cache key, so editing a prompt template
+    automatically stops old extractions from being served.
+    """
+    return hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+
+
+class ExtractionCache:
+    """SQLite-backed LRU cache of parsed extraction results"""
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = path
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS extraction_cache (
+                image_hash TEXT NOT NULL,
+                prompt_hash TEXT NOT NULL,
+                model TEXT NOT NULL,
+                result TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                last_used REAL NOT NULL,
+                PRIMARY KEY (image_hash, prompt_hash, model)
+            )
+            """
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_extraction_cache_last_used ON extraction_cache (last_used)"
+        )
+        self._conn.commit()
+        logger.info(f"Extraction cache initialized at {path} (max {max_entries} entries)")
+
+    def get(self, image_hash: str, prompt_hash: str, model: str) -> Optional[Dict[str, Any]]:
+        """
+        Get a cached extraction result.
+
+        Returns:
+            Cached result dictionary, or None on a miss
+        """
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT result FROM extraction_cache WHERE image_hash = ? AND prompt_hash = ? AND model = ?",
+                (image_hash, prompt_hash, model)
+            ).fetchone()
+
+            if row is None:
+                self.misses += 1
+                return None
+
+            self._conn.execute(
+                "UPDATE extraction_cache SET last_used = ? WHERE image_hash = ? AND prompt_hash = ? AND model = ?",
+                (time.time(), image_hash, prompt_hash, model)
+            )
+            self._conn.commit()
+            self.hits += 1
+
+        logger.info(f"Extraction cache hit for {image_hash[:16]}... ({model})")
+        return json.loads(row[0])
+
+    def put(self, image_hash: str, prompt_hash: str, model: str, result: Dict[str, Any]):
+        """
+        Store an extraction result.
+        Entries for the same image and model under an older prompt are dropped,
+        and the least recently used entries are evicted beyond max_entries.
+        """
+        payload = json.dumps(result)
+        now = time.time()
+
+        with self._lock:
+            self._conn.execute(
+                "DELETE FROM extraction_cache WHERE image_hash = ? AND model = ? AND prompt_hash != ?",
+                (image_hash, model, prompt_hash)
+            )
+            self._conn.execute(
+                "INSERT OR REPLACE INTO extraction_cache "
+                "(image_hash, prompt_hash, model, result, created_at, last_used) VALUES (?, ?, ?, ?, ?, ?)",
+                (image_hash, prompt_hash, model, payload, now, now)
+            )
+            self._conn.execute(
+                "DELETE FROM extraction_cache WHERE rowid IN ("
+                "SELECT rowid FROM extraction_cache ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+            self._conn.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        """Get hit/miss counters and current size"""
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM extraction_cache").fetchone()[0]
+            lookups = self.hits + self.misses
+            return {
+                "entries": entries,
+                "max_entries": self.max_entries,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups * 100, 2) if lookups else 0.0
+            }
+
+    def clear(self):
+        """Remove all cached results"""
+        with self._lock:
+            self._conn.execute("DELETE FROM extraction_cache")
+            self._conn.commit()
+        logger.info("Extraction cache cleared")
+
+
+# Global extraction cache instance
+_extraction_cache: Optional[ExtractionCache] = None
+_extraction_cache_lock = threading.Lock()
+
+
+def get_extraction_cache() -> Optional[ExtractionCache]:
+    """
+    Get the global extraction cache instance.
+
+    Returns:
+        ExtractionCache, or None if caching is disabled or the cache file cannot be opened
+    """
+    global _extraction_cache
+
+    if not EXTRACTION_CACHE_ENABLED:
+        return None
+
+    if _extraction_cache is None:
+        with _extraction_cache_lock:
+            if _extraction_cache is None:
+                try:
+                    _extraction_cache = ExtractionCache(EXTRACTION_CACHE_PATH, EXTRACTION_CACHE_MAX_ENTRIES)
+                except Exception as e:
+                    logger.error(f"Could not open extraction cache, continuing without it: {e}")
+                    return None
+
+    return _extraction_cache
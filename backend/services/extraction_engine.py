@@ -0,0 +1,129 @@
+"""
+Async extraction engine.
+A single long-lived event loop, on its own thread, drives every in-flight invoice
+extraction in the process. Gemini calls use the SDK's async client; R2 (boto3) and
+Supabase calls, which have no async clients here, run on a small I/O thread pool.
+Synchronous code submits coroutines with ExtractionEngine.run(). In-flight slots
+are shared fairly between users by a FairScheduler, and their number is tuned
+by an AIMD controller from the outcome of every Gemini call.
+"""
+import os
+import asyncio
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, AsyncContextManager, Callable, Coroutine, Dict, Optional
+
+from services.fair_scheduler import FairScheduler
+from services.concurrency_controller import (
+    AIMDController, AIMD_ENABLED, AIMD_MIN_IN_FLIGHT, AIMD_INITIAL_IN_FLIGHT
+)
+
+logger = logging.getLogger(__name__)
+
+# Global cap on invoices being extracted at once, across all batches and users.
+# With AIMD enabled this is the ceiling the adaptive limit may grow to.
+EXTRACTION_MAX_IN_FLIGHT = int(os.getenv("EXTRACTION_MAX_IN_FLIGHT", "100"))
+
+# Threads for blocking R2 / Supabase / cache calls made by in-flight extractions
+EXTRACTION_IO_THREADS = int(os.getenv("EXTRACTION_IO_THREADS", "32"))
+
+# Global cap on concurrent Gemini requests; hedged extractions can hold two at once
+GEMINI_MAX_CONCURRENT_CALLS = int(os.getenv("GEMINI_MAX_CONCURRENT_CALLS", "100"))
+
+
+class ExtractionEngine:
+    """Owns the extraction event loop, its per-user in-flight scheduling and the Gemini call cap"""
+
+    def __init__(self, max_in_flight: int = EXTRACTION_MAX_IN_FLIGHT, io_threads: int = EXTRACTION_IO_THREADS,
+                 max_gemini_calls: int = GEMINI_MAX_CONCURRENT_CALLS):
+        self.max_in_flight = max_in_flight
+        self.max_gemini_calls = max_gemini_calls
+        self._loop = asyncio.new_event_loop()
+        self._io_executor = ThreadPoolExecutor(max_workers=io_threads, thread_name_prefix="extraction-io")
+        self._loop.set_default_executor(self._io_executor)
+        self._controller = (
+            AIMDController(AIMD_MIN_IN_FLIGHT, max_in_flight, AIMD_INITIAL_IN_FLIGHT) if AIMD_ENABLED else None
+        )
+        self._scheduler = FairScheduler(self._controller.limit if self._controller else max_in_flight)
+        self._gemini_calls = asyncio.Semaphore(max_gemini_calls)
+
+        self._thread = threading.Thread(target=self._run_loop, name="extraction-engine", daemon=True)
+        self._thread.start()
+        logger.info(f"Extraction engine started (max {max_in_flight} in flight, "
+                    f"{max_gemini_calls} Gemini calls, {io_threads} I/O threads)")
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_forever()
+
+    def slot(self, username: str) -> AsyncContextManager[None]:
+        """
+        In-flight slot for one of a user's extractions; use with `async with`.
+        Users waiting for slots are served in weighted round robin, not FIFO.
+        """
+        return self._scheduler.slot(username)
+
+    @property
+    def gemini_calls(self) -> asyncio.Semaphore:
+        """Semaphore bounding concurrent Gemini requests; use with `async with`"""
+        return self._gemini_calls
+
+    def record_gemini_call(self, model: str, seconds: Optional[float], ok: bool = True, rate_limited: bool = False):
+        """
+        Feed one finished Gemini call to the concurrency controller.
+        Must be called on the engine loop (the in-flight limit may change).
+        """
+        if not self._controller:
+            return
+        new_limit = self._controller.record(model, seconds, ok, rate_limited, self._scheduler.is_saturated())
+        if new_limit is not None:
+            self._scheduler.set_capacity(new_limit)
+
+    def concurrency_stats(self) -> Dict[str, Any]:
+        """Get the adaptive in-flight limit and current usage"""
+        scheduler = self._scheduler.stats()["global"]
+        controller = self._controller.stats() if self._controller else {
+            "limit": self.max_in_flight, "floor": self.max_in_flight, "ceiling": self.max_in_flight
+        }
+        return {
+            "adaptive": self._controller is not None,
+            **controller,
+            "in_use": scheduler["in_use"],
+            "queued": scheduler["queued"],
+            "max_gemini_calls": self.max_gemini_calls
+        }
+
+    def scheduler_stats(self, username: Optional[str] = None) -> Dict[str, Any]:
+        """Get slot queue depth and wait times (per user, or only for username)"""
+        return self._scheduler.stats(username)
+
+    def run(self, coro: Coroutine) -> Any:
+        """
+        Run a coroutine on the engine loop and wait for its result.
+        Must be called from outside the engine loop (sync code, worker threads).
+        """
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("ExtractionEngine.run() called from the engine loop; await the coroutine instead")
+        return asyncio.run_coroutine_threadsafe(coro, self._loop).result()
+
+    async def run_blocking(self, func: Callable, *args, **kwargs) -> Any:
+        """Run a blocking call on the I/O thread pool without stalling the loop"""
+        return await self._loop.run_in_executor(self._io_executor, partial(func, *args, **kwargs))
+
+
+# Global extraction engine instance
+_engine: Optional[ExtractionEngine] = None
+_engine_lock = threading.Lock()
+
+
+def get_extraction_engine() -> ExtractionEngine:
+    """Get the global extraction engine, starting its loop on first use"""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = ExtractionEngine()
+    return _engine
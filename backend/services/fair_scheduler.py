@@ -0,0 +1,204 @@
+"""
+Per-tenant fair scheduling of extraction slots.
+Every batch in the process shares one budget of in-flight extractions. Without
+scheduling, a 500-file batch queues 500 waiters ahead of a later 5-file batch and
+that user waits for all of them. Here each tenant (username) gets its own queue
+in front of the shared budget, and freed slots are handed out by weighted round
+robin (deficit round robin with unit cost), so a small batch starts within a few
+slot releases regardless of how much work other tenants have queued.
+"""
+import os
+import time
+import asyncio
+import threading
+import logging
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Relative share per tenant, e.g. TENANT_WEIGHTS="bigshop:3,smallshop:1". Unlisted tenants get 1.
+TENANT_WEIGHTS = os.getenv("TENANT_WEIGHTS", "")
+DEFAULT_TENANT_WEIGHT = 1
+
+# Recent slot waits kept per tenant for the wait-time percentiles
+WAIT_WINDOW_SIZE = 200
+
+
+def parse_tenant_weights(spec: str) -> Dict[str, int]:
+    """Parse 'user:weight,user:weight' into a dict, ignoring malformed entries"""
+    weights = {}
+    for entry in spec.split(","):
+        name, _, weight = entry.strip().partition(":")
+        try:
+            if name and int(weight) > 0:
+                weights[name] = int(weight)
+        except ValueError:
+            logger.warning(f"Ignoring malformed TENANT_WEIGHTS entry: {entry!r}")
+    return weights
+
+
+class TenantQueue:
+    """Waiters and counters for one tenant"""
+
+    def __init__(self, weight: int):
+        self.weight = weight
+        self.deficit = 0
+        self.waiters: Deque[Tuple[asyncio.Future, float]] = deque()  # (future, enqueued_at)
+        self.running = 0
+        self.granted = 0
+        self.waits: Deque[float] = deque(maxlen=WAIT_WINDOW_SIZE)
+        self.total_wait = 0.0
+
+
+class FairScheduler:
+    """
+    Hands out a fixed number of slots to tenants in weighted round robin.
+    acquire/release must run on one event loop (the extraction engine's);
+    stats() may be called from any thread.
+    """
+
+    def __init__(self, capacity: int, weights: Optional[Dict[str, int]] = None):
+        self.capacity = capacity
+        self.weights = weights if weights is not None else parse_tenant_weights(TENANT_WEIGHTS)
+        self._tenants: Dict[str, TenantQueue] = {}
+        self._active: Deque[str] = deque()  # Tenants with waiters, in round-robin order
+        self._in_use = 0
+        self._lock = threading.Lock()
+
+    def _tenant(self, tenant: str) -> TenantQueue:
+        queue = self._tenants.get(tenant)
+        if queue is None:
+            queue = TenantQueue(self.weights.get(tenant, DEFAULT_TENANT_WEIGHT))
+            self._tenants[tenant] = queue
+        return queue
+
+    def _grant(self, tenant: str, queue: TenantQueue, waited: float):
+        self._in_use += 1
+        queue.running += 1
+        queue.granted += 1
+        queue.waits.append(waited)
+        queue.total_wait += waited
+
+    def _next_waiter(self) -> Optional[str]:
+        """Pop the next tenant to serve (deficit round robin, unit cost per slot)"""
+        while self._active:
+            tenant = self._active[0]
+            queue = self._tenants[tenant]
+            # Drop waiters cancelled while queued
+            while queue.waiters and queue.waiters[0][0].done():
+                queue.waiters.popleft()
+            if not queue.waiters:
+                queue.deficit = 0
+                self._active.popleft()
+                continue
+            if queue.deficit <= 0:
+                queue.deficit += queue.weight
+            queue.deficit -= 1
+            if queue.deficit <= 0:
+                # Tenant used its share for this round; move to the back
+                self._active.rotate(-1)
+            return tenant
+        return None
+
+    def _dispatch(self):
+        """Give free slots to waiting tenants; caller holds the lock"""
+        while self._in_use < self.capacity:
+            tenant = self._next_waiter()
+            if tenant is None:
+                return
+            queue = self._tenants[tenant]
+            waiter, enqueued_at = queue.waiters.popleft()
+            self._grant(tenant, queue, time.monotonic() - enqueued_at)
+            waiter.set_result(None)
+
+    async def acquire(self, tenant: str):
+        """Wait for a slot on behalf of a tenant"""
+        with self._lock:
+            queue = self._tenant(tenant)
+            if self._in_use < self.capacity and not self._active:
+                self._grant(tenant, queue, 0.0)
+                return
+            waiter = asyncio.get_running_loop().create_future()
+            queue.waiters.append((waiter, time.monotonic()))
+            if tenant not in self._active:
+                self._active.append(tenant)
+            self._dispatch()
+
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            with self._lock:
+                if waiter.done() and not waiter.cancelled():
+                    # Granted and cancelled at the same time: hand the slot on
+                    self._release_locked(tenant)
+            raise
+
+    def _release_locked(self, tenant: str):
+        self._in_use -= 1
+        self._tenants[tenant].running -= 1
+        self._dispatch()
+
+    def release(self, tenant: str):
+        """Return a slot and wake the next tenant in line"""
+        with self._lock:
+            self._release_locked(tenant)
+
+    def set_capacity(self, capacity: int):
+        """Change the number of slots; must be called on the scheduler's event loop"""
+        with self._lock:
+            self.capacity = capacity
+            self._dispatch()
+
+    def is_saturated(self) -> bool:
+        """Whether every slot is taken or work is waiting for one"""
+        with self._lock:
+            return self._in_use >= self.capacity or bool(self._active)
+
+    @asynccontextmanager
+    async def slot(self, tenant: str) -> AsyncIterator[None]:
+        """Hold one slot for the duration of the block; use with `async with`"""
+        await self.acquire(tenant)
+        try:
+            yield
+        finally:
+            self.release(tenant)
+
+    def stats(self, tenant: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Get queue depth, running count and slot wait times.
+
+        Args:
+            tenant: Only include this tenant's entry (global totals are always included)
+
+        Returns:
+            Dictionary with 'global' totals and per-tenant 'tenants' entries
+        """
+        with self._lock:
+            tenants = {}
+            for name, queue in self._tenants.items():
+                if tenant is not None and name != tenant:
+                    continue
+                waits = sorted(queue.waits)
+                tenants[name] = {
+                    "weight": queue.weight,
+                    "queued": sum(1 for w, _ in queue.waiters if not w.done()),
+                    "running": queue.running,
+                    "granted": queue.granted,
+                    "avg_wait_seconds": round(queue.total_wait / queue.granted, 3) if queue.granted else 0.0,
+                    "p90_wait_seconds": round(waits[int(0.9 * (len(waits) - 1))], 3) if waits else 0.0,
+                    "max_wait_seconds": round(waits[-1], 3) if waits else 0.0
+                }
+            return {
+                "global": {
+                    "capacity": self.capacity,
+                    "in_use": self._in_use,
+                    "queued": sum(
+                        sum(1 for w, _ in queue.waiters if not w.done())
+                        for queue in self._tenants.values()
+                    ),
+                    "tenants_waiting": len(self._active)
+                },
+                "tenants": tenants
+            }
@@ -2,12 +2,19 @@
 Fuzzy string matching service for inventory item mapping.
 Uses rapidfuzz for efficient fuzzy matching with configurable threshold.
 """
+import os
 import logging
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Optional, Callable, Tuple
+import numpy as np
 from rapidfuzz import fuzz, process
 
 logger = logging.getLogger(__name__)
 
+# Worker threads used by process.cdist (-1 = all CPU cores)
+FUZZY_MATCH_WORKERS = int(os.getenv("FUZZY_MATCH_WORKERS", "-1"))
+# Queries scored per cdist call; bounds the score matrix to CDIST_CHUNK_ROWS x len(choices)
+CDIST_CHUNK_ROWS = 2048
+
 
 def get_fuzzy_matches(
     customer_item: str,
@@ -103,3 +110,161 @@ def batch_match_items(
     
     logger.info(f"Batch matched {len(customer_items)} customer items")
     return results
+
+
+def find_matching_pairs(
+    queries: List[str],
+    choices: List[str],
+    threshold: float,
+    scorer: Callable = fuzz.ratio,
+    workers: Optional[int] = None
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find every (query, choice) pair scoring at least threshold.
+    
+    Scores all pairs with process.cdist (multi-threaded), in chunks of
+    CDIST_CHUNK_ROWS queries. Scores are kept as float64 so the comparison
+    matches calling scorer(query, choice) >= threshold pair by pair.
+    Strings are compared as given (normalize them before calling).
+    
+    Args:
+        queries: Query strings
+        choices: Choice strings
+        threshold: Minimum score (0-100)
+        scorer: rapidfuzz scorer, default fuzz.ratio
+        workers: cdist worker threads (default: FUZZY_MATCH_WORKERS)
+        
+    Returns:
+        Tuple of (query indices, choice indices) arrays, sorted by query index
+    """
+    if not queries or not choices:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    
+    workers = FUZZY_MATCH_WORKERS if workers is None else workers
+    query_idx, choice_idx = [], []
+    for start in range(0, len(queries), CDIST_CHUNK_ROWS):
+        scores = process.cdist(
+            queries[start:start + CDIST_CHUNK_ROWS], choices,
+            scorer=scorer, dtype=np.float64, workers=workers
+        )
+        rows, cols = np.nonzero(scores >= threshold)
+        query_idx.append(rows + start)
+        choice_idx.append(cols)
+    
+    return np.concatenate(query_idx), np.concatenate(choice_idx)
+
+
+def normalize_part_number(part_number: str) -> str:
+    """Normalize part number for matching (remove spaces, lowercase)"""
+    if not part_number:
+        return ""
+    return part_number.strip().replace(" ", "").replace("-", "").lower()
+
+
+def fuzzy_match_part_numbers(part1: str, part2: str, threshold: float = 99.0) -> bool:
+    """
+    Check if two part numbers match with fuzzy logic.
+    Uses 99%+ similarity threshold to catch variations.
+    """
+    norm1 = normalize_part_number(part1)
+    norm2 = normalize_part_number(part2)
+    
+    if norm1 == norm2:
+        return True
+    
+    similarity = fuzz.ratio(norm1, norm2)
+    return similarity >= threshold
+
+
+class PartNumberIndex:
+    """
+    Finds the indexed part numbers that fuzzy_match_part_numbers() would match,
+    without scoring every indexed part.
+    
+    Identical normalized part numbers are a dict lookup. fuzz.ratio is
+    100 * (1 - d / (len1 + len2)), where the indel distance d is at least
+    |len1 - len2| and at least 1 for different strings, so only normalized keys
+    whose length satisfies both bounds are scored with rapidfuzz. At the 98-99%
+    thresholds used here that rules out every pair shorter than 50-100 characters.
+    """
+    
+    def __init__(self, threshold: float):
+        self.threshold = threshold
+        self._slack = 1.0 - threshold / 100.0
+        self._exact: Dict[str, List[int]] = {}
+        self._by_length: Dict[int, List[Tuple[int, str]]] = {}
+        self.values: List[Any] = []
+    
+    def add(self, part_number: str, value: Any = None) -> int:
+        """Index a part number (value defaults to the part number). Returns its position."""
+        position = len(self.values)
+        self.values.append(part_number if value is None else value)
+        norm = normalize_part_number(part_number)
+        self._exact.setdefault(norm, []).append(position)
+        self._by_length.setdefault(len(norm), []).append((position, norm))
+        return position
+    
+    def matches(self, part_number: str) -> List[int]:
+        """Positions of all matching part numbers, in the order they were added"""
+        norm = normalize_part_number(part_number)
+        hits = set(self._exact.get(norm, ()))
+        
+        for length, entries in self._by_length.items():
+            max_distance = self._slack * (len(norm) + length) + 1e-9
+            if max_distance < 1 or abs(len(norm) - length) > max_distance:
+                continue
+            for position, other in entries:
+                if other != norm and fuzz.ratio(norm, other) >= self.threshold:
+                    hits.add(position)
+        
+        return sorted(hits)
+    
+    def first_match(self, part_number: str) -> Optional[Any]:
+        """Value of the earliest added matching part number, or None"""
+        hits = self.matches(part_number)
+        return self.values[hits[0]] if hits else None
+
+
+def match_sales_to_parts(
+    descriptions: List[str],
+    part_to_customer_items: Dict[str, List[str]],
+    threshold: float = 90
+) -> Dict[str, List[Tuple[int, str]]]:
+    """
+    Match sale descriptions to parts through their mapped customer items.
+    
+    A description matches a part when fuzz.ratio against any of the part's customer
+    items (lowercased) reaches the threshold; the first such item in the part's list
+    is the matched one. All pairs are scored in one cdist pass over the unique
+    lowercased customer items.
+    
+    Args:
+        descriptions: Unique lowercased sale descriptions
+        part_to_customer_items: part_number -> mapped customer items
+        threshold: Minimum fuzz.ratio score
+    
+    Returns:
+        part_number -> [(description index, matched customer item)] sorted by
+        description index, for parts with at least one match (in input order)
+    """
+    choice_ids: Dict[str, int] = {}
+    slots: Dict[int, List[Tuple[str, int]]] = {}  # choice id -> [(part_number, position in its list)]
+    for part_number, customer_items in part_to_customer_items.items():
+        for position, customer_item in enumerate(customer_items):
+            choice_id = choice_ids.setdefault(customer_item.lower(), len(choice_ids))
+            slots.setdefault(choice_id, []).append((part_number, position))
+    
+    desc_ids, matched_choices = find_matching_pairs(descriptions, list(choice_ids), threshold)
+    
+    first_item: Dict[Tuple[str, int], int] = {}  # (part_number, description index) -> first matching position
+    for desc_id, choice_id in zip(desc_ids.tolist(), matched_choices.tolist()):
+        for part_number, position in slots[choice_id]:
+            key = (part_number, desc_id)
+            if key not in first_item or position < first_item[key]:
+                first_item[key] = position
+    
+    matches: Dict[str, List[Tuple[int, str]]] = {part_number: [] for part_number in part_to_customer_items}
+    for (part_number, desc_id), position in first_item.items():
+        matches[part_number].append((desc_id, part_to_customer_items[part_number][position]))
+    
+    return {part_number: sorted(found) for part_number, found in matches.items() if found}
@@ -0,0 +1,98 @@
+"""
+Shared Gemini client provider.
+Creates one genai.Client per API key for the whole process, with a keep-alive
+HTTP connection pool sized for the extraction worker pool, so requests reuse
+TLS connections instead of building a new client per invoice.
+"""
+import os
+import threading
+import logging
+import zlib
+from itertools import count
+from typing import Dict, Optional, Tuple
+
+import httpx
+from google import genai
+from google.genai import types
+
+from config import get_google_api_keys
+
+logger = logging.getLogger(__name__)
+
+# Keep-alive connections per API key. Matches extraction_engine.EXTRACTION_MAX_IN_FLIGHT
+# by default so every in-flight extraction can hold a warm connection.
+GEMINI_POOL_SIZE = int(os.getenv("GEMINI_POOL_SIZE", "100"))
+GEMINI_KEEPALIVE_EXPIRY = 60.0  # Seconds an idle connection stays open
+
+
+class GeminiClientProvider:
+    """Process-wide pool of Gemini clients, one per API key"""
+
+    def __init__(self, pool_size: int = GEMINI_POOL_SIZE):
+        self.pool_size = pool_size
+        self._clients: Dict[str, genai.Client] = {}
+        self._round_robin = count()
+        self._lock = threading.Lock()
+
+    def _create_client(self, api_key: str) -> genai.Client:
+        limits = httpx.Limits(
+            max_connections=self.pool_size,
+            max_keepalive_connections=self.pool_size,
+            keepalive_expiry=GEMINI_KEEPALIVE_EXPIRY
+        )
+        http_options = types.HttpOptions(
+            client_args={"limits": limits},
+            async_client_args={"limits": limits}
+        )
+        return genai.Client(api_key=api_key, http_options=http_options)
+
+    def get_client(self, shard_key: Optional[str] = None) -> Tuple[Optional[genai.Client], Optional[str]]:
+        """
+        Get a shared client.
+
+        Args:
+            shard_key: Optional stable key (e.g. image hash) so retries of the same
+                       image use the same API key. Round-robin across keys if None.
+
+        Returns:
+            Tuple of (client, api_key), or (None, None) if no API key is configured
+        """
+        api_keys = get_google_api_keys()
+        if not api_keys:
+            return None, None
+
+        if shard_key:
+            index = zlib.crc32(shard_key.encode()) % len(api_keys)
+        else:
+            index = next(self._round_robin) % len(api_keys)
+        api_key = api_keys[index]
+
+        client = self._clients.get(api_key)
+        if client is None:
+            with self._lock:
+                client = self._clients.get(api_key)
+                if client is None:
+                    client = self._create_client(api_key)
+                    self._clients[api_key] = client
+                    logger.info(f"Gemini client initialized (key {index + 1}/{len(api_keys)}, pool size {self.pool_size})")
+        return client, api_key
+
+
+# Global Gemini client provider instance
+_client_provider: Optional[GeminiClientProvider] = None
+_client_provider_lock = threading.Lock()
+
+
+def get_gemini_client(shard_key: Optional[str] = None) -> Tuple[Optional[genai.Client], Optional[str]]:
+    """
+    Get a shared Gemini client and the API key it uses.
+
+    Returns:
+        Tuple of (client, api_key), or (None, None) if no API key is configured
+    """
+    global _client_provider
+    if _client_provider is None:
+        with _client_provider_lock:
+            if _client_provider is None:
+                _client_provider = GeminiClientProvider()
+    return _client_provider.get_client(shard_key)
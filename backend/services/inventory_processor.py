@@ -5,45 +5,144 @@ Uses vendor_gemini prompt for vendor invoice extraction.
 import os
 import json
 import time
+import asyncio
 import logging
-from typing import List, Dict, Any, Optional, Callable
+from typing import List, Dict, Any, Optional, Callable, Tuple
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import threading
 
 from google import genai
 from google.genai import types
-from PIL import Image
-import tempfile
 
 from services.processor import (
     calculate_image_hash,
-    RateLimiter,
     calculate_accuracy,
     calculate_cost_inr
 )
 from services.storage import get_storage_client
+from services.extraction_cache import get_extraction_cache, hash_prompt
+from services.rate_limiter import get_rate_limiter, is_rate_limit_error
+from services.gemini_client import get_gemini_client
+from services.extraction_engine import get_extraction_engine
+from services.model_router import get_model_router, summarize_routing, ROUTE_PRO
 from database import get_database_client
-from config import get_google_api_key
+from database_helpers import get_records_by_image_hashes
+from services.stock_ledger import apply_stock_movements
+from services.stock_scheduler import get_stock_scheduler
+from services.job_queue import JobCancelled
 from config_loader import get_user_config
 from utils.date_helpers import normalize_date, format_to_db, get_ist_now_str
+from utils.image_optimizer import detect_image_mime_type
 
 logger = logging.getLogger(__name__)
 
-# Rate limiter for API calls
-limiter = RateLimiter(rpm=30)
+# Rate limiter for API calls (buckets shared with the sales pipeline)
+limiter = get_rate_limiter()
 
 # Model Configuration
 PRIMARY_MODEL = "gemini-3-flash-preview"
 FALLBACK_MODEL = "gemini-3-pro-preview"
 ACCURACY_THRESHOLD = 50.0  # Switch to Pro if accuracy < 50%
 
+# Columns returned for an existing vendor invoice in duplicate warnings
+INVENTORY_DUPLICATE_FIELDS = [
+    "id", "invoice_number", "invoice_date", "receipt_link",
+    "upload_date", "part_number", "description", "image_hash"
+]
+
+
+async def generate_vendor_data_async(
+    client: genai.Client,
+    api_key: str,
+    model_name: str,
+    vendor_prompt: str,
+    img: types.Part,
+    image_hash: str,
+    prompt_hash: str
+) -> Tuple[Any, int, int]:
+    """
+    Run one vendor extraction call, served from the extraction cache when possible.
+    
+    Returns:
+        Tuple of (parsed JSON response, input_tokens, output_tokens)
+    """
+    engine = get_extraction_engine()
+    cache = get_extraction_cache()
+    if cache:
+        cached = await engine.run_blocking(cache.get, image_hash, prompt_hash, model_name)
+        if cached:
+            return cached["data"], cached["input_tokens"], cached["output_tokens"]
+    
+    config = types.GenerateContentConfig(
+        system_instruction=vendor_prompt,
+        response_mime_type="application/json",
+        temperature=0.1
+    )
+    
+    await limiter.wait_async(model_name, api_key)
+    try:
+        async with engine.gemini_calls:
+            # Timed from when the request goes out, as in the sales pipeline
+            started = time.monotonic()
+            response = await client.aio.models.generate_content(
+                model=model_name,
+                contents=[img, "Extract all vendor invoice data according to the instructions."],
+                config=config
+            )
+    except Exception as e:
+        rate_limited = is_rate_limit_error(e)
+        if rate_limited:
+            limiter.report_rate_limited(model_name, api_key)
+        engine.record_gemini_call(model_name, None, ok=False, rate_limited=rate_limited)
+        raise
+    limiter.report_success(model_name, api_key)
+    engine.record_gemini_call(model_name, time.monotonic() - started)
+    
+    # Parse response
+    json_text = response.text.strip()
+    extracted_data = json.loads(json_text)
+    
+    # Get token usage
+    usage = response.usage_metadata
+    input_tokens = usage.prompt_token_count if usage else 0
+    output_tokens = usage.candidates_token_count if usage else 0
+    
+    if cache:
+        try:
+            await engine.run_blocking(cache.put, image_hash, prompt_hash, model_name, {
+                "data": extracted_data,
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens
+            })
+        except Exception as e:
+            logger.warning(f"Could not write extraction cache: {e}")
+    
+    return extracted_data, input_tokens, output_tokens
+
 
 def process_vendor_invoice(
     image_bytes: bytes,
     filename: str,
     receipt_link: str,
-    username: str
+    username: str,
+    image_hash: Optional[str] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Synchronous entry point for process_vendor_invoice_async.
+    Runs the extraction on the shared extraction engine loop and waits for the result.
+    """
+    return get_extraction_engine().run(
+        process_vendor_invoice_async(image_bytes, filename, receipt_link, username, image_hash)
+    )
+
+
+async def process_vendor_invoice_async(
+    image_bytes: bytes,
+    filename: str,
+    receipt_link: str,
+    username: str,
+    image_hash: Optional[str] = None
 ) -> Optional[Dict[str, Any]]:
     """
     Process a vendor invoice image using Gemini AI with vendor_gemini prompt.
@@ -53,6 +152,7 @@ def process_vendor_invoice(
         filename: Original filename
         receipt_link: R2 presigned URL
         username: Username for config lookup
+        image_hash: SHA-256 hash of image_bytes, if already calculated by the caller
         
     Returns:
         Extracted invoice data dictionary or None
@@ -70,117 +170,142 @@ def process_vendor_invoice(
         logger.error(f"No vendor_gemini prompt found for user: {username}")
         return None
     
-    # Get API key
-    api_key = get_google_api_key()
-    if not api_key:
+    # Extraction cache key parts
+    prompt_hash = hash_prompt(vendor_prompt)
+    if not image_hash:
+        image_hash = calculate_image_hash(image_bytes)
+    
+    # Shared Gemini client (keep-alive connections), sharded by image
+    client, api_key = get_gemini_client(shard_key=image_hash)
+    if not client:
         logger.error("No Google API key configured")
         return None
     
-    # Configure Gemini client
-    client = genai.Client(api_key=api_key)
+    # Image goes to Gemini straight from memory, without a PIL decode/re-encode
+    img = types.Part.from_bytes(data=image_bytes, mime_type=detect_image_mime_type(image_bytes))
     
-    # Convert bytes to PIL Image
-    import io
-    img = Image.open(io.BytesIO(image_bytes))
+    # Pick the starting model from ink statistics and past extraction outcomes
+    engine = get_extraction_engine()
+    router = get_model_router()
     
     try:
-        # Try with Flash model first
-        logger.info(f"Trying {PRIMARY_MODEL} for vendor invoice extraction...")
-        
-        config = types.GenerateContentConfig(
-            system_instruction=vendor_prompt,
-            response_mime_type="application/json",
-            temperature=0.1
-        )
-        
-        response = client.models.generate_content(
-            model=PRIMARY_MODEL,
-            contents=[img, "Extract all vendor invoice data according to the instructions."],
-            config=config
-        )
-        
-        # Parse response
-        json_text = response.text.strip()
-        extracted_data = json.loads(json_text)
-        
-        # Handle case where Gemini returns just the items array instead of full structure
-        if isinstance(extracted_data, list):
-            extracted_data = {
-                "invoice_type": "Printed",
-                "invoice_date": "",
-                "invoice_number": "",
-                "items": extracted_data
-            }
-        
-        # Calculate accuracy
-        items = extracted_data.get("items", [])
-        accuracy = calculate_accuracy(items)
-        
-        # QUALITY CHECK: Penalize if critical fields are missing
-        # This handles cases where Flash returns a valid JSON but with empty fields/template
-        header = extracted_data.get("header", {}) if isinstance(extracted_data.get("header"), dict) else {}
-        vendor_name = extracted_data.get("vendor_name", "") or header.get("vendor_name", "")
-        # Note: invoice_number might be missing on some valid bills, but vendor_name is critical for stock
-        
-        if not vendor_name or not str(vendor_name).strip():
-            logger.warning("Quality Check Failed: Missing Vendor Name. Forcing fallback to Pro model.")
-            accuracy = 0.0
-            
-        # Also check if we have items but they are empty "N/A" placeholders
-        if items:
-            valid_items = 0
-            for item in items:
-                desc = str(item.get("description", "")).strip()
-                part = str(item.get("part_number", "")).strip()
-                if desc and desc.lower() != "n/a" or part and part.lower() != "n/a":
-                    valid_items += 1
-            
-            if valid_items == 0:
-                logger.warning("Quality Check Failed: Items found but all appear empty/N/A. Forcing fallback.")
-                accuracy = 0.0
-        
-        # Get token usage
-        usage = response.usage_metadata
-        input_tokens = usage.prompt_token_count if usage else 0
-        output_tokens = usage.candidates_token_count if usage else 0
-        total_tokens = input_tokens + output_tokens
-        
-        # Calculate cost
-        cost_inr = calculate_cost_inr(input_tokens, output_tokens, "Flash")
-        
-        model_used = "Flash"
-        
-        # Fallback to Pro if accuracy is low
-        if accuracy < ACCURACY_THRESHOLD:
-            logger.warning(f"Flash accuracy ({accuracy}%) < {ACCURACY_THRESHOLD}%, falling back to Pro model...")
-            
-            config_pro = types.GenerateContentConfig(
-                system_instruction=vendor_prompt,
-                response_mime_type="application/json",
-                temperature=0.1
-            )
-            
-            response_pro = client.models.generate_content(
-                model=FALLBACK_MODEL,
-                contents=[img, "Extract all vendor invoice data according to the instructions."],
-                config=config_pro
-            )
+        routing = await engine.run_blocking(router.route, "vendor", username, image_bytes) if router else None
+        flash_failed = None
+        pro_first = bool(routing and routing["route"] == ROUTE_PRO)
+        pro_first_failed = False
+        
+        if pro_first:
+            # Bills where Flash usually fails (e.g. handwritten) skip the Flash call
+            logger.info(f"Routing {filename} straight to {FALLBACK_MODEL} "
+                        f"(Flash failure rate {routing['flash_failure_rate']:.0%} by {routing['basis']})")
             
-            json_text = response_pro.text.strip()
-            extracted_data = json.loads(json_text)
+            try:
+                extracted_data, input_tokens, output_tokens = await generate_vendor_data_async(
+                    client, api_key, FALLBACK_MODEL, vendor_prompt, img, image_hash, prompt_hash
+                )
+            except Exception as e:
+                # As in the sales pipeline, a failed Pro-first call falls back to Flash once
+                logger.warning(f"⚠️ Pro-first extraction failed for {filename} ({e}), trying {PRIMARY_MODEL}")
+                pro_first_failed = True
+        
+        if pro_first and not pro_first_failed:
+            if isinstance(extracted_data, list):
+                extracted_data = {
+                    "invoice_type": "Printed",
+                    "invoice_date": "",
+                    "invoice_number": "",
+                    "items": extracted_data
+                }
             
-            # Recalculate with Pro model
             items = extracted_data.get("items", [])
             accuracy = calculate_accuracy(items)
             
-            usage_pro = response_pro.usage_metadata
-            input_tokens = usage_pro.prompt_token_count if usage_pro else 0
-            output_tokens = usage_pro.candidates_token_count if usage_pro else 0
             total_tokens = input_tokens + output_tokens
             cost_inr = calculate_cost_inr(input_tokens, output_tokens, "Pro")
             
             model_used = "Pro"
             logger.info(f"Pro model accuracy: {accuracy}%")
+        else:
+            # Try with Flash model first
+            logger.info(f"Trying {PRIMARY_MODEL} for vendor invoice extraction...")
+            
+            extracted_data, input_tokens, output_tokens = await generate_vendor_data_async(
+                client, api_key, PRIMARY_MODEL, vendor_prompt, img, image_hash, prompt_hash
+            )
+            
+            # Handle case where Gemini returns just the items array instead of full structure
+            if isinstance(extracted_data, list):
+                extracted_data = {
+                    "invoice_type": "Printed",
+                    "invoice_date": "",
+                    "invoice_number": "",
+                    "items": extracted_data
+                }
+            
+            # Calculate accuracy
+            items = extracted_data.get("items", [])
+            accuracy = calculate_accuracy(items)
+            
+            # QUALITY CHECK: Penalize if critical fields are missing
+            # This handles cases where Flash returns a valid JSON but with empty fields/template
+            header = extracted_data.get("header", {}) if isinstance(extracted_data.get("header"), dict) else {}
+            vendor_name = extracted_data.get("vendor_name", "") or header.get("vendor_name", "")
+            # Note: invoice_number might be missing on some valid bills, but vendor_name is critical for stock
+            
+            if not vendor_name or not str(vendor_name).strip():
+                logger.warning("Quality Check Failed: Missing Vendor Name. Forcing fallback to Pro model.")
+                accuracy = 0.0
+                
+            # Also check if we have items but they are empty "N/A" placeholders
+            if items:
+                valid_items = 0
+                for item in items:
+                    desc = str(item.get("description", "")).strip()
+                    part = str(item.get("part_number", "")).strip()
+                    if desc and desc.lower() != "n/a" or part and part.lower() != "n/a":
+                        valid_items += 1
+                
+                if valid_items == 0:
+                    logger.warning("Quality Check Failed: Items found but all appear empty/N/A. Forcing fallback.")
+                    accuracy = 0.0
+            
+            # Token usage
+            total_tokens = input_tokens + output_tokens
+            
+            # Calculate cost
+            cost_inr = calculate_cost_inr(input_tokens, output_tokens, "Flash")
+            
+            model_used = "Flash"
+            
+            # Fallback to Pro if accuracy is low (never twice: a Pro-first failure keeps the Flash result)
+            flash_failed = accuracy < ACCURACY_THRESHOLD
+            if flash_failed and pro_first_failed:
+                logger.warning(f"Flash accuracy ({accuracy}%) < {ACCURACY_THRESHOLD}%, but {FALLBACK_MODEL} "
+                               f"already failed on this invoice; keeping the Flash result")
+            elif flash_failed:
+                logger.warning(f"Flash accuracy ({accuracy}%) < {ACCURACY_THRESHOLD}%, falling back to Pro model...")
+                
+                extracted_data, input_tokens, output_tokens = await generate_vendor_data_async(
+                    client, api_key, FALLBACK_MODEL, vendor_prompt, img, image_hash, prompt_hash
+                )
+                
+                # Recalculate with Pro model
+                items = extracted_data.get("items", [])
+                accuracy = calculate_accuracy(items)
+                
+                total_tokens = input_tokens + output_tokens
+                cost_inr = calculate_cost_inr(input_tokens, output_tokens, "Pro")
+                
+                model_used = "Pro"
+                logger.info(f"Pro model accuracy: {accuracy}%")
+        
+        # Feed the outcome back to the router
+        if routing:
+            await engine.run_blocking(
+                router.record_outcome, routing, username,
+                flash_failed=flash_failed,
+                handwritten=str(extracted_data.get("invoice_type", "")).lower() == "handwritten"
+            )
         
         # Transform to match expected format
         result = {
@@ -199,7 +324,8 @@ def process_vendor_invoice(
             "input_tokens": input_tokens,
             "output_tokens": output_tokens,
             "total_tokens": total_tokens,
-            "cost_inr": cost_inr
+            "cost_inr": cost_inr,
+            "routing": routing
         }
         
         logger.info(f"✓ Vendor invoice processed: {filename} (Model: {model_used}, Accuracy: {accuracy}%)")
@@ -373,17 +499,22 @@ def convert_to_inventory_rows(
     return rows
 
 
-def save_to_inventory_table(rows: List[Dict[str, Any]], username: str):
+def save_to_inventory_table(rows: List[Dict[str, Any]], username: str, update_stock: bool = True) -> List[Dict[str, Any]]:
     """
-    Save inventory rows to Supabase inventory_items table.
+    Save inventory rows to Supabase inventory_items table and add them to stock levels.
     
     Args:
         rows: List of inventory item dictionaries
         username: Username for RLS
+        update_stock: Add the saved rows to stock levels now; batches pass False and
+                      apply all their rows at once
+    
+    Returns:
+        The saved rows as returned by the database
     """
     if not rows:
         logger.warning("No rows to save to inventory_items")
-        return
+        return []
     
     try:
         db = get_database_client()
@@ -396,31 +527,87 @@ def save_to_inventory_table(rows: List[Dict[str, Any]], username: str):
     except Exception as e:
         logger.error(f"Error saving to inventory_items: {e}")
         raise
+    
+    # Add the new items to stock (the upload itself has succeeded either way)
+    if update_stock:
+        try:
+            apply_stock_movements(username, vendor_added=response.data or [])
+        except Exception as e:
+            logger.error(f"Error updating stock levels for new inventory items: {e}")
+    
+    return response.data or []
 
 
 def process_single_inventory_item(
     file_key: str,
     r2_bucket: str,
     username: str,
-    force_upload: bool
+    force_upload: bool,
+    duplicates_checked: bool = False
+) -> Dict[str, Any]:
+    """
+    Synchronous entry point for process_single_inventory_item_async.
+    Returns a result dictionary.
+    """
+    return get_extraction_engine().run(
+        process_single_inventory_item_async(file_key, r2_bucket, username, force_upload, duplicates_checked)
+    )
+
+
+def delete_inventory_items_by_hash(image_hash: str, username: str, update_stock: bool = True) -> List[Dict[str, Any]]:
+    """
+    Delete all inventory rows created from an image, before it is re-uploaded.
+    Returns the deleted rows; with update_stock=False they are not removed from stock levels.
+    """
+    db = get_database_client()
+    response = db.client.table("inventory_items")\
+        .delete()\
+        .eq("image_hash", image_hash)\
+        .eq("username", username)\
+        .execute()
+    
+    if update_stock:
+        try:
+            apply_stock_movements(username, vendor_removed=response.data or [])
+        except Exception as e:
+            logger.error(f"Error updating stock levels for replaced inventory items: {e}")
+    
+    return response.data or []
+
+
+async def process_single_inventory_item_async(
+    file_key: str,
+    r2_bucket: str,
+    username: str,
+    force_upload: bool,
+    duplicates_checked: bool = False,
+    stock_movements: Optional[Dict[str, List[Dict[str, Any]]]] = None
 ) -> Dict[str, Any]:
     """
     Process a single inventory item (helper for parallel processing).
     Returns a result dictionary.
+    
+    duplicates_checked: True when the caller already resolved this file's hash
+    with check_inventory_duplicates_bulk, so the per-file lookup is skipped.
+    stock_movements: When given, the rows saved and replaced are appended to its
+    "vendor_added" / "vendor_removed" lists for the caller to apply to stock levels
+    once, instead of being applied here.
     """
+    defer_stock = stock_movements is not None
     storage = get_storage_client()
-    db = get_database_client()
+    engine = get_extraction_engine()
     
     result = {
         "success": False,
         "file_key": file_key,
         "error": None,
-        "duplicate": None
+        "duplicate": None,
+        "routing": None
     }
     
     try:
         # Download image from R2
-        image_bytes = storage.download_file(r2_bucket, file_key)
+        image_bytes = await engine.run_blocking(storage.download_file, r2_bucket, file_key)
         if not image_bytes:
             raise Exception(f"Failed to download file from R2: {file_key}")
         
@@ -431,47 +618,18 @@ def process_single_inventory_item(
         # If force_upload is True, we skip the check and DELETE existing duplicates
         if force_upload:
             logger.info(f"Force upload enabled. Deleting existing items with hash {img_hash} for replacement.")
-            db.client.table("inventory_items")\
-                .delete()\
-                .eq("image_hash", img_hash)\
-                .eq("username", username)\
-                .execute()
-        else:
+            removed = await engine.run_blocking(delete_inventory_items_by_hash, img_hash, username, not defer_stock)
+            if defer_stock:
+                stock_movements["vendor_removed"].extend(removed)
+        elif not duplicates_checked:
             # Normal flow: Check for duplicates and report them
-            duplicate_check = db.client.table("inventory_items")\
-                .select("*")\
-                .eq("image_hash", img_hash)\
-                .eq("username", username)\
-                .limit(1)\
-                .execute()
-            
-            if duplicate_check.data and len(duplicate_check.data) > 0:
+            existing = await engine.run_blocking(check_inventory_duplicates_bulk, [img_hash], username)
+            existing_record = existing.get(img_hash)
+            
+            if existing_record:
                 # Duplicate found!
-                existing_record = duplicate_check.data[0]
                 logger.warning(f"Duplicate detected for {file_key}: image_hash={img_hash}")
-                
-                # Format upload date for message
-                upload_date = existing_record.get("upload_date")
-                if upload_date:
-                    date_msg = f"already uploaded on {upload_date}"
-                else:
-                    date_msg = "already uploaded previously"
-                
-                # Return duplicate info
-                result["duplicate"] = {
-                    "file_key": file_key,
-                    "image_hash": img_hash,
-                    "existing_record": {
-                        "id": existing_record.get("id"),
-                        "invoice_number": existing_record.get("invoice_number"),
-                        "invoice_date": existing_record.get("invoice_date"),
-                        "receipt_link": existing_record.get("receipt_link"),
-                        "upload_date": existing_record.get("upload_date"),
-                        "part_number": existing_record.get("part_number"),
-                        "description": existing_record.get("description")
-                    },
-                    "message": f"This vendor invoice was {date_msg}"
-                }
+                result["duplicate"] = format_inventory_duplicate(file_key, img_hash, existing_record)
                 result["success"] = True # handled as success but with duplicate info
                 return result
         
@@ -482,24 +640,28 @@ def process_single_inventory_item(
             receipt_link = f"r2://{r2_bucket}/{file_key}"
         
         # Process with Gemini AI using VENDOR prompt
-        invoice_data = process_vendor_invoice(
+        invoice_data = await process_vendor_invoice_async(
             image_bytes=image_bytes,
             filename=file_key.split('/')[-1],
             receipt_link=receipt_link,
-            username=username
+            username=username,
+            image_hash=img_hash
         )
         
         if not invoice_data:
             raise Exception("Gemini processing returned no data")
+        result["routing"] = invoice_data.get("routing")
         
         # Convert to inventory rows
-        inventory_rows = convert_to_inventory_rows(invoice_data, username, img_hash)
+        inventory_rows = await engine.run_blocking(convert_to_inventory_rows, invoice_data, username, img_hash)
         
         if not inventory_rows:
             raise Exception("No inventory rows generated from extracted data")
         
         # Save to inventory_items table
-        save_to_inventory_table(inventory_rows, username)
+        saved = await engine.run_blocking(save_to_inventory_table, inventory_rows, username, not defer_stock)
+        if defer_stock:
+            stock_movements["vendor_added"].extend(saved)
         
         result["success"] = True
         logger.info(f"✓ Successfully processed inventory item: {file_key}")
@@ -513,6 +675,52 @@ def process_single_inventory_item(
 
 
 
+def check_inventory_duplicates_bulk(image_hashes: List[str], username: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Resolve many image hashes against inventory_items in one query per chunk.
+    
+    Returns:
+        Dictionary of image_hash -> existing inventory record, for duplicates only
+    """
+    return get_records_by_image_hashes("inventory_items", username, image_hashes, INVENTORY_DUPLICATE_FIELDS)
+
+
+def format_inventory_duplicate(file_key: str, img_hash: str, existing_record: Dict[str, Any]) -> Dict[str, Any]:
+    """Build the duplicate info returned to the frontend for a vendor invoice."""
+    # Format upload date for message
+    upload_date = existing_record.get("upload_date")
+    date_msg = f"already uploaded on {upload_date}" if upload_date else "already uploaded previously"
+    
+    return {
+        "file_key": file_key,
+        "image_hash": img_hash,
+        "existing_record": {
+            "id": existing_record.get("id"),
+            "invoice_number": existing_record.get("invoice_number"),
+            "invoice_date": existing_record.get("invoice_date"),
+            "receipt_link": existing_record.get("receipt_link"),
+            "upload_date": existing_record.get("upload_date"),
+            "part_number": existing_record.get("part_number"),
+            "description": existing_record.get("description")
+        },
+        "message": f"This vendor invoice was {date_msg}"
+    }
+
+
+def download_and_hash_inventory_item(file_key: str, r2_bucket: str) -> Optional[str]:
+    """Download an inventory image from R2 and return its hash, or None if the download failed."""
+    storage = get_storage_client()
+    
+    try:
+        image_bytes = storage.download_file(r2_bucket, file_key)
+        if not image_bytes:
+            return None
+        return calculate_image_hash(image_bytes)
+    except Exception as e:
+        logger.error(f"Error hashing {file_key}: {e}")
+        return None
+
+
 def check_inventory_item_duplicate(
     file_key: str,
     r2_bucket: str,
@@ -522,48 +730,15 @@ def check_inventory_item_duplicate(
     Check if an inventory item is a duplicate without processing it.
     Downloads file, calculates hash, and checks DB.
     """
-    storage = get_storage_client()
-    db = get_database_client()
-    
     try:
-        # Download image from R2
-        image_bytes = storage.download_file(r2_bucket, file_key)
-        if not image_bytes:
+        img_hash = download_and_hash_inventory_item(file_key, r2_bucket)
+        if not img_hash:
             return None
         
-        # Calculate image hash
-        img_hash = calculate_image_hash(image_bytes)
-        
-        # Check for duplicates
-        duplicate_check = db.client.table("inventory_items")\
-            .select("*")\
-            .eq("image_hash", img_hash)\
-            .eq("username", username)\
-            .limit(1)\
-            .execute()
-        
-        if duplicate_check.data and len(duplicate_check.data) > 0:
-            existing_record = duplicate_check.data[0]
+        existing_record = check_inventory_duplicates_bulk([img_hash], username).get(img_hash)
+        if existing_record:
             logger.warning(f"Duplicate detected for {file_key}: image_hash={img_hash}")
-            
-            # Format upload date
-            upload_date = existing_record.get("upload_date")
-            date_msg = f"already uploaded on {upload_date}" if upload_date else "already uploaded previously"
-            
-            return {
-                "file_key": file_key,
-                "image_hash": img_hash,
-                "existing_record": {
-                    "id": existing_record.get("id"),
-                    "invoice_number": existing_record.get("invoice_number"),
-                    "invoice_date": existing_record.get("invoice_date"),
-                    "receipt_link": existing_record.get("receipt_link"),
-                    "upload_date": existing_record.get("upload_date"),
-                    "part_number": existing_record.get("part_number"),
-                    "description": existing_record.get("description")
-                },
-                "message": f"This vendor invoice was {date_msg}"
-            }
+            return format_inventory_duplicate(file_key, img_hash, existing_record)
             
     except Exception as e:
         logger.error(f"Error checking duplicate for {file_key}: {e}")
@@ -576,7 +751,10 @@ def process_inventory_batch(
     r2_bucket: str,
     username: str,
     progress_callback: Optional[Callable] = None,
-    force_upload: bool = False
+    force_upload: bool = False,
+    completed_files: Optional[Dict[str, Dict[str, Any]]] = None,
+    on_file_complete: Optional[Callable[[str, Dict[str, Any]], None]] = None,
+    cancelled: Optional[threading.Event] = None
 ) -> Dict[str, Any]:
     """
     Process a batch of inventory images with Gemini AI using parallel execution.
@@ -587,49 +765,71 @@ def process_inventory_batch(
         username: Username for config and RLS
         progress_callback: Optional callback for progress updates
         force_upload: If True, overwrite duplicates
+        completed_files: Results per file key already saved by an interrupted run of
+                         this batch; those files are skipped
+        on_file_complete: Optional callback function(file_key, result) after each file
+                          is saved, used to checkpoint the batch
+        cancelled: Set when the batch must stop (its job lost its lease): files not
+                   started yet are skipped
         
     Returns:
         Dictionary with processing results
+    
+    Raises:
+        JobCancelled: If cancelled was set during the batch
     """
-    logger.info(f"Starting inventory batch processing: {len(file_keys)} files with 25 workers")
+    engine = get_extraction_engine()
+    
+    # Resume: files saved before an interruption are not scanned or processed again
+    total_files = len(file_keys)
+    if completed_files:
+        file_keys = [key for key in file_keys if key not in completed_files]
+        logger.info(f"Resuming inventory batch: {total_files - len(file_keys)}/{total_files} files already saved")
     
-    processed = 0
+    logger.info(f"Starting inventory batch processing: {len(file_keys)} files "
+                f"(max {engine.max_in_flight} in flight)")
+    
+    processed = total_files - len(file_keys)
     failed = 0
     errors = []
     duplicates = []  # Track duplicates for user decision
     
-    # Use ThreadPoolExecutor for parallel processing
+    # Threads for the duplicate pre-scan downloads
     max_workers = 25
     
     # PHASE 1: PRE-SCAN FOR DUPLICATES (If not forcing upload)
     # This allows us to return early if duplicates are found, improving UX
+    # Files whose hash the pre-scan resolved (none when forcing upload)
+    image_hashes: Dict[str, str] = {}
     if not force_upload:
         logger.info("Phase 2a: Pre-scanning for duplicates...")
         with ThreadPoolExecutor(max_workers=max_workers) as executor:
             future_to_file = {
                 executor.submit(
-                    check_inventory_item_duplicate,
+                    download_and_hash_inventory_item,
                     file_key,
-                    r2_bucket,
-                    username
+                    r2_bucket
                 ): file_key for file_key in file_keys
             }
             
-            scan_count = 0
             for future in as_completed(future_to_file):
-                scan_count += 1
                 try:
-                    result = future.result()
-                    if result:
-                        duplicates.append(result)
+                    img_hash = future.result()
+                    if img_hash:
+                        image_hashes[future_to_file[future]] = img_hash
                 except Exception as e:
                     logger.error(f"Error during duplicate scan: {e}")
-                
-                # We don't update progress callback here strictly, or we could update as "Scanning..."
-                if progress_callback:
-                    # Fake progress for scanning phase (0-10%)
-                    # Or just keep it at 0
-                    pass
+        
+        if cancelled is not None and cancelled.is_set():
+            raise JobCancelled(f"Inventory batch for {username} cancelled during the duplicate scan")
+        
+        # Resolve all hashes with one query per chunk instead of one per file
+        existing = check_inventory_duplicates_bulk(list(image_hashes.values()), username)
+        for file_key in file_keys:
+            img_hash = image_hashes.get(file_key)
+            if img_hash and img_hash in existing:
+                logger.warning(f"Duplicate detected for {file_key}: image_hash={img_hash}")
+                duplicates.append(format_inventory_duplicate(file_key, img_hash, existing[img_hash]))
             
         if duplicates:
             logger.info(f"Duplicate scan found {len(duplicates)} duplicates. Stopping batch to request user action.")
@@ -645,59 +845,90 @@ def process_inventory_batch(
     # PHASE 2: PROCESSING (If no duplicates or forced)
     logger.info("Phase 2b: AI Processing...")
     
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        # Submit all tasks
-        future_to_file = {
-            executor.submit(
-                process_single_inventory_item, 
-                file_key, 
-                r2_bucket, 
-                username, 
-                force_upload
-            ): file_key for file_key in file_keys
-        }
-        
+    # Saved rows reach stock levels in one ledger update for the whole batch
+    stock_movements: Dict[str, List[Dict[str, Any]]] = {"vendor_added": [], "vendor_removed": []}
+    
+    async def run_item(file_key: str) -> Tuple[str, Dict[str, Any]]:
+        async with engine.slot(username):
+            if cancelled is not None and cancelled.is_set():
+                return file_key, {"cancelled": True}
+            result = await process_single_inventory_item_async(
+                file_key,
+                r2_bucket,
+                username,
+                force_upload,
+                file_key in image_hashes,  # pre-scan above already resolved this file's duplicates
+                stock_movements
+            )
+        return file_key, result
+    
+    routing_decisions = []
+    
+    async def run_all():
+        nonlocal processed, failed
         completed_count = 0
         
         # Process results as they complete
-        for future in as_completed(future_to_file):
+        for next_done in asyncio.as_completed([run_item(file_key) for file_key in file_keys]):
             completed_count += 1
-            file_key = future_to_file[future]
             
             try:
-                result = future.result()
-                
-                # Handle duplicated (Shouldn't happen if pre-scan worked, but safe to keep)
-                if result.get("duplicate"):
-                    duplicates.append(result["duplicate"])
-                    logger.info(f"Skipping {file_key} - duplicate detected")
-                
-                # Handle success (processed or duplicate handled)
-                elif result.get("success"):
-                    processed += 1
-                
-                # Handle error
-                else:
-                    failed += 1
-                    if result.get("error"):
-                        errors.append(result["error"])
-                
-                # Update progress
-                if progress_callback:
-                    # We call callback safe from main thread
-                    progress_callback(completed_count, len(file_keys), file_key)
-                    
+                file_key, result = await next_done
             except Exception as exc:
-                logger.error(f"Generated an exception for {file_key}: {exc}")
+                logger.error(f"Generated an exception while processing inventory item: {exc}")
                 failed += 1
-                errors.append(f"System error processing {file_key}: {str(exc)}")
+                errors.append(f"System error processing inventory item: {str(exc)}")
+                continue
+            
+            if result.get("cancelled"):
+                continue
+            
+            routing_decisions.append(result.get("routing"))
+            
+            # Handle duplicated (Shouldn't happen if pre-scan worked, but safe to keep)
+            if result.get("duplicate"):
+                duplicates.append(result["duplicate"])
+                logger.info(f"Skipping {file_key} - duplicate detected")
+            
+            # Handle success (processed or duplicate handled)
+            elif result.get("success"):
+                processed += 1
+                if on_file_complete:
+                    await engine.run_blocking(on_file_complete, file_key, result)
+            
+            # Handle error
+            else:
+                failed += 1
+                if result.get("error"):
+                    errors.append(result["error"])
+            
+            # Update progress
+            if progress_callback:
+                progress_callback(completed_count, len(file_keys), file_key)
+    
+    try:
+        engine.run(run_all())
+        # Another worker owns the batch now and resumes it from the checkpoints
+        if cancelled is not None and cancelled.is_set():
+            raise JobCancelled(f"Inventory batch for {username} cancelled after {processed} files")
+    finally:
+        try:
+            apply_stock_movements(username, **stock_movements)
+            if completed_files:
+                # Rows saved before the interruption may not have reached stock levels
+                get_stock_scheduler().request(username, reason="inventory resume")
+        except Exception as e:
+            logger.error(f"Error updating stock levels for inventory batch: {e}")
     
     results = {
         "processed": processed,
         "failed": failed,
         "errors": errors,
-        "duplicates": duplicates
+        "duplicates": duplicates,
+        # Starting-model routing for this batch (Gemini calls and time saved by Pro-first images)
+        "routing": summarize_routing(routing_decisions)
     }
+    logger.info(f"Model routing: {results['routing']}")
     
     logger.info(f"Inventory batch processing complete: {processed} succeeded, {failed} failed, {len(duplicates)} duplicates")
     
@@ -0,0 +1,546 @@
+"""
+Durable job queue for background upload/processing batches.
+Jobs, their user-visible status and per-file checkpoints live in a JobStore
+(SQLite by default), so task status survives restarts and is visible from every
+worker process. Workers lease jobs; a job whose lease expires (worker crashed or
+was restarted) is picked up again and resumes from its checkpoints.
+"""
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+import logging
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from pathlib import Path
+from typing import Callable, Dict, Any, List, Optional
+
+from services.progress_bus import get_progress_bus
+
+logger = logging.getLogger(__name__)
+
+# Queue configuration
+JOB_STORE_BACKEND = os.getenv("JOB_STORE_BACKEND", "sqlite")
+JOB_QUEUE_PATH = os.getenv(
+    "JOB_QUEUE_PATH",
+    str(Path(__file__).parent.parent / "cache" / "job_queue.sqlite3")
+)
+JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", "10"))  # Batches run at once per process
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "60"))
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))  # Leases before a job is given up as failed
+JOB_POLL_INTERVAL = 1.0  # Seconds between queue polls when idle
+JOB_PROGRESS_FLUSH_INTERVAL = 0.5  # Minimum seconds between progress writes for one job
+
+# Queue states (the user-visible status lives in the job's state dict)
+QUEUE_QUEUED = "queued"
+QUEUE_RUNNING = "running"
+QUEUE_FINISHED = "finished"
+
+
+class JobStore(ABC):
+    """
+    Storage interface for the job queue.
+    Implementations must make lease_next() atomic across processes, and call
+    _notify() with the new state after every state write.
+    """
+
+    def __init__(self):
+        self._listeners: List[Callable[[str, Dict[str, Any]], None]] = []
+
+    def add_listener(self, listener: Callable[[str, Dict[str, Any]], None]):
+        """Call listener(job_id, state) after every state write made through this store"""
+        self._listeners.append(listener)
+
+    def _notify(self, job_id: str, state: Dict[str, Any]):
+        for listener in self._listeners:
+            try:
+                listener(job_id, state)
+            except Exception as e:
+                logger.error(f"Job state listener failed for {job_id}: {e}")
+
+    @abstractmethod
+    def create_job(self, job_id: str, kind: str, username: str, payload: Dict[str, Any], state: Dict[str, Any]):
+        ...
+
+    @abstractmethod
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abstractmethod
+    def update_state(self, job_id: str, updates: Dict[str, Any], progress: Optional[Dict[str, Any]] = None):
+        """Shallow-merge updates into the job state, and progress into state['progress']"""
+
+    @abstractmethod
+    def lease_next(self, worker_id: str, kinds: List[str], lease_seconds: int) -> Optional[Dict[str, Any]]:
+        """
+        Claim a queued job (or one whose lease expired) and count the attempt.
+        Jobs of users with the fewest running jobs go first, oldest first within that.
+        """
+
+    @abstractmethod
+    def renew_lease(self, job_id: str, worker_id: str, lease_seconds: int) -> bool:
+        ...
+
+    @abstractmethod
+    def finish_job(self, job_id: str, worker_id: str):
+        ...
+
+    @abstractmethod
+    def save_checkpoint(self, job_id: str, stage: str, item_key: str, result: Any):
+        ...
+
+    @abstractmethod
+    def get_checkpoints(self, job_id: str, stage: str) -> Dict[str, Any]:
+        ...
+
+    @abstractmethod
+    def queue_stats(self, username: str) -> Dict[str, Any]:
+        """Count a user's queued and running jobs and the age of the oldest queued one"""
+
+
+class SQLiteJobStore(JobStore):
+    """
+    JobStore backed by a local SQLite file in WAL mode.
+    Safe for several worker processes on the same host.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._lock = threading.Lock()
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                job_id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                username TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                state TEXT NOT NULL,
+                queue_state TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                lease_owner TEXT,
+                lease_expires REAL,
+                created_at REAL NOT NULL,
+                updated_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_queue ON jobs (queue_state, created_at)")
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS job_checkpoints (
+                job_id TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                item_key TEXT NOT NULL,
+                result TEXT,
+                created_at REAL NOT NULL,
+                PRIMARY KEY (job_id, stage, item_key)
+            )
+            """
+        )
+        logger.info(f"Job store initialized at {path}")
+
+    def _row_to_job(self, row) -> Dict[str, Any]:
+        job_id, kind, username, payload, state, queue_state, attempts, lease_owner, lease_expires, created_at, updated_at = row
+        return {
+            "job_id": job_id,
+            "kind": kind,
+            "username": username,
+            "payload": json.loads(payload),
+            "state": json.loads(state),
+            "queue_state": queue_state,
+            "attempts": attempts,
+            "lease_owner": lease_owner,
+            "lease_expires": lease_expires,
+            "created_at": created_at,
+            "updated_at": updated_at
+        }
+
+    def create_job(self, job_id: str, kind: str, username: str, payload: Dict[str, Any], state: Dict[str, Any]):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO jobs (job_id, kind, username, payload, state, queue_state, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, kind, username, json.dumps(payload), json.dumps(state, default=str), QUEUE_QUEUED, now, now)
+            )
+        self._notify(job_id, state)
+
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return self._row_to_job(row) if row else None
+
+    def update_state(self, job_id: str, updates: Dict[str, Any], progress: Optional[Dict[str, Any]] = None):
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._conn.execute("SELECT state FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+                if row is None:
+                    self._conn.execute("ROLLBACK")
+                    return
+                state = json.loads(row[0])
+                state.update(updates)
+                if progress:
+                    state.setdefault("progress", {}).update(progress)
+                self._conn.execute(
+                    "UPDATE jobs SET state = ?, updated_at = ? WHERE job_id = ?",
+                    (json.dumps(state, default=str), time.time(), job_id)
+                )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        self._notify(job_id, state)
+
+    def lease_next(self, worker_id: str, kinds: List[str], lease_seconds: int) -> Optional[Dict[str, Any]]:
+        if not kinds:
+            return None
+        now = time.time()
+        placeholders = ",".join("?" for _ in kinds)
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                # A user with several batches queued must not take every worker slot
+                row = self._conn.execute(
+                    f"SELECT job_id FROM jobs AS j WHERE kind IN ({placeholders}) AND "
+                    f"(queue_state = ? OR (queue_state = ? AND lease_expires < ?)) "
+                    f"ORDER BY (SELECT COUNT(*) FROM jobs AS r WHERE r.username = j.username "
+                    f"AND r.queue_state = ? AND r.lease_expires >= ?), created_at LIMIT 1",
+                    (*kinds, QUEUE_QUEUED, QUEUE_RUNNING, now, QUEUE_RUNNING, now)
+                ).fetchone()
+                if row is None:
+                    self._conn.execute("COMMIT")
+                    return None
+                self._conn.execute(
+                    "UPDATE jobs SET queue_state = ?, lease_owner = ?, lease_expires = ?, "
+                    "attempts = attempts + 1, updated_at = ? WHERE job_id = ?",
+                    (QUEUE_RUNNING, worker_id, now + lease_seconds, now, row[0])
+                )
+                job_row = self._conn.execute("SELECT * FROM jobs WHERE job_id = ?", (row[0],)).fetchone()
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return self._row_to_job(job_row)
+
+    def renew_lease(self, job_id: str, worker_id: str, lease_seconds: int) -> bool:
+        with self._lock:
+            cursor = self._conn.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE job_id = ? AND lease_owner = ? AND queue_state = ?",
+                (time.time() + lease_seconds, job_id, worker_id, QUEUE_RUNNING)
+            )
+            return cursor.rowcount == 1
+
+    def finish_job(self, job_id: str, worker_id: str):
+        with self._lock:
+            self._conn.execute(
+                "UPDATE jobs SET queue_state = ?, lease_expires = NULL, updated_at = ? "
+                "WHERE job_id = ? AND lease_owner = ?",
+                (QUEUE_FINISHED, time.time(), job_id, worker_id)
+            )
+
+    def save_checkpoint(self, job_id: str, stage: str, item_key: str, result: Any):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO job_checkpoints (job_id, stage, item_key, result, created_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (job_id, stage, item_key, json.dumps(result, default=str), time.time())
+            )
+
+    def get_checkpoints(self, job_id: str, stage: str) -> Dict[str, Any]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT item_key, result FROM job_checkpoints WHERE job_id = ? AND stage = ? ORDER BY created_at",
+                (job_id, stage)
+            ).fetchall()
+        return {item_key: json.loads(result) for item_key, result in rows}
+
+    def queue_stats(self, username: str) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            queued, oldest = self._conn.execute(
+                "SELECT COUNT(*), MIN(created_at) FROM jobs WHERE username = ? AND queue_state = ?",
+                (username, QUEUE_QUEUED)
+            ).fetchone()
+            running = self._conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE username = ? AND queue_state = ? AND lease_expires >= ?",
+                (username, QUEUE_RUNNING, now)
+            ).fetchone()[0]
+        return {
+            "queued": queued,
+            "running": running,
+            "oldest_queued_seconds": round(now - oldest, 1) if oldest else 0.0
+        }
+
+
+# Writes progress recorded by JobProgress.update(), off the caller's thread
+_progress_writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="job-progress")
+
+
+class JobProgress:
+    """
+    Throttled writer for a job's progress.
+    Progress callbacks fire per file; this coalesces them into at most one store
+    write per JOB_PROGRESS_FLUSH_INTERVAL. update() never touches the store itself:
+    callbacks run on the extraction engine loop, where a locked store would stall
+    every user's extractions, so due writes go to a background writer thread.
+    Call flush() at phase boundaries (it writes on the calling thread).
+    """
+
+    def __init__(self, store: JobStore, job_id: str, interval: float = JOB_PROGRESS_FLUSH_INTERVAL):
+        self.store = store
+        self.job_id = job_id
+        self.interval = interval
+        self._updates: Dict[str, Any] = {}
+        self._progress: Dict[str, Any] = {}
+        self._last_flush = 0.0
+        self._write_scheduled = False
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()  # Keeps writes in the order their updates were taken
+
+    def update(self, progress: Optional[Dict[str, Any]] = None, **updates):
+        """Record state fields (and progress fields), scheduling a write if the interval has passed"""
+        with self._lock:
+            self._updates.update(updates)
+            if progress:
+                self._progress.update(progress)
+            due = not self._write_scheduled and time.monotonic() - self._last_flush >= self.interval
+            if due:
+                self._write_scheduled = True
+        if due:
+            _progress_writer.submit(self._scheduled_flush)
+    
+    def _scheduled_flush(self):
+        with self._lock:
+            self._write_scheduled = False
+        self.flush()
+
+    def flush(self):
+        """Write pending state and progress now"""
+        with self._write_lock:
+            with self._lock:
+                updates, progress = self._updates, self._progress
+                self._updates, self._progress = {}, {}
+                self._last_flush = time.monotonic()
+            if updates or progress:
+                try:
+                    self.store.update_state(self.job_id, updates, progress)
+                except Exception as e:
+                    logger.error(f"Failed to write progress for job {self.job_id}: {e}")
+
+
+class JobCancelled(Exception):
+    """Raised inside a job handler that must stop because its worker lost the job's lease"""
+
+
+class JobLease:
+    """
+    A worker's lease on a running job, handed to the handler as job["lease"].
+    The worker's heartbeat renews it. Once a renewal fails another worker may
+    lease the job, so lost is set: the handler stops at its next check() and must
+    leave shared resources (temp files) to the new owner.
+    """
+    
+    def __init__(self, store: JobStore, job_id: str, worker_id: str, lease_seconds: int):
+        self.store = store
+        self.job_id = job_id
+        self.worker_id = worker_id
+        self.lease_seconds = lease_seconds
+        self.lost = threading.Event()
+    
+    def renew(self) -> bool:
+        """Extend the lease; False (and lost set) if this worker no longer holds it"""
+        if not self.lost.is_set() and self.store.renew_lease(self.job_id, self.worker_id, self.lease_seconds):
+            return True
+        self.lost.set()
+        return False
+    
+    def check(self):
+        """Raise JobCancelled if the lease was lost (call between files and before checkpoints)"""
+        if self.lost.is_set():
+            raise JobCancelled(f"Lost lease on job {self.job_id}")
+    
+    def held(self) -> bool:
+        """Renew now and tell whether this worker still holds the lease (a failed renewal counts as not held)"""
+        try:
+            return self.renew()
+        except Exception as e:
+            logger.error(f"Failed to renew lease on job {self.job_id}: {e}")
+            return False
+
+
+# Handlers by job kind, registered by the routes that enqueue them
+_job_handlers: Dict[str, Callable[[Dict[str, Any]], None]] = {}
+
+
+def register_job_handler(kind: str, handler: Callable[[Dict[str, Any]], None]):
+    """
+    Register the function that runs jobs of a kind.
+    The handler receives the leased job dictionary and must record the final
+    user-visible status itself; an exception marks the job failed. job["lease"]
+    is the JobLease, for the handler to stop (JobCancelled) once it is lost.
+    """
+    _job_handlers[kind] = handler
+
+
+class JobWorker:
+    """Leases jobs from the store and runs them on a small thread pool"""
+
+    def __init__(self, store: JobStore, concurrency: int = JOB_WORKER_CONCURRENCY,
+                 lease_seconds: int = JOB_LEASE_SECONDS):
+        self.store = store
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._active: Dict[str, JobLease] = {}  # job_id -> lease of the running job
+        self._active_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+
+    def start(self):
+        for i in range(self.concurrency):
+            thread = threading.Thread(target=self._run, name=f"job-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        heartbeat = threading.Thread(target=self._heartbeat, name="job-heartbeat", daemon=True)
+        heartbeat.start()
+        self._threads.append(heartbeat)
+        logger.info(f"Job worker {self.worker_id} started ({self.concurrency} slots, kinds: {sorted(_job_handlers)})")
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def notify(self):
+        """Wake idle slots after a job was enqueued in this process"""
+        self._wake.set()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                job = self.store.lease_next(self.worker_id, list(_job_handlers), self.lease_seconds)
+            except Exception as e:
+                logger.error(f"Failed to lease job: {e}")
+                job = None
+
+            if job is None:
+                self._wake.wait(JOB_POLL_INTERVAL)
+                self._wake.clear()
+                continue
+
+            self._execute(job)
+
+    def _execute(self, job: Dict[str, Any]):
+        job_id = job["job_id"]
+
+        if job["attempts"] > JOB_MAX_ATTEMPTS:
+            # The job took down its worker every time it ran; stop retrying it
+            logger.error(f"Job {job_id} abandoned after {job['attempts'] - 1} interrupted attempts")
+            self.store.update_state(job_id, {
+                "status": "failed",
+                "message": f"Processing failed: interrupted {job['attempts'] - 1} times",
+                "end_time": datetime.now().isoformat()
+            })
+            self.store.finish_job(job_id, self.worker_id)
+            return
+
+        if job["attempts"] > 1:
+            logger.warning(f"Resuming job {job_id} (attempt {job['attempts']}/{JOB_MAX_ATTEMPTS})")
+
+        lease = JobLease(self.store, job_id, self.worker_id, self.lease_seconds)
+        job["lease"] = lease
+        with self._active_lock:
+            self._active[job_id] = lease
+        try:
+            _job_handlers[job["kind"]](job)
+        except JobCancelled as e:
+            # The job is another worker's now; it records the status from here on
+            logger.warning(f"Job {job_id} stopped: {e}")
+        except Exception as e:
+            logger.error(f"Job {job_id} failed: {e}")
+            if not lease.lost.is_set():
+                self.store.update_state(job_id, {
+                    "status": "failed",
+                    "message": f"Processing failed: {str(e)}",
+                    "end_time": datetime.now().isoformat()
+                })
+        finally:
+            with self._active_lock:
+                self._active.pop(job_id, None)
+            self.store.finish_job(job_id, self.worker_id)
+
+    def _heartbeat(self):
+        while not self._stop.wait(self.lease_seconds / 3):
+            with self._active_lock:
+                leases = list(self._active.values())
+            for lease in leases:
+                if lease.lost.is_set():
+                    continue
+                try:
+                    if not lease.renew():
+                        logger.warning(f"Lost lease on job {lease.job_id}, cancelling it")
+                except Exception as e:
+                    logger.error(f"Failed to renew lease on job {lease.job_id}: {e}")
+
+
+# Global job store and worker instances
+_job_store: Optional[JobStore] = None
+_job_worker: Optional[JobWorker] = None
+_job_queue_lock = threading.RLock()
+
+
+def get_job_store() -> JobStore:
+    """Get the global job store for the configured backend"""
+    global _job_store
+    if _job_store is None:
+        with _job_queue_lock:
+            if _job_store is None:
+                if JOB_STORE_BACKEND == "sqlite":
+                    store = SQLiteJobStore(JOB_QUEUE_PATH)
+                else:
+                    raise ValueError(f"Unsupported JOB_STORE_BACKEND: {JOB_STORE_BACKEND}")
+                # Push every state write to streaming subscribers in this process
+                store.add_listener(get_progress_bus().publish)
+                _job_store = store
+    return _job_store
+
+
+def start_job_worker() -> JobWorker:
+    """Start this process's job worker (idempotent)"""
+    global _job_worker
+    with _job_queue_lock:
+        if _job_worker is None:
+            _job_worker = JobWorker(get_job_store())
+            _job_worker.start()
+    return _job_worker
+
+
+def stop_job_worker():
+    """Stop leasing new jobs; running jobs are resumed elsewhere once their lease expires"""
+    if _job_worker is not None:
+        _job_worker.stop()
+
+
+def enqueue_job(kind: str, username: str, payload: Dict[str, Any], state: Dict[str, Any]) -> str:
+    """
+    Create a queued job and wake a local worker.
+
+    Returns:
+        The new job ID (used as the task_id by the status endpoints)
+    """
+    job_id = str(uuid.uuid4())
+    get_job_store().create_job(job_id, kind, username, payload, state)
+    if _job_worker is not None:
+        _job_worker.notify()
+    return job_id
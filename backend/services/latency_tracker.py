@@ -0,0 +1,83 @@
+"""
+In-process latency tracking for Gemini calls.
+Keeps a rolling window of recent call latencies per model so callers can
+derive thresholds (e.g. when to hedge a slow request) from live percentiles.
+"""
+import os
+import math
+import threading
+from collections import deque
+from typing import Deque, Dict, Any, Optional
+
+# Number of recent successful calls kept per model
+LATENCY_WINDOW_SIZE = int(os.getenv("LATENCY_WINDOW_SIZE", "200"))
+
+
+class LatencyTracker:
+    """Rolling window of call latencies, one per model"""
+
+    def __init__(self, window_size: int = LATENCY_WINDOW_SIZE):
+        self.window_size = window_size
+        self._samples: Dict[str, Deque[float]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, model: str, seconds: float):
+        """Record the latency of one successful call"""
+        with self._lock:
+            samples = self._samples.get(model)
+            if samples is None:
+                samples = deque(maxlen=self.window_size)
+                self._samples[model] = samples
+            samples.append(seconds)
+
+    def sample_count(self, model: str) -> int:
+        with self._lock:
+            return len(self._samples.get(model, ()))
+
+    def percentile(self, model: str, pct: float, min_samples: int = 1) -> Optional[float]:
+        """
+        Get a latency percentile for a model (nearest-rank).
+
+        Args:
+            model: Model name
+            pct: Percentile between 0 and 100
+            min_samples: Return None until at least this many samples exist
+
+        Returns:
+            Latency in seconds, or None if there are not enough samples
+        """
+        with self._lock:
+            samples = sorted(self._samples.get(model, ()))
+        if not samples or len(samples) < min_samples:
+            return None
+        rank = max(1, math.ceil(pct / 100.0 * len(samples)))
+        return samples[min(rank, len(samples)) - 1]
+
+    def stats(self) -> Dict[str, Any]:
+        """Get sample count and p50/p90/p99 latency per model"""
+        with self._lock:
+            models = list(self._samples.keys())
+        return {
+            model: {
+                "samples": self.sample_count(model),
+                "p50": self.percentile(model, 50),
+                "p90": self.percentile(model, 90),
+                "p99": self.percentile(model, 99)
+            }
+            for model in models
+        }
+
+
+# Global latency tracker instance
+_latency_tracker: Optional[LatencyTracker] = None
+_latency_tracker_lock = threading.Lock()
+
+
+def get_latency_tracker() -> LatencyTracker:
+    """Get the global latency tracker instance"""
+    global _latency_tracker
+    if _latency_tracker is None:
+        with _latency_tracker_lock:
+            if _latency_tracker is None:
+                _latency_tracker = LatencyTracker()
+    return _latency_tracker
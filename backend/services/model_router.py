@@ -0,0 +1,296 @@
+"""
+Starting-model router for Gemini extraction.
+Handwritten bills usually fail the accuracy threshold on Flash and are re-run on
+Pro, wasting a Flash call. Before extraction, the router bins each image by cheap
+ink statistics and looks up how often Flash has been good enough for that user and
+bin (and, for vendor invoices, how often the user's bills came back Handwritten).
+Images where Flash usually fails start directly on Pro.
+"""
+import os
+import time
+import random
+import sqlite3
+import threading
+import logging
+from collections import deque
+from pathlib import Path
+from typing import Deque, Dict, Any, List, Optional, Tuple
+
+from utils.image_optimizer import compute_ink_features
+from services.latency_tracker import get_latency_tracker
+
+logger = logging.getLogger(__name__)
+
+# Router configuration
+MODEL_ROUTER_ENABLED = os.getenv("MODEL_ROUTER_ENABLED", "true").lower() == "true"
+MODEL_ROUTER_PATH = os.getenv(
+    "MODEL_ROUTER_PATH",
+    str(Path(__file__).parent.parent / "cache" / "model_router.sqlite3")
+)
+ROUTER_PRO_THRESHOLD = float(os.getenv("ROUTER_PRO_THRESHOLD", "0.75"))  # Flash failure rate that routes to Pro
+ROUTER_MIN_SAMPLES = int(os.getenv("ROUTER_MIN_SAMPLES", "10"))  # Outcomes needed before a key is trusted
+ROUTER_HISTORY_SIZE = 200  # Recent outcomes kept per key
+ROUTER_MAX_STORED_OUTCOMES = 50000
+
+# Share of Pro-eligible images still started on Flash. Keeps the history learning
+# (a key routed to Pro would otherwise never produce new Flash outcomes) and gives
+# a measured hit rate for the routing decisions.
+ROUTER_EXPLORE_RATE = float(os.getenv("ROUTER_EXPLORE_RATE", "0.1"))
+
+ROUTE_FLASH = "flash"
+ROUTE_PRO = "pro"
+
+# Latency of this model converts saved Flash calls into seconds
+FLASH_LATENCY_MODEL = "gemini-3-flash-preview"
+
+
+def get_image_bin(features: Optional[Dict[str, float]]) -> str:
+    """Bucket ink features into a coarse bin label, e.g. 'd3g1'"""
+    if not features:
+        return "unknown"
+    density_bucket = min(int(features["ink_density"] / 0.02), 7)
+    gap_bucket = min(int(features["blank_row_ratio"] * 4), 3)
+    return f"d{density_bucket}g{gap_bucket}"
+
+
+class OutcomeWindow:
+    """Recent boolean outcomes for one key"""
+
+    def __init__(self, size: int = ROUTER_HISTORY_SIZE):
+        self.values: Deque[bool] = deque(maxlen=size)
+
+    def add(self, value: bool):
+        self.values.append(value)
+
+    def rate(self, min_samples: int) -> Optional[float]:
+        """Fraction of True outcomes, or None with fewer than min_samples"""
+        if len(self.values) < min_samples:
+            return None
+        return sum(self.values) / len(self.values)
+
+
+class ModelRouter:
+    """Chooses Flash or Pro as the starting model for each image"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        # (pipeline, username, image_bin) and (pipeline, username, "*") -> Flash failure outcomes
+        self._flash_failures: Dict[Tuple[str, str, str], OutcomeWindow] = {}
+        # (pipeline, username) -> invoice_type == Handwritten outcomes
+        self._handwritten: Dict[Tuple[str, str], OutcomeWindow] = {}
+        self._counters: Dict[str, Dict[str, float]] = {}
+
+        Path(path).parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS router_outcomes (
+                pipeline TEXT NOT NULL,
+                username TEXT NOT NULL,
+                image_bin TEXT NOT NULL,
+                flash_failed INTEGER,
+                handwritten INTEGER,
+                created_at REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+        self._load_history()
+
+    def _load_history(self):
+        rows = self._conn.execute(
+            "SELECT pipeline, username, image_bin, flash_failed, handwritten FROM router_outcomes "
+            "ORDER BY created_at DESC LIMIT ?",
+            (ROUTER_MAX_STORED_OUTCOMES,)
+        ).fetchall()
+        for pipeline, username, image_bin, flash_failed, handwritten in reversed(rows):
+            self._remember(pipeline, username, image_bin, flash_failed, handwritten)
+        logger.info(f"Model router loaded {len(rows)} past outcomes from {self.path}")
+
+    def _remember(self, pipeline: str, username: str, image_bin: str,
+                  flash_failed: Optional[bool], handwritten: Optional[bool]):
+        if flash_failed is not None:
+            for key in ((pipeline, username, image_bin), (pipeline, username, "*")):
+                self._flash_failures.setdefault(key, OutcomeWindow()).add(bool(flash_failed))
+        if handwritten is not None:
+            self._handwritten.setdefault((pipeline, username), OutcomeWindow()).add(bool(handwritten))
+
+    def _count(self, pipeline: str, name: str, amount: float = 1):
+        counters = self._counters.setdefault(pipeline, {})
+        counters[name] = counters.get(name, 0) + amount
+
+    def estimate_flash_failure(self, pipeline: str, username: str, image_bin: str) -> Tuple[Optional[float], str]:
+        """
+        Estimate how likely Flash is to miss the accuracy threshold for an image.
+
+        Returns:
+            Tuple of (probability or None, basis), where basis names the history used
+        """
+        with self._lock:
+            bin_window = self._flash_failures.get((pipeline, username, image_bin))
+            rate = bin_window.rate(ROUTER_MIN_SAMPLES) if bin_window else None
+            if rate is not None:
+                return rate, "image_bin"
+
+            user_window = self._flash_failures.get((pipeline, username, "*"))
+            rate = user_window.rate(ROUTER_MIN_SAMPLES) if user_window else None
+            if rate is not None:
+                return rate, "user"
+
+            # Handwritten bills almost always fail on Flash, so a user's invoice_type
+            # history stands in until enough Flash outcomes exist
+            handwritten_window = self._handwritten.get((pipeline, username))
+            rate = handwritten_window.rate(ROUTER_MIN_SAMPLES) if handwritten_window else None
+            if rate is not None:
+                return rate, "invoice_type"
+
+        return None, "none"
+
+    def route(self, pipeline: str, username: str, image_bytes: bytes) -> Dict[str, Any]:
+        """
+        Pick the starting model for one image.
+
+        Args:
+            pipeline: "sales" or "vendor"; histories are kept separately
+            username: Owner of the image
+            image_bytes: Image content
+
+        Returns:
+            Routing decision dictionary (pass it back to record_outcome)
+        """
+        started = time.monotonic()
+        image_bin = get_image_bin(compute_ink_features(image_bytes))
+        probability, basis = self.estimate_flash_failure(pipeline, username, image_bin)
+
+        route = ROUTE_FLASH
+        explored = False
+        if probability is not None and probability >= ROUTER_PRO_THRESHOLD:
+            if random.random() < ROUTER_EXPLORE_RATE:
+                explored = True
+            else:
+                route = ROUTE_PRO
+
+        with self._lock:
+            self._count(pipeline, "pro_first" if route == ROUTE_PRO else "flash_first")
+            if explored:
+                self._count(pipeline, "explored")
+            if route == ROUTE_PRO:
+                self._count(pipeline, "expected_flash_calls_saved", probability)
+
+        return {
+            "pipeline": pipeline,
+            "route": route,
+            "image_bin": image_bin,
+            "flash_failure_rate": round(probability, 3) if probability is not None else None,
+            "basis": basis,
+            "explored": explored,
+            "routing_ms": round((time.monotonic() - started) * 1000, 1)
+        }
+
+    def record_outcome(self, decision: Dict[str, Any], username: str,
+                       flash_failed: Optional[bool] = None, handwritten: Optional[bool] = None):
+        """
+        Record what happened to a routed image.
+
+        Args:
+            decision: Dictionary returned by route()
+            username: Owner of the image
+            flash_failed: Whether Flash missed the accuracy threshold (None if Flash was not run)
+            handwritten: Whether the extraction reported a Handwritten invoice (None if unknown)
+        """
+        if flash_failed is None and handwritten is None:
+            return
+
+        pipeline = decision["pipeline"]
+        image_bin = decision["image_bin"]
+        with self._lock:
+            self._remember(pipeline, username, image_bin, flash_failed, handwritten)
+            if decision.get("explored") and flash_failed is not None:
+                self._count(pipeline, "explored_resolved")
+                if flash_failed:
+                    self._count(pipeline, "explore_hits")
+            try:
+                self._conn.execute(
+                    "INSERT INTO router_outcomes (pipeline, username, image_bin, flash_failed, handwritten, created_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?)",
+                    (pipeline, username, image_bin,
+                     None if flash_failed is None else int(flash_failed),
+                     None if handwritten is None else int(handwritten),
+                     time.time())
+                )
+                self._conn.execute(
+                    "DELETE FROM router_outcomes WHERE rowid IN ("
+                    "SELECT rowid FROM router_outcomes ORDER BY created_at DESC LIMIT -1 OFFSET ?)",
+                    (ROUTER_MAX_STORED_OUTCOMES,)
+                )
+                self._conn.commit()
+            except sqlite3.Error as e:
+                logger.warning(f"Could not persist routing outcome: {e}")
+
+    def stats(self) -> Dict[str, Any]:
+        """Get routing counters, measured hit rate and estimated savings per pipeline"""
+        flash_latency = get_latency_tracker().percentile(FLASH_LATENCY_MODEL, 50) or 0.0
+        with self._lock:
+            result = {}
+            for pipeline, counters in self._counters.items():
+                resolved = counters.get("explored_resolved", 0)
+                calls_saved = counters.get("expected_flash_calls_saved", 0)
+                result[pipeline] = {
+                    "flash_first": int(counters.get("flash_first", 0)),
+                    "pro_first": int(counters.get("pro_first", 0)),
+                    "explored": int(counters.get("explored", 0)),
+                    "hit_rate": round(counters.get("explore_hits", 0) / resolved * 100, 2) if resolved else None,
+                    "estimated_flash_calls_saved": round(calls_saved, 1),
+                    "estimated_seconds_saved": round(calls_saved * flash_latency, 1)
+                }
+            return result
+
+
+def summarize_routing(decisions: List[Optional[Dict[str, Any]]]) -> Dict[str, Any]:
+    """
+    Summarize the routing decisions of one batch.
+
+    Returns:
+        Dictionary with counts, expected Gemini calls saved and seconds saved
+    """
+    decisions = [d for d in decisions if d]
+    pro_first = [d for d in decisions if d["route"] == ROUTE_PRO]
+    calls_saved = sum(d["flash_failure_rate"] or 0 for d in pro_first)
+    flash_latency = get_latency_tracker().percentile(FLASH_LATENCY_MODEL, 50) or 0.0
+    return {
+        "routed": len(decisions),
+        "flash_first": len(decisions) - len(pro_first),
+        "pro_first": len(pro_first),
+        "estimated_gemini_calls_saved": round(calls_saved, 1),
+        "estimated_seconds_saved": round(calls_saved * flash_latency, 1)
+    }
+
+
+# Global model router instance
+_model_router: Optional[ModelRouter] = None
+_model_router_lock = threading.Lock()
+
+
+def get_model_router() -> Optional[ModelRouter]:
+    """
+    Get the global model router instance.
+
+    Returns:
+        ModelRouter, or None if routing is disabled or its history cannot be opened
+    """
+    global _model_router
+
+    if not MODEL_ROUTER_ENABLED:
+        return None
+
+    if _model_router is None:
+        with _model_router_lock:
+            if _model_router is None:
+                try:
+                    _model_router = ModelRouter(MODEL_ROUTER_PATH)
+                except Exception as e:
+                    logger.error(f"Could not open model router history, routing disabled: {e}")
+                    return None
+
+    return _model_router
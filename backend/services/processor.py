@@ -5,9 +5,9 @@ Ported from invoice_processor_r2_streamlit.py
 import os
 import json
 import time
+import asyncio
 import threading
-import tempfile
-from typing import List, Dict, Any, Optional, Callable
+from typing import List, Dict, Any, Optional, Callable, Tuple
 from datetime import datetime
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import logging
@@ -15,23 +15,46 @@ import logging
 
 from google import genai
 from google.genai import types
-from PIL import Image
 import pandas as pd
 
-from config import get_google_api_key
 from config_loader import get_user_config, get_gemini_prompt, get_columns_config
 from database import get_database_client
+from database_helpers import get_records_by_image_hashes
 from services.storage import get_storage_client
 from utils.date_helpers import normalize_date, format_to_db, get_ist_now_str
 from utils.hash_utils import calculate_image_hash
+from utils.image_optimizer import detect_image_mime_type
+from services.extraction_cache import get_extraction_cache, hash_prompt
+from services.rate_limiter import get_rate_limiter, is_rate_limit_error
+from services.gemini_client import get_gemini_client
+from services.extraction_engine import get_extraction_engine
+from services.latency_tracker import get_latency_tracker
+from services.model_router import get_model_router, summarize_routing, ROUTE_PRO
+from services.job_queue import JobCancelled
 
 # Google Sheets → Supabase migration complete
 # All data now stored in Supabase database tables
 
 logger = logging.getLogger(__name__)
 
-# Configuration for parallel processing
-MAX_WORKERS = 25  # Process up to 25 invoices concurrently (increased for bulk uploads)
+# Phase 2 extraction runs on the shared async extraction engine; concurrency is
+# bounded process-wide by EXTRACTION_MAX_IN_FLIGHT (see services/extraction_engine.py)
+
+# Phase 1 duplicate scan: concurrent downloads, independent of the extraction limit.
+# With early abort on, hashes are looked up every DUPLICATE_LOOKUP_BATCH_SIZE files and the
+# scan stops at the first duplicate. Off by default: the upload page re-submits every
+# non-reported file with force_upload=True, which would silently replace unscanned duplicates.
+DUPLICATE_SCAN_WORKERS = int(os.getenv("DUPLICATE_SCAN_WORKERS", "10"))
+DUPLICATE_SCAN_EARLY_ABORT = os.getenv("DUPLICATE_SCAN_EARLY_ABORT", "false").lower() == "true"
+DUPLICATE_LOOKUP_BATCH_SIZE = 25
+
+# Upper bound on downloaded image bytes held in memory by a single batch.
+# Bytes fetched during the duplicate scan are kept for extraction while they fit,
+# so each file is downloaded once; files beyond the budget are fetched again later.
+MAX_INFLIGHT_BYTES = int(os.getenv("MAX_INFLIGHT_BYTES", str(256 * 1024 * 1024)))
+
+# Budget reserved for a download whose size R2 does not report (corrected once it arrives)
+INFLIGHT_FILE_SIZE_ESTIMATE = int(os.getenv("INFLIGHT_FILE_SIZE_ESTIMATE", str(10 * 1024 * 1024)))
 
 # Gemini System Instruction - NOW LOADED DYNAMICALLY per user
 # See config_loader.get_gemini_prompt(username) for user-specific prompts
@@ -44,6 +67,14 @@ PRIMARY_MODEL = "gemini-3-flash-preview"  # Gemini 3 Flash
 FALLBACK_MODEL = "gemini-3-pro-preview"   # Gemini 3 Pro
 ACCURACY_THRESHOLD = 70.0  # Switch to Pro model if accuracy < 70%
 
+# Hedged requests: when Flash has not answered within HEDGE_PERCENTILE of its recent
+# latency, a Pro request is raced against it and the first acceptable result wins.
+# Off by default (it trades extra Pro calls for tail latency); needs HEDGE_MIN_SAMPLES
+# Flash calls in this process before the first hedge.
+HEDGE_ENABLED = os.getenv("HEDGE_ENABLED", "false").lower() == "true"
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "90"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+
 # Pricing Configuration (USD per 1M tokens)
 # Gemini 3 Flash Preview pricing (approximate)
 FLASH_INPUT_PRICE_PER_1M = 0.075  # USD
@@ -58,24 +89,69 @@ USD_TO_INR = 84.0  # 1 USD = 84 INR (approximate)
 
 
 
-class RateLimiter:
-    """Ensures we don't exceed the API's rate limit."""
-    def __init__(self, rpm=30):
-        self.interval = 60.0 / rpm
-        self._last_call = 0
-        self._lock = threading.Lock()
+# Shared per-model token buckets (see services/rate_limiter.py)
+limiter = get_rate_limiter()
+
 
-    def wait(self):
-        with self._lock:
-            now = time.time()
-            elapsed = now - self._last_call
-            wait_time = self.interval - elapsed
-            if wait_time > 0:
-                time.sleep(wait_time)
-            self._last_call = time.time()
+class ByteBudget:
+    """Bounds the total size of image bytes held in memory at the same time."""
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._in_use = 0
+        self._cond = threading.Condition()
+        # Coroutine waiters, on the loop of the first acquire_async() call
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._async_cond: Optional[asyncio.Condition] = None
 
+    def _fits(self, size: int) -> bool:
+        # An oversized file is still admitted when nothing else is held
+        return self._in_use + size <= self.max_bytes or self._in_use == 0
 
-limiter = RateLimiter(rpm=30)
+    def try_acquire(self, size: int) -> bool:
+        """Reserve size bytes without waiting. Returns False if over budget."""
+        with self._cond:
+            if not self._fits(size):
+                return False
+            self._in_use += size
+            return True
+
+    def acquire(self, size: int):
+        """Reserve size bytes, waiting until enough budget is released."""
+        with self._cond:
+            while not self._fits(size):
+                self._cond.wait()
+            self._in_use += size
+
+    async def acquire_async(self, size: int):
+        """Reserve size bytes from a coroutine, yielding to the event loop while over budget."""
+        if self._async_cond is None:
+            self._loop = asyncio.get_running_loop()
+            self._async_cond = asyncio.Condition()
+        async with self._async_cond:
+            await self._async_cond.wait_for(lambda: self.try_acquire(size))
+    
+    def resize(self, reserved: int, size: int):
+        """Correct a reservation to the actual size, without waiting (the bytes are already held)."""
+        with self._cond:
+            self._in_use = max(0, self._in_use + size - reserved)
+        if size < reserved:
+            self._notify()
+
+    def release(self, size: int):
+        with self._cond:
+            self._in_use = max(0, self._in_use - size)
+        self._notify()
+    
+    def _notify(self):
+        with self._cond:
+            self._cond.notify_all()
+        if self._loop is not None:
+            # Safe from any thread; waiters re-check the budget on the loop
+            self._loop.call_soon_threadsafe(lambda: self._loop.create_task(self._notify_async()))
+    
+    async def _notify_async(self):
+        async with self._async_cond:
+            self._async_cond.notify_all()
 
 
 
@@ -251,33 +327,307 @@ def create_combined_bbox(bbox1: Dict, bbox2: Dict) -> Dict:
     }
 
 
+async def generate_invoice_data_async(
+    client: genai.Client,
+    api_key: str,
+    model_name: str,
+    system_instruction: str,
+    img: types.Part,
+    image_hash: str,
+    prompt_hash: str,
+    attempt: int,
+    processing_errors: List[str]
+) -> Tuple[Dict[str, Any], int, int, int]:
+    """
+    Run one extraction call, served from the extraction cache when possible.
+    
+    Args:
+        client: Gemini client
+        api_key: API key the client uses (selects the rate limit bucket)
+        model_name: Model to call
+        system_instruction: User-specific prompt
+        img: Invoice image part
+        image_hash: SHA-256 hash of the image bytes (cache key)
+        prompt_hash: SHA-256 hash of system_instruction (cache key)
+        attempt: Zero-based retry attempt, for error messages
+        processing_errors: List collecting error messages for the invoice
+    
+    Returns:
+        Tuple of (data, input_tokens, output_tokens, total_tokens)
+    
+    Raises:
+        json.JSONDecodeError or ValueError if the response is not a valid extraction
+    """
+    engine = get_extraction_engine()
+    cache = get_extraction_cache()
+    if cache:
+        cached = await engine.run_blocking(cache.get, image_hash, prompt_hash, model_name)
+        if cached:
+            print(f"[CACHE HIT] Reusing {model_name} extraction for {image_hash[:16]}...", flush=True)
+            return cached["data"], cached["input_tokens"], cached["output_tokens"], cached["total_tokens"]
+    
+    await limiter.wait_async(model_name, api_key)
+    
+    # Configure generation with system instruction
+    config = types.GenerateContentConfig(
+        system_instruction=system_instruction
+    )
+    
+    # Call API. Latency is timed from when the request goes out: rate limiter and
+    # call-cap queueing would otherwise read as a slow model to hedging and AIMD.
+    started = None
+    try:
+        async with engine.gemini_calls:
+            started = time.monotonic()
+            response = await client.aio.models.generate_content(
+                model=model_name,
+                contents=[img, "Extract bill data."],
+                config=config
+            )
+    except asyncio.CancelledError:
+        # Lost a hedged race: the elapsed time is a lower bound on this call's latency.
+        # Recording it keeps slow calls in the distribution instead of only the winners.
+        if started is not None:
+            get_latency_tracker().record(model_name, time.monotonic() - started)
+        raise
+    except Exception as e:
+        rate_limited = is_rate_limit_error(e)
+        if rate_limited:
+            limiter.report_rate_limited(model_name, api_key)
+        engine.record_gemini_call(model_name, None, ok=False, rate_limited=rate_limited)
+        raise
+    limiter.report_success(model_name, api_key)
+    elapsed = time.monotonic() - started
+    engine.record_gemini_call(model_name, elapsed)
+    get_latency_tracker().record(model_name, elapsed)
+    
+    # Extract token usage from response metadata
+    input_tokens = 0
+    output_tokens = 0
+    total_tokens = 0
+    
+    if response.usage_metadata:
+        usage = response.usage_metadata
+        input_tokens = getattr(usage, 'prompt_token_count', 0)
+        output_tokens = getattr(usage, 'candidates_token_count', 0)
+        total_tokens = getattr(usage, 'total_token_count', input_tokens + output_tokens)
+        
+        print(f"[TOKENS] Input: {input_tokens}, Output: {output_tokens}, Total: {total_tokens}", flush=True)
+        logger.info(f"Token usage - Input: {input_tokens}, Output: {output_tokens}, Total: {total_tokens}")
+    
+    # Extract JSON from response
+    text = response.text.strip()
+    
+    # Remove markdown code blocks if present
+    if text.startswith("```json"):
+        text = text[7:]
+    if text.startswith("```"):
+        text = text[3:]
+    if text.endswith("```"):
+        text = text[:-3]
+    
+    text = text.strip()
+    
+    # Parse JSON
+    try:
+        data = json.loads(text)
+    except json.JSONDecodeError as json_err:
+        # Enhanced error logging with actual response
+        error_msg = f"JSON parse error on attempt {attempt + 1}: {json_err}"
+        processing_errors.append(error_msg)
+        logger.error(f"{error_msg}\nResponse text preview: {text[:500]}...")
+        raise  # Re-raise to trigger retry logic
+    
+    # Validate structure
+    if "header" not in data or "items" not in data:
+        error_msg = "Invalid response structure - missing header or items"
+        processing_errors.append(error_msg)
+        logger.error(f"{error_msg}\nData keys: {list(data.keys())}")
+        raise ValueError(error_msg)
+    
+    # Cache the parsed extraction before callers add per-upload metadata
+    if cache:
+        try:
+            await engine.run_blocking(cache.put, image_hash, prompt_hash, model_name, {
+                "data": data,
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "total_tokens": total_tokens
+            })
+        except Exception as e:
+            logger.warning(f"Could not write extraction cache: {e}")
+    
+    return data, input_tokens, output_tokens, total_tokens
+
+
 def process_single_invoice(
     image_bytes: bytes,
     filename: str,
     receipt_link: str,
-    username: str  # NEW: Required for loading user-specific prompt
+    username: str,  # NEW: Required for loading user-specific prompt
+    image_hash: Optional[str] = None
+) -> Optional[Dict[str, Any]]:
+    """
+    Synchronous entry point for process_single_invoice_async.
+    Runs the extraction on the shared extraction engine loop and waits for the result.
+    Must not be called from the engine loop itself.
+    """
+    return get_extraction_engine().run(
+        process_single_invoice_async(image_bytes, filename, receipt_link, username, image_hash)
+    )
+
+
+async def run_model_attempts(
+    client: genai.Client,
+    api_key: str,
+    model_name: str,
+    system_instruction: str,
+    img: types.Part,
+    image_hash: str,
+    prompt_hash: str,
+    processing_errors: List[str]
+) -> Optional[Dict[str, Any]]:
+    """
+    Run the full retry cycle for one model.
+    
+    Returns:
+        Dictionary with data, model_used, model_accuracy, token counts, cost_inr and
+        fallback_reason (set when a Flash result should be retried on Pro),
+        or None if every attempt failed
+    """
+    # Generate content with retry logic (full retries for each model)
+    for attempt in range(MAX_RETRIES):
+        try:
+            print(f"[ATTEMPT {attempt + 1}/{MAX_RETRIES}] Using model: {model_name}", flush=True)
+            logger.info(f"Attempting with {model_name} (attempt {attempt + 1}/{MAX_RETRIES})")
+            
+            data, input_tokens, output_tokens, total_tokens = await generate_invoice_data_async(
+                client, api_key, model_name, system_instruction, img,
+                image_hash, prompt_hash, attempt, processing_errors
+            )
+            
+            # Calculate accuracy from item confidences
+            accuracy = calculate_accuracy(data.get("items", []))
+            
+            print(f"[ACCURACY] Model {model_name}: {accuracy:.2f}%", flush=True)
+            logger.info(f"Model {model_name} - Accuracy: {accuracy:.2f}%")
+            
+            # Check for critical field confidence (Date & Receipt Number)
+            header = data.get("header", {})
+            receipt_conf = float(header.get("receipt_number_confidence", 100))
+            date_conf = float(header.get("date_confidence", 100))
+            overall_conf = float(header.get("overall_confidence", 100))
+            
+            logger.info(f"Confidences - Overall: {overall_conf}%, Receipt: {receipt_conf}%, Date: {date_conf}%")
+            
+            # DEBUG: Check if bbox data is present in Gemini response
+            has_bbox = any(k.endswith('_bbox') for k in header.keys())
+            if not has_bbox:
+                logger.warning("⚠️  BBOX MISSING: Gemini did NOT return bbox data!")
+            else:
+                logger.info(f"✓ BBOX FOUND: receipt_number_bbox = {header.get('receipt_number_bbox')}")
+            
+            # DEBUG: Check if line_item_row_bbox is present in items
+            items = data.get("items", [])
+            if items:
+                sample_item = items[0]
+                if 'line_item_row_bbox' in sample_item:
+                    logger.info(f"✓ LINE_ITEM_ROW_BBOX FOUND: {sample_item.get('line_item_row_bbox')}")
+                else:
+                    logger.warning(f"⚠️ LINE_ITEM_ROW_BBOX MISSING! Item keys: {list(sample_item.keys())}")
+            
+            # Check if we need to fallback to Pro model (only for Flash)
+            # Fallback triggers:
+            # 1. Overall item accuracy < ACCURACY_THRESHOLD (70%)
+            # 2. Overall Image Confidence < ACCURACY_THRESHOLD (70%)
+            # 3. Receipt number confidence < 50%
+            # NOTE: Date confidence is NOT checked - if date is missing from invoice,
+            #       a better model won't help. User will manually correct in Review Dates tab.
+            fallback_reason = None
+            if model_name == PRIMARY_MODEL:
+                if accuracy < ACCURACY_THRESHOLD:
+                    fallback_reason = f"Item Accuracy {accuracy:.2f}% < {ACCURACY_THRESHOLD}%"
+                elif overall_conf < ACCURACY_THRESHOLD:
+                    fallback_reason = f"Overall Image Confidence {overall_conf}% < {ACCURACY_THRESHOLD}%"
+                elif receipt_conf < 50:
+                    fallback_reason = f"Receipt Confidence {receipt_conf}% < 50%"
+            
+            return {
+                "data": data,
+                "model_used": model_name,
+                "model_accuracy": round(accuracy, 2),
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+                "total_tokens": total_tokens,
+                "cost_inr": calculate_cost_inr(input_tokens, output_tokens, model_name),
+                "fallback_reason": fallback_reason
+            }
+            
+        except json.JSONDecodeError as e:
+            error_msg = f"JSON decode error on attempt {attempt + 1}/{MAX_RETRIES}"
+            logger.warning(f"{error_msg}: {e}")
+            if attempt == MAX_RETRIES - 1:
+                processing_errors.append(f"{model_name} failed after {MAX_RETRIES} attempts: {e}")
+                logger.error(f"❌ {model_name} failed to parse JSON after {MAX_RETRIES} attempts")
+            else:
+                await asyncio.sleep(2 ** attempt)  # Exponential backoff
+            
+        except Exception as e:
+            error_msg = f"Error on attempt {attempt + 1}/{MAX_RETRIES}"
+            logger.error(f"{error_msg}: {e}")
+            processing_errors.append(f"{model_name} error: {str(e)}")
+            if attempt == MAX_RETRIES - 1:
+                logger.error(f"❌ {model_name} failed after {MAX_RETRIES} attempts")
+            else:
+                await asyncio.sleep(2 ** attempt)
+    
+    return None
+
+
+def get_hedge_delay() -> Optional[float]:
+    """
+    Seconds to wait for Flash before launching a hedged Pro request.
+    
+    Returns:
+        The HEDGE_PERCENTILE of recent Flash latency, or None when hedging is
+        disabled or too few Flash calls have been observed yet
+    """
+    if not HEDGE_ENABLED:
+        return None
+    return get_latency_tracker().percentile(PRIMARY_MODEL, HEDGE_PERCENTILE, HEDGE_MIN_SAMPLES)
+
+
+async def process_single_invoice_async(
+    image_bytes: bytes,
+    filename: str,
+    receipt_link: str,
+    username: str,
+    image_hash: Optional[str] = None
 ) -> Optional[Dict[str, Any]]:
     """
     Process a single invoice image with Gemini AI using google-genai SDK.
     Uses gemini-3-flash-preview by default, with automatic fallback to
     gemini-3-pro-preview if accuracy is below threshold.
+    With HEDGE_ENABLED, a Pro request is also started when Flash is slower than
+    its recent HEDGE_PERCENTILE latency; the first acceptable result wins.
     
     Args:
         image_bytes: Image file content
         filename: Original filename
         receipt_link: URL to receipt in R2 storage
         username: Username for loading user-specific config
+        image_hash: SHA-256 hash of image_bytes, if already calculated by the caller
     
     Returns:
         Dictionary with extracted invoice data including model metadata, or None if failed
     """
-    api_key = get_google_api_key()
-    if not api_key:
+    # Shared client (keep-alive connections); sharded by image so retries stay on one key
+    if not image_hash:
+        image_hash = calculate_image_hash(image_bytes)
+    client, api_key = get_gemini_client(shard_key=image_hash)
+    if not client:
         logger.error("Google API key not configured")
         return None
-
-    # Instantiate Client
-    client = genai.Client(api_key=api_key)
     
     # Load user-specific Gemini prompt
     system_instruction = get_gemini_prompt(username)
@@ -287,262 +637,177 @@ def process_single_invoice(
     
     logger.debug(f"Loaded prompt for user {username}, length: {len(system_instruction)}")
     
-    # Load image
-    tmp_path = None
+    # Extraction cache key part
+    prompt_hash = hash_prompt(system_instruction)
+    
+    # Image goes to Gemini straight from memory: no temp file, and no
+    # decode/re-encode round trip through PIL
+    img = types.Part.from_bytes(data=image_bytes, mime_type=detect_image_mime_type(image_bytes))
+    print(f"\n{'='*80}", flush=True)
+    print(f">>> PROCESSING IMAGE: {filename}", flush=True)
+    print(f"{'='*80}\n", flush=True)
+    logger.info(f"Processing image: {filename}")
+    
+    # Pick the starting model from ink statistics and past extraction outcomes
+    engine = get_extraction_engine()
+    router = get_model_router()
+    routing = await engine.run_blocking(router.route, "sales", username, image_bytes) if router else None
+    
+    processing_errors = []  # Collect all errors (shared by Flash and Pro attempts)
+    
+    def start_model(model_name: str) -> asyncio.Task:
+        return asyncio.ensure_future(run_model_attempts(
+            client, api_key, model_name, system_instruction, img,
+            image_hash, prompt_hash, processing_errors
+        ))
+    
+    def finish(result: Dict[str, Any], fallback_reason: Optional[str] = None) -> Dict[str, Any]:
+        """Add upload and model metadata to a successful extraction"""
+        data = result["data"]
+        data["receipt_link"] = receipt_link
+        data["upload_date"] = get_ist_now_str()
+        data["model_used"] = result["model_used"]
+        data["model_accuracy"] = result["model_accuracy"]
+        data["input_tokens"] = result["input_tokens"]
+        data["output_tokens"] = result["output_tokens"]
+        data["total_tokens"] = result["total_tokens"]
+        data["cost_inr"] = result["cost_inr"]
+        
+        # Add fallback tracking
+        data["fallback_attempted"] = fallback_reason is not None
+        data["fallback_reason"] = fallback_reason
+        data["processing_errors"] = " | ".join(processing_errors) if processing_errors else None
+        data["routing"] = routing
+        return data
+    
+    # Images where Flash usually misses the threshold (e.g. handwritten) start on Pro.
+    # If Pro fails, Flash is tried once and Pro is not launched again for the image.
+    pro_first_reason = None
+    if routing and routing["route"] == ROUTE_PRO:
+        print(f"[ROUTER] Starting {filename} on Pro: Flash failure rate "
+              f"{routing['flash_failure_rate']:.0%} ({routing['basis']}, bin {routing['image_bin']})", flush=True)
+        logger.info(f"Routing {filename} straight to {FALLBACK_MODEL} "
+                    f"(Flash failure rate {routing['flash_failure_rate']:.0%} by {routing['basis']})")
+        pro_result = await start_model(FALLBACK_MODEL)
+        if pro_result:
+            cost_inr = pro_result["cost_inr"]
+            logger.info(f"Processing cost: ₹{cost_inr:.4f} INR")
+            data = finish(pro_result)
+            print(f"\n[SUCCESS] Processed: {filename}", flush=True)
+            print(f"          Model: {FALLBACK_MODEL} | Accuracy: {pro_result['model_accuracy']:.2f}% | Cost: Rs.{cost_inr:.4f}\n", flush=True)
+            logger.info(f"Successfully processed: {filename} | Model: {FALLBACK_MODEL} | Accuracy: {pro_result['model_accuracy']:.2f}% | Cost: Rs.{cost_inr:.4f}")
+            return data
+        logger.warning(f"⚠️ Pro-first extraction failed for {filename}, trying {PRIMARY_MODEL}")
+        pro_first_reason = f"Pro-first extraction failed, fell back to {PRIMARY_MODEL}"
+    
+    # Try with primary model (Flash) first
+    print(f"[AI] Starting Flash model attempt", flush=True)
+    logger.info(f"Starting Flash model attempt")
+    flash_task = start_model(PRIMARY_MODEL)
+    pro_task = None
+    hedge_reason = None
+    
+    # Hedge: if Flash is slower than usual, race a Pro request against it
+    hedge_delay = get_hedge_delay() if pro_first_reason is None else None
+    if hedge_delay is not None:
+        done, _ = await asyncio.wait({flash_task}, timeout=hedge_delay)
+        if not done:
+            hedge_reason = f"Hedged: Flash slower than p{HEDGE_PERCENTILE:g} latency ({hedge_delay:.1f}s)"
+            print(f"[HEDGE] {filename}: starting Pro alongside Flash ({hedge_reason})", flush=True)
+            logger.info(f"{hedge_reason} - starting {FALLBACK_MODEL} in parallel for {filename}")
+            pro_task = start_model(FALLBACK_MODEL)
+    
     try:
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.jpg') as tmp:
-            tmp.write(image_bytes)
-            tmp_path = tmp.name
-        
-        img = Image.open(tmp_path)
-        print(f"\n{'='*80}", flush=True)
-        print(f">>> PROCESSING IMAGE: {filename}", flush=True)
-        print(f"{'='*80}\n", flush=True)
-        logger.info(f"Processing image: {filename}")
-        
-        # Try with primary model (Flash) first
-        model_name = PRIMARY_MODEL
-        fallback_attempted = False
-        fallback_reason = ""
-        flash_result = None  # Store Flash result in case we need it as fallback
-        processing_errors = []  # Collect all errors
+        if pro_task is not None:
+            await asyncio.wait({flash_task, pro_task}, return_when=asyncio.FIRST_COMPLETED)
+            if pro_task.done() and pro_task.result():
+                logger.info(f"Hedged {FALLBACK_MODEL} request answered first for {filename}")
+                pro_result = pro_task.result()
+                data = finish(pro_result, hedge_reason)
+                logger.info(f"Successfully processed: {filename} | Model: {pro_result['model_used']} | Accuracy: {pro_result['model_accuracy']:.2f}% | Cost: Rs.{pro_result['cost_inr']:.4f}")
+                return data
+        
+        flash_result = await flash_task
+        
+        # Feed the Flash outcome back to the router
+        if routing and flash_result:
+            await engine.run_blocking(
+                router.record_outcome, routing, username,
+                flash_failed=bool(flash_result["fallback_reason"])
+            )
+        
+        if flash_result and not flash_result["fallback_reason"]:
+            # Flash result is acceptable - processing succeeded!
+            accuracy = flash_result["model_accuracy"]
+            cost_inr = flash_result["cost_inr"]
+            logger.info(f"Processing cost: ₹{cost_inr:.4f} INR")
+            # A hedged or Pro-first request was still made (and cancelled or failed), so it is tracked
+            data = finish(flash_result, hedge_reason or pro_first_reason)
+            print(f"\n[SUCCESS] Processed: {filename}", flush=True)
+            print(f"          Model: {PRIMARY_MODEL} | Accuracy: {accuracy:.2f}% | Cost: Rs.{cost_inr:.4f}\n", flush=True)
+            logger.info(f"Successfully processed: {filename} | Model: {PRIMARY_MODEL} | Accuracy: {accuracy:.2f}% | Cost: Rs.{cost_inr:.4f}")
+            return data
+        
+        if flash_result is None and pro_task is None:
+            # Flash failed completely; a better model is not tried for errors
+            print(f"\n[ERROR] Processing failed for {filename}\n", flush=True)
+            logger.error(f"Complete failure: {PRIMARY_MODEL} failed for {filename}")
+            logger.error(f"   Errors: {' | '.join(processing_errors)}")
+            return None
+        
+        fallback_reason = flash_result["fallback_reason"] if flash_result else hedge_reason
+        
+        if pro_first_reason is not None:
+            # Pro already failed on this image: keep the Flash result below threshold
+            logger.warning(f"⚠️ {fallback_reason}, but {FALLBACK_MODEL} already failed on {filename}; "
+                           f"keeping the {PRIMARY_MODEL} result")
+            data = finish(flash_result, f"{pro_first_reason}; {fallback_reason}")
+            logger.info(f"✓ Using Flash result: {filename} | Accuracy: {flash_result['model_accuracy']}% | Cost: ₹{flash_result['cost_inr']:.4f}")
+            return data
         
         # CRITICAL FIX: Give Pro model its own full retry cycle
-        # Try Flash first, then if fallback needed, try Pro with fresh retries
-        for model_attempt in [PRIMARY_MODEL, FALLBACK_MODEL]:
-            model_name = model_attempt
-            
-            # Skip Pro model if fallback wasn't triggered
-            if model_name == FALLBACK_MODEL and not fallback_attempted:
-                continue
+        if pro_task is None:
+            logger.warning(f"⚠️ Fallback triggered: {fallback_reason}. Will try {FALLBACK_MODEL}")
+            print(f"[FALLBACK] Starting Pro model attempt after Flash fallback: {fallback_reason}", flush=True)
+            logger.info(f"Starting Pro model attempt after Flash fallback: {fallback_reason}")
+            pro_task = start_model(FALLBACK_MODEL)
+        
+        pro_result = await pro_task
+        
+        if pro_result:
+            accuracy = pro_result["model_accuracy"]
+            cost_inr = pro_result["cost_inr"]
+            logger.info(f"Processing cost: ₹{cost_inr:.4f} INR")
+            data = finish(pro_result, fallback_reason)
+            print(f"\n[SUCCESS] Processed: {filename}", flush=True)
+            print(f"          Model: {FALLBACK_MODEL} | Accuracy: {accuracy:.2f}% | Cost: Rs.{cost_inr:.4f}\n", flush=True)
+            logger.info(f"Successfully processed: {filename} | Model: {FALLBACK_MODEL} | Accuracy: {accuracy:.2f}% | Cost: Rs.{cost_inr:.4f}")
+            logger.info(f"  ℹ️ Fallback was used: {fallback_reason}")
+            return data
+        
+        # If Pro model failed and we have Flash result, use it
+        if flash_result:
+            logger.warning(f"⚠️ Pro model failed, falling back to Flash result")
             
-            # Log model being attempted
-            if model_name == FALLBACK_MODEL:
-                print(f"[FALLBACK] Starting Pro model attempt after Flash fallback: {fallback_reason}", flush=True)
-                logger.info(f"Starting Pro model attempt after Flash fallback: {fallback_reason}")
-            else:
-                print(f"[AI] Starting Flash model attempt", flush=True)
-                logger.info(f"Starting Flash model attempt")
+            # Use Flash result but mark that Pro was attempted
+            data = finish(flash_result, fallback_reason)
             
-            # Generate content with retry logic (full retries for each model)
-            for attempt in range(MAX_RETRIES):
-                try:
-                    limiter.wait()
-                    
-                    print(f"[ATTEMPT {attempt + 1}/{MAX_RETRIES}] Using model: {model_name}", flush=True)
-                    logger.info(f"Attempting with {model_name} (attempt {attempt + 1}/{MAX_RETRIES})")
-                    
-                    # Configure generation with system instruction
-                    config = types.GenerateContentConfig(
-                        system_instruction=system_instruction
-                    )
-                    
-                    # Call API
-                    response = client.models.generate_content(
-                        model=model_name,
-                        contents=[img, "Extract bill data."],
-                        config=config
-                    )
-                    
-                    # Extract token usage from response metadata
-                    input_tokens = 0
-                    output_tokens = 0
-                    total_tokens = 0
-                    
-                    if response.usage_metadata:
-                        usage = response.usage_metadata
-                        input_tokens = getattr(usage, 'prompt_token_count', 0)
-                        output_tokens = getattr(usage, 'candidates_token_count', 0)
-                        total_tokens = getattr(usage, 'total_token_count', input_tokens + output_tokens)
-                        
-                        print(f"[TOKENS] Input: {input_tokens}, Output: {output_tokens}, Total: {total_tokens}", flush=True)
-                        logger.info(f"Token usage - Input: {input_tokens}, Output: {output_tokens}, Total: {total_tokens}")
-                    
-                    # Extract JSON from response
-                    text = response.text.strip()
-                    
-                    # Remove markdown code blocks if present
-                    if text.startswith("```json"):
-                        text = text[7:]
-                    if text.startswith("```"):
-                        text = text[3:]
-                    if text.endswith("```"):
-                        text = text[:-3]
-                    
-                    text = text.strip()
-                    
-                    # Parse JSON
-                    try:
-                        data = json.loads(text)
-                    except json.JSONDecodeError as json_err:
-                        # Enhanced error logging with actual response
-                        error_msg = f"JSON parse error on attempt {attempt + 1}: {json_err}"
-                        processing_errors.append(error_msg)
-                        logger.error(f"{error_msg}\nResponse text preview: {text[:500]}...")
-                        raise  # Re-raise to trigger retry logic
-                    
-                    # Validate structure
-                    if "header" not in data or "items" not in data:
-                        error_msg = "Invalid response structure - missing header or items"
-                        processing_errors.append(error_msg)
-                        logger.error(f"{error_msg}\nData keys: {list(data.keys())}")
-                        raise ValueError(error_msg)
-                    
-                    # Calculate accuracy from item confidences
-                    accuracy = calculate_accuracy(data.get("items", []))
-                    
-                    print(f"[ACCURACY] Model {model_name}: {accuracy:.2f}%", flush=True)
-                    logger.info(f"Model {model_name} - Accuracy: {accuracy:.2f}%")
-                    
-                    # Check for critical field confidence (Date & Receipt Number)
-                    header = data.get("header", {})
-                    receipt_conf = float(header.get("receipt_number_confidence", 100))
-                    date_conf = float(header.get("date_confidence", 100))
-                    overall_conf = float(header.get("overall_confidence", 100))
-                    
-                    logger.info(f"Confidences - Overall: {overall_conf}%, Receipt: {receipt_conf}%, Date: {date_conf}%")
-                    
-                    # DEBUG: Check if bbox data is present in Gemini response
-                    has_bbox = any(k.endswith('_bbox') for k in header.keys())
-                    if not has_bbox:
-                        logger.warning("⚠️  BBOX MISSING: Gemini did NOT return bbox data!")
-                    else:
-                        logger.info(f"✓ BBOX FOUND: receipt_number_bbox = {header.get('receipt_number_bbox')}")
-                    
-                    # DEBUG: Check if line_item_row_bbox is present in items
-                    items = data.get("items", [])
-                    if items:
-                        sample_item = items[0]
-                        if 'line_item_row_bbox' in sample_item:
-                            logger.info(f"✓ LINE_ITEM_ROW_BBOX FOUND: {sample_item.get('line_item_row_bbox')}")
-                        else:
-                            logger.warning(f"⚠️ LINE_ITEM_ROW_BBOX MISSING! Item keys: {list(sample_item.keys())}")
-                    
-                    
-                    # Check if we need to fallback to Pro model (only for Flash)
-                    if model_name == PRIMARY_MODEL:
-                        needs_fallback = False
-                        fallback_reason_temp = ""
-                        
-                        # Fallback triggers:
-                        # 1. Overall item accuracy < ACCURACY_THRESHOLD (70%)
-                        # 2. Overall Image Confidence < ACCURACY_THRESHOLD (70%)
-                        # 3. Receipt number confidence < 50%
-                        # NOTE: Date confidence is NOT checked - if date is missing from invoice,
-                        #       a better model won't help. User will manually correct in Review Dates tab.
-                        
-                        if accuracy < ACCURACY_THRESHOLD:
-                            needs_fallback = True
-                            fallback_reason_temp = f"Item Accuracy {accuracy:.2f}% < {ACCURACY_THRESHOLD}%"
-                        elif overall_conf < ACCURACY_THRESHOLD:
-                            needs_fallback = True
-                            fallback_reason_temp = f"Overall Image Confidence {overall_conf}% < {ACCURACY_THRESHOLD}%"
-                        elif receipt_conf < 50:
-                            needs_fallback = True
-                            fallback_reason_temp = f"Receipt Confidence {receipt_conf}% < 50%"
-                        
-                        if needs_fallback:
-                            # Store Flash result and trigger Pro attempt
-                            fallback_attempted = True
-                            fallback_reason = fallback_reason_temp
-                            
-                            # Calculate cost for Flash attempt
-                            flash_cost = calculate_cost_inr(input_tokens, output_tokens, model_name)
-                            
-                            # Store Flash result as backup
-                            flash_result = {
-                                "data": data,
-                                "model_used": model_name,
-                                "model_accuracy": round(accuracy, 2),
-                                "input_tokens": input_tokens,
-                                "output_tokens": output_tokens,
-                                "total_tokens": total_tokens,
-                                "cost_inr": flash_cost
-                            }
-                            
-                            logger.warning(f"⚠️ Fallback triggered: {fallback_reason}. Will try {FALLBACK_MODEL}")
-                            break  # Exit Flash retry loop to try Pro model
-                    
-                    # If we got here, processing succeeded!
-                    # Calculate cost
-                    cost_inr = calculate_cost_inr(input_tokens, output_tokens, model_name)
-                    
-                    logger.info(f"Processing cost: ₹{cost_inr:.4f} INR")
-                    
-                    # Add metadata
-                    data["receipt_link"] = receipt_link
-                    data["upload_date"] = get_ist_now_str()
-                    data["model_used"] = model_name
-                    data["model_accuracy"] = round(accuracy, 2)
-                    data["input_tokens"] = input_tokens
-                    data["output_tokens"] = output_tokens
-                    data["total_tokens"] = total_tokens
-                    data["cost_inr"] = cost_inr
-                    
-                    # Add fallback tracking
-                    data["fallback_attempted"] = fallback_attempted
-                    data["fallback_reason"] = fallback_reason if fallback_attempted else None
-                    data["processing_errors"] = " | ".join(processing_errors) if processing_errors else None
-                    
-                    print(f"\n[SUCCESS] Processed: {filename}", flush=True)
-                    print(f"          Model: {model_name} | Accuracy: {accuracy:.2f}% | Cost: Rs.{cost_inr:.4f}\n", flush=True)
-                    logger.info(f"Successfully processed: {filename} | Model: {model_name} | Accuracy: {accuracy:.2f}% | Cost: Rs.{cost_inr:.4f}")
-                    if fallback_attempted:
-                        logger.info(f"  ℹ️ Fallback was used: {fallback_reason}")
-                    
-                    return data
-                    
-                except json.JSONDecodeError as e:
-                    error_msg = f"JSON decode error on attempt {attempt + 1}/{MAX_RETRIES}"
-                    logger.warning(f"{error_msg}: {e}")
-                    if attempt == MAX_RETRIES - 1:
-                        processing_errors.append(f"{model_name} failed after {MAX_RETRIES} attempts: {e}")
-                        logger.error(f"❌ {model_name} failed to parse JSON after {MAX_RETRIES} attempts")
-                    else:
-                        time.sleep(2 ** attempt)  # Exponential backoff
-                    
-                except Exception as e:
-                    error_msg = f"Error on attempt {attempt + 1}/{MAX_RETRIES}"
-                    logger.error(f"{error_msg}: {e}")
-                    processing_errors.append(f"{model_name} error: {str(e)}")
-                    if attempt == MAX_RETRIES - 1:
-                        logger.error(f"❌ {model_name} failed after {MAX_RETRIES} attempts")
-                    else:
-                        time.sleep(2 ** attempt)
+            logger.info(f"✓ Using Flash result: {filename} | Accuracy: {flash_result['model_accuracy']}% | Cost: ₹{flash_result['cost_inr']:.4f}")
+            logger.info(f"  ⚠️ Pro model attempted but failed: {processing_errors[-1] if processing_errors else 'Unknown error'}")
             
-            # If Pro model just failed and we have Flash result, use it
-            if model_name == FALLBACK_MODEL and flash_result:
-                logger.warning(f"⚠️ Pro model failed, falling back to Flash result")
-                
-                # Use Flash result but mark that Pro was attempted
-                data = flash_result["data"]
-                data["receipt_link"] = receipt_link
-                data["upload_date"] = get_ist_now_str()
-                data["model_used"] = flash_result["model_used"]
-                data["model_accuracy"] = flash_result["model_accuracy"]
-                data["input_tokens"] = flash_result["input_tokens"]
-                data["output_tokens"] = flash_result["output_tokens"]
-                data["total_tokens"] = flash_result["total_tokens"]
-                data["cost_inr"] = flash_result["cost_inr"]
-                data["fallback_attempted"] = True
-                data["fallback_reason"] = fallback_reason
-                data["processing_errors"] = " | ".join(processing_errors)
-                
-                logger.info(f"✓ Using Flash result: {filename} | Accuracy: {flash_result['model_accuracy']}% | Cost: ₹{flash_result['cost_inr']:.4f}")
-                logger.info(f"  ⚠️ Pro model attempted but failed: {processing_errors[-1] if processing_errors else 'Unknown error'}")
-                
-                return data
+            return data
         
+        # If we got here, both models failed completely
+        print(f"\n[ERROR] Processing failed for {filename}\n", flush=True)
+        logger.error(f"Complete failure: Both Flash and Pro models failed for {filename}")
+        logger.error(f"   Errors: {' | '.join(processing_errors)}")
+        return None
+    
     finally:
-        # Cleanup temp file
-        if tmp_path and os.path.exists(tmp_path):
-            os.unlink(tmp_path)
-    
-    # If we got here, both models failed completely
-    print(f"\n[ERROR] Processing failed for {filename}\n", flush=True)
-    logger.error(f"Complete failure: Both Flash and Pro models failed for {filename}")
-    logger.error(f"   Errors: {' | '.join(processing_errors)}")
-    return None
+        # The losing request of a hedged race is cancelled
+        for task in (flash_task, pro_task):
+            if task is not None and not task.done():
+                task.cancel()
 
 
 
@@ -558,44 +823,48 @@ def check_duplicate_invoice(image_hash: str, username: str) -> Optional[Dict[str
     Returns:
         Dictionary with existing invoice data if duplicate found, None otherwise
     """
-    try:
-        db = get_database_client()
+    return check_duplicate_invoices_bulk([image_hash], username).get(image_hash)
+
+
+def check_duplicate_invoices_bulk(image_hashes: List[str], username: str) -> Dict[str, Dict[str, Any]]:
+    """
+    Resolve many image hashes against existing invoices in a handful of queries.
+    Checks invoices first, then verified_invoices for the hashes not found there.
+    
+    Args:
+        image_hashes: SHA-256 hashes of the images
+        username: Username for RLS filtering
         
+    Returns:
+        Dictionary of image_hash -> existing invoice data, for duplicates only
+    """
+    try:
         # First check invoices table (in-progress/review invoices)
         # Note: invoices uses 'id' as primary key, not 'row_id'
         fields = ['id', 'receipt_number', 'date', 'customer', 
                   'receipt_link', 'upload_date', 'image_hash']
-        result = db.query('invoices', fields) \
-                    .eq('image_hash', image_hash) \
-                    .eq('username', username) \
-                    .limit(1) \
-                    .execute()
-        
-        if result.data and len(result.data) > 0:
-            duplicate_row = result.data[0]
+        duplicates = get_records_by_image_hashes('invoices', username, image_hashes, fields)
+        
+        for image_hash, duplicate_row in duplicates.items():
             logger.info(f"Duplicate found in invoices for hash {image_hash[:16]}... - Receipt: {duplicate_row.get('receipt_number', 'N/A')}")
-            return duplicate_row
         
-        # If not found in invoices, check verified_invoices table (completed invoices)
+        # For hashes not found in invoices, check verified_invoices table (completed invoices)
         # Note: verified_invoices uses 'row_id', not 'id'
-        fields_verified = ['row_id', 'receipt_number', 'date', 'customer_name', 'total_bill_amount', 
-                          'receipt_link', 'upload_date', 'image_hash']
-        result_verified = db.query('verified_invoices', fields_verified) \
-                            .eq('image_hash', image_hash) \
-                            .eq('username', username) \
-                            .limit(1) \
-                            .execute()
-        
-        if result_verified.data and len(result_verified.data) > 0:
-            duplicate_row = result_verified.data[0]
-            logger.info(f"Duplicate found in verified_invoices for hash {image_hash[:16]}... - Receipt: {duplicate_row.get('receipt_number', 'N/A')}")
-            return duplicate_row
+        remaining = [h for h in image_hashes if h and h not in duplicates]
+        if remaining:
+            fields_verified = ['row_id', 'receipt_number', 'date', 'customer_name', 'total_bill_amount', 
+                              'receipt_link', 'upload_date', 'image_hash']
+            verified = get_records_by_image_hashes('verified_invoices', username, remaining, fields_verified)
+            
+            for image_hash, duplicate_row in verified.items():
+                logger.info(f"Duplicate found in verified_invoices for hash {image_hash[:16]}... - Receipt: {duplicate_row.get('receipt_number', 'N/A')}")
+            duplicates.update(verified)
         
-        return None
+        return duplicates
         
     except Exception as e:
         logger.error(f"Error checking for duplicates in Supabase: {e}")
-        return None
+        return {}
 
 
 def delete_invoice_by_hash(image_hash: str, username: str):
@@ -822,7 +1091,10 @@ def process_invoices_batch(
     sheet_id: str,
     username: str,
     progress_callback: Optional[Callable[[int, int, str], None]] = None,
-    force_upload: bool = False
+    force_upload: bool = False,
+    completed_rows: Optional[Dict[str, List[Dict[str, Any]]]] = None,
+    on_file_complete: Optional[Callable[[str, List[Dict[str, Any]]], None]] = None,
+    cancelled: Optional[threading.Event] = None
 ) -> Dict[str, Any]:
     """
     Process a batch of invoices from R2 storage with parallel processing
@@ -834,16 +1106,32 @@ def process_invoices_batch(
         username: Username for logging
         progress_callback: Optional callback function(processed, total, current_file)
         force_upload: If True, bypass duplicate checking and delete old duplicates
+        completed_rows: Rows per file key already extracted by an interrupted run of
+                        this batch; those files are neither re-scanned nor re-extracted
+        on_file_complete: Optional callback function(file_key, rows) after each file is
+                          extracted, used to checkpoint the batch
+        cancelled: Set when the batch must stop (its job lost its lease): files not
+                   started yet are skipped and nothing is saved
     
     Returns:
         Dictionary with processing results including duplicate info
+    
+    Raises:
+        JobCancelled: If cancelled was set before the rows were saved
     """
     storage = get_storage_client()
     # sheets_client removed - now using Supabase via database_helpers
     
+    # Resume: files extracted before an interruption are only saved, not processed again
+    total_files = len(file_keys)
+    resumed_rows = [row for key in file_keys for row in (completed_rows or {}).get(key, [])]
+    if completed_rows:
+        file_keys = [key for key in file_keys if key not in completed_rows]
+        logger.info(f"Resuming batch: {total_files - len(file_keys)}/{total_files} files already extracted")
+    
     results = {
-        "total": len(file_keys),
-        "processed": 0,
+        "total": total_files,
+        "processed": total_files - len(file_keys),
         "failed": 0,
         "errors": [],
         "duplicates": []  # Track detected duplicates
@@ -856,39 +1144,67 @@ def process_invoices_batch(
     print(f"Force upload: {force_upload}", flush=True)
     print(f"{'='*80}\n", flush=True)
     
-    all_rows = []
+    all_rows = resumed_rows
     results_lock = threading.Lock()
     
-    def process_single_file(file_key: str, file_index: int) -> Optional[List[Dict[str, Any]]]:
+    # Bytes and hashes carried from the duplicate scan into extraction,
+    # so each file is downloaded and hashed only once per batch
+    byte_budget = ByteBudget(MAX_INFLIGHT_BYTES)
+    prefetched_bytes: Dict[str, bytes] = {}
+    image_hashes: Dict[str, str] = {}
+    routing_decisions: List[Optional[Dict[str, Any]]] = []
+    
+    engine = get_extraction_engine()
+    
+    async def process_single_file(file_key: str, file_index: int) -> Optional[List[Dict[str, Any]]]:
         """Process a single file and return its rows"""
+        image_bytes = prefetched_bytes.pop(file_key, None)
+        reserved = len(image_bytes) if image_bytes else 0
         try:
-            # Update progress - downloading
-            if progress_callback:
-                progress_callback(file_index, len(file_keys), f"Downloading {file_key}")
-            
-            # Download from R2
-            print(f"\n[{file_index + 1}/{len(file_keys)}] Downloading: {file_key}", flush=True)
-            logger.info(f"[{file_index + 1}/{len(file_keys)}] Downloading: {file_key}")
-            image_bytes = storage.download_file(r2_bucket, file_key)
-            
-            if not image_bytes:
-                with results_lock:
-                    results["failed"] += 1
-                    results["errors"].append(f"Failed to download: {file_key}")
+            if cancelled is not None and cancelled.is_set():
                 return None
             
-            # Calculate image hash (needed for database storage)
-            image_hash = calculate_image_hash(image_bytes)
-            print(f"[HASH] {image_hash[:16]}...", flush=True)
-            logger.info(f"Calculated hash for {file_key}: {image_hash[:16]}...")
+            if image_bytes is None:
+                # Update progress - downloading
+                if progress_callback:
+                    progress_callback(file_index, len(file_keys), f"Downloading {file_key}")
+                
+                # Wait for room in the in-flight byte budget before downloading the image
+                size = await engine.run_blocking(storage.get_file_size, r2_bucket, file_key) or INFLIGHT_FILE_SIZE_ESTIMATE
+                await byte_budget.acquire_async(size)
+                reserved = size
+                
+                # Download from R2
+                print(f"\n[{file_index + 1}/{len(file_keys)}] Downloading: {file_key}", flush=True)
+                logger.info(f"[{file_index + 1}/{len(file_keys)}] Downloading: {file_key}")
+                image_bytes = await engine.run_blocking(storage.download_file, r2_bucket, file_key)
+                
+                if not image_bytes:
+                    with results_lock:
+                        results["failed"] += 1
+                        results["errors"].append(f"Failed to download: {file_key}")
+                    return None
+                
+                if len(image_bytes) != reserved:
+                    byte_budget.resize(reserved, len(image_bytes))
+                    reserved = len(image_bytes)
+            else:
+                logger.info(f"[{file_index + 1}/{len(file_keys)}] Reusing bytes from duplicate scan: {file_key}")
+            
+            # Image hash (needed for database storage) - reuse the one from the duplicate scan
+            image_hash = image_hashes.get(file_key)
+            if not image_hash:
+                image_hash = calculate_image_hash(image_bytes)
+                print(f"[HASH] {image_hash[:16]}...", flush=True)
+                logger.info(f"Calculated hash for {file_key}: {image_hash[:16]}...")
             
             # If force_upload is enabled, delete old duplicate before processing
             if force_upload:
                 logger.info(f"Force upload enabled for {file_key} - checking for old duplicates to delete")
-                duplicate = check_duplicate_invoice(image_hash, username)
+                duplicate = await engine.run_blocking(check_duplicate_invoice, image_hash, username)
                 if duplicate:
                     logger.info(f"Deleting old duplicate for hash {image_hash[:16]}...")
-                    delete_invoice_by_hash(image_hash, username)
+                    await engine.run_blocking(delete_invoice_by_hash, image_hash, username)
             
             
             # Generate permanent public URL
@@ -907,14 +1223,18 @@ def process_invoices_batch(
             
             # Process with automated system (with user-specific prompt)
             print(f"[AI PROCESSING] {file_key}", flush=True)
-            invoice_data = process_single_invoice(image_bytes, file_key, receipt_link, username)
+            invoice_data = await process_single_invoice_async(image_bytes, file_key, receipt_link, username, image_hash)
             
             if invoice_data:
                 # Add image hash to invoice data
                 invoice_data["image_hash"] = image_hash
+                with results_lock:
+                    routing_decisions.append(invoice_data.get("routing"))
                 
                 # Convert to rows (with user-specific column mapping)
-                rows = convert_to_dataframe_rows(invoice_data, username)
+                rows = await engine.run_blocking(convert_to_dataframe_rows, invoice_data, username)
+                if on_file_complete:
+                    await engine.run_blocking(on_file_complete, file_key, rows)
                 with results_lock:
                     results["processed"] += 1
                 
@@ -935,6 +1255,11 @@ def process_invoices_batch(
                 results["failed"] += 1
                 results["errors"].append(f"Error: {file_key} - {str(e)}")
             return None
+        
+        finally:
+            image_bytes = None
+            if reserved:
+                byte_budget.release(reserved)
     
     # ===== PHASE 1: PRE-PROCESSING DUPLICATE CHECK =====
     # Check ALL files for duplicates BEFORE starting any processing
@@ -943,24 +1268,42 @@ def process_invoices_batch(
         logger.info(f"Phase 1: Checking {len(file_keys)} files for duplicates...")
         duplicates_found = []
         
-        for idx, file_key in enumerate(file_keys):
+        stop_scan = threading.Event()
+        pending_lookup: List[str] = []
+        
+        def scan_file(file_key: str, file_index: int) -> Optional[str]:
+            """Download and hash one file for the duplicate check"""
+            if stop_scan.is_set() or (cancelled is not None and cancelled.is_set()):
+                return None
             try:
-                # Download and hash file
-                if progress_callback:
-                    progress_callback(idx, len(file_keys), f"Checking for duplicates: {file_key}")
-                
-                logger.info(f"[{idx + 1}/{len(file_keys)}] Checking: {file_key}")
+                logger.info(f"[{file_index + 1}/{len(file_keys)}] Checking: {file_key}")
                 image_bytes = storage.download_file(r2_bucket, file_key)
                 
                 if not image_bytes:
                     logger.warning(f"Failed to download {file_key} during duplicate check")
-                    continue
+                    return None
                 
-                # Calculate hash and check for duplicate
                 image_hash = calculate_image_hash(image_bytes)
                 logger.info(f"Hash for {file_key}: {image_hash[:16]}...")
                 
-                duplicate = check_duplicate_invoice(image_hash, username)
+                with results_lock:
+                    image_hashes[file_key] = image_hash
+                    # Keep the bytes for Phase 2 while they fit in the in-flight budget
+                    if byte_budget.try_acquire(len(image_bytes)):
+                        prefetched_bytes[file_key] = image_bytes
+                return image_hash
+            except Exception as e:
+                logger.error(f"Error checking {file_key} for duplicates: {e}")
+                return None
+        
+        def resolve_pending():
+            """Look up the hashes scanned so far in bulk and record duplicates in file order"""
+            if not pending_lookup:
+                return
+            existing = check_duplicate_invoices_bulk([image_hashes[k] for k in pending_lookup], username)
+            for file_key in pending_lookup:
+                image_hash = image_hashes[file_key]
+                duplicate = existing.get(image_hash)
                 if duplicate:
                     logger.warning(f"Duplicate detected: {file_key} matches existing receipt {duplicate.get('receipt_number', 'N/A')}")
                     duplicates_found.append({
@@ -968,15 +1311,47 @@ def process_invoices_batch(
                         "existing_invoice": duplicate,
                         "image_hash": image_hash
                     })
-            except Exception as e:
-                logger.error(f"Error checking {file_key} for duplicates: {e}")
-                continue
+            pending_lookup.clear()
+        
+        # Download and hash concurrently, but consume results in file order so
+        # progress stays ordered. Hashes are resolved in one bulk lookup at the end,
+        # or every DUPLICATE_LOOKUP_BATCH_SIZE files when early abort is enabled.
+        with ThreadPoolExecutor(max_workers=DUPLICATE_SCAN_WORKERS) as scan_executor:
+            scan_futures = [
+                scan_executor.submit(scan_file, file_key, idx)
+                for idx, file_key in enumerate(file_keys)
+            ]
+            
+            for idx, (file_key, future) in enumerate(zip(file_keys, scan_futures)):
+                image_hash = future.result()
+                if progress_callback:
+                    progress_callback(idx + 1, len(file_keys), f"Checked for duplicates: {file_key}")
+                
+                if not image_hash:
+                    continue
+                pending_lookup.append(file_key)
+                
+                if DUPLICATE_SCAN_EARLY_ABORT and len(pending_lookup) >= DUPLICATE_LOOKUP_BATCH_SIZE:
+                    resolve_pending()
+                    if duplicates_found:
+                        logger.info(f"Duplicate found after scanning {idx + 1}/{len(file_keys)} files - stopping scan early")
+                        stop_scan.set()
+                        for pending in scan_futures[idx + 1:]:
+                            pending.cancel()
+                        break
+            
+            if not stop_scan.is_set():
+                resolve_pending()
+        
+        if cancelled is not None and cancelled.is_set():
+            raise JobCancelled(f"Invoice batch for {username} cancelled during the duplicate scan")
         
         # If ANY duplicates found, return immediately WITHOUT processing
         if duplicates_found:
+            prefetched_bytes.clear()
             logger.info(f"Found {len(duplicates_found)} duplicate(s) - returning without processing")
             return {
-                "total": len(file_keys),
+                "total": total_files,
                 "processed": 0,
                 "failed": 0,
                 "errors": [],
@@ -988,32 +1363,47 @@ def process_invoices_batch(
         logger.info("Force upload enabled - skipping pre-processing duplicate check")
     
     # ===== PHASE 2: PARALLEL PROCESSING =====
-    # Process files in parallel using ThreadPoolExecutor
-    logger.info(f"Starting parallel processing of {len(file_keys)} files with {MAX_WORKERS} workers")
-    
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        # Submit all tasks
-        future_to_file = {
-            executor.submit(process_single_file, file_key, idx): (file_key, idx)
-            for idx, file_key in enumerate(file_keys)
-        }
-        
-        # Collect results as they complete
-        for future in future_to_file:
-            file_key, idx = future_to_file[future]
-            try:
-                rows = future.result()
-                if rows:
-                    with results_lock:
-                        all_rows.extend(rows)
-            except Exception as e:
-                logger.error(f"Unexpected error in future for {file_key}: {e}")
-                with results_lock:
-                    results["failed"] += 1
-                    results["errors"].append(f"Future error: {file_key} - {str(e)}")
+    # All files run as coroutines on the extraction engine loop; the engine's
+    # scheduler bounds how many are in flight across every batch in the process
+    # and shares the slots fairly with other users' batches
+    logger.info(f"Starting parallel processing of {len(file_keys)} files on the extraction engine "
+                f"(max {engine.max_in_flight} in flight, {len(prefetched_bytes)} already in memory)")
+    
+    # Files already held in memory are scheduled first: they own byte budget,
+    # and files waiting on the budget must not take the in-flight slots ahead of them
+    submit_order = sorted(enumerate(file_keys), key=lambda pair: pair[1] not in prefetched_bytes)
+    
+    async def run_file(file_key: str, idx: int) -> Optional[List[Dict[str, Any]]]:
+        async with engine.slot(username):
+            return await process_single_file(file_key, idx)
+    
+    async def run_all() -> List[Any]:
+        return await asyncio.gather(
+            *(run_file(file_key, idx) for idx, file_key in submit_order),
+            return_exceptions=True
+        )
+    
+    # Collect results
+    for (idx, file_key), rows in zip(submit_order, engine.run(run_all())):
+        if isinstance(rows, BaseException):
+            logger.error(f"Unexpected error in task for {file_key}: {rows}")
+            with results_lock:
+                results["failed"] += 1
+                results["errors"].append(f"Future error: {file_key} - {str(rows)}")
+        elif rows:
+            with results_lock:
+                all_rows.extend(rows)
     
     logger.info(f"Parallel processing complete. Processed: {results['processed']}, Failed: {results['failed']}")
     
+    # Another worker owns the batch now and saves its own extraction results
+    if cancelled is not None and cancelled.is_set():
+        raise JobCancelled(f"Invoice batch for {username} cancelled after extracting {results['processed']} files")
+    
+    # Starting-model routing for this batch (Gemini calls and time saved by Pro-first images)
+    results["routing"] = summarize_routing(routing_decisions)
+    logger.info(f"Model routing: {results['routing']}")
+    
     
     # Save to Supabase database if we have data
     if all_rows:
@@ -1256,6 +1646,142 @@ def create_verification_records(df_new: pd.DataFrame, sheet_id: str):
         raise
 
 
+# Rows per insert request when writing new verification records
+VERIFICATION_INSERT_BATCH_SIZE = int(os.getenv("VERIFICATION_INSERT_BATCH_SIZE", "500"))
+
+DATE_VERIFICATION_COLUMNS = [
+    'receipt_number', 'date', 'audit_findings', 'verification_status', 'receipt_link',
+    'upload_date', 'row_id', 'receipt_number_bbox', 'date_bbox', 'date_and_receipt_combined_bbox'
+]
+
+AMOUNT_VERIFICATION_COLUMNS = [
+    'verification_status', 'receipt_number', 'description', 'quantity', 'rate', 'amount',
+    'amount_mismatch', 'receipt_link', 'row_id', 'line_item_row_bbox', 'date_and_receipt_combined_bbox'
+]
+
+
+def build_date_verification_records(df_new: pd.DataFrame) -> pd.DataFrame:
+    """
+    Build one verification_dates record per receipt number with its Audit Findings.
+    
+    Findings (joined with " | "): "Date Diff: N" for gaps other than 0/1 day from the
+    previous receipt, "Missing Date", "Duplicate Receipt Number" and "Duplicate Receipt Link".
+    Status is 'Duplicate Receipt Number', 'Done' (no findings) or 'Pending'.
+    
+    Args:
+        df_new: DataFrame of rows from convert_to_dataframe_rows
+    
+    Returns:
+        DataFrame sorted by receipt number and date
+    """
+    import numpy as np
+    
+    # Group by receipt_number (one row per receipt); first() takes the first non-null value per column
+    date_records = df_new.groupby('receipt_number').first().reset_index()
+    
+    # Dates are stored in YYYY-MM-DD format (PostgreSQL DATE)
+    date_records['_parsed_date'] = pd.to_datetime(date_records['date'], format='%Y-%m-%d', errors='coerce')
+    date_records = date_records.sort_values(['receipt_number', '_parsed_date']).reset_index(drop=True)
+    
+    # Gap from the previous receipt; a diff of 1 day is normal sequential progression
+    diff_days = (date_records['_parsed_date'] - date_records['_parsed_date'].shift()).dt.days
+    has_diff = diff_days.notna() & (diff_days != 0) & (diff_days != 1)
+    
+    receipt_numbers = date_records['receipt_number']
+    duplicate_receipt = receipt_numbers.map(bool) & (
+        receipt_numbers.map(receipt_numbers.value_counts()) > 1
+    )
+    
+    if 'receipt_link' in date_records.columns:
+        links = date_records['receipt_link']
+        duplicate_link = links.map(bool) & (links.map(links.value_counts()) > 1)
+    else:
+        duplicate_link = pd.Series(False, index=date_records.index)
+    
+    findings = zip(
+        np.where(has_diff, "Date Diff: " + diff_days.fillna(0).astype(int).astype(str), ""),
+        np.where(date_records['_parsed_date'].isna(), "Missing Date", ""),
+        np.where(duplicate_receipt, "Duplicate Receipt Number", ""),
+        np.where(duplicate_link, "Duplicate Receipt Link", ""),
+    )
+    date_records['audit_findings'] = [" | ".join(f for f in parts if f) for parts in findings]
+    
+    date_records['verification_status'] = np.select(
+        [duplicate_receipt.to_numpy(), date_records['audit_findings'].eq("").to_numpy()],
+        ['Duplicate Receipt Number', 'Done'],
+        default='Pending'
+    )
+    
+    return date_records.drop(columns=['_parsed_date'])
+
+
+def build_amount_verification_records(df_new: pd.DataFrame, all_rows: List[Dict[str, Any]]) -> pd.DataFrame:
+    """
+    Build one verification_amounts record per line item.
+    
+    Status is 'Done' when amount_mismatch is 0 and 'Pending' otherwise.
+    
+    Args:
+        df_new: DataFrame of rows from convert_to_dataframe_rows
+        all_rows: The same rows as dictionaries (receipt_link fallback)
+    
+    Returns:
+        DataFrame of line items
+    """
+    import numpy as np
+    
+    amount_records = df_new.copy()
+    
+    # receipt_link is a header field; convert_to_dataframe_rows copies it to each row
+    if 'receipt_link' not in amount_records.columns and all_rows:
+        first_receipt_link = all_rows[0].get('receipt_link')
+        if first_receipt_link:
+            amount_records['receipt_link'] = first_receipt_link
+            logger.info(f"Added receipt_link to {len(amount_records)} amount records: {first_receipt_link[:50]}...")
+    
+    if 'amount_mismatch' in amount_records.columns:
+        amount_records['amount_mismatch'] = pd.to_numeric(amount_records['amount_mismatch'], errors='coerce').fillna(0)
+        # Done: mismatch == 0 (no review needed), Pending: mismatch requires review
+        amount_records['verification_status'] = np.where(amount_records['amount_mismatch'] == 0, 'Done', 'Pending')
+    
+    return amount_records
+
+
+def _verification_rows(records: pd.DataFrame, columns: List[str], username: str) -> List[Dict[str, Any]]:
+    """Select insert columns (missing ones as None) and replace NaN with None for JSON"""
+    frame = records.reindex(columns=columns).astype(object)
+    frame = frame.where(frame.notna(), None)
+    frame.insert(0, 'username', username)
+    return frame.to_dict('records')
+
+
+def _insert_verification_rows(db, table: str, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """
+    Insert rows with one request per batch.
+    
+    A batch the database rejects is retried row by row, so one bad row does not
+    drop the rest of its batch.
+    
+    Returns:
+        Inserted rows as returned by the database
+    """
+    inserted = []
+    for i in range(0, len(rows), VERIFICATION_INSERT_BATCH_SIZE):
+        batch = rows[i:i + VERIFICATION_INSERT_BATCH_SIZE]
+        try:
+            inserted.extend(db.batch_insert(table, batch, batch_size=len(batch)))
+            continue
+        except Exception as e:
+            logger.warning(f"Bulk insert into {table} failed, inserting {len(batch)} rows one by one: {e}")
+        
+        for row in batch:
+            try:
+                inserted.extend(db.insert(table, row) or [])
+            except Exception as e:
+                logger.error(f"Failed to insert {table} record {row.get('row_id')}: {e}")
+    return inserted
+
+
 def create_verification_records_supabase(all_rows: List[Dict[str, Any]], username: str):
     """
     Create verification records in Supabase tables for new invoices.
@@ -1266,20 +1792,18 @@ def create_verification_records_supabase(all_rows: List[Dict[str, Any]], usernam
     - Auto-sets status to 'Done' if no issues
     
     For verification_amounts:
-    - One record per line item
-    - ONLY creates records where amount_mismatch > 0
+    - One record per line item, linked to its receipt's verification_dates row via header_id
+    - Status 'Done' if amount_mismatch is 0, otherwise 'Pending'
+    
+    Each table is written with bulk inserts (VERIFICATION_INSERT_BATCH_SIZE rows per request).
     
     Args:
         all_rows: List of row dictionaries from convert_to_dataframe_rows
         username: Username for RLS
     """
-    import pandas as pd
-    import numpy as np
-    
     db = get_database_client()
     
     try:
-        # Convert rows to DataFrame for easier processing
         df_new = pd.DataFrame(all_rows)
         
         if df_new.empty:
@@ -1290,195 +1814,37 @@ def create_verification_records_supabase(all_rows: List[Dict[str, Any]], usernam
         # VERIFY DATES - With Audit Findings Logic
         # =============================================
         
-        # Group by receipt_number for date verification (one row per receipt)
-        date_records = df_new.groupby('receipt_number').first().reset_index()
-        date_records['verification_status'] = 'Pending'
-        
-        # Parse dates for comparison - dates are stored in YYYY-MM-DD format in database
-        date_records['_parsed_date'] = pd.to_datetime(
-            date_records['date'], 
-            format='%Y-%m-%d',  # YYYY-MM-DD format (PostgreSQL DATE)
-            errors='coerce'
-        )
-        
-        # Sort by receipt_number and date for sequential comparison
-        date_records = date_records.sort_values(['receipt_number', '_parsed_date']).reset_index(drop=True)
-        
-        # Calculate date differences (gap between consecutive receipts)
-        prev_date = date_records['_parsed_date'].shift()
-        date_records['_date_diff_days'] = (date_records['_parsed_date'] - prev_date).dt.days
-        
-        # Build Audit Findings
-        def build_audit_findings(row, all_records):
-            findings = []
-            
-            # 1. Date Difference (gap from previous receipt)
-            # Exclude diff of 1 day as it's normal sequential progression
-            diff_days = row.get('_date_diff_days')
-            if pd.notna(diff_days) and diff_days != 0 and diff_days != 1:
-                findings.append(f"Date Diff: {int(diff_days)}")
-            
-            # 2. Missing Date
-            if pd.isna(row.get('_parsed_date')):
-                findings.append("Missing Date")
-            
-            # 3. Duplicate Receipt Number (if same receipt number appears more than once)
-            receipt_num = row.get('receipt_number', '')
-            if receipt_num:
-                count = (all_records['receipt_number'] == receipt_num).sum()
-                if count > 1:
-                    findings.append("Duplicate Receipt Number")
-            
-            # 4. Duplicate Receipt Link (same file uploaded twice)
-            receipt_link = row.get('receipt_link', '')
-            if receipt_link:
-                link_count = (all_records['receipt_link'] == receipt_link).sum()
-                if link_count > 1:
-                    findings.append("Duplicate Receipt Link")
-            
-            return " | ".join(findings) if findings else ""
-        
-        # Apply audit findings to each row
-        date_records['audit_findings'] = date_records.apply(
-            lambda row: build_audit_findings(row, date_records), axis=1
+        date_records = build_date_verification_records(df_new)
+        inserted_dates = _insert_verification_rows(
+            db, 'verification_dates', _verification_rows(date_records, DATE_VERIFICATION_COLUMNS, username)
         )
+        logger.info(f"Created {len(inserted_dates)} date verification records in Supabase")
         
-        # Set Verification Status based on Audit Findings
-        def set_date_status(row):
-            audit = str(row.get('audit_findings', '')).strip()
-            if 'Duplicate Receipt Number' in audit:
-                return 'Duplicate Receipt Number'
-            elif 'Already Verified' in audit:
-                return 'Already Verified'
-            elif not audit:
-                # No issues found - auto-done
-                return 'Done'
-            else:
-                # Has issues - needs review
-                return 'Pending'
-        
-        date_records['verification_status'] = date_records.apply(set_date_status, axis=1)
-        
-        # Drop temporary columns
-        date_records = date_records.drop(columns=['_parsed_date', '_date_diff_days'], errors='ignore')
-        
-        # Insert date verification records into Supabase
-        date_insert_count = 0
-        for _, row in date_records.iterrows():
-            try:
-                date_row = {
-                    'username': username,
-                    'receipt_number': row.get('receipt_number'),
-                    'date': row.get('date'),
-                    'audit_findings': row.get('audit_findings'),
-                    'verification_status': row.get('verification_status'),
-                    'receipt_link': row.get('receipt_link'),
-                    'upload_date': row.get('upload_date'),
-                    'row_id': row.get('row_id'),
-                    'receipt_number_bbox': row.get('receipt_number_bbox'),
-                    'date_bbox': row.get('date_bbox'),
-                    'date_and_receipt_combined_bbox': row.get('date_and_receipt_combined_bbox')
-                }
-                db.insert('verification_dates', date_row)
-                date_insert_count += 1
-            except Exception as e:
-                logger.error(f"Failed to insert date verification record: {e}")
-        
-        logger.info(f"Created {date_insert_count} date verification records in Supabase")
-        
-        # NEW: Fetch the inserted headers to get their IDs for linking
-        header_ids_map = {}  # receipt_number -> header_id
-        try:
-            for _, date_row in date_records.iterrows():
-                receipt_num = date_row.get('receipt_number')
-                if receipt_num:
-                    # Query to get the header ID we just created
-                    header_data = db.query('verification_dates') \
-                        .eq('username', username) \
-                        .eq('receipt_number', receipt_num) \
-                        .execute().data
-                    
-                    if header_data and len(header_data) > 0:
-                        # Take the most recent one (should be what we just inserted)
-                        header_id = header_data[0].get('id')
-                        if header_id:
-                            header_ids_map[receipt_num] = header_id
-                            logger.debug(f"Header ID for receipt {receipt_num}: {header_id}")
-        except Exception as e:
-            logger.warning(f"Could not fetch header IDs: {e}")
+        # Link line items to the headers just inserted (receipt_number -> header_id)
+        header_ids_map = {
+            str(row.get('receipt_number')): row.get('id')
+            for row in inserted_dates
+            if row.get('receipt_number') and row.get('id')
+        }
         
         # =============================================
-        # VERIFY AMOUNT - Filter Amount Mismatch > 0
+        # VERIFY AMOUNT - One record per line item
         # =============================================
         
-        amount_records = df_new.copy()
-       
-        # CRITICAL: Add receipt_link to each row (it's a header field, not in line items)
-        if not df_new.empty and 'receipt_link' in df_new.columns:
-            # receipt_link should already be in df_new from convert_to_dataframe_rows
-            pass
-        else:
-            # Add receipt_link from the first record (all rows have same receipt_link)
-            if all_rows:
-                first_receipt_link = all_rows[0].get('receipt_link') if all_rows else None
-                if first_receipt_link:
-                    amount_records['receipt_link'] = first_receipt_link
-                    logger.info(f"Added receipt_link to {len(amount_records)} amount records: {first_receipt_link[:50]}...")
-        
-        # CRITICAL: Set verification_status based on amount_mismatch
-        if 'amount_mismatch' in amount_records.columns:
-            # Convert to numeric
-            amount_records['amount_mismatch'] = pd.to_numeric(
-                amount_records['amount_mismatch'], errors='coerce'
-            ).fillna(0)
-            
-            # Set status based on mismatch value
-            # Done: mismatch == 0 (no review needed)
-            # Pending: mismatch > 0 (requires review)
-            amount_records['verification_status'] = amount_records['amount_mismatch'].apply(
-                lambda x: 'Done' if x == 0 else 'Pending'
-            )
+        amount_records = build_amount_verification_records(df_new, all_rows)
+        amount_rows = _verification_rows(amount_records, AMOUNT_VERIFICATION_COLUMNS, username)
         
-        # Proceed with all records (both Done and Pending)
-        if not amount_records.empty:
-            
-            # Insert amount verification records into Supabase WITH header_id
-            amount_insert_count = 0
-            for _, row in amount_records.iterrows():
-                try:
-                    receipt_num = row.get('receipt_number')
-                    
-                    # NEW: Get header_id from our map
-                    header_id = header_ids_map.get(receipt_num) if header_ids_map else None
-                    
-                    amount_row = {
-                        'username': username,
-                        'verification_status': row.get('verification_status'),  # Use calculated status (Done or Pending)
-                        'receipt_number': receipt_num,
-                        'header_id': header_id,  # NEW: Link to header via stable ID
-                        'description': row.get('description'),
-                        'quantity': row.get('quantity'),
-                        'rate': row.get('rate'),
-                        'amount': row.get('amount'),
-                        'amount_mismatch': row.get('amount_mismatch'),
-                        'receipt_link': row.get('receipt_link'),
-                        'row_id': row.get('row_id'),
-                        'line_item_row_bbox': row.get('line_item_row_bbox'),  # Only use row-level bbox
-                        'date_and_receipt_combined_bbox': row.get('date_and_receipt_combined_bbox')
-                    }
-                    
-                    # Log if we're missing header_id (for debugging)
-                    if not header_id:
-                        logger.warning(f"No header_id found for receipt {receipt_num} when creating line item")
-                    
-                    db.insert('verification_amounts', amount_row)
-                    amount_insert_count += 1
-                except Exception as e:
-                    logger.error(f"Failed to insert amount verification record: {e}")
-            
-            logger.info(f"Created {amount_insert_count} amount verification records in Supabase (filtered: amount_mismatch > 0)")
-        else:
-            logger.info("No amount verification records needed (all amount_mismatch = 0)")
+        missing_headers = set()
+        for row in amount_rows:
+            receipt_num = row.get('receipt_number')
+            row['header_id'] = header_ids_map.get(str(receipt_num))
+            if not row['header_id']:
+                missing_headers.add(str(receipt_num))
+        if missing_headers:
+            logger.warning(f"No header_id found for {len(missing_headers)} receipts when creating line items: {sorted(missing_headers)[:10]}")
+        
+        inserted_amounts = _insert_verification_rows(db, 'verification_amounts', amount_rows)
+        logger.info(f"Created {len(inserted_amounts)} amount verification records in Supabase")
         
     except Exception as e:
         logger.error(f"Error creating verification records in Supabase: {e}")
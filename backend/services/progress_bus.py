@@ -0,0 +1,186 @@
+"""
+In-process pub/sub for background task progress.
+Every job state write is published on the task's topic; streaming endpoints
+subscribe and push the events to the browser (SSE) instead of the browser
+polling the status endpoints. Each topic keeps a short replay buffer so a
+subscriber that connects late, or reconnects with Last-Event-ID, still gets
+the events it missed.
+"""
+import os
+import json
+import time
+import asyncio
+import threading
+import logging
+from collections import deque
+from typing import AsyncIterator, Callable, Deque, Dict, Any, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Bus configuration
+PROGRESS_REPLAY_SIZE = int(os.getenv("PROGRESS_REPLAY_SIZE", "100"))  # Events kept per task for late subscribers
+PROGRESS_TOPIC_TTL = 600  # Seconds a finished task's events stay available
+PROGRESS_STREAM_POLL_INTERVAL = 2.0  # Seconds between store reads when no event arrives (task on another worker)
+PROGRESS_KEEPALIVE_INTERVAL = 15.0  # Seconds between SSE keepalive comments
+
+# User-visible statuses after which a task's stream ends
+TERMINAL_STATUSES = {"completed", "failed", "duplicate_detected"}
+
+
+class Topic:
+    """Replay buffer and live subscribers for one task"""
+
+    def __init__(self):
+        self.next_id = 1
+        self.events: Deque[Tuple[int, Dict[str, Any]]] = deque(maxlen=PROGRESS_REPLAY_SIZE)
+        self.subscribers: List[Tuple[asyncio.AbstractEventLoop, asyncio.Queue]] = []
+        self.finished_at: Optional[float] = None
+
+
+class ProgressBus:
+    """Thread-safe publisher; subscribers consume on their own event loop"""
+
+    def __init__(self):
+        self._topics: Dict[str, Topic] = {}
+        self._lock = threading.Lock()
+
+    def _prune(self, now: float):
+        # Finished topics past their TTL, and topics only ever subscribed to
+        # (their task published from another process)
+        expired = [
+            task_id for task_id, topic in self._topics.items()
+            if not topic.subscribers and (
+                not topic.events or (topic.finished_at and now - topic.finished_at > PROGRESS_TOPIC_TTL)
+            )
+        ]
+        for task_id in expired:
+            del self._topics[task_id]
+
+    def publish(self, task_id: str, state: Dict[str, Any]):
+        """
+        Publish a task's new state. Safe to call from any thread.
+
+        Args:
+            task_id: Task (job) ID
+            state: Full user-visible task state after the change
+        """
+        now = time.time()
+        with self._lock:
+            topic = self._topics.get(task_id)
+            if topic is None:
+                self._prune(now)
+                topic = Topic()
+                self._topics[task_id] = topic
+            event_id = topic.next_id
+            topic.next_id += 1
+            topic.events.append((event_id, state))
+            if state.get("status") in TERMINAL_STATUSES:
+                topic.finished_at = now
+            subscribers = list(topic.subscribers)
+
+        for loop, queue in subscribers:
+            try:
+                loop.call_soon_threadsafe(queue.put_nowait, (event_id, state))
+            except RuntimeError:
+                # Subscriber's loop is closed; it is removed when its stream ends
+                pass
+
+    def subscribe(self, task_id: str, last_event_id: Optional[int] = None
+                  ) -> Tuple[asyncio.Queue, List[Tuple[int, Dict[str, Any]]]]:
+        """
+        Register a subscriber on the calling event loop.
+
+        Args:
+            task_id: Task (job) ID
+            last_event_id: Replay buffered events after this ID (None for live events only)
+
+        Returns:
+            Tuple of (queue receiving live (event_id, state) pairs, replayed events)
+        """
+        queue: asyncio.Queue = asyncio.Queue()
+        with self._lock:
+            topic = self._topics.setdefault(task_id, Topic())
+            topic.subscribers.append((asyncio.get_running_loop(), queue))
+            backlog = [] if last_event_id is None else [
+                (event_id, state) for event_id, state in topic.events if event_id > last_event_id
+            ]
+        return queue, backlog
+
+    def unsubscribe(self, task_id: str, queue: asyncio.Queue):
+        with self._lock:
+            topic = self._topics.get(task_id)
+            if topic:
+                topic.subscribers = [entry for entry in topic.subscribers if entry[1] is not queue]
+
+
+async def stream_task_events(task_id: str, load_state: Callable[[], Optional[Dict[str, Any]]],
+                             format_event: Callable[[Dict[str, Any]], Dict[str, Any]],
+                             last_event_id: Optional[int] = None) -> AsyncIterator[str]:
+    """
+    Server-Sent Events for one task, ending after a terminal status.
+
+    Args:
+        task_id: Task (job) ID
+        load_state: Blocking function returning the task's current state from the job store (or None)
+        format_event: Function turning a state dict into the JSON payload sent to the client
+        last_event_id: Last-Event-ID sent by a reconnecting client
+
+    Yields:
+        SSE-formatted strings
+    """
+    def sse(state: Dict[str, Any], event_id: Optional[int] = None) -> str:
+        prefix = f"id: {event_id}\n" if event_id else ""
+        return f"{prefix}data: {json.dumps(format_event(state), default=str)}\n\n"
+
+    loop = asyncio.get_running_loop()
+    bus = get_progress_bus()
+    queue, backlog = bus.subscribe(task_id, last_event_id)
+    try:
+        if backlog:
+            # Reconnect: replay what the client missed
+            for event_id, state in backlog:
+                yield sse(state, event_id)
+        else:
+            # The job may run on another worker process, or have finished before this
+            # process kept any events: start from the stored state
+            state = await loop.run_in_executor(None, load_state)
+            if state is None:
+                return
+            yield sse(state)
+        last_sent = state
+        last_write = time.monotonic()
+
+        while state.get("status") not in TERMINAL_STATUSES:
+            try:
+                event_id, state = await asyncio.wait_for(queue.get(), timeout=PROGRESS_STREAM_POLL_INTERVAL)
+            except asyncio.TimeoutError:
+                # No event in this process: the store is the source of truth
+                event_id = None
+                state = await loop.run_in_executor(None, load_state)
+                if state is None:
+                    return
+
+            if state != last_sent:
+                last_sent = state
+                last_write = time.monotonic()
+                yield sse(state, event_id)
+            elif time.monotonic() - last_write >= PROGRESS_KEEPALIVE_INTERVAL:
+                last_write = time.monotonic()
+                yield ": keepalive\n\n"
+    finally:
+        bus.unsubscribe(task_id, queue)
+
+
+# Global progress bus instance
+_progress_bus: Optional[ProgressBus] = None
+_progress_bus_lock = threading.Lock()
+
+
+def get_progress_bus() -> ProgressBus:
+    """Get the global progress bus instance"""
+    global _progress_bus
+    if _progress_bus is None:
+        with _progress_bus_lock:
+            if _progress_bus is None:
+                _progress_bus = ProgressBus()
+    return _progress_bus
@@ -0,0 +1,164 @@
+"""
+Gemini API rate limiting.
+Token buckets per model (and optionally per API key) with burst capacity,
+plus adaptive rate reduction when Gemini answers 429 / RESOURCE_EXHAUSTED.
+"""
+import os
+import time
+import asyncio
+import hashlib
+import threading
+import logging
+from typing import Dict, Any, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Requests per minute per model. Override with GEMINI_RPM_<MODEL>, e.g.
+# GEMINI_RPM_GEMINI_3_FLASH_PREVIEW=120. Unlisted models use GEMINI_DEFAULT_RPM.
+GEMINI_DEFAULT_RPM = float(os.getenv("GEMINI_DEFAULT_RPM", "30"))
+GEMINI_BURST = int(os.getenv("GEMINI_BURST", "5"))  # Requests allowed back-to-back after idle time
+
+# Adaptive backoff: multiply the rate on each 429, recover a fraction of
+# the configured rate per successful call, never drop below the floor
+RATE_LIMIT_DECREASE_FACTOR = 0.5
+RATE_LIMIT_RECOVERY_FRACTION = 0.05
+MIN_RPM = 2.0
+
+
+def get_model_rpm(model: str) -> float:
+    """Get the configured requests-per-minute for a model"""
+    env_name = "GEMINI_RPM_" + "".join(c if c.isalnum() else "_" for c in model).upper()
+    return float(os.getenv(env_name, GEMINI_DEFAULT_RPM))
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """Check if an exception is a Gemini quota / rate limit error (HTTP 429)"""
+    if getattr(error, "code", None) == 429:
+        return True
+    message = str(error)
+    return "429" in message or "RESOURCE_EXHAUSTED" in message
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket.
+    Callers reserve a token under the lock and sleep outside it, so a waiting
+    thread never blocks other threads from reserving their own slot.
+    """
+    def __init__(self, rpm: float, capacity: int):
+        self.base_rpm = rpm
+        self.rpm = rpm
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._last_refill = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now: float):
+        rate_per_sec = self.rpm / 60.0
+        self._tokens = min(self.capacity, self._tokens + (now - self._last_refill) * rate_per_sec)
+        self._last_refill = now
+
+    def reserve(self) -> float:
+        """
+        Take one token, going into debt if none is available.
+
+        Returns:
+            Seconds the caller must wait before using the token
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            if self._tokens >= 0:
+                return 0.0
+            return -self._tokens / (self.rpm / 60.0)
+
+    def acquire(self):
+        """Block the calling thread until a token is available"""
+        wait_time = self.reserve()
+        if wait_time > 0:
+            time.sleep(wait_time)
+
+    async def acquire_async(self):
+        """Wait for a token without blocking the event loop"""
+        wait_time = self.reserve()
+        if wait_time > 0:
+            await asyncio.sleep(wait_time)
+
+    def decrease(self):
+        """Cut the rate after a 429 and drop any burst allowance"""
+        with self._lock:
+            self._refill(time.monotonic())
+            self.rpm = max(MIN_RPM, self.rpm * RATE_LIMIT_DECREASE_FACTOR)
+            self._tokens = min(self._tokens, 0.0)
+
+    def recover(self):
+        """Step the rate back towards the configured rate after a success"""
+        with self._lock:
+            if self.rpm < self.base_rpm:
+                self._refill(time.monotonic())
+                self.rpm = min(self.base_rpm, self.rpm + self.base_rpm * RATE_LIMIT_RECOVERY_FRACTION)
+
+
+class GeminiRateLimiter:
+    """Keeps one token bucket per (model, API key)"""
+    def __init__(self, burst: int = GEMINI_BURST):
+        self.burst = burst
+        self._buckets: Dict[Tuple[str, str], TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def _bucket(self, model: str, api_key: Optional[str] = None) -> TokenBucket:
+        # Keys are fingerprinted so raw API keys are never held as dict keys or logged
+        key_id = hashlib.sha256(api_key.encode()).hexdigest()[:12] if api_key else ""
+        bucket_key = (model, key_id)
+
+        bucket = self._buckets.get(bucket_key)
+        if bucket is None:
+            with self._lock:
+                bucket = self._buckets.get(bucket_key)
+                if bucket is None:
+                    bucket = TokenBucket(get_model_rpm(model), self.burst)
+                    self._buckets[bucket_key] = bucket
+        return bucket
+
+    def wait(self, model: str, api_key: Optional[str] = None):
+        """Block until a request to this model (and key) is allowed"""
+        self._bucket(model, api_key).acquire()
+
+    async def wait_async(self, model: str, api_key: Optional[str] = None):
+        """Async variant of wait() for code running on an event loop"""
+        await self._bucket(model, api_key).acquire_async()
+
+    def report_success(self, model: str, api_key: Optional[str] = None):
+        """Record a successful call so a throttled bucket can recover"""
+        self._bucket(model, api_key).recover()
+
+    def report_rate_limited(self, model: str, api_key: Optional[str] = None):
+        """Record a 429 / RESOURCE_EXHAUSTED response and slow the bucket down"""
+        bucket = self._bucket(model, api_key)
+        bucket.decrease()
+        logger.warning(f"Gemini rate limit hit for {model}: reduced to {bucket.rpm:.1f} RPM")
+
+    def stats(self) -> Dict[str, Any]:
+        """Get current vs configured rate for every bucket"""
+        with self._lock:
+            return {
+                f"{model}:{key_id}" if key_id else model: {
+                    "rpm": round(bucket.rpm, 2),
+                    "configured_rpm": bucket.base_rpm,
+                    "burst": bucket.capacity
+                }
+                for (model, key_id), bucket in self._buckets.items()
+            }
+
+
+# Global rate limiter instance, shared by all extraction pipelines
+_rate_limiter: Optional[GeminiRateLimiter] = None
+
+
+def get_rate_limiter() -> GeminiRateLimiter:
+    """Get the global Gemini rate limiter instance"""
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = GeminiRateLimiter()
+    return _rate_limiter
@@ -0,0 +1,709 @@
+"""
+Stock ledger service.
+Keeps stock_levels in step with vendor purchases (IN) and customer sales (OUT).
+
+apply_stock_movements() applies new vendor items, verified sales, transaction
+edits/deletes and mapping changes to only the stock rows they affect.
+recalculate_stock_for_user() rebuilds every row from all transactions and is
+the reconciliation job for the ledger; background callers go through the
+debounced scheduler in services.stock_scheduler.
+"""
+import time
+import logging
+import threading
+from datetime import datetime
+from typing import List, Dict, Any, Optional, Tuple, Iterable, Set
+
+import numpy as np
+
+from database import get_database_client
+from database_helpers import iter_table_rows, iter_verified_invoices
+from services.fuzzy_matcher import PartNumberIndex, match_sales_to_parts
+from services.stock_scheduler import get_stock_scheduler
+
+logger = logging.getLogger(__name__)
+
+# ============================================================================
+# REORDER POINT CONFIGURATION - CHANGE HERE TO UPDATE DEFAULT
+# ============================================================================
+DEFAULT_REORDER_POINT = 2  # Change this value to update default for ALL items
+# ============================================================================
+
+# Fuzzy thresholds: vendor part number -> stock group, stock group -> mapped
+# customer items, sale description -> customer item
+GROUP_MATCH_THRESHOLD = 99
+MAPPING_MATCH_THRESHOLD = 98
+SALES_MATCH_THRESHOLD = 90
+
+VENDOR_ITEM_COLUMNS = ["part_number", "description", "qty", "rate", "invoice_date"]
+SALE_COLUMNS = ["description", "quantity", "rate", "date"]
+# verified_invoices fields that move stock (Sync & Finish rewrites rows whether or not they changed)
+SALE_STOCK_FIELDS = ["type", "description", "quantity", "rate", "date"]
+
+STOCK_DELETE_CHUNK_SIZE = 100  # ids per delete request (kept short for the URL)
+
+# Stock writers (ledger updates, full recalculations) run one at a time per user
+_user_locks: Dict[str, threading.RLock] = {}
+_user_locks_guard = threading.Lock()
+
+
+def stock_lock(username: str) -> threading.RLock:
+    """Lock serializing stock_levels writes for a user (re-entrant)"""
+    with _user_locks_guard:
+        return _user_locks.setdefault(username, threading.RLock())
+
+
+def _iso_date(value: Any) -> Optional[str]:
+    """Date as YYYY-MM-DD (accepts database dates and Sync & Finish's dd-MMM-yyyy), None if empty"""
+    if value is None or value == "":
+        return None
+    text = str(value).strip()
+    try:
+        return datetime.strptime(text[:10], "%Y-%m-%d").date().isoformat()
+    except ValueError:
+        pass
+    try:
+        return datetime.strptime(text, "%d-%b-%Y").date().isoformat()
+    except ValueError:
+        return text
+
+
+def _new_entry(part_number: str, description: str) -> Dict[str, Any]:
+    """Empty stock entry for a part group (transaction totals are filled in later)"""
+    return {
+        "part_number": part_number,
+        "internal_item_name": description,
+        "vendor_description": description,
+        "total_in": 0.0,
+        "total_out": 0.0,
+        "customer_items": [],
+        "vendor_rate": None,
+        "customer_rate": None,
+        "last_vendor_invoice_date": None,
+        "last_customer_invoice_date": None
+    }
+
+
+def _load_mappings(username: str) -> List[Dict[str, Any]]:
+    """Inventory mappings (customer item, part, vendor desc, priority, reorder) with status Added"""
+    return list(iter_table_rows(
+        "vendor_mapping_entries",
+        username,
+        columns=["customer_item_name", "part_number", "vendor_description", "priority", "reorder_point"],
+        filters={"status": "Added"}
+    ))
+
+
+def _mapping_lookup(mapping_data: List[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """part_number -> {customer_item_name, priority, reorder_point} (last mapping wins)"""
+    mapping_lookup = {}
+    for mapping in mapping_data:
+        part = mapping.get("part_number")
+        if part:
+            mapping_lookup[part] = {
+                "customer_item_name": mapping.get("customer_item_name"),
+                "priority": mapping.get("priority"),
+                "reorder_point": mapping.get("reorder_point")
+            }
+    return mapping_lookup
+
+
+def _customer_items_by_part(mapping_data: List[Dict[str, Any]], part_numbers: Iterable[str]) -> Dict[str, List[str]]:
+    """
+    Mapped customer items of each part: mappings whose part number fuzzy matches
+    the part (98% threshold), in mapping order. Parts without any are omitted.
+    """
+    mapping_index = PartNumberIndex(threshold=MAPPING_MATCH_THRESHOLD)
+    for mapping in mapping_data:
+        vendor_part = mapping.get("part_number")
+        customer_item = mapping.get("customer_item_name")
+        if vendor_part and customer_item:
+            mapping_index.add(vendor_part, customer_item)
+
+    part_to_customer_items = {}
+    for part_number in part_numbers:
+        customer_items_for_part = [mapping_index.values[i] for i in mapping_index.matches(part_number)]
+        if customer_items_for_part:
+            part_to_customer_items[part_number] = customer_items_for_part
+    return part_to_customer_items
+
+
+def _collapse_sales(sales: Iterable[Dict[str, Any]]) -> Tuple[Dict[str, int], List[float], List[Optional[Tuple[Any, int, Any]]], int]:
+    """
+    Collapse sales to unique lowercased descriptions, in order of first appearance.
+
+    Returns:
+        Tuple of (description -> index, total quantity per description,
+        first sale with the latest date per description as (date, position, rate) or None,
+        number of sales read)
+    """
+    sales_count = 0
+    desc_index: Dict[str, int] = {}
+    desc_qty: List[float] = []
+    desc_latest: List[Optional[Tuple[Any, int, Any]]] = []
+    for item in sales:
+        sales_count += 1
+        customer_desc = item.get("description")
+        if not customer_desc:
+            continue
+
+        qty = float(item.get("quantity", 0) or 0)
+
+        desc_id = desc_index.setdefault(customer_desc.lower(), len(desc_index))
+        if desc_id == len(desc_qty):
+            desc_qty.append(0.0)
+            desc_latest.append(None)
+        desc_qty[desc_id] += qty
+
+        # Keep the first sale with the latest date
+        if item.get("date"):
+            latest = desc_latest[desc_id]
+            if latest is None or item["date"] > latest[0]:
+                desc_latest[desc_id] = (item["date"], sales_count, item.get("rate"))
+
+    return desc_index, desc_qty, desc_latest, sales_count
+
+
+def _add_sales(entry: Dict[str, Any], matches: List[Tuple[int, str]], qty_by_desc: np.ndarray,
+               desc_latest: List[Optional[Tuple[Any, int, Any]]]):
+    """Add a part's matched sales (from match_sales_to_parts) to its stock entry"""
+    desc_ids = np.fromiter((desc_id for desc_id, _ in matches), dtype=np.int64, count=len(matches))
+
+    # Add to total_out
+    entry["total_out"] += float(qty_by_desc[desc_ids].sum())
+
+    # Track customer items that were actually sold (distinct, in order of first sale)
+    for _, matched_customer_item in matches:
+        if matched_customer_item not in entry["customer_items"]:
+            entry["customer_items"].append(matched_customer_item)
+
+    # Update customer rate and date from the first sale with the latest date
+    dated = [desc_latest[desc_id] for desc_id, _ in matches if desc_latest[desc_id] is not None]
+    if dated:
+        sale_date, _, sale_rate = max(dated, key=lambda sale: (sale[0], -sale[1]))
+        existing_date = entry["last_customer_invoice_date"]
+        if not existing_date or sale_date > existing_date:
+            entry["last_customer_invoice_date"] = sale_date
+            entry["customer_rate"] = sale_rate
+
+
+def _stock_record(username: str, entry: Dict[str, Any], old_stock: Any, priority: Any,
+                  reorder_point: Any, now: str) -> Dict[str, Any]:
+    """stock_levels row for a stock entry"""
+    current_stock = entry["total_in"] - entry["total_out"]
+
+    # customer_items: mapped customer items first, then the ones actually sold
+    customer_items_str = ", ".join(entry["customer_items"]) if entry["customer_items"] else None
+
+    # Calculate ACTUAL ON HAND (including old_stock for value calculation)
+    stock_on_hand = current_stock + (old_stock or 0)
+
+    # Calculate value using ON HAND (not just current_stock)
+    unit_value = entry.get("vendor_rate") or 0
+    total_value = stock_on_hand * unit_value
+
+    return {
+        "username": username,
+        "part_number": entry["part_number"],
+        "internal_item_name": entry["internal_item_name"],
+        "vendor_description": entry["vendor_description"],
+        "customer_items": customer_items_str,
+        "current_stock": round(current_stock, 2),
+        "total_in": round(entry["total_in"], 2),
+        "total_out": round(entry["total_out"], 2),
+        "reorder_point": reorder_point,
+        "old_stock": old_stock,
+        "priority": priority,
+        "vendor_rate": entry.get("vendor_rate"),
+        "customer_rate": entry.get("customer_rate"),
+        "unit_value": unit_value,
+        "total_value": round(total_value, 2),  # Includes old_stock
+        "last_vendor_invoice_date": entry.get("last_vendor_invoice_date"),
+        "last_customer_invoice_date": entry.get("last_customer_invoice_date"),
+        "updated_at": now
+    }
+
+
+def _group_stock_entries(mapping_data: List[Dict[str, Any]],
+                         vendor_data: Iterable[Dict[str, Any]]) -> Tuple[Dict[str, Dict[str, Any]], PartNumberIndex]:
+    """
+    Group mappings, then vendor invoice items (IN), into stock entries. Each joins
+    the earliest group whose part number matches it (99%) or starts its own, so the
+    groups depend on the order of the mappings and items.
+    
+    Returns:
+        Tuple of (group part number -> entry with its mapped customer items and IN totals,
+        index of the group part numbers in creation order)
+    """
+    stock_by_part = {}
+    group_index = PartNumberIndex(threshold=GROUP_MATCH_THRESHOLD)  # Group keys of stock_by_part, in insertion order
+    
+    # Initialize stock_by_part with MAPPINGS FIRST (map once, use forever)
+    # This ensures mappings persist even when vendor invoices are deleted
+    for mapping in mapping_data:
+        part_number = mapping.get("part_number")
+        vendor_desc = mapping.get("vendor_description")
+        customer_item = mapping.get("customer_item_name")
+        
+        if not part_number or not vendor_desc:
+            continue
+        
+        # Find existing group with fuzzy match (same logic as before)
+        matched_group = group_index.first_match(part_number)
+        
+        group_key = matched_group or part_number
+        
+        if group_key not in stock_by_part:
+            group_index.add(group_key)
+            # Create entry with mapping data, zero transactional data
+            stock_by_part[group_key] = _new_entry(group_key, vendor_desc)
+        
+        # Add customer item if not already in list
+        if customer_item and customer_item not in stock_by_part[group_key]["customer_items"]:
+            stock_by_part[group_key]["customer_items"].append(customer_item)
+    
+    # Fill IN transactions from vendor invoices (if any exist)
+    for item in vendor_data:
+        part_number = item.get("part_number", "")
+        internal_item_name = item.get("description", "")
+        
+        if not part_number:
+            continue
+        
+        # Find existing group with fuzzy match
+        matched_group = group_index.first_match(part_number)
+        
+        group_key = matched_group or part_number
+        
+        # If this part doesn't have a mapping, create entry from vendor invoice
+        if group_key not in stock_by_part:
+            group_index.add(group_key)
+            stock_by_part[group_key] = _new_entry(group_key, internal_item_name)
+            stock_by_part[group_key]["vendor_rate"] = item.get("rate")
+            stock_by_part[group_key]["last_vendor_invoice_date"] = item.get("invoice_date")
+        
+        _add_vendor_item(stock_by_part[group_key], item)
+    
+    return stock_by_part, group_index
+
+
+def _stock_records(username: str, stock_by_part: Dict[str, Dict[str, Any]], mapping_data: List[Dict[str, Any]],
+                   existing_stock_levels: List[Dict[str, Any]], now: str) -> List[Dict[str, Any]]:
+    """
+    stock_levels rows for the stock entries, then for the existing rows of parts
+    without any (kept with their name and old stock).
+    """
+    # Old Stock: Still from existing stock_levels (transactional snapshot)
+    # key: (part_number, internal_item_name) -> old_stock
+    existing_values = {}
+    for stock in existing_stock_levels:
+        existing_values[(stock.get("part_number"), stock.get("internal_item_name"))] = stock.get("old_stock")
+    
+    # Priority and Reorder Point come from the MAPPING TABLE (mapping_lookup)
+    # key: part_number -> {customer_item, priority, reorder_point}
+    mapping_lookup = _mapping_lookup(mapping_data)
+    
+    stock_records = []
+    for part, data in stock_by_part.items():
+        mapping_info = mapping_lookup.get(part, {})
+        reorder_point = mapping_info.get("reorder_point")
+        if reorder_point is None:
+            reorder_point = DEFAULT_REORDER_POINT
+        
+        stock_records.append(_stock_record(
+            username, data, existing_values.get((part, data["internal_item_name"])),
+            mapping_info.get("priority"), reorder_point, now
+        ))
+    
+    # Add orphaned items (exist in stock_levels but have no transactions)
+    # These are items uploaded from mapping sheets that haven't been purchased/sold yet.
+    # Their mapping fields follow the remaining mappings (cleared when none are left).
+    orphaned_items = [
+        existing_item for existing_item in existing_stock_levels
+        if existing_item.get("part_number") and existing_item["part_number"] not in stock_by_part
+    ]
+    orphan_customer_items = _customer_items_by_part(mapping_data, {item["part_number"] for item in orphaned_items})
+    
+    for existing_item in orphaned_items:
+        part_num = existing_item["part_number"]
+        internal_name = existing_item.get("internal_item_name")
+        mapping_info = mapping_lookup.get(part_num, {})
+        customer_items = orphan_customer_items.get(part_num)
+        
+        stock_records.append({
+            "username": username,
+            "part_number": part_num,
+            "internal_item_name": internal_name or "Unknown Item",
+            "vendor_description": existing_item.get("vendor_description") or internal_name or "Unknown Item",
+            "customer_items": ", ".join(customer_items) if customer_items else None,
+            "current_stock": 0,  # No transactions yet
+            "total_in": 0,
+            "total_out": 0,
+            "reorder_point": mapping_info.get("reorder_point") or DEFAULT_REORDER_POINT,
+            "old_stock": existing_item.get("old_stock"),
+            "priority": mapping_info.get("priority"),
+            "vendor_rate": None,
+            "customer_rate": None,
+            "unit_value": 0,
+            "total_value": 0,
+            "last_vendor_invoice_date": None,
+            "last_customer_invoice_date": None,
+            "updated_at": now
+        })
+        logger.info(f"🔄 Preserved orphaned item: {part_num} (no transactions)")
+    
+    return stock_records
+
+
+def _write_stock_levels(db, username: str, stock_records: List[Dict[str, Any]], existing_rows: List[Dict[str, Any]],
+                        only_changed: bool = False) -> Tuple[int, int, int]:
+    """
+    Replace a user's stock_levels rows without ever leaving the table empty.
+
+    Records for part numbers that already have a row are written over that row
+    (by id), new part numbers are inserted, and rows left over afterwards are deleted.
+    With only_changed, records equal to their row (apart from updated_at) are not written.
+    
+    Returns:
+        Tuple of (rows updated, rows inserted, rows removed)
+    """
+    rows_by_part: Dict[Any, List[Dict[str, Any]]] = {}
+    for row in existing_rows:
+        rows_by_part.setdefault(row.get("part_number"), []).append(row)
+
+    updates, inserts = [], []
+    for record in stock_records:
+        rows = rows_by_part.get(record["part_number"])
+        if not rows:
+            inserts.append(record)
+            continue
+        row = rows.pop(0)
+        if only_changed and all(row.get(key) == value for key, value in record.items() if key != "updated_at"):
+            continue
+        updates.append({"id": row["id"], **record})
+    stale_ids = [row["id"] for rows in rows_by_part.values() for row in rows]
+
+    if updates:
+        db.batch_upsert("stock_levels", updates, batch_size=500)
+    if inserts:
+        db.batch_insert("stock_levels", inserts)
+    for i in range(0, len(stale_ids), STOCK_DELETE_CHUNK_SIZE):
+        db.delete_in("stock_levels", "id", stale_ids[i:i + STOCK_DELETE_CHUNK_SIZE], match={"username": username})
+
+    logger.info(f"stock_levels written: {len(updates)} updated, {len(inserts)} inserted, {len(stale_ids)} removed")
+    return len(updates), len(inserts), len(stale_ids)
+
+
+def recalculate_stock_for_user(username: str):
+    """
+    Core logic to recalculate stock levels for a user.
+
+    Rebuilds every stock row from all vendor invoice items, verified sales and
+    mappings. This is the reconciliation job for apply_stock_movements(); rows are
+    written over in place, so the stock page never sees an empty table.
+    """
+    with stock_lock(username):
+        _recalculate_stock_for_user(username)
+
+
+def _recalculate_stock_for_user(username: str):
+    db = get_database_client()
+
+    logger.info(f"Starting stock recalculation for {username}")
+
+    # 1. Get all vendor invoice items (IN transactions) - EXCLUDING items marked as deleted
+    vendor_data = list(iter_table_rows(
+        "inventory_items",
+        username,
+        columns=VENDOR_ITEM_COLUMNS,
+        filters={"excluded_from_stock": False}
+    ))
+    logger.info(f"Found {len(vendor_data)} vendor invoice items")
+
+    # 2. Customer sales items (OUT transactions) are streamed from verified_invoices in step 6
+
+    # 3. Get inventory mappings (customer item, part, vendor desc, priority, reorder)
+    mapping_data = _load_mappings(username)
+    logger.info(f"Found {len(mapping_data)} inventory mappings")
+
+    # 4. GET EXISTING STOCK LEVELS TO PRESERVE MANUAL EDITS (Old Stock only)
+    # Priority and Reorder are now sourced from vendor_mapping_entries
+    existing_stock_levels = list(iter_table_rows(
+        "stock_levels",
+        username,
+        columns=["part_number", "internal_item_name", "vendor_description", "old_stock"]
+    ))
+    logger.info(f"Found {len(existing_stock_levels)} existing stock levels to preserve")
+
+    # 5. Group MAPPINGS FIRST (map once, use forever), then fill IN transactions from vendor invoices
+    logger.info(f"🔷 Step 1-2: Grouping {len(mapping_data)} mappings and {len(vendor_data)} vendor invoices")
+
+    stock_by_part, _ = _group_stock_entries(mapping_data, vendor_data)
+
+    # 6. Build part_to_customer_items mapping ONCE (optimize from O(n²) to O(n))
+    # For each part_number in stock_by_part, find customer_items via 98% fuzzy match
+    logger.info(f"🔷 Step 3: Building part-to-customer mapping for {len(stock_by_part)} parts")
+
+    part_to_customer_items = _customer_items_by_part(mapping_data, stock_by_part.keys())
+
+    logger.info(f"🔷 Step 4: Processing sales transactions (streamed from verified_invoices)")
+
+    # Collapse sales to unique lowercased descriptions, then match each one against
+    # the mapped customer items (90% threshold)
+    desc_index, desc_qty, desc_latest, sales_count = _collapse_sales(iter_verified_invoices(
+        username,
+        columns=SALE_COLUMNS,
+        filters={"type": "Part"},
+        prefetch=True
+    ))
+    sales_by_part = match_sales_to_parts(list(desc_index), part_to_customer_items, threshold=SALES_MATCH_THRESHOLD)
+    qty_by_desc = np.asarray(desc_qty, dtype=np.float64)
+
+    for part_number, matches in sales_by_part.items():
+        _add_sales(stock_by_part[part_number], matches, qty_by_desc, desc_latest)
+
+    logger.info(f"Processed {sales_count} sales invoice items")
+
+    # 7-8. Calculate current stock and values, keeping orphaned items (no transactions)
+    stock_records = _stock_records(username, stock_by_part, mapping_data, existing_stock_levels, datetime.now().isoformat())
+
+    # 9. Write the new stock levels over the existing rows
+    if stock_records:
+        _write_stock_levels(db, username, stock_records, existing_stock_levels)
+
+        logger.info(f"✅ Recalculated {len(stock_records)} stock levels for {username}")
+    else:
+        logger.warning(f"No stock records calculated for {username}")
+
+
+def _add_vendor_item(entry: Dict[str, Any], item: Dict[str, Any]):
+    """Add a vendor invoice item's quantity and update the latest rate/date"""
+    entry["total_in"] += float(item.get("qty", 0) or 0)
+
+    # Update vendor_description if it was created from mapping without invoice
+    if not entry.get("internal_item_name"):
+        entry["internal_item_name"] = item.get("description", "")
+        entry["vendor_description"] = item.get("description", "")
+
+    # Update latest rate and date
+    if item.get("invoice_date"):
+        existing_date = entry["last_vendor_invoice_date"]
+        if not existing_date or item["invoice_date"] > existing_date:
+            entry["last_vendor_invoice_date"] = item["invoice_date"]
+            entry["vendor_rate"] = item.get("rate")
+
+
+def _has_transactions(row: Dict[str, Any]) -> bool:
+    """Whether a stock_levels row has any vendor items or sales counted"""
+    return bool(
+        row.get("total_in") or row.get("total_out") or row.get("vendor_rate") is not None
+        or row.get("last_vendor_invoice_date") or row.get("last_customer_invoice_date")
+    )
+
+
+def apply_stock_movements(
+    username: str,
+    vendor_added: Iterable[Dict[str, Any]] = (),
+    vendor_removed: Iterable[Dict[str, Any]] = (),
+    sales_added: Iterable[Dict[str, Any]] = (),
+    sales_removed: Iterable[Dict[str, Any]] = (),
+    mapping_parts: Iterable[str] = ()
+) -> Dict[str, Any]:
+    """
+    Apply stock movements to the affected stock_levels rows only.
+
+    Call after the change is saved. Rows come out exactly as the full recalculation
+    would write them: the groups are rebuilt from all mappings and vendor items
+    (99% part number matches, in the same order), and the sales (OUT) side is
+    re-derived from all verified sales for the groups a movement can affect (a
+    sale counts toward every row whose mapped customer items match it, 90%); other
+    rows keep the sales they have counted. Nothing is added to a saved total, so
+    applying the same movements twice, or after a full recalculation has already
+    counted them, changes nothing. Only rows that differ are written. If the
+    ledger update fails, a full recalculation of the user's stock is scheduled
+    instead.
+
+    Edit = remove the old row + add the new one.
+
+    Args:
+        username: Username
+        vendor_added: inventory_items rows added (part_number, description, qty, rate, invoice_date)
+        vendor_removed: inventory_items rows deleted, or old versions of edited rows
+        sales_added: verified_invoices rows added (type, description, quantity, rate, date)
+        sales_removed: verified_invoices rows deleted, or old versions of edited rows
+        mapping_parts: Part numbers whose vendor_mapping_entries changed
+
+    Returns:
+        Dictionary with mode ("delta", "reconcile" or "none"), rows_updated,
+        rows_inserted, rows_removed, rows_rederived (rows whose sales were
+        re-derived) and seconds
+    """
+    started = time.perf_counter()
+    vendor_added = [_vendor_movement(item) for item in vendor_added if _counts_as_stock(item)]
+    vendor_removed = [_vendor_movement(item) for item in vendor_removed if _counts_as_stock(item)]
+    sales_added = [_sale_movement(item) for item in sales_added if item.get("type") == "Part"]
+    sales_removed = [_sale_movement(item) for item in sales_removed if item.get("type") == "Part"]
+    mapping_parts = list(dict.fromkeys(part for part in mapping_parts if part))
+
+    report = {"mode": "none", "rows_updated": 0, "rows_inserted": 0, "rows_removed": 0, "rows_rederived": 0, "seconds": 0.0}
+    if not (vendor_added or vendor_removed or sales_added or sales_removed or mapping_parts):
+        return report
+
+    with stock_lock(username):
+        try:
+            report.update(_apply_movements(username, vendor_added, vendor_removed, sales_added, sales_removed, mapping_parts))
+            report["mode"] = "delta"
+        except Exception as e:
+            logger.error(f"Stock ledger update failed for {username}, scheduling a full recalculation: {e}")
+            get_stock_scheduler().request(username, reason="ledger")
+            report["mode"] = "reconcile"
+
+    report["seconds"] = round(time.perf_counter() - started, 3)
+    logger.info(
+        f"Stock ledger ({report['mode']}) for {username}: {len(vendor_added)}+/{len(vendor_removed)}- vendor items, "
+        f"{len(sales_added)}+/{len(sales_removed)}- sales, {len(mapping_parts)} mappings -> "
+        f"{report['rows_updated']} rows updated, {report['rows_inserted']} inserted, {report['rows_removed']} removed "
+        f"({report['rows_rederived']} sales re-derived) in {report['seconds']}s"
+    )
+    return report
+
+
+def _counts_as_stock(item: Dict[str, Any]) -> bool:
+    return bool(item.get("part_number")) and not item.get("excluded_from_stock")
+
+
+def _vendor_movement(item: Dict[str, Any]) -> Dict[str, Any]:
+    return {**item, "invoice_date": _iso_date(item.get("invoice_date"))}
+
+
+def _sale_movement(item: Dict[str, Any]) -> Dict[str, Any]:
+    return {**item, "date": _iso_date(item.get("date"))}
+
+
+def _apply_movements(
+    username: str,
+    vendor_added: List[Dict[str, Any]],
+    vendor_removed: List[Dict[str, Any]],
+    sales_added: List[Dict[str, Any]],
+    sales_removed: List[Dict[str, Any]],
+    mapping_parts: List[str]
+) -> Dict[str, int]:
+    db = get_database_client()
+
+    # Grouping is order dependent (a group is named after its first mapping or vendor
+    # item and takes the first match), so the groups are rebuilt like the full
+    # recalculation does rather than patched. That is index lookups only; matching
+    # all sales against all groups is the expensive part the ledger avoids.
+    mapping_data = _load_mappings(username)
+    existing_rows = list(iter_table_rows("stock_levels", username))
+    stock_by_part, group_index = _group_stock_entries(mapping_data, iter_table_rows(
+        "inventory_items",
+        username,
+        columns=VENDOR_ITEM_COLUMNS,
+        filters={"excluded_from_stock": False}
+    ))
+
+    rows: Dict[str, Dict[str, Any]] = {}
+    for row in existing_rows:
+        rows.setdefault(row.get("part_number"), row)
+
+    # Groups whose sales (OUT) may have changed: new groups, groups getting their first
+    # vendor items (their row may have been kept without transactions), groups whose
+    # mapped customer items changed, and the groups matching a sale added or removed
+    rederive: Set[str] = set()
+    changed_mappings = PartNumberIndex(threshold=MAPPING_MATCH_THRESHOLD)
+    for part_number in mapping_parts:
+        changed_mappings.add(part_number)
+    for part_number, entry in stock_by_part.items():
+        row = rows.get(part_number)
+        row_items = row["customer_items"].split(", ") if row and row.get("customer_items") else []
+        if (
+            row is None
+            or (_has_transactions(entry) and not _has_transactions(row))
+            or row_items[:len(entry["customer_items"])] != entry["customer_items"]
+            or changed_mappings.matches(part_number)
+        ):
+            rederive.add(part_number)
+
+    if sales_added or sales_removed:
+        part_to_customer_items = _customer_items_by_part(mapping_data, stock_by_part.keys())
+        desc_index, _, _, _ = _collapse_sales([*sales_added, *sales_removed])
+        rederive.update(match_sales_to_parts(list(desc_index), part_to_customer_items, threshold=SALES_MATCH_THRESHOLD))
+    
+    # Every other group keeps the sales its row has counted
+    for part_number, entry in stock_by_part.items():
+        if part_number not in rederive:
+            row = rows[part_number]
+            entry.update(
+                total_out=float(row.get("total_out") or 0),
+                customer_items=row["customer_items"].split(", ") if row.get("customer_items") else [],
+                customer_rate=row.get("customer_rate"),
+                last_customer_invoice_date=row.get("last_customer_invoice_date")
+            )
+    if rederive:
+        _rederive_sales_side(username, {part: stock_by_part[part] for part in rederive}, mapping_data)
+    
+    stock_records = _stock_records(username, stock_by_part, mapping_data, existing_rows, datetime.now().isoformat())
+    rows_updated, rows_inserted, rows_removed = _write_stock_levels(
+        db, username, stock_records, existing_rows, only_changed=True
+    )
+    return {
+        "rows_updated": rows_updated,
+        "rows_inserted": rows_inserted,
+        "rows_removed": rows_removed,
+        "rows_rederived": len(rederive)
+    }
+
+
+def _rederive_sales_side(username: str, entries: Dict[str, Dict[str, Any]], mapping_data: List[Dict[str, Any]]):
+    """Add all verified sales matching their mapped customer items to some stock entries"""
+    part_to_customer_items = _customer_items_by_part(mapping_data, entries.keys())
+    if not part_to_customer_items:
+        return
+
+    desc_index, desc_qty, desc_latest, _ = _collapse_sales(iter_verified_invoices(
+        username,
+        columns=SALE_COLUMNS,
+        filters={"type": "Part"},
+        prefetch=True
+    ))
+    qty_by_desc = np.asarray(desc_qty, dtype=np.float64)
+    sales_by_part = match_sales_to_parts(list(desc_index), part_to_customer_items, threshold=SALES_MATCH_THRESHOLD)
+    for part_number, matches in sales_by_part.items():
+        _add_sales(entries[part_number], matches, qty_by_desc, desc_latest)
+
+
+def verified_sales_changes(
+    previous: Dict[str, Dict[str, Any]],
+    records: List[Dict[str, Any]]
+) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Stock movements of re-written verified_invoices rows.
+
+    Args:
+        previous: str(row_id) -> saved row before the write (SALE_STOCK_FIELDS at least)
+        records: Rows written (with row_id)
+
+    Returns:
+        Tuple of (sales_added, sales_removed) for apply_stock_movements(); rows whose
+        stock fields are unchanged are left out
+    """
+    def stock_fields(row):
+        quantity, rate = row.get("quantity"), row.get("rate")
+        return (
+            row.get("type"),
+            row.get("description"),
+            float(quantity or 0),
+            None if rate is None else float(rate),
+            _iso_date(row.get("date"))
+        )
+
+    sales_added, sales_removed = [], []
+    for record in records:
+        old = previous.get(str(record.get("row_id")))
+        if old is not None and stock_fields(old) == stock_fields(record):
+            continue
+        if old is not None:
+            sales_removed.append(old)
+        sales_added.append(record)
+    return sales_added, sales_removed
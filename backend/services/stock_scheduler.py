@@ -0,0 +1,217 @@
+"""
+Background stock recalculation scheduler.
+Full stock recalculations are requested per user and coalesced: requests made
+within STOCK_RECALC_DEBOUNCE_SECONDS of each other share one run (a steady stream
+of requests still runs every STOCK_RECALC_MAX_DELAY_SECONDS), at most one run per
+user is in flight, and requests made during a run schedule a single follow-up run.
+Callers get a ticket they can wait on (sync or async) or poll with status().
+"""
+import os
+import time
+import asyncio
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+# Quiet period after the latest request before a user's recalculation starts
+STOCK_RECALC_DEBOUNCE_SECONDS = float(os.getenv("STOCK_RECALC_DEBOUNCE_SECONDS", "2"))
+
+# Longest a request waits for its run to start while new requests keep arriving
+STOCK_RECALC_MAX_DELAY_SECONDS = float(os.getenv("STOCK_RECALC_MAX_DELAY_SECONDS", "10"))
+
+# Recalculations running at once (always different users)
+STOCK_RECALC_WORKERS = int(os.getenv("STOCK_RECALC_WORKERS", "2"))
+
+
+class _UserState:
+    """Scheduling state of one user's recalculations (guarded by the scheduler lock)"""
+
+    def __init__(self):
+        self.requested = 0       # Ticket of the latest request
+        self.covered = 0         # Latest ticket the running (or last) run covers
+        self.completed = 0       # Latest ticket whose run has finished
+        self.due_at: Optional[float] = None
+        self.first_pending_at: Optional[float] = None
+        self.running = False
+        self.requests = 0
+        self.runs = 0
+        self.last_reason: Optional[str] = None
+        self.last_finished_at: Optional[float] = None
+        self.last_seconds: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+
+class StockRecalcScheduler:
+    """Debounces, coalesces and runs per-user stock recalculations on a worker pool"""
+
+    def __init__(self, recalculate: Callable[[str], Any], debounce_seconds: float = STOCK_RECALC_DEBOUNCE_SECONDS,
+                 max_delay_seconds: float = STOCK_RECALC_MAX_DELAY_SECONDS, workers: int = STOCK_RECALC_WORKERS):
+        self.recalculate = recalculate
+        self.debounce_seconds = debounce_seconds
+        self.max_delay_seconds = max(max_delay_seconds, debounce_seconds)
+        self._users: Dict[str, _UserState] = {}
+        self._cond = threading.Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="stock-recalc")
+
+        self._thread = threading.Thread(target=self._dispatch, name="stock-recalc-dispatcher", daemon=True)
+        self._thread.start()
+        logger.info(f"Stock recalculation scheduler started (debounce {debounce_seconds}s, "
+                    f"max delay {self.max_delay_seconds}s, {workers} workers)")
+
+    def request(self, username: str, reason: str = "manual", delay: Optional[float] = None) -> int:
+        """
+        Request a full stock recalculation for a user.
+
+        Args:
+            username: Username to recalculate
+            reason: Short label of the trigger, for logs and status
+            delay: Debounce window for this request (default: debounce_seconds; 0 runs as soon as possible)
+
+        Returns:
+            Ticket to pass to wait() / wait_async(); a run started after this call covers it
+        """
+        delay = self.debounce_seconds if delay is None else max(0.0, delay)
+        with self._cond:
+            state = self._users.setdefault(username, _UserState())
+            now = time.monotonic()
+            state.requested += 1
+            state.requests += 1
+            state.last_reason = reason
+            if state.first_pending_at is None:
+                state.first_pending_at = now
+            state.due_at = min(now + delay, state.first_pending_at + self.max_delay_seconds)
+            self._cond.notify_all()
+            logger.debug(f"Stock recalculation requested for {username} ({reason}), ticket {state.requested}")
+            return state.requested
+
+    def wait(self, username: str, ticket: int, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """
+        Block until the run covering a ticket has finished (or the timeout expires).
+
+        Returns:
+            status() of the user, with done telling whether the ticket's run has finished
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            state = self._users.setdefault(username, _UserState())
+            while state.completed < ticket:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return self._status(username, state, ticket)
+
+    async def wait_async(self, username: str, ticket: int, timeout: Optional[float] = None) -> Dict[str, Any]:
+        """Like wait(), without blocking the event loop"""
+        return await asyncio.get_running_loop().run_in_executor(None, partial(self.wait, username, ticket, timeout))
+
+    def status(self, username: str, ticket: Optional[int] = None) -> Dict[str, Any]:
+        """
+        Get a user's recalculation state for polling.
+
+        Returns:
+            Dictionary with state ("idle", "pending" or "running"), requested, completed,
+            done (for ticket, or the latest request), requests, runs, coalesced and last-run details
+        """
+        with self._cond:
+            return self._status(username, self._users.get(username) or _UserState(), ticket)
+
+    def stats(self) -> Dict[str, Any]:
+        """Get request and run counts across all users"""
+        with self._cond:
+            requests = sum(state.requests for state in self._users.values())
+            runs = sum(state.runs for state in self._users.values())
+            return {
+                "users": len(self._users),
+                "pending": sum(1 for state in self._users.values() if state.due_at is not None),
+                "running": sum(1 for state in self._users.values() if state.running),
+                "requests": requests,
+                "runs": runs,
+                "coalesced": requests - runs
+            }
+
+    def _status(self, username: str, state: _UserState, ticket: Optional[int]) -> Dict[str, Any]:
+        ticket = state.requested if ticket is None else ticket
+        if state.running:
+            current = "running"
+        elif state.due_at is not None:
+            current = "pending"
+        else:
+            current = "idle"
+        return {
+            "username": username,
+            "state": current,
+            "ticket": ticket,
+            "requested": state.requested,
+            "completed": state.completed,
+            "done": state.completed >= ticket,
+            "requests": state.requests,
+            "runs": state.runs,
+            "coalesced": state.requests - state.runs,
+            "last_reason": state.last_reason,
+            "last_seconds": state.last_seconds,
+            "last_finished_ago": (
+                round(time.monotonic() - state.last_finished_at, 1) if state.last_finished_at is not None else None
+            ),
+            "last_error": state.last_error
+        }
+
+    def _dispatch(self):
+        """Start due runs; users with a run in flight wait for it to finish"""
+        with self._cond:
+            while True:
+                now = time.monotonic()
+                next_due = None
+                for username, state in self._users.items():
+                    if state.due_at is None or state.running:
+                        continue
+                    if state.due_at <= now:
+                        state.running = True
+                        state.covered = state.requested
+                        state.due_at = state.first_pending_at = None
+                        self._executor.submit(self._run, username, state)
+                    elif next_due is None or state.due_at < next_due:
+                        next_due = state.due_at
+                self._cond.wait(None if next_due is None else next_due - now)
+
+    def _run(self, username: str, state: _UserState):
+        started = time.monotonic()
+        error = None
+        try:
+            self.recalculate(username)
+        except Exception as e:
+            error = str(e)
+            logger.error(f"Stock recalculation failed for {username}: {e}")
+        seconds = round(time.monotonic() - started, 3)
+
+        with self._cond:
+            state.running = False
+            state.runs += 1
+            state.completed = state.covered
+            state.last_finished_at = time.monotonic()
+            state.last_seconds = seconds
+            state.last_error = error
+            coalesced = state.requests - state.runs
+            self._cond.notify_all()
+        logger.info(f"Stock recalculation for {username} finished in {seconds}s "
+                    f"({coalesced} requests coalesced so far)")
+
+
+# Global scheduler instance
+_scheduler: Optional[StockRecalcScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_stock_scheduler() -> StockRecalcScheduler:
+    """Get the global stock recalculation scheduler, starting it on first use"""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                from services.stock_ledger import recalculate_stock_for_user
+                _scheduler = StockRecalcScheduler(recalculate_stock_for_user)
+    return _scheduler
@@ -113,6 +113,26 @@ class R2StorageClient:
             logger.error(f"Failed to download from R2: {e}")
             return None
     
+    def get_file_size(self, bucket: str, key: str) -> Optional[int]:
+        """
+        Get the size of a file in R2 without downloading it
+        
+        Args:
+            bucket: R2 bucket name
+            key: Object key (path) in R2
+        
+        Returns:
+            Size in bytes, or None if failed
+        """
+        try:
+            client = self.get_client()
+            response = client.head_object(Bucket=bucket, Key=key)
+            return response.get('ContentLength')
+        
+        except ClientError as e:
+            logger.warning(f"Failed to read R2 object size: {e}")
+            return None
+    
     def delete_file(self, bucket: str, key: str) -> bool:
         """
         Delete a file from R2
@@ -2,9 +2,11 @@
 Verification workflow service.
 Contains build_verified() and run_sync_verified_logic() ported from old processor.
 """
+import os
+import numpy as np
 import pandas as pd
 import logging
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
 from datetime import datetime
 
 from utils.date_helpers import normalize_date, format_to_mmm, safe_format_date_series
@@ -13,6 +15,11 @@ from utils.date_helpers import normalize_date, format_to_mmm, safe_format_date_s
 
 logger = logging.getLogger(__name__)
 
+# Incremental Sync & Finish: invoices changed up to this many seconds before the
+# watermark are read again, covering writes whose transaction committed after a
+# later timestamp had already been seen
+SYNC_WATERMARK_OVERLAP_SECONDS = int(os.getenv("SYNC_WATERMARK_OVERLAP_SECONDS", "300"))
+
 
 def _find_col(df: pd.DataFrame, candidates: list) -> Optional[str]:
     """Find a column in the dataframe using case-insensitive matching"""
@@ -41,19 +48,18 @@ def build_verified(df_raw: pd.DataFrame, df_date: pd.DataFrame, df_amount: pd.Da
     rowid_col_date = _find_col(date, ["row_id", "Row_Id", "Row ID", "rowid"])
     rowid_col_amount = _find_col(amount, ["row_id", "Row_Id", "Row ID", "rowid"])
 
-    def clean_link(x):
-        if pd.isna(x):
-            return pd.NA
-        s = str(x).strip()
-        return s if s else pd.NA
+    def column_or(df, name, fill):
+        """df[name], or a column of fill values if df has no such column"""
+        return df[name] if name in df.columns else pd.Series([fill] * len(df))
 
-    def as_str_trim(x):
-        if pd.isna(x):
-            return ""
-        s = str(x).strip()
-        if s.endswith('.0'):
-            s = s[:-2]
-        return s
+    def clean_link(series):
+        """Stripped links as strings; NA for missing or blank links"""
+        cleaned = series.astype(str).str.strip()
+        return cleaned.where(series.notna() & (cleaned != ""), pd.NA)
+    
+    def as_str_trim(series):
+        """Stripped strings without a trailing '.0' (receipt numbers read as floats)"""
+        return series.str.strip().str.replace(r"\.0$", "", regex=True)
 
     def fix_date(series):
         """Parse dates using explicit dd-mm-yyyy or dd-MMM-yyyy format"""
@@ -80,33 +86,35 @@ def build_verified(df_raw: pd.DataFrame, df_date: pd.DataFrame, df_amount: pd.Da
             
             return pd.NaT
         
-        dt = series.apply(parse_single_date)
-        result = dt.apply(lambda x: x.strftime("%d-%b-%Y") if pd.notna(x) else "")
-        return result
+        # Parse each distinct value once; invoices repeat the same few dates across many line items
+        codes, uniques = pd.factorize(series)
+        formatted = [parse_single_date(val) for val in uniques]
+        formatted = np.array([x.strftime("%d-%b-%Y") if pd.notna(x) else "" for x in formatted] + [""], dtype=object)
+        return pd.Series(formatted[codes], index=series.index)
 
     # Clean and prepare data
-    raw["Receipt Link_clean"] = raw.get("Receipt Link", pd.Series([pd.NA]*len(raw))).apply(clean_link)
-    raw["Receipt Number_str"] = raw.get("Receipt Number", pd.Series([""]*len(raw))).astype(str).fillna("").apply(as_str_trim)
-    raw["Date"] = fix_date(raw.get("Date", pd.Series([pd.NA]*len(raw))))
+    raw["Receipt Link_clean"] = column_or(raw, "Receipt Link", pd.NA).pipe(clean_link)
+    raw["Receipt Number_str"] = column_or(raw, "Receipt Number", "").astype(str).fillna("").pipe(as_str_trim)
+    raw["Date"] = fix_date(column_or(raw, "Date", pd.NA))
 
-    date["Receipt Link_clean"] = date.get("Receipt Link", pd.Series([pd.NA]*len(date))).apply(clean_link)
-    date["Receipt Number_str"] = date.get("Receipt Number", pd.Series([""]*len(date))).astype(str).fillna("").apply(as_str_trim)
-    date["Verification Status_clean"] = date.get("Verification Status", pd.Series([""]*len(date))).astype(str).str.strip().str.lower()
+    date["Receipt Link_clean"] = column_or(date, "Receipt Link", pd.NA).pipe(clean_link)
+    date["Receipt Number_str"] = column_or(date, "Receipt Number", "").astype(str).fillna("").pipe(as_str_trim)
+    date["Verification Status_clean"] = column_or(date, "Verification Status", "").astype(str).str.strip().str.lower()
     
     # DEBUG: Log verification status values
     if not date.empty:
         status_counts = date["Verification Status_clean"].value_counts()
         logger.info(f"🔍 Date verification statuses: {status_counts.to_dict()}")
     
-    amount["Receipt Link_clean"] = amount.get("Receipt Link", pd.Series([pd.NA]*len(amount))).apply(clean_link)
-    amount["Receipt Number_str"] = amount.get("Receipt Number", pd.Series([""]*len(amount))).astype(str).fillna("").apply(as_str_trim)
-    amount["Verification Status_clean"] = amount.get("Verification Status", pd.Series([""]*len(amount))).astype(str).str.strip().str.lower()
+    amount["Receipt Link_clean"] = column_or(amount, "Receipt Link", pd.NA).pipe(clean_link)
+    amount["Receipt Number_str"] = column_or(amount, "Receipt Number", "").astype(str).fillna("").pipe(as_str_trim)
+    amount["Verification Status_clean"] = column_or(amount, "Verification Status", "").astype(str).str.strip().str.lower()
     
     # DEBUG: Log verification status values 
     if not amount.empty:
         status_counts = amount["Verification Status_clean"].value_counts()
         logger.info(f"🔍 Amount verification statuses: {status_counts.to_dict()}")
-    date["Date"] = fix_date(date.get("Date", pd.Series([pd.NA]*len(date))))
+    date["Date"] = fix_date(column_or(date, "Date", pd.NA))
     
     if "Upload Date" in date.columns:
         date["Upload Date_dt"] = pd.to_datetime(date["Upload Date"], errors="coerce")
@@ -114,10 +122,6 @@ def build_verified(df_raw: pd.DataFrame, df_date: pd.DataFrame, df_amount: pd.Da
     else:
         date = date.drop_duplicates(subset=["Receipt Link_clean", "Receipt Number_str"], keep="last")
 
-    amount["Receipt Link_clean"] = amount.get("Receipt Link", pd.Series([pd.NA]*len(amount))).apply(clean_link)
-    amount["Receipt Number_str"] = amount.get("Receipt Number", pd.Series([""]*len(amount))).astype(str).fillna("").apply(as_str_trim)
-    amount["Verification Status_clean"] = amount.get("Verification Status", pd.Series([""]*len(amount))).astype(str).str.strip().str.lower()
-    
     if "Upload Date" in amount.columns:
         amount["Upload Date_dt"] = pd.to_datetime(amount["Upload Date"], errors="coerce")
         amount = amount.sort_values("Upload Date_dt").drop_duplicates(
@@ -186,7 +190,7 @@ def build_verified(df_raw: pd.DataFrame, df_date: pd.DataFrame, df_amount: pd.Da
         raw["Receipt Link_clean"].isin(amount_links_all) |
         raw["Receipt Number_str"].isin(date_numbers_all) |
         raw["Receipt Number_str"].isin(amount_numbers_all) |
-        raw.get(rowid_col_raw, pd.Series([pd.NA]*len(raw))).astype(str).isin(amount_rowids_all)
+        column_or(raw, rowid_col_raw, pd.NA).astype(str).isin(amount_rowids_all)
     )
 
     # Base dataframe: records NOT in verification or already verified
@@ -195,7 +199,7 @@ def build_verified(df_raw: pd.DataFrame, df_date: pd.DataFrame, df_amount: pd.Da
     
     if excluded_row_ids and rowid_col_raw:
         before_exclude = len(base_df)
-        base_df = base_df[~base_df.get(rowid_col_raw, pd.Series([""] * len(base_df))).astype(str).isin(excluded_row_ids)].copy()
+        base_df = base_df[~column_or(base_df, rowid_col_raw, "").astype(str).isin(excluded_row_ids)].copy()
         logger.info(f"📊 After excluding pending row_ids: {len(base_df)} records (removed {before_exclude - len(base_df)})")
     
     # NEW: Exclude any records with Receipt Numbers that are Pending in ANY sheet
@@ -219,12 +223,12 @@ def build_verified(df_raw: pd.DataFrame, df_date: pd.DataFrame, df_amount: pd.Da
     mask_candidate_date_done = raw["Receipt Link_clean"].isin(date_done_links)
     mask_candidate_amount_done_rowid = False
     if rowid_col_raw:
-        mask_candidate_amount_done_rowid = raw.get(rowid_col_raw, pd.Series([""]*len(raw))).astype(str).isin(amount_done_rowids)
+        mask_candidate_amount_done_rowid = column_or(raw, rowid_col_raw, "").astype(str).isin(amount_done_rowids)
     mask_candidate_amount_done_number = raw["Receipt Number_str"].isin(amount_done_numbers)
 
     mask_blocked_by_pending_rowid = False
     if rowid_col_raw and excluded_row_ids:
-        mask_blocked_by_pending_rowid = raw.get(rowid_col_raw, pd.Series([""] * len(raw))).astype(str).isin(excluded_row_ids)
+        mask_blocked_by_pending_rowid = column_or(raw, rowid_col_raw, "").astype(str).isin(excluded_row_ids)
     
     # NEW: Also block if Receipt Number is Pending in ANY sheet
     mask_blocked_by_pending_receipt = False
@@ -246,73 +250,53 @@ def build_verified(df_raw: pd.DataFrame, df_date: pd.DataFrame, df_amount: pd.Da
         logger.info(f"📊 After excluding rejected from included: {len(included_rows)} records (removed {before_exclude - len(included_rows)})")
 
     # Process orphaned Done records (exist only in verification tables, not in invoices)
+    # A Done row is orphaned if its row_id is in neither base_df nor included_rows
+    known_row_ids = set()
+    if rowid_col_raw and rowid_col_raw in base_df.columns:
+        known_row_ids.update(base_df[rowid_col_raw].astype(str).str.strip())
+    if not included_rows.empty and rowid_col_raw and rowid_col_raw in included_rows.columns:
+        known_row_ids.update(included_rows[rowid_col_raw].astype(str).str.strip())
+    
+    def synthetic_records(rows: pd.DataFrame, row_ids: pd.Series, fields: list) -> list:
+        """Synthetic invoice records (Review Status 'Verified') for orphaned verification rows"""
+        columns = [(rowid_col_raw, row_ids.tolist())]
+        for name, default in fields:
+            columns.append((name, rows[name].tolist() if name in rows.columns else [default] * len(rows)))
+        columns.append(('Review Status', ['Verified'] * len(rows)))
+        names = [name for name, _ in columns]
+        return [dict(zip(names, values)) for values in zip(*(values for _, values in columns))]
+    
     orphaned_records = []
+    orphaned_row_ids = set()
     
     # Get orphaned Done records from verification_dates
-    date_done_orphaned = date[date["Verification Status_clean"] == "done"].copy()
+    date_done_orphaned = date[date["Verification Status_clean"] == "done"]
     if not date_done_orphaned.empty and rowid_col_date:
-        for _, row in date_done_orphaned.iterrows():
-            # Check if this row_id exists in base_df or included_rows
-            row_id_val = str(row.get(rowid_col_date, ""))
-            if not row_id_val:
-                continue
-                
-            # If not in base_df and not in included_rows, it's orphaned
-            in_base = False
-            if rowid_col_raw and rowid_col_raw in base_df.columns:
-                in_base = base_df[rowid_col_raw].astype(str).str.strip().eq(row_id_val).any()
-            
-            in_included = False
-            if not included_rows.empty and rowid_col_raw and rowid_col_raw in included_rows.columns:
-                in_included = included_rows[rowid_col_raw].astype(str).str.strip().eq(row_id_val).any()
-            
-            if not in_base and not in_included:
-                # This is an orphaned record - create synthetic invoice record
-                synthetic_record = {
-                    rowid_col_raw: row_id_val,
-                    'Receipt Number': row.get('Receipt Number', ''),
-                    'Receipt Link': row.get('Receipt Link', ''),
-                    'Date': row.get('Date', None),
-                    'Upload Date': row.get('Upload Date', None),
-                    'Review Status': 'Verified'
-                }
-                orphaned_records.append(synthetic_record)
+        row_ids = date_done_orphaned[rowid_col_date].map(str)
+        orphan_mask = (row_ids != "") & ~row_ids.isin(known_row_ids)
+        orphaned_records.extend(synthetic_records(
+            date_done_orphaned[orphan_mask],
+            row_ids[orphan_mask],
+            [('Receipt Number', ''), ('Receipt Link', ''), ('Date', None), ('Upload Date', None)]
+        ))
+        orphaned_row_ids.update(row_ids[orphan_mask])
     
-    # Get orphaned Done records from verification_amounts  
-    amount_done_orphaned = amount[amount["Verification Status_clean"] == "done"].copy()
+    # Get orphaned Done records from verification_amounts (each row_id once, skipping date orphans)
+    amount_done_orphaned = amount[amount["Verification Status_clean"] == "done"]
     if not amount_done_orphaned.empty and rowid_col_amount:
-        for _, row in amount_done_orphaned.iterrows():
-            row_id_val = str(row.get(rowid_col_amount, ""))
-            if not row_id_val:
-                continue
-            
-            # Check if already processed as date orphan or exists in base/included
-            already_added = any(r.get(rowid_col_raw) == row_id_val for r in orphaned_records)
-            if already_added:
-                continue
-                
-            in_base = False
-            if rowid_col_raw and rowid_col_raw in base_df.columns:
-                in_base = base_df[rowid_col_raw].astype(str).str.strip().eq(row_id_val).any()
-            
-            in_included = False
-            if not included_rows.empty and rowid_col_raw and rowid_col_raw in included_rows.columns:
-                in_included = included_rows[rowid_col_raw].astype(str).str.strip().eq(row_id_val).any()
-            
-            if not in_base and not in_included:
-                # This is an orphaned record - create synthetic invoice record
-                synthetic_record = {
-                    rowid_col_raw: row_id_val,
-                    'Receipt Number': row.get('Receipt Number', ''),
-                    'Receipt Link': row.get('Receipt Link', ''),
-                    'Description': row.get('Description', ''),
-                    'Quantity': row.get('Quantity', None),
-                    'Rate': row.get('Rate', None),
-                    'Amount': row.get('Amount', None),
-                    'Upload Date': row.get('Upload Date', None),
-                    'Review Status': 'Verified'
-                }
-                orphaned_records.append(synthetic_record)
+        row_ids = amount_done_orphaned[rowid_col_amount].map(str)
+        orphan_mask = (
+            (row_ids != "")
+            & ~row_ids.isin(known_row_ids)
+            & ~row_ids.isin(orphaned_row_ids)
+            & ~row_ids.duplicated(keep="first")
+        )
+        orphaned_records.extend(synthetic_records(
+            amount_done_orphaned[orphan_mask],
+            row_ids[orphan_mask],
+            [('Receipt Number', ''), ('Receipt Link', ''), ('Description', ''), ('Quantity', None),
+             ('Rate', None), ('Amount', None), ('Upload Date', None)]
+        ))
     
     if orphaned_records:
         logger.info(f"📊 Found {len(orphaned_records)} orphaned Done records (not in invoices)")
@@ -373,7 +357,7 @@ def build_verified(df_raw: pd.DataFrame, df_date: pd.DataFrame, df_amount: pd.Da
             amt_merge = amount_done_df[[rowid_col_amount] + amt_cols].copy()
             amt_merge[rowid_col_amount] = amt_merge[rowid_col_amount].astype(str)
             amt_merge = amt_merge.drop_duplicates(subset=[rowid_col_amount], keep="last")
-            included_rows[rowid_col_raw] = included_rows.get(rowid_col_raw, pd.Series([""]*len(included_rows))).astype(str)
+            included_rows[rowid_col_raw] = column_or(included_rows, rowid_col_raw, "").astype(str)
             
             included_rows = included_rows.merge(
                 amt_merge.rename(columns={rowid_col_amount: rowid_col_raw}), 
@@ -638,7 +622,136 @@ Added to existing verification.py
 """
 
 
-async def run_sync_verified_logic_supabase(username: str, progress_callback=None) -> Dict[str, Any]:
+def _column_as_str(df: pd.DataFrame, column: str) -> pd.Series:
+    """A column as strings (str() of each value), or empty strings if the column is missing"""
+    if column in df.columns:
+        return df[column].map(str)
+    return pd.Series("", index=df.index, dtype=object)
+
+
+def _apply_date_corrections(df_raw: pd.DataFrame, date_done: pd.DataFrame) -> bool:
+    """
+    Copy corrected receipt numbers and dates from Done verification_dates rows onto
+    every invoice line item with the same receipt link (modifies df_raw in place).
+    When several Done rows share a link, each field takes the last non-empty value.
+    
+    Args:
+        df_raw: Invoices with Title Case columns
+        date_done: Done verification_dates rows with Title Case columns
+    
+    Returns:
+        True if any invoice row has the link of a Done row
+    """
+    links = date_done['Receipt Link'].astype(str).str.strip()
+    corrections = pd.DataFrame({
+        'link': links,
+        'Receipt Number': date_done['Receipt Number'].astype(str).str.replace(r'\.0$', '', regex=True),
+        'Date': date_done['Date'].apply(normalize_date)
+    })[links.notna() & (links != '')]
+    
+    raw_links = df_raw['Receipt Link'].astype(str).str.strip()
+    if not raw_links.isin(set(corrections['link'])).any():
+        return False
+    
+    for column in ['Receipt Number', 'Date']:
+        values = corrections[corrections[column] != ''].drop_duplicates(subset=['link'], keep='last')
+        new_values = raw_links.map(pd.Series(values[column].values, index=values['link'].values))
+        matched = raw_links.isin(values['link'])
+        if matched.any():
+            df_raw.loc[matched, column] = new_values[matched].infer_objects()
+    return True
+
+
+def _apply_amount_corrections(df_raw: pd.DataFrame, amt_done: pd.DataFrame) -> bool:
+    """
+    Copy corrected quantity, rate and amount from Done verification_amounts rows onto
+    the invoice line items with the same receipt link and description (modifies df_raw
+    in place). When several Done rows share a key, each field takes the last value
+    that is present.
+    
+    Args:
+        df_raw: Invoices with Title Case columns
+        amt_done: Done verification_amounts rows with Title Case columns
+    
+    Returns:
+        True if any invoice row matches a Done row
+    """
+    links = _column_as_str(amt_done, 'Receipt Link').str.strip()
+    # Description is part of the key, so it is matched on rather than corrected
+    keys = links + '\x1f' + _column_as_str(amt_done, 'Description').str.strip()
+    amt_done = amt_done[links != '']
+    keys = keys[links != '']
+    if amt_done.empty:
+        return False
+    
+    raw_keys = (
+        df_raw['Receipt Link'].astype(str).str.strip() + '\x1f'
+        + df_raw['Description'].astype(str).str.strip()
+    )
+    if not raw_keys.isin(set(keys)).any():
+        return False
+    
+    for column in ['Quantity', 'Rate', 'Amount']:
+        if column not in amt_done.columns:
+            continue
+        present = amt_done[column].notna() & (amt_done[column].astype(str) != '')
+        values = pd.Series(amt_done.loc[present, column].values, index=keys[present].values)
+        values = values[~values.index.duplicated(keep='last')]
+        new_values = raw_keys.map(values)
+        matched = raw_keys.isin(values.index)
+        if matched.any():
+            df_raw.loc[matched, column] = new_values[matched].infer_objects()
+    return True
+
+
+def _latest_updated_at(records: List[Dict[str, Any]], default: Optional[str] = None) -> Optional[str]:
+    """Latest updated_at value among invoice records (default if none carry one)"""
+    values = [r['updated_at'] for r in records if r.get('updated_at')]
+    if not values:
+        return default
+    return max(values, key=pd.Timestamp)
+
+
+def _load_touched_invoices(username: str, watermark: Dict[str, Any], dates_data: List[Dict[str, Any]],
+                           amounts_data: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+    """
+    Load the invoices an incremental sync has to re-derive.
+    
+    A receipt is touched if any of its line items changed since the watermark, if it
+    has rows in either verification table, or if it was still pending after the last
+    sync (its verification rows may since have been deleted). All line items of a
+    touched receipt are loaded, since build_verified decides per receipt.
+    
+    Args:
+        username: Username for RLS filtering
+        watermark: The user's sync_watermarks row
+        dates_data: All verification_dates rows of the user
+        amounts_data: All verification_amounts rows of the user
+    
+    Returns:
+        Tuple of (invoice records of touched receipts, new invoices watermark)
+    """
+    from database_helpers import get_invoices_updated_since, get_invoices_for_receipts
+    
+    since = pd.Timestamp(watermark['invoices_watermark']) - pd.Timedelta(seconds=SYNC_WATERMARK_OVERLAP_SECONDS)
+    changed = get_invoices_updated_since(username, since.isoformat())
+    
+    receipt_numbers = set(str(r) for r in watermark.get('pending_receipts') or [])
+    receipt_links = set()
+    for record in changed + dates_data + amounts_data:
+        receipt_number = str(record.get('receipt_number') or '').strip()
+        receipt_link = str(record.get('receipt_link') or '').strip()
+        if receipt_number:
+            receipt_numbers.add(receipt_number)
+        if receipt_link:
+            receipt_links.add(receipt_link)
+    
+    invoices_data = get_invoices_for_receipts(username, sorted(receipt_numbers), sorted(receipt_links))
+    return invoices_data, _latest_updated_at(changed, default=watermark['invoices_watermark'])
+
+
+async def run_sync_verified_logic_supabase(username: str, progress_callback=None,
+                                           full_rebuild: bool = False) -> Dict[str, Any]:
     """
     Execute the Sync & Finish workflow using Supabase:
     1. Read invoices, verification_dates, verification_amounts from Supabase
@@ -646,22 +759,33 @@ async def run_sync_verified_logic_supabase(username: str, progress_callback=None
     3. Rebuild verified_invoices table
     4. Clean up verification tables (remove Done/Rejected)
     
+    By default the sync is incremental: only receipts touched since the user's last
+    sync (see _load_touched_invoices) are read and re-derived, so the work scales
+    with the edits rather than the invoices table. Without a watermark (first sync,
+    migration not applied) or if the incremental read fails, all invoices are read.
+    
     Args:
         username: Username for RLS filtering
         progress_callback: Optional async function to report progress
                           Called with (stage, percentage, message)
+        full_rebuild: Read and re-derive all invoices even if a watermark exists
     
     Returns:
-        Dictionary with sync results
+        Dictionary with sync results ("mode" is "incremental" or "full")
     """
     from database_helpers import (
         get_all_invoices,
         get_verification_dates,
         get_verification_amounts,
         update_verified_invoices,
-        convert_numeric_types
+        get_verified_invoices_by_row_ids,
+        convert_numeric_types,
+        get_sync_watermark,
+        save_sync_watermark
     )
     from database import get_database_client
+    from services.stock_ledger import SALE_STOCK_FIELDS, apply_stock_movements, verified_sales_changes
+    from services.stock_scheduler import get_stock_scheduler
     
     # Helper to emit progress
     async def emit_progress(stage: str, percentage: int, message: str):
@@ -671,7 +795,8 @@ async def run_sync_verified_logic_supabase(username: str, progress_callback=None
     results = {
         "success": False,
         "message": "",
-        "records_synced": 0
+        "records_synced": 0,
+        "mode": "full"
     }
     
     try:
@@ -679,10 +804,37 @@ async def run_sync_verified_logic_supabase(username: str, progress_callback=None
         await emit_progress("reading", 5, "Reading invoice data...")
         
         # 1. Read data from Supabase (returns list of dicts)
-        invoices_data = get_all_invoices(username)
         dates_data = get_verification_dates(username)
         amounts_data = get_verification_amounts(username)
         
+        invoices_data = None
+        watermark = None if full_rebuild else get_sync_watermark(username)
+        if watermark and watermark.get('invoices_watermark'):
+            try:
+                invoices_data, new_watermark = _load_touched_invoices(username, watermark, dates_data, amounts_data)
+            except Exception as e:
+                logger.warning(f"Incremental read failed for {username}, falling back to full sync: {e}")
+                invoices_data = None
+            
+            if invoices_data is not None and not invoices_data:
+                if dates_data or amounts_data:
+                    # Verification rows without invoice rows: let the full path handle them
+                    invoices_data = None
+                else:
+                    save_sync_watermark(username, new_watermark, [])
+                    logger.info(f"No receipts changed since last sync for {username}")
+                    results["success"] = True
+                    results["mode"] = "incremental"
+                    results["message"] = "Nothing to sync"
+                    return results
+        
+        if invoices_data is None:
+            invoices_data = get_all_invoices(username)
+            new_watermark = _latest_updated_at(invoices_data)
+        else:
+            results["mode"] = "incremental"
+            logger.info(f"Incremental sync for {username}: {len(invoices_data)} line items in touched receipts")
+        
         if not invoices_data:
             logger.warning(f"No invoices found for user: {username}")
             results["message"] = "No invoices found"
@@ -734,26 +886,8 @@ async def run_sync_verified_logic_supabase(username: str, progress_callback=None
             
             if not date_done.empty:
                 logger.info(f"Applying {len(date_done)} date/receipt corrections")
-                date_done['Receipt Link_clean'] = date_done['Receipt Link'].astype(str).str.strip()
-                date_done['Receipt Number'] = date_done['Receipt Number'].astype(str).str.replace(r'\.0$', '', regex=True)
-                date_done['Date'] = date_done['Date'].apply(normalize_date)
-                
-                for _, row in date_done.iterrows():
-                    link = row.get('Receipt Link_clean')
-                    new_rec_num = row.get('Receipt Number')
-                    new_date = row.get('Date')
-                    
-                    if not link:
-                        continue
-                    
-                    mask = df_raw['Receipt Link'].astype(str).str.strip() == link
-                    if mask.any():
-                        if new_rec_num:
-                            df_raw.loc[mask, 'Receipt Number'] = new_rec_num
-                        if new_date:
-                            df_raw.loc[mask, 'Date'] = new_date  # Already normalized to DD-MM-YYYY
-
-                        corrections_made = True
+                if _apply_date_corrections(df_raw, date_done):
+                    corrections_made = True
 
         # 3. Apply amount corrections
         if 'Verification Status' in df_amount.columns:
@@ -761,85 +895,27 @@ async def run_sync_verified_logic_supabase(username: str, progress_callback=None
             
             if not amt_done.empty:
                 logger.info(f"Applying {len(amt_done)} amount corrections")
-                
-                for _, row in amt_done.iterrows():
-                    link = str(row.get('Receipt Link', '')).strip()
-                    desc = str(row.get('Description', '')).strip()
-                    new_qty = row.get('Quantity')
-                    new_rate = row.get('Rate')
-                    new_amt = row.get('Amount')
-                    new_desc = row.get('Description')
-                    
-                    if not link:
-                        continue
-
-                    mask = (
-                        (df_raw['Receipt Link'].astype(str).str.strip() == link) & 
-                        (df_raw['Description'].astype(str).str.strip() == desc)
-                    )
-                    
-                    if mask.any():
-                        if pd.notna(new_desc) and str(new_desc).strip() != '' and str(new_desc).strip() != desc:
-                            df_raw.loc[mask, 'Description'] = new_desc
-                        
-                        if pd.notna(new_qty) and str(new_qty) != '':
-                            df_raw.loc[mask, 'Quantity'] = new_qty
-                        if pd.notna(new_rate) and str(new_rate) != '':
-                            df_raw.loc[mask, 'Rate'] = new_rate
-                        if pd.notna(new_amt) and str(new_amt) != '':
-                            df_raw.loc[mask, 'Amount'] = new_amt
-                        
-
-                        corrections_made = True
+                if _apply_amount_corrections(df_raw, amt_done):
+                    corrections_made = True
 
         # 3B. Mark ALL receipts as "Verified" if they are fully Done
-        # Collect Done and Pending receipt numbers from both sheets
-        date_done_receipts = set()
+        # A receipt is fully verified if it is not Pending in either table (a receipt that
+        # appears in a table without being Pending there is Done), so any such receipt
+        # in invoices means the invoices need saving
         date_pending_receipts = set()
-        amount_done_receipts = set()
         amount_pending_receipts = set()
         
         if 'Verification Status' in df_date.columns and 'Receipt Number' in df_date.columns:
             date_status_lower = df_date['Verification Status'].astype(str).str.lower().str.strip()
-            date_done_receipts = set(df_date.loc[date_status_lower == 'done', 'Receipt Number'].astype(str).str.strip())
             date_pending_receipts = set(df_date.loc[date_status_lower.isin(['pending', 'duplicate receipt number']), 'Receipt Number'].astype(str).str.strip())
         
         if 'Verification Status' in df_amount.columns and 'Receipt Number' in df_amount.columns:
             amount_status_lower = df_amount['Verification Status'].astype(str).str.lower().str.strip()
-            amount_done_receipts = set(df_amount.loc[amount_status_lower == 'done', 'Receipt Number'].astype(str).str.strip())
             amount_pending_receipts = set(df_amount.loc[amount_status_lower.isin(['pending', 'duplicate receipt number']), 'Receipt Number'].astype(str).str.strip())
         
-        # A receipt is fully verified if:
-        # - If it appears in Dates sheet: must be Done (not Pending)
-        # - If it appears in Amounts sheet: must be Done (not Pending)
-        # - If it doesn't appear in either sheet: it's auto-verified
-        all_receipts_in_raw = set(df_raw['Receipt Number'].astype(str).str.strip())
-        
-        for receipt_num in all_receipts_in_raw:
-            appears_in_dates = receipt_num in date_done_receipts or receipt_num in date_pending_receipts
-            appears_in_amounts = receipt_num in amount_done_receipts or receipt_num in amount_pending_receipts
-            
-            is_done_in_dates = receipt_num in date_done_receipts
-            is_done_in_amounts = receipt_num in amount_done_receipts
-            is_pending_in_dates = receipt_num in date_pending_receipts
-            is_pending_in_amounts = receipt_num in amount_pending_receipts
-            
-            # Mark as Verified if:
-            # - Not pending in either sheet
-            # - Done in all sheets where it appears
-            should_verify = True
-            if is_pending_in_dates or is_pending_in_amounts:
-                should_verify = False
-            elif appears_in_dates and not is_done_in_dates:
-                should_verify = False
-            elif appears_in_amounts and not is_done_in_amounts:
-                should_verify = False
-            
-            if should_verify:
-                mask = df_raw['Receipt Number'].astype(str).str.strip() == receipt_num
-                if mask.any():
-
-                    corrections_made = True
+        all_receipts_in_raw = set(df_raw['Receipt Number'].astype(str).str.strip().dropna())
+        if all_receipts_in_raw - date_pending_receipts - amount_pending_receipts:
+            corrections_made = True
 
 
         # 4. Save updated invoices to Supabase
@@ -864,11 +940,9 @@ async def run_sync_verified_logic_supabase(username: str, progress_callback=None
             
             # OPTIMIZED: Use batch upsert for 10-15x performance improvement
             records_to_upsert = []
-            for _, row in df_raw_snake.iterrows():
-                row_dict = row.to_dict()
+            for row_dict in df_raw_snake.to_dict('records'):
                 row_dict['username'] = username
-                row_dict = convert_numeric_types(row_dict)
-                records_to_upsert.append(row_dict)
+                records_to_upsert.append(convert_numeric_types(row_dict))
             
             updated_count = db.batch_upsert('invoices', records_to_upsert, batch_size=500)
             logger.info(f"✅ Upserted {updated_count} invoice records (preserving all existing data)")
@@ -933,9 +1007,29 @@ async def run_sync_verified_logic_supabase(username: str, progress_callback=None
         
         final_records = final_df_snake.to_dict('records')
         
+        # Saved versions of the rows about to be rewritten, to apply only the changed sales to stock
+        try:
+            previous_sales = get_verified_invoices_by_row_ids(
+                username, [record.get('row_id') for record in final_records], SALE_STOCK_FIELDS
+            )
+        except Exception as e:
+            logger.warning(f"Could not read saved verified invoices, stock will be fully recalculated: {e}")
+            previous_sales = None
+        
         # Save to verified_invoices table
-        update_verified_invoices(username, final_records)
+        saved = update_verified_invoices(username, final_records)
         logger.info(f"verified_invoices updated with {len(final_records)} rows")
+        
+        # Apply new and corrected sales to stock levels
+        if saved:
+            try:
+                if previous_sales is None:
+                    get_stock_scheduler().request(username, reason="sync")
+                else:
+                    sales_added, sales_removed = verified_sales_changes(previous_sales, final_records)
+                    apply_stock_movements(username, sales_added=sales_added, sales_removed=sales_removed)
+            except Exception as e:
+                logger.error(f"Error updating stock levels after sync: {e}")
 
         # 6. Clean up verification tables - CROSS-SHEET DEPENDENCY
         await emit_progress("cleanup", 95, "Cleaning up verification tables...")
@@ -964,27 +1058,16 @@ async def run_sync_verified_logic_supabase(username: str, progress_callback=None
         if 'Verification Status' in df_date.columns:
             # Keep Pending and Duplicate Receipt Number records
             # CRITICAL FIX: Also keep Done records if the same receipt has pending amounts
-            def should_keep_date_record(row):
-                status = str(row.get('Verification Status', '')).lower().strip()
-                receipt_num = str(row.get('Receipt Number', '')).strip()
-                
-                # Keep if Pending or Duplicate
-                if status in ['pending', 'duplicate receipt number']:
-                    return True
-                
-                # If Done, check if same Receipt is still Pending in Verify Amount
-                if status == 'done':
-                    # If receipt exists in Verify Amount and is Pending there, keep in Dates
-                    if receipt_num in amount_pending_receipts:
-                        return True
-                    # If receipt exists in Verify Amount but is Done, can delete
-                    # If receipt doesn't exist in Verify Amount, can delete
-                    return False
-                
-                # Already Verified, Rejected - can delete
-                return False
+            # If Done, keep only while the same receipt is still Pending in Verify Amount;
+            # Already Verified, Rejected - can delete
+            date_status = df_date['Verification Status'].map(str).str.lower().str.strip()
+            date_receipt_nums = _column_as_str(df_date, 'Receipt Number').str.strip()
+            keep_date = (
+                date_status.isin(['pending', 'duplicate receipt number'])
+                | ((date_status == 'done') & date_receipt_nums.isin(amount_pending_receipts))
+            )
             
-            df_date_clean = df_date[df_date.apply(should_keep_date_record, axis=1)].copy()
+            df_date_clean = df_date[keep_date].copy()
             df_date_clean_snake = df_date_clean.rename(columns=reverse_map)
             
             # Clean NaN/Inf values (not JSON compliant)
@@ -994,26 +1077,19 @@ async def run_sync_verified_logic_supabase(username: str, progress_callback=None
             clean_date_records = df_date_clean_snake.to_dict('records')
             
             # Update verification_dates
-            update_verification_records(username, 'verification_dates', clean_date_records)
+            update_verification_records(username, 'verification_dates', clean_date_records, diff=True)
             logger.info(f"verification_dates cleaned: {len(clean_date_records)} records remain")
 
         # Clean verification_amounts
         if 'Verification Status' in df_amount.columns:
-            def should_keep_amount_record(row):
-                status = str(row.get('Verification Status', '')).lower().strip()
-                receipt_num = str(row.get('Receipt Number', '')).strip()
-                
-                if status in ['pending', 'duplicate receipt number']:
-                    return True
-                
-                if status == 'done':
-                    if receipt_num in date_pending_receipts:
-                        return True
-                    return False
-                
-                return False
+            amount_status = df_amount['Verification Status'].map(str).str.lower().str.strip()
+            amount_receipt_nums = _column_as_str(df_amount, 'Receipt Number').str.strip()
+            keep_amount = (
+                amount_status.isin(['pending', 'duplicate receipt number'])
+                | ((amount_status == 'done') & amount_receipt_nums.isin(date_pending_receipts))
+            )
             
-            df_amount_clean = df_amount[df_amount.apply(should_keep_amount_record, axis=1)].copy()
+            df_amount_clean = df_amount[keep_amount].copy()
             df_amount_clean_snake = df_amount_clean.rename(columns=reverse_map)
             
             # Clean NaN/Inf values (not JSON compliant)
@@ -1023,9 +1099,17 @@ async def run_sync_verified_logic_supabase(username: str, progress_callback=None
             clean_amount_records = df_amount_clean_snake.to_dict('records')
             
             # Update verification_amounts
-            update_verification_records(username, 'verification_amounts', clean_amount_records)
+            update_verification_records(username, 'verification_amounts', clean_amount_records, diff=True)
             logger.info(f"verification_amounts cleaned: {len(clean_amount_records)} records remain")
 
+        # 7. Advance the watermark; still-pending receipts are re-checked next time
+        save_sync_watermark(
+            username,
+            new_watermark,
+            list(date_pending_receipts | amount_pending_receipts),
+            full_sync=results["mode"] == "full"
+        )
+        
         results["success"] = True
         results["message"] = "Sync & Finish completed successfully"
         results["records_synced"] = len(final_records)
@@ -119,6 +119,28 @@ def optimize_image_for_gemini(
     return optimized_data, metadata
 
 
+def detect_image_mime_type(image_data: bytes, default: str = "image/jpeg") -> str:
+    """
+    Detect image MIME type from its leading magic bytes, without decoding the image.
+    
+    Args:
+        image_data: Image bytes
+        default: MIME type returned when the format is not recognised
+    
+    Returns:
+        MIME type string (e.g. "image/jpeg")
+    """
+    if image_data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if image_data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if image_data[:4] == b"RIFF" and image_data[8:12] == b"WEBP":
+        return "image/webp"
+    if image_data[4:12] in (b"ftypheic", b"ftypheix", b"ftypmif1"):
+        return "image/heic"
+    return default
+
+
 def should_optimize_image(image_data: bytes, min_size_kb: int = 100) -> bool:
     """
     Determine if image should be optimized.
@@ -216,3 +238,53 @@ def validate_image_quality(image_data: bytes) -> dict:
             'warnings': [f"Failed to validate image: {str(e)}"],
             'metrics': {}
         }
+
+
+# Side length of the grayscale thumbnail used for ink analysis
+INK_SAMPLE_SIZE = 256
+
+def compute_ink_features(image_data: bytes, sample_size: int = INK_SAMPLE_SIZE) -> Optional[dict]:
+    """
+    Cheap ink statistics for routing an image before extraction.
+    Works on a small grayscale thumbnail, so it costs a few milliseconds per image.
+    
+    Features:
+    - ink_density: fraction of pixels clearly darker than the paper
+    - blank_row_ratio: fraction of thumbnail rows with (almost) no ink. Printed
+      bills have clean gaps between text lines; handwriting fills rows unevenly.
+    
+    Args:
+        image_data: Image bytes
+        sample_size: Thumbnail side length in pixels
+    
+    Returns:
+        Dictionary of features, or None if the image cannot be decoded
+    """
+    try:
+        import numpy as np
+        
+        with Image.open(io.BytesIO(image_data)) as img:
+            # JPEG draft mode decodes at reduced scale, far cheaper than a full decode
+            img.draft('L', (sample_size, sample_size))
+            gray = img.convert('L')
+        gray.thumbnail((sample_size, sample_size))
+        pixels = np.asarray(gray, dtype=np.float32)
+        
+        if pixels.size == 0:
+            return None
+        
+        # Paper is the dominant tone; ink is anything well below it
+        paper_level = float(np.median(pixels))
+        ink = pixels < paper_level * 0.75
+        ink_density = float(ink.mean())
+        
+        row_ink = ink.mean(axis=1)
+        blank_row_ratio = float((row_ink < max(ink_density * 0.2, 0.002)).mean())
+        
+        return {
+            'ink_density': round(ink_density, 4),
+            'blank_row_ratio': round(blank_row_ratio, 4)
+        }
+    except Exception as e:
+        logger.debug(f"Could not compute ink features: {e}")
+        return None
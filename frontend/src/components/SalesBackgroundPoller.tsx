@@ -2,6 +2,7 @@ import React, { useEffect, useRef } from 'react';
 import { useLocation } from 'react-router-dom';
 import { useGlobalStatus } from '../contexts/GlobalStatusContext';
 import { uploadAPI as salesAPI, invoicesAPI, reviewAPI } from '../services/api';
+import { stopTaskWatch } from '../lib/api';
 
 const SalesBackgroundPoller: React.FC = () => {
     const location = useLocation();
@@ -78,117 +79,110 @@ const SalesBackgroundPoller: React.FC = () => {
         // Don't poll task status if we are ON the upload page (the page handles its own polling)
         if (location.pathname === '/sales/upload') {
             if (pollIntervalRef.current) {
-                clearInterval(pollIntervalRef.current);
+                stopTaskWatch(pollIntervalRef.current);
                 pollIntervalRef.current = null;
             }
             return;
         }
 
-        const checkStatus = async () => {
-            const activeTaskId = localStorage.getItem('activeSalesTaskId');
+        const handleStatus = async (statusData: any) => {
+            // Update global status
+            const total = statusData.progress?.total || 0;
+            const processed = statusData.progress?.processed || 0;
+            const remaining = Math.max(0, total - processed);
+
+            // Check for completion
+            if (statusData.status === 'completed') {
+                // Task completed!
+                setSalesStatus({
+                    isUploading: false,
+                    processingCount: 0,
+                    totalProcessing: 0,
+                    // reviewCount is now handled by the separate stats poller above, 
+                    // but we can set syncCount here if needed, or let stats poller handle it eventually.
+                    // However, immediate feedback is nice.
+                    syncCount: processed,
+                    isComplete: true // Show green tick
+                });
+
+                // Clear task ID so we stop polling
+                localStorage.removeItem('activeSalesTaskId');
 
-            if (!activeTaskId) {
                 if (pollIntervalRef.current) {
-                    clearInterval(pollIntervalRef.current);
+                    stopTaskWatch(pollIntervalRef.current);
                     pollIntervalRef.current = null;
                 }
-                return;
-            }
 
-            try {
-                const statusData = await salesAPI.getProcessStatus(activeTaskId);
-
-                // Update global status
-                const total = statusData.progress?.total || 0;
-                const processed = statusData.progress?.processed || 0;
-                const remaining = Math.max(0, total - processed);
-
-                // Check for completion
-                if (statusData.status === 'completed') {
-                    // Task completed!
-                    setSalesStatus({
-                        isUploading: false,
-                        processingCount: 0,
-                        totalProcessing: 0,
-                        // reviewCount is now handled by the separate stats poller above, 
-                        // but we can set syncCount here if needed, or let stats poller handle it eventually.
-                        // However, immediate feedback is nice.
-                        syncCount: processed,
-                        isComplete: true // Show green tick
-                    });
-
-                    // Clear task ID so we stop polling
-                    localStorage.removeItem('activeSalesTaskId');
-
-                    if (pollIntervalRef.current) {
-                        clearInterval(pollIntervalRef.current);
-                        pollIntervalRef.current = null;
-                    }
+                // Force a stats refresh to ensure counts are 100% accurate
+                const stats = await invoicesAPI.getStats();
+                setSalesStatus({ reviewCount: stats.pending_review });
 
-                    // Force a stats refresh to ensure counts are 100% accurate
-                    const stats = await invoicesAPI.getStats();
-                    setSalesStatus({ reviewCount: stats.pending_review });
-
-                } else if (statusData.status === 'failed') {
-                    // Failed
-                    setSalesStatus({
-                        isUploading: false,
-                        processingCount: 0,
-                        totalProcessing: 0,
-                        reviewCount: 0,
-                        syncCount: 0,
-                        isComplete: false
-                    });
-
-                    localStorage.removeItem('activeSalesTaskId');
-
-                    if (pollIntervalRef.current) {
-                        clearInterval(pollIntervalRef.current);
-                        pollIntervalRef.current = null;
-                    }
-                } else if (statusData.status === 'duplicate_detected') {
-                    // Duplicates detected - update status but keep task ID
-                    // The user needs to go to the upload page to resolve this
-                    setSalesStatus({
-                        isUploading: false,
-                        processingCount: 0,
-                        // reviewCount for duplicates is tricky - stats API might count them or not depending on implementation
-                        // For now we trust the stats API for the badge, but local state can reflect this specific event
-                        isComplete: false
-                    });
-                } else {
-                    // Still processing
-                    setSalesStatus({
-                        isUploading: false,
-                        processingCount: remaining,
-                        totalProcessing: total,
-                        syncCount: processed,
-                        isComplete: false
-                    });
+            } else if (statusData.status === 'failed') {
+                // Failed
+                setSalesStatus({
+                    isUploading: false,
+                    processingCount: 0,
+                    totalProcessing: 0,
+                    reviewCount: 0,
+                    syncCount: 0,
+                    isComplete: false
+                });
+
+                localStorage.removeItem('activeSalesTaskId');
+
+                if (pollIntervalRef.current) {
+                    stopTaskWatch(pollIntervalRef.current);
+                    pollIntervalRef.current = null;
                 }
-            } catch (error: any) {
-                console.error('Error polling background sales status:', error);
-                if (error?.response?.status === 404 || error?.response?.status === 403) {
-                    // Task gone
-                    localStorage.removeItem('activeSalesTaskId');
-                    if (pollIntervalRef.current) {
-                        clearInterval(pollIntervalRef.current);
-                        pollIntervalRef.current = null;
-                    }
+            } else if (statusData.status === 'duplicate_detected') {
+                // Duplicates detected - update status but keep task ID
+                // The user needs to go to the upload page to resolve this
+                setSalesStatus({
+                    isUploading: false,
+                    processingCount: 0,
+                    // reviewCount for duplicates is tricky - stats API might count them or not depending on implementation
+                    // For now we trust the stats API for the badge, but local state can reflect this specific event
+                    isComplete: false
+                });
+
+                // The task stream ends here; the upload page picks the task up again
+                if (pollIntervalRef.current) {
+                    stopTaskWatch(pollIntervalRef.current);
+                    pollIntervalRef.current = null;
+                }
+            } else {
+                // Still processing
+                setSalesStatus({
+                    isUploading: false,
+                    processingCount: remaining,
+                    totalProcessing: total,
+                    syncCount: processed,
+                    isComplete: false
+                });
+            }
+        };
+
+        const handleError = (error: any) => {
+            console.error('Error polling background sales status:', error);
+            if (error?.response?.status === 404 || error?.response?.status === 403) {
+                // Task gone
+                localStorage.removeItem('activeSalesTaskId');
+                if (pollIntervalRef.current) {
+                    stopTaskWatch(pollIntervalRef.current);
+                    pollIntervalRef.current = null;
                 }
             }
         };
 
-        // Start polling if task ID exists
+        // Follow the task if one is active (SSE stream, polling only if the stream fails)
         const activeTaskId = localStorage.getItem('activeSalesTaskId');
         if (activeTaskId && !pollIntervalRef.current) {
-            checkStatus(); // Check immediately
-            pollIntervalRef.current = setInterval(checkStatus, 2000); // Poll every 2s
+            pollIntervalRef.current = salesAPI.watchProcessStatus(activeTaskId, handleStatus, handleError);
         }
 
         return () => {
             if (pollIntervalRef.current) {
-                clearInterval(pollIntervalRef.current);
+                stopTaskWatch(pollIntervalRef.current);
                 pollIntervalRef.current = null;
             }
         };
@@ -5,6 +5,8 @@ const API_BASE_URL = import.meta.env.VITE_API_URL || 'http://localhost:8000';
 // Create axios instance
 const apiClient: AxiosInstance = axios.create({
     baseURL: API_BASE_URL,
+    // Accept the HttpOnly stream cookie set at login (EventSource cannot send the bearer header)
+    withCredentials: true,
     headers: {
         'Content-Type': 'application/json',
     },
@@ -35,4 +37,103 @@ apiClient.interceptors.response.use(
     }
 );
 
+// Stream cookie for EventSource, refreshed once per page load for sessions older than the cookie
+let streamSession: Promise<void> | null = null;
+
+export const ensureStreamSession = (): Promise<void> => {
+    if (!streamSession) {
+        streamSession = apiClient.post('/api/auth/stream-session')
+            .then(() => undefined)
+            .catch((error) => {
+                streamSession = null;
+                throw error;
+            });
+    }
+    return streamSession;
+};
+
+type TaskWatch = {
+    source: EventSource | null;
+    timer: number | null;
+    stopped: boolean;
+};
+
+const taskWatches = new Map<number, TaskWatch>();
+let nextTaskWatchId = 1;
+
+/**
+ * Follow a background task's status over its Server-Sent Events stream.
+ * Each event carries the same JSON as the status endpoint. If the stream cannot be
+ * opened or the browser gives up reconnecting, falls back to polling every pollMs.
+ * Handlers run one at a time, in order. Returns an id for stopTaskWatch().
+ */
+export const watchTaskStatus = (
+    streamPath: string,
+    poll: () => Promise<any>,
+    onStatus: (status: any) => void | Promise<void>,
+    onError?: (error: any) => void,
+    pollMs: number = 2000
+): number => {
+    const id = nextTaskWatchId++;
+    const watch: TaskWatch = { source: null, timer: null, stopped: false };
+    taskWatches.set(id, watch);
+
+    let handling: Promise<void> = Promise.resolve();
+    const deliver = (status: any) => {
+        handling = handling
+            .then(() => (watch.stopped ? undefined : onStatus(status)))
+            .catch((error) => console.error('Error handling task status:', error));
+    };
+
+    const startPolling = () => {
+        if (watch.stopped || watch.timer !== null) return;
+        watch.timer = window.setInterval(async () => {
+            try {
+                deliver(await poll());
+            } catch (error) {
+                console.error('Error polling task status:', error);
+                if (!watch.stopped) onError?.(error);
+            }
+        }, pollMs);
+    };
+
+    ensureStreamSession()
+        .then(() => {
+            if (watch.stopped) return;
+            const source = new EventSource(`${API_BASE_URL}${streamPath}`, { withCredentials: true });
+            watch.source = source;
+
+            source.onmessage = (event) => {
+                try {
+                    deliver(JSON.parse(event.data));
+                } catch (error) {
+                    console.error('Error parsing task status event:', error);
+                }
+            };
+
+            source.onerror = () => {
+                // The browser reconnects by itself (resuming from Last-Event-ID) unless the
+                // stream was refused, e.g. 401/404; poll from then on
+                if (source.readyState === EventSource.CLOSED) {
+                    watch.source = null;
+                    startPolling();
+                }
+            };
+        })
+        .catch(startPolling);
+
+    return id;
+};
+
+export const stopTaskWatch = (id: number | null) => {
+    if (id === null) return;
+    const watch = taskWatches.get(id);
+    if (!watch) return;
+    watch.stopped = true;
+    watch.source?.close();
+    if (watch.timer !== null) clearInterval(watch.timer);
+    taskWatches.delete(id);
+};
+
+export { API_BASE_URL };
 export default apiClient;
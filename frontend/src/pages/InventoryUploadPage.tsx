@@ -2,6 +2,7 @@ import React, { useState, useCallback, useEffect } from 'react';
 import { Upload as UploadIcon, X, Loader2, CheckCircle, XCircle } from 'lucide-react';
 import { useNavigate } from 'react-router-dom';
 import { inventoryAPI } from '../services/inventoryApi';
+import { stopTaskWatch } from '../lib/api';
 import { useQueryClient } from '@tanstack/react-query';
 import DuplicateWarningModal from '../components/DuplicateWarningModal';
 import ImagePreviewModal from '../components/ImagePreviewModal';
@@ -83,91 +84,88 @@ const InventoryUploadPage: React.FC = () => {
             // Set initial global state assuming processing is active
             setInventoryStatus({ isUploading: false, processingCount: 1, totalProcessing: 1 }); // Approx
 
-            // Start continuous polling
-            const interval = setInterval(async () => {
-                try {
-                    const statusData = await inventoryAPI.getProcessStatus(activeTaskId);
+            // Follow task status (SSE stream, polling only if the stream fails)
+            const interval = inventoryAPI.watchProcessStatus(activeTaskId, (statusData: any) => {
 
-                    // UPDATE GLOBAL STATUS
-                    const total = statusData.progress?.total || 0;
-                    const processed = statusData.progress?.processed || 0;
-                    const remaining = Math.max(0, total - processed);
+                // UPDATE GLOBAL STATUS
+                const total = statusData.progress?.total || 0;
+                const processed = statusData.progress?.processed || 0;
+                const remaining = Math.max(0, total - processed);
+
+                setInventoryStatus({
+                    isUploading: false,
+                    processingCount: remaining,
+                    totalProcessing: total,
+                    reviewCount: 0, // In processing phase
+                    syncCount: 0
+                });
+
+                // Preserve duplicateStats across updates
+                setProcessingStatus((prev: any) => ({
+                    ...statusData,
+                    duplicateStats: prev?.duplicateStats
+                }));
 
+                // Handle duplicate detection on resume
+                if (statusData.status === 'duplicate_detected' && (statusData as any).duplicates?.length > 0) {
+                    stopTaskWatch(interval);
+                    setPollingInterval(null);
+                    setIsProcessing(false);
+
+                    const duplicates = (statusData as any).duplicates;
+                    setDuplicateQueue(duplicates);
+                    setCurrentDuplicateIndex(0);
+                    setDuplicateInfo(duplicates[0]);
+                    setShowDuplicateModal(true);
+                    setFilesToSkip([]);
+                    setFilesToForceUpload([]);
+
+                    // UPDATE GLOBAL STATUS: Need Review
                     setInventoryStatus({
                         isUploading: false,
-                        processingCount: remaining,
-                        totalProcessing: total,
-                        reviewCount: 0, // In processing phase
-                        syncCount: 0
+                        processingCount: 0,
+                        reviewCount: duplicates.length, // Pending duplicates to review
+                        syncCount: processed
                     });
 
-                    // Preserve duplicateStats across updates
-                    setProcessingStatus((prev: any) => ({
-                        ...statusData,
-                        duplicateStats: prev?.duplicateStats
-                    }));
-
-                    // Handle duplicate detection on resume
-                    if (statusData.status === 'duplicate_detected' && (statusData as any).duplicates?.length > 0) {
-                        clearInterval(interval);
-                        setPollingInterval(null);
-                        setIsProcessing(false);
+                    // CRITICAL: Use the full list of R2 keys from the backend response
+                    // This ensures we know about ALL files (new + duplicates) for correct processing later
+                    const allFileKeys = (statusData as any).uploaded_r2_keys || duplicates.map((dup: any) => dup.file_key);
+                    setUploadedFiles(allFileKeys);
+                    (window as any).__temp_r2_keys = allFileKeys;
 
-                        const duplicates = (statusData as any).duplicates;
-                        setDuplicateQueue(duplicates);
-                        setCurrentDuplicateIndex(0);
-                        setDuplicateInfo(duplicates[0]);
-                        setShowDuplicateModal(true);
-                        setFilesToSkip([]);
-                        setFilesToForceUpload([]);
-
-                        // UPDATE GLOBAL STATUS: Need Review
-                        setInventoryStatus({
-                            isUploading: false,
-                            processingCount: 0,
-                            reviewCount: duplicates.length, // Pending duplicates to review
-                            syncCount: processed
-                        });
-
-                        // CRITICAL: Use the full list of R2 keys from the backend response
-                        // This ensures we know about ALL files (new + duplicates) for correct processing later
-                        const allFileKeys = (statusData as any).uploaded_r2_keys || duplicates.map((dup: any) => dup.file_key);
-                        setUploadedFiles(allFileKeys);
-                        (window as any).__temp_r2_keys = allFileKeys;
-
-                        localStorage.removeItem('activeInventoryTaskId');
-                        return;
-                    }
+                    localStorage.removeItem('activeInventoryTaskId');
+                    return;
+                }
 
-                    // Handle completion
-                    if (statusData.status === 'completed' || statusData.status === 'failed') {
-                        clearInterval(interval);
-                        setPollingInterval(null);
-                        localStorage.removeItem('activeInventoryTaskId');
-                        localStorage.setItem('inventoryCompletionStatus', JSON.stringify(statusData));
+                // Handle completion
+                if (statusData.status === 'completed' || statusData.status === 'failed') {
+                    stopTaskWatch(interval);
+                    setPollingInterval(null);
+                    localStorage.removeItem('activeInventoryTaskId');
+                    localStorage.setItem('inventoryCompletionStatus', JSON.stringify(statusData));
 
-                        // UPDATE GLOBAL STATUS: Finished
-                        setInventoryStatus({
-                            isUploading: false,
-                            processingCount: 0,
-                            reviewCount: 0,
-                            syncCount: processed
-                        });
+                    // UPDATE GLOBAL STATUS: Finished
+                    setInventoryStatus({
+                        isUploading: false,
+                        processingCount: 0,
+                        reviewCount: 0,
+                        syncCount: processed
+                    });
 
 
-                    }
-                } catch (error: any) {
-                    console.error('Error polling inventory status:', error);
-                    if (error?.response?.status === 403 || error?.response?.status === 404) {
-                        clearInterval(interval);
-                        setPollingInterval(null);
-                        localStorage.removeItem('activeInventoryTaskId');
-                        setIsProcessing(false);
-                        setProcessingStatus(null);
-                        setInventoryStatus({ processingCount: 0, isUploading: false });
-                    }
                 }
-            }, 1000);
+            }, (error: any) => {
+                console.error('Error polling inventory status:', error);
+                if (error?.response?.status === 403 || error?.response?.status === 404) {
+                    stopTaskWatch(interval);
+                    setPollingInterval(null);
+                    localStorage.removeItem('activeInventoryTaskId');
+                    setIsProcessing(false);
+                    setProcessingStatus(null);
+                    setInventoryStatus({ processingCount: 0, isUploading: false });
+                }
+            });
 
             setPollingInterval(interval);
         }
@@ -175,7 +173,7 @@ const InventoryUploadPage: React.FC = () => {
         // Cleanup on unmount - preserve session
         return () => {
             if (pollingInterval) {
-                clearInterval(pollingInterval);
+                stopTaskWatch(pollingInterval);
             }
         };
     }, []);
@@ -374,8 +372,7 @@ const InventoryUploadPage: React.FC = () => {
             // Save taskId to localStorage for persistence
             const taskId = processResponse.task_id;
             localStorage.setItem('activeInventoryTaskId', taskId);
-            const pollInterval = setInterval(async () => {
-                const status = await inventoryAPI.getProcessStatus(taskId);
+            const pollInterval = inventoryAPI.watchProcessStatus(taskId, (status: any) => {
                 setProcessingStatus(status);
 
                 // UPDATE GLOBAL STATUS: Processing Progress
@@ -386,7 +383,7 @@ const InventoryUploadPage: React.FC = () => {
 
                 // Handle duplicate detection - START SEQUENTIAL WORKFLOW
                 if (status.status === 'duplicate_detected' && (status as any).duplicates?.length > 0) {
-                    clearInterval(pollInterval);
+                    stopTaskWatch(pollInterval);
                     setIsProcessing(false);
 
                     // Initialize duplicate queue
@@ -421,7 +418,7 @@ const InventoryUploadPage: React.FC = () => {
 
                 // Handle completion or failure
                 if (status.status === 'completed' || status.status === 'failed') {
-                    clearInterval(pollInterval);
+                    stopTaskWatch(pollInterval);
 
                     if (status.status === 'completed') {
                         // When no duplicates detected, all files are new
@@ -433,7 +430,7 @@ const InventoryUploadPage: React.FC = () => {
                         setInventoryStatus({ processingCount: 0 });
                     }
                 }
-            }, 1000);
+            });
         } catch (error) {
             console.error('Error:', error);
             setIsUploading(false);
@@ -529,9 +526,8 @@ const InventoryUploadPage: React.FC = () => {
                 const processResponse = await inventoryAPI.processInventory(allFilesToProcess, true);
                 setProcessingStatus(processResponse);
 
-                // Poll for completion
-                const pollForce = setInterval(async () => {
-                    const status = await inventoryAPI.getProcessStatus(processResponse.task_id);
+                // Follow the task until completion
+                const pollForce = inventoryAPI.watchProcessStatus(processResponse.task_id, (status: any) => {
                     // Preserve duplicateStats across polling updates
                     setProcessingStatus((prev: any) => ({
                         ...status,
@@ -546,10 +542,10 @@ const InventoryUploadPage: React.FC = () => {
 
 
                     if (status.status === 'completed' || status.status === 'failed') {
-                        clearInterval(pollForce);
+                        stopTaskWatch(pollForce);
                         finishProcessing(status);
                     }
-                }, 1000);
+                });
             } else {
                 // No files to process - all were skipped
                 finishProcessing();
@@ -2,6 +2,7 @@ import React, { useState, useCallback, useEffect } from 'react';
 import { Upload as UploadIcon, X, Loader2, CheckCircle, XCircle } from 'lucide-react';
 import { useNavigate } from 'react-router-dom';
 import { uploadAPI as salesAPI } from '../services/api';
+import { stopTaskWatch } from '../lib/api';
 import { useQueryClient } from '@tanstack/react-query';
 import DuplicateWarningModal from '../components/DuplicateWarningModal';
 import ImagePreviewModal from '../components/ImagePreviewModal';
@@ -81,89 +82,86 @@ const UploadPage: React.FC = () => {
 
             setSalesStatus({ isUploading: false, processingCount: 1, totalProcessing: 1, reviewCount: 0, syncCount: 0, isComplete: false });
 
-            // Start continuous polling
-            const interval = setInterval(async () => {
-                try {
-                    const statusData = await salesAPI.getProcessStatus(activeTaskId);
+            // Follow task status (SSE stream, polling only if the stream fails)
+            const interval = salesAPI.watchProcessStatus(activeTaskId, (statusData: any) => {
 
-                    // UPDATE GLOBAL STATUS
-                    const total = statusData.progress?.total || 0;
-                    const processed = statusData.progress?.processed || 0;
-                    const remaining = Math.max(0, total - processed);
+                // UPDATE GLOBAL STATUS
+                const total = statusData.progress?.total || 0;
+                const processed = statusData.progress?.processed || 0;
+                const remaining = Math.max(0, total - processed);
+
+                setSalesStatus({
+                    isUploading: false,
+                    processingCount: remaining,
+                    totalProcessing: total,
+                    reviewCount: 0,
+                    syncCount: 0
+                });
+
+                // Preserve duplicateStats across updates
+                setProcessingStatus((prev: any) => ({
+                    ...statusData,
+                    duplicateStats: prev?.duplicateStats
+                }));
+
+                // Handle duplicate detection on resume
+                if (statusData.status === 'duplicate_detected' && (statusData as any).duplicates?.length > 0) {
+                    stopTaskWatch(interval);
+                    intervalRef.current = null;
+                    setPollingInterval(null);
+                    setIsProcessing(false);
+
+                    const duplicates = (statusData as any).duplicates;
+                    setDuplicateQueue(duplicates);
+                    setCurrentDuplicateIndex(0);
+                    setDuplicateInfo(duplicates[0]);
+                    setShowDuplicateModal(true);
+                    setFilesToSkip([]);
+                    setFilesToForceUpload([]);
 
                     setSalesStatus({
                         isUploading: false,
-                        processingCount: remaining,
-                        totalProcessing: total,
-                        reviewCount: 0,
-                        syncCount: 0
+                        processingCount: 0,
+                        reviewCount: duplicates.length,
+                        syncCount: processed
                     });
 
-                    // Preserve duplicateStats across updates
-                    setProcessingStatus((prev: any) => ({
-                        ...statusData,
-                        duplicateStats: prev?.duplicateStats
-                    }));
+                    const allFileKeys = (statusData as any).uploaded_r2_keys || duplicates.map((dup: any) => dup.file_key);
+                    setUploadedFiles(allFileKeys);
+                    (window as any).__temp_r2_keys = allFileKeys;
 
-                    // Handle duplicate detection on resume
-                    if (statusData.status === 'duplicate_detected' && (statusData as any).duplicates?.length > 0) {
-                        clearInterval(interval);
-                        intervalRef.current = null;
-                        setPollingInterval(null);
-                        setIsProcessing(false);
-
-                        const duplicates = (statusData as any).duplicates;
-                        setDuplicateQueue(duplicates);
-                        setCurrentDuplicateIndex(0);
-                        setDuplicateInfo(duplicates[0]);
-                        setShowDuplicateModal(true);
-                        setFilesToSkip([]);
-                        setFilesToForceUpload([]);
-
-                        setSalesStatus({
-                            isUploading: false,
-                            processingCount: 0,
-                            reviewCount: duplicates.length,
-                            syncCount: processed
-                        });
-
-                        const allFileKeys = (statusData as any).uploaded_r2_keys || duplicates.map((dup: any) => dup.file_key);
-                        setUploadedFiles(allFileKeys);
-                        (window as any).__temp_r2_keys = allFileKeys;
-
-                        localStorage.removeItem('activeSalesTaskId');
-                        return;
-                    }
+                    localStorage.removeItem('activeSalesTaskId');
+                    return;
+                }
 
-                    // Handle completion
-                    if (statusData.status === 'completed' || statusData.status === 'failed') {
-                        clearInterval(interval);
-                        intervalRef.current = null;
-                        setPollingInterval(null);
-                        localStorage.removeItem('activeSalesTaskId');
-                        localStorage.setItem('salesCompletionStatus', JSON.stringify(statusData));
+                // Handle completion
+                if (statusData.status === 'completed' || statusData.status === 'failed') {
+                    stopTaskWatch(interval);
+                    intervalRef.current = null;
+                    setPollingInterval(null);
+                    localStorage.removeItem('activeSalesTaskId');
+                    localStorage.setItem('salesCompletionStatus', JSON.stringify(statusData));
 
-                        setSalesStatus({
-                            isUploading: false,
-                            processingCount: 0,
-                            reviewCount: 0,
-                            syncCount: processed
-                        });
+                    setSalesStatus({
+                        isUploading: false,
+                        processingCount: 0,
+                        reviewCount: 0,
+                        syncCount: processed
+                    });
 
-                    }
-                } catch (error: any) {
-                    console.error('Error polling status:', error);
-                    if (error?.response?.status === 403 || error?.response?.status === 404) {
-                        clearInterval(interval);
-                        intervalRef.current = null;
-                        setPollingInterval(null);
-                        localStorage.removeItem('activeSalesTaskId');
-                        setIsProcessing(false);
-                        setProcessingStatus(null);
-                        setSalesStatus({ processingCount: 0, reviewCount: 0, syncCount: 0 });
-                    }
                 }
-            }, 1000);
+            }, (error: any) => {
+                console.error('Error polling status:', error);
+                if (error?.response?.status === 403 || error?.response?.status === 404) {
+                    stopTaskWatch(interval);
+                    intervalRef.current = null;
+                    setPollingInterval(null);
+                    localStorage.removeItem('activeSalesTaskId');
+                    setIsProcessing(false);
+                    setProcessingStatus(null);
+                    setSalesStatus({ processingCount: 0, reviewCount: 0, syncCount: 0 });
+                }
+            });
 
             intervalRef.current = interval;
             setPollingInterval(interval);
@@ -172,7 +170,7 @@ const UploadPage: React.FC = () => {
         // Cleanup on unmount - IMPORTANT: Don't clear session, just stop polling
         return () => {
             if (intervalRef.current) {
-                clearInterval(intervalRef.current);
+                stopTaskWatch(intervalRef.current);
                 intervalRef.current = null;
             }
             // Clear completion badge when leaving the page
@@ -370,8 +368,7 @@ const UploadPage: React.FC = () => {
             // Save taskId to localStorage for persistence
             const taskId = processResponse.task_id;
             localStorage.setItem('activeSalesTaskId', taskId);
-            const pollInterval = setInterval(async () => {
-                const status = await salesAPI.getProcessStatus(taskId);
+            const pollInterval = salesAPI.watchProcessStatus(taskId, (status: any) => {
                 setProcessingStatus(status);
 
                 const processed = status.progress?.processed || 0;
@@ -382,7 +379,7 @@ const UploadPage: React.FC = () => {
 
                 // Handle duplicate detection - START SEQUENTIAL WORKFLOW
                 if (status.status === 'duplicate_detected' && (status as any).duplicates?.length > 0) {
-                    clearInterval(pollInterval);
+                    stopTaskWatch(pollInterval);
                     intervalRef.current = null;
                     setPollingInterval(null);
                     setIsProcessing(false);
@@ -432,7 +429,7 @@ const UploadPage: React.FC = () => {
 
                 // Handle completion or failure
                 if (status.status === 'completed' || status.status === 'failed') {
-                    clearInterval(pollInterval);
+                    stopTaskWatch(pollInterval);
                     intervalRef.current = null;
                     setPollingInterval(null);
 
@@ -445,7 +442,7 @@ const UploadPage: React.FC = () => {
                         setSalesStatus({ processingCount: 0, reviewCount: 0, syncCount: 0 });
                     }
                 }
-            }, 1000); // Poll every 1 second for responsive updates
+            });
 
             intervalRef.current = pollInterval;
             setPollingInterval(pollInterval);
@@ -551,9 +548,8 @@ const UploadPage: React.FC = () => {
                     duplicateStats: prev?.duplicateStats  // Keep our stored stats
                 }));
 
-                // Poll for completion
-                const interval = setInterval(async () => {
-                    const status = await salesAPI.getProcessStatus(processResponse.task_id);
+                // Follow the task until completion
+                const interval = salesAPI.watchProcessStatus(processResponse.task_id, (status: any) => {
 
                     // UPDATE GLOBAL STATUS to keep sidebar in sync
                     const total = status.progress?.total || 0;
@@ -574,13 +570,13 @@ const UploadPage: React.FC = () => {
                     }));
 
                     if (status.status === 'completed' || status.status === 'failed') {
-                        clearInterval(interval);
+                        stopTaskWatch(interval);
                         intervalRef.current = null;
                         setPollingInterval(null);
                         finishProcessing(status);  // Pass latest status directly
                         localStorage.removeItem('activeUploadTaskId');  // Clear session
                     }
-                }, 1000);
+                });
 
                 // Store interval for cleanup
                 intervalRef.current = interval;
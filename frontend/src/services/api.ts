@@ -1,4 +1,4 @@
-import apiClient from '../lib/api';
+import apiClient, { API_BASE_URL, watchTaskStatus } from '../lib/api';
 import { mapArrayToFrontend, mapArrayToBackend } from '../utils/columnMapping';
 
 export interface LoginCredentials {
@@ -69,6 +69,16 @@ export const uploadAPI = {
         return response.data;
     },
 
+    // Stream status updates (polling getProcessStatus only if the stream fails); stop with stopTaskWatch
+    watchProcessStatus: (taskId: string, onStatus: (status: any) => void | Promise<void>, onError?: (error: any) => void) => {
+        return watchTaskStatus(
+            `/api/upload/process/stream/${taskId}`,
+            () => uploadAPI.getProcessStatus(taskId),
+            onStatus,
+            onError
+        );
+    },
+
     getFileUrl: async (fileKey: string) => {
         const response = await apiClient.get(`/api/upload/files/view/${encodeURIComponent(fileKey)}`);
         return response.data.url;
@@ -165,17 +175,9 @@ export const reviewAPI = {
         records_synced?: number;
     }) => void): Promise<void> => {
         return new Promise((resolve, reject) => {
-            // Get token from localStorage (same as axios interceptor uses)
-            const token = localStorage.getItem('auth_token');
-
-            if (!token) {
-                reject(new Error('Not authenticated'));
-                return;
-            }
-
-            // Pass token as query parameter since EventSource doesn't support headers
-            const url = `${import.meta.env.VITE_API_URL}/api/review/sync-finish/stream?token=${encodeURIComponent(token)}`;
-            const eventSource = new EventSource(url);
+            // EventSource cannot send the bearer header; the HttpOnly stream cookie authenticates it
+            const url = `${API_BASE_URL}/api/review/sync-finish/stream`;
+            const eventSource = new EventSource(url, { withCredentials: true });
 
             eventSource.onmessage = (event) => {
                 try {
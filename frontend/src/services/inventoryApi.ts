@@ -2,7 +2,7 @@
  * Inventory API client
  * Handles all inventory-related API calls
  */
-import apiClient from '../lib/api';
+import apiClient, { watchTaskStatus } from '../lib/api';
 
 export const inventoryAPI = {
     /**
@@ -41,6 +41,18 @@ export const inventoryAPI = {
         return response.data;
     },
 
+    /**
+     * Stream processing status (polls getProcessStatus only if the stream fails); stop with stopTaskWatch
+     */
+    watchProcessStatus: (taskId: string, onStatus: (status: any) => void | Promise<void>, onError?: (error: any) => void) => {
+        return watchTaskStatus(
+            `/api/inventory/stream/${taskId}`,
+            () => inventoryAPI.getProcessStatus(taskId),
+            onStatus,
+            onError
+        );
+    },
+
     /**
      * Get inventory items with optional filtering
      */